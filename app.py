@@ -1,5 +1,12 @@
 from orderbook import OrderBook
-from fastapi import FastAPI, HTTPException, Form
+from orderbook.pegs import first_order
+from orderbook.netting import SettlementNetter
+from orderbook.keystore import KeyStore
+from orderbook.settlement_queue import SettlementQueue, SETTLED, FAILED, RETRYING
+from orderbook.settlement_retry import RetryPolicy, UNKNOWN
+from orderbook.algos import AlgoScheduler
+from orderbook.marketmaker import MarketMaker
+from fastapi import FastAPI, HTTPException, Form, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import json
@@ -11,12 +18,16 @@ from typing import Optional
 
 from dotenv import load_dotenv
 
-# import asyncio
+import asyncio
 import logging
 from web3 import Web3
 
 # Import the TradeSettlementClient
-from orderbook.trade_settlement_client import TradeSettlementClient, AllowanceChecker
+from orderbook.trade_settlement_client import (
+    MULTICALL3_ADDRESS,
+    AllowanceChecker,
+    AsyncTradeSettlementClient,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -36,7 +47,7 @@ app.add_middleware(
 )
 
 # Global settlement client - initialize on startup
-settlement_client: Optional[TradeSettlementClient] = None
+settlement_client: Optional[AsyncTradeSettlementClient] = None
 allowance_checker: Optional[AllowanceChecker] = None
 
 # Configuration - you should move these to environment variables
@@ -45,8 +56,100 @@ CONTRACT_ADDRESS = os.getenv(
     "CONTRACT_ADDRESS", "0xF14dbF48b727AD8346dD8Fa6C0FC42FCb81FF115"
 )
 PRIVATE_KEY = os.getenv("PRIVATE_KEY")  # Should be loaded securely
+# More operator keys (comma separated), each signing settlements on its own nonce sequence;
+# every key may have up to SETTLEMENT_SIGNER_MAX_PENDING transactions awaiting a receipt
+PRIVATE_KEYS = [key.strip() for key in os.getenv("PRIVATE_KEYS", "").split(",") if key.strip()]
+SETTLEMENT_SIGNER_MAX_PENDING = int(os.getenv("SETTLEMENT_SIGNER_MAX_PENDING", 16))
+# Signing keys of trading accounts are kept in memory only, from their orders; keys listed here
+# (comma separated) are known from startup, so fills restored from a snapshot or the settlement
+# queue can be signed before their accounts send another order
+ACCOUNT_PRIVATE_KEYS = [
+    key.strip() for key in os.getenv("ACCOUNT_PRIVATE_KEYS", "").split(",") if key.strip()
+]
+key_store = KeyStore(ACCOUNT_PRIVATE_KEYS)
+# Settlement receipts are awaited by one loop following new blocks; a receipt counts once it is
+# SETTLEMENT_CONFIRMATIONS blocks deep. The block number is read every RECEIPT_POLL_INTERVAL seconds
+SETTLEMENT_CONFIRMATIONS = int(os.getenv("SETTLEMENT_CONFIRMATIONS", 0))
+RECEIPT_POLL_INTERVAL = float(os.getenv("RECEIPT_POLL_INTERVAL", 0.2))
+# Gas of a settlement call is estimated every SETTLEMENT_GAS_SAMPLE_EVERY-th time and cached in
+# between; fees follow the network's recent blocks. A transaction not mined within
+# SETTLEMENT_GAS_BUMP_AFTER seconds is replaced with 12.5% higher fees, at most
+# SETTLEMENT_GAS_MAX_BUMPS times and never above SETTLEMENT_MAX_FEE_GWEI (unset, no cap)
+SETTLEMENT_GAS_SAMPLE_EVERY = int(os.getenv("SETTLEMENT_GAS_SAMPLE_EVERY", 20))
+SETTLEMENT_GAS_BUMP_AFTER = float(os.getenv("SETTLEMENT_GAS_BUMP_AFTER", 30))
+SETTLEMENT_GAS_MAX_BUMPS = int(os.getenv("SETTLEMENT_GAS_MAX_BUMPS", 3))
+SETTLEMENT_MAX_FEE_GWEI = os.getenv("SETTLEMENT_MAX_FEE_GWEI")
+# Order entry reads allowances and balances from a cache: an (account, token) pair is read again
+# after ALLOWANCE_CACHE_TTL seconds, or as soon as a Transfer, Approval or TradeSettled log of a
+# block (looked for every ALLOWANCE_POLL_INTERVAL seconds) touches it. At most
+# ALLOWANCE_CACHE_SIZE pairs are kept
+ALLOWANCE_CACHE_TTL = float(os.getenv("ALLOWANCE_CACHE_TTL", 30))
+ALLOWANCE_CACHE_SIZE = int(os.getenv("ALLOWANCE_CACHE_SIZE", 10000))
+ALLOWANCE_POLL_INTERVAL = float(os.getenv("ALLOWANCE_POLL_INTERVAL", 1))
+# Reads needed together (allowances, balances and nonces of an order or a batch) go out as one
+# eth_call through the Multicall3 contract at MULTICALL3_ADDRESS; without one deployed there,
+# they are made separately
+MULTICALL3_ADDRESS = os.getenv("MULTICALL3_ADDRESS", MULTICALL3_ADDRESS)
 CONTRACT_ABI = []  # Load your contract ABI here
 
+# Most candles one /api/candles request may ask for, the bars kept per interval
+MAX_CANDLES = 1000
+
+# Expiry of GTT/GTD/DAY orders and persistence of the resting books across restarts
+EXPIRY_INTERVAL = float(os.getenv("EXPIRY_INTERVAL", 0.1))  # seconds between expiry sweeps
+SNAPSHOT_PATH = os.getenv("ORDERBOOK_SNAPSHOT_PATH")  # unset disables snapshots
+
+# Self-trade prevention for new books: cancel_newest, cancel_oldest, cancel_both, decrement or
+# none (default, an account's crossing orders trade with each other as they always have)
+STP_MODE = os.getenv("STP_MODE", "none")
+
+# Books in batch auction mode are checked this often (seconds) for a due uncross
+AUCTION_POLL_INTERVAL = float(os.getenv("AUCTION_POLL_INTERVAL", 0.05))
+
+# Matched trades are queued in a local SQLite file and settled by background workers, so
+# orders are acknowledged without waiting for the chain. Each worker claims up to
+# SETTLEMENT_BATCH queued settlements at a time and nets their fills per counterparty pair;
+# a positive SETTLEMENT_WINDOW (seconds) makes it wait that long between claims so that
+# more fills are netted together
+SETTLEMENT_QUEUE_PATH = os.getenv("SETTLEMENT_QUEUE_PATH", "settlement_queue.db")
+SETTLEMENT_WORKERS = int(os.getenv("SETTLEMENT_WORKERS", 1))
+SETTLEMENT_BATCH = int(os.getenv("SETTLEMENT_BATCH", 100))
+SETTLEMENT_WINDOW = float(os.getenv("SETTLEMENT_WINDOW", 0))
+SETTLEMENT_POLL_INTERVAL = float(os.getenv("SETTLEMENT_POLL_INTERVAL", 0.05))
+
+# Fills whose settlement failed transiently (RPC errors, transactions not mined in time) are
+# retried after an exponential backoff with jitter, up to SETTLEMENT_MAX_ATTEMPTS attempts;
+# retries take at most SETTLEMENT_RETRY_BUDGET of each claim. Fills that cannot be settled
+# go to the queue's dead letters, from which they can be replayed
+SETTLEMENT_MAX_ATTEMPTS = int(os.getenv("SETTLEMENT_MAX_ATTEMPTS", 5))
+SETTLEMENT_RETRY_BASE_DELAY = float(os.getenv("SETTLEMENT_RETRY_BASE_DELAY", 1))
+SETTLEMENT_RETRY_MAX_DELAY = float(os.getenv("SETTLEMENT_RETRY_MAX_DELAY", 300))
+SETTLEMENT_RETRY_BUDGET = float(os.getenv("SETTLEMENT_RETRY_BUDGET", 0.25))
+
+# With a batcher (a Multicall3-style aggregate3 contract the settlement contract accepts
+# settleTrade from), the net transfers of a claim are settled many per transaction: at most
+# SETTLEMENT_BATCH_MAX_TRADES, using at most SETTLEMENT_BATCH_GAS_FRACTION of the block gas
+# limit. Unset, every net transfer is its own transaction
+SETTLEMENT_BATCHER_ADDRESS = os.getenv("SETTLEMENT_BATCHER_ADDRESS")
+SETTLEMENT_BATCH_MAX_TRADES = int(os.getenv("SETTLEMENT_BATCH_MAX_TRADES", 50))
+SETTLEMENT_BATCH_GAS_FRACTION = float(os.getenv("SETTLEMENT_BATCH_GAS_FRACTION", 0.5))
+settlement_netter = SettlementNetter()
+settlement_queue: Optional[SettlementQueue] = None
+settlement_retry = RetryPolicy(
+    max_attempts=SETTLEMENT_MAX_ATTEMPTS,
+    base_delay=SETTLEMENT_RETRY_BASE_DELAY,
+    max_delay=SETTLEMENT_RETRY_MAX_DELAY,
+    budget=SETTLEMENT_RETRY_BUDGET,
+)
+
+# TWAP / VWAP parent orders are checked this often (seconds) for due child orders
+ALGO_POLL_INTERVAL = float(os.getenv("ALGO_POLL_INTERVAL", 0.05))
+algo_scheduler = AlgoScheduler()
+
+# Market makers quote only what their account's allowance and balance cover, net of its other
+# resting orders; their funds are read again every ALLOWANCE_POLL_INTERVAL seconds
+market_makers = {}  # symbol : MarketMaker quoting into its book
+
 # Token address mapping - you should expand this
 TOKEN_ADDRESSES = {
     "SEI": os.getenv("SEI_TOKEN_ADDRESS", "0x8eFcF5c2DDDA6C1A63D8395965Ca6c0609CE32D5"),
@@ -59,29 +162,588 @@ TOKEN_ADDRESSES = {
 @app.on_event("startup")
 async def startup_event():
     """Initialize settlement client on startup"""
-    global settlement_client, allowance_checker
+    global settlement_client, allowance_checker, settlement_queue
 
     CONTRACT_ABI = load_abi("orderbook/settlement_abi.json")
     # print(CONTRACT_ABI)
 
     try:
-        settlement_client = TradeSettlementClient(
+        settlement_client = AsyncTradeSettlementClient(
             WEB3_PROVIDER,
             CONTRACT_ADDRESS,
             CONTRACT_ABI,
             PRIVATE_KEY,
+            batcher_address=SETTLEMENT_BATCHER_ADDRESS,
+            max_batch_trades=SETTLEMENT_BATCH_MAX_TRADES,
+            batch_gas_fraction=SETTLEMENT_BATCH_GAS_FRACTION,
+            private_keys=PRIVATE_KEYS,
+            max_pending_per_signer=SETTLEMENT_SIGNER_MAX_PENDING,
+            confirmations=SETTLEMENT_CONFIRMATIONS,
+            receipt_poll_interval=RECEIPT_POLL_INTERVAL,
+            gas_strategy={
+                "sample_every": SETTLEMENT_GAS_SAMPLE_EVERY,
+                "bump_after": SETTLEMENT_GAS_BUMP_AFTER,
+                "max_bumps": SETTLEMENT_GAS_MAX_BUMPS,
+                "max_fee": (
+                    Web3.to_wei(SETTLEMENT_MAX_FEE_GWEI, "gwei")
+                    if SETTLEMENT_MAX_FEE_GWEI
+                    else None
+                ),
+            },
+            allowance_cache={
+                "ttl": ALLOWANCE_CACHE_TTL,
+                "max_entries": ALLOWANCE_CACHE_SIZE,
+                "poll_interval": ALLOWANCE_POLL_INTERVAL,
+            },
+            multicall_address=MULTICALL3_ADDRESS,
         )
-        allowance_checker = AllowanceChecker(WEB3_PROVIDER)
+        allowance_checker = AllowanceChecker(WEB3_PROVIDER, MULTICALL3_ADDRESS)
         logger.info("Settlement client initialized successfully")
     except Exception as e:
         logger.error(f"Failed to initialize settlement client: {e}")
         # You might want to exit here if settlement is critical
 
+    if settlement_client is not None and settlement_client.signers is not None:
+        try:
+            nonces = await settlement_client.signers.sync()
+            for lane, nonce in zip(settlement_client.signers.lanes, nonces):
+                logger.info(f"Operator {lane.account.address} next nonce {nonce}")
+        except Exception as e:
+            # Synced on the first settlement instead
+            logger.error(f"Failed to read the operator nonces: {e}")
+
+    if SNAPSHOT_PATH and os.path.exists(SNAPSHOT_PATH):
+        try:
+            with open(SNAPSHOT_PATH, "r") as f:
+                snapshots = json.load(f)
+            for symbol, state in snapshots.items():
+                order_books[symbol] = OrderBook.from_snapshot(state, key_store.get)
+            logger.info(f"Restored {len(snapshots)} order book(s) from {SNAPSHOT_PATH}")
+        except Exception as e:
+            logger.error(f"Failed to restore order book snapshot: {e}")
+
+    asyncio.create_task(expire_orders_loop())
+    asyncio.create_task(auction_loop())
+    asyncio.create_task(algo_loop())
+
+    settlement_queue = SettlementQueue(SETTLEMENT_QUEUE_PATH)
+    recovered = settlement_queue.recover()
+    if recovered:
+        logger.info(f"Queued {recovered} interrupted settlement(s) again")
+    for worker_id in range(SETTLEMENT_WORKERS):
+        asyncio.create_task(settlement_worker(worker_id))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Persist the resting books, including pending expiries, if a snapshot path is set"""
+    if not SNAPSHOT_PATH:
+        return
+    try:
+        snapshots = {symbol: book.snapshot() for symbol, book in order_books.items()}
+        with open(SNAPSHOT_PATH, "w") as f:
+            json.dump(snapshots, f)
+        logger.info(f"Saved {len(snapshots)} order book snapshot(s) to {SNAPSHOT_PATH}")
+    except Exception as e:
+        logger.error(f"Failed to save order book snapshot: {e}")
+
+
+async def expire_orders_loop():
+    """Periodically remove resting orders whose time in force has run out"""
+    while True:
+        await asyncio.sleep(EXPIRY_INTERVAL)
+        now = int(time.time() * 1000)
+        for symbol, order_book in list(order_books.items()):
+            try:
+                expired = order_book.expire_orders(now)
+                if expired:
+                    logger.info(f"Expired {len(expired)} order(s) in {symbol}")
+            except Exception as e:
+                logger.error(f"Error expiring orders in {symbol}: {e}")
+
+
+async def auction_loop():
+    """Uncross the books in batch auction mode whenever their interval has elapsed"""
+    while True:
+        await asyncio.sleep(AUCTION_POLL_INTERVAL)
+        now = int(time.time() * 1000)
+        for symbol, order_book in list(order_books.items()):
+            if not order_book.auction_due(now):
+                continue
+            try:
+                result = order_book.run_auction()
+                if result is not None and result["trades"]:
+                    logger.info(
+                        f"Auction in {symbol} cleared {result['volume']} at {result['price']} in {len(result['trades'])} fill(s)"
+                    )
+                    await settle_auction_result(symbol, result)
+            except Exception as e:
+                logger.error(f"Error running auction in {symbol}: {e}")
+
+
+async def algo_loop():
+    """Release the due child orders of TWAP / VWAP parents and settle their trades"""
+    while True:
+        await asyncio.sleep(ALGO_POLL_INTERVAL)
+        if not len(algo_scheduler):
+            continue
+        now = int(time.time() * 1000)
+        try:
+            released = algo_scheduler.run(now, order_books)
+        except Exception as e:
+            logger.error(f"Error releasing algo child orders: {e}")
+            continue
+        for parent, result in released:
+            try:
+                if not result["success"]:
+                    logger.warning(
+                        f"Child order of algo {parent.algo_id} rejected: {result['message']}"
+                    )
+                    continue
+                converted_trades = convert_trades(result["data"][0])
+                if converted_trades:
+                    base_asset, quote_asset = parent.symbol.split("_")
+                    await settle_fills(converted_trades, base_asset, quote_asset)
+                if result.get("triggered"):
+                    await settle_triggered_orders(result["triggered"])
+            except Exception as e:
+                logger.error(f"Error settling child order of algo {parent.algo_id}: {e}")
+
+
+async def settlement_worker(worker_id: int):
+    """Claim queued settlements and due retries, settle their netted fills and record the outcome"""
+    while True:
+        try:
+            settlements = settlement_queue.claim(
+                SETTLEMENT_BATCH, settlement_retry.retry_limit(SETTLEMENT_BATCH)
+            )
+        except Exception as e:
+            logger.error(f"Settlement worker {worker_id} failed to claim settlements: {e}")
+            settlements = []
+        if settlements:
+            try:
+                await settle_claimed(settlements)
+            except Exception as e:
+                logger.error(f"Settlement worker {worker_id} failed: {e}")
+                for settlement in settlements:
+                    # Transfers still unconfirmed from earlier attempts stay held back
+                    unconfirmed = (settlement["result"] or {}).get("unconfirmed", [])
+                    record_attempt(
+                        settlement,
+                        {"error": str(e), "unconfirmed": unconfirmed},
+                        [(settlement["trades"], str(e))],
+                    )
+        if len(settlements) < SETTLEMENT_BATCH:
+            # Caught up, wait for more fills (the netting window, if any)
+            await asyncio.sleep(max(SETTLEMENT_WINDOW, SETTLEMENT_POLL_INTERVAL))
+
+
+async def settle_claimed(settlements: list):
+    """Net the fills of claimed settlements together, settle them and record each outcome"""
+    # One at a time, as transfers of several settlements may share a transaction
+    resolved = [await resolve_unconfirmed(settlement) for settlement in settlements]
+    failures = {settlement["id"]: [] for settlement in settlements}
+    for settlement, (_, trades, _) in zip(settlements, resolved):
+        # The queue stores no signing keys, they are looked up again here
+        settlement["trades"] = key_store.attach(settlement["trades"] + trades)
+        for trade in settlement["trades"]:
+            unknown = [party[0] for party in (trade["party1"], trade["party2"]) if party[4] is None]
+            if unknown:
+                # Not seen since a restart: retried until the account sends an order again
+                failures[settlement["id"]].append(
+                    ([trade], f"Signing key of {', '.join(unknown)} not known yet")
+                )
+                continue
+            trade["settlement_id"] = settlement["id"]
+            settlement_netter.add(trade, settlement["baseAsset"], settlement["quoteAsset"])
+    netting = settlement_netter.flush()
+    logger.info(
+        f"Netted {netting['fills']} fill(s) of {len(settlements)} settlement(s) into {netting['transactions']} transaction(s), reduction {netting['reduction_ratio']:.2%}"
+    )
+    try:
+        results = (await settle_net_transfers(netting))["settlement_results"]
+    except Exception as e:
+        # Some transfers may have gone out before the error, none is signed again blindly
+        logger.error(f"Error settling {netting['transactions']} net transfer(s): {e}")
+        results = [e] * len(netting["transfers"])
+
+    outcomes = {}
+    for settlement, (settled, _, unconfirmed) in zip(settlements, resolved):
+        # A retry keeps what earlier attempts settled
+        previous = settlement["result"] or {}
+        outcomes[settlement["id"]] = {
+            "transfers": [
+                transfer for transfer in previous.get("transfers", []) if transfer["success"]
+            ] + settled,
+            "unconfirmed": unconfirmed,
+            "offsetFills": previous.get("offsetFills", 0),
+            "reductionRatio": netting["reduction_ratio"],
+        }
+    for transfer, result in zip(netting["transfers"], results):
+        try:
+            if isinstance(result, Exception):
+                raise result
+            outcome = transfer_outcome(result)
+        except Exception as e:
+            outcome = {
+                "netId": transfer["net_id"],
+                "fills": len(transfer["fills"]),
+                "success": False,
+                "unconfirmed": True,
+                "error": f"Settlement outcome unknown: {e}",
+            }
+        for settlement_id in set(fill["settlement_id"] for fill in transfer["fills"]):
+            outcomes[settlement_id]["transfers"].append(outcome)
+            if outcome["success"]:
+                continue
+            fills = [fill for fill in transfer["fills"] if fill["settlement_id"] == settlement_id]
+            if outcome.get("unconfirmed"):
+                # Held back from signing again until resolve_unconfirmed knows its fate
+                outcomes[settlement_id]["unconfirmed"].append(
+                    {"transfer": outcome, "trades": without_settlement_id(fills)}
+                )
+            else:
+                failures[settlement_id].append((fills, outcome.get("error")))
+    for offset in netting["offsets"]:
+        for fill in offset["fills"]:
+            outcomes[fill["settlement_id"]]["offsetFills"] += 1
+
+    for settlement in settlements:
+        record_attempt(settlement, outcomes[settlement["id"]], failures[settlement["id"]])
+
+
+async def resolve_unconfirmed(settlement: dict) -> tuple:
+    """Check what became of the transfers of a settlement sent but not seen confirmed.
+
+    Returns the transfers since mined, the fills to settle again (their
+    transaction reverted or was dropped, so signing them again cannot settle
+    them twice) and the entries still unconfirmed, which stay held back.
+    """
+    settled, trades, unconfirmed = [], [], []
+    for entry in (settlement["result"] or {}).get("unconfirmed", []):
+        sent = entry["transfer"]
+        status, receipt = await check_unconfirmed(sent)
+        if status == "mined":
+            transfer = {key: value for key, value in sent.items() if key in TRANSFER_FIELDS}
+            transfer.update(
+                success=True,
+                transactionHash=receipt.transactionHash.hex(),
+                blockNumber=receipt.blockNumber,
+            )
+            settled.append(transfer)
+        elif status in ("reverted", "dropped"):
+            logger.warning(
+                f"Settlement {settlement['id']}: transaction {sent['transactionHashes'][-1]} {status}, settling its {len(entry['trades'])} fill(s) again"
+            )
+            trades += entry["trades"]
+        else:
+            unconfirmed.append(entry)
+    return settled, trades, unconfirmed
+
+
+async def check_unconfirmed(sent: dict) -> tuple:
+    """(status, receipt) of a transfer sent but not seen confirmed, from check_sent.
+
+    "unknown" if it cannot be looked up, e.g. its outcome was lost before the
+    transaction hashes were known.
+    """
+    if not settlement_client or not sent.get("transactionHashes"):
+        return "unknown", None
+    try:
+        return await settlement_client.check_sent(
+            sent["transactionHashes"], sent["signer"], sent["signerNonce"], sent["nonces"]
+        )
+    except Exception as e:
+        logger.error(f"Could not check transaction {sent['transactionHashes'][-1]}: {e}")
+        return "unknown", None
+
+
+# Fields of a transfer outcome kept once its unconfirmed transaction is found mined
+TRANSFER_FIELDS = ("netId", "price", "quantity", "fills", "batchSize")
+
+
+def without_settlement_id(fills: list) -> list:
+    return [
+        {key: value for key, value in fill.items() if key != "settlement_id"}
+        for fill in fills
+    ]
+
+
+def record_attempt(settlement: dict, outcome: dict, failures: list):
+    """Record a settlement attempt as settled, to be retried, or failed.
+
+    failures holds (fills, error) per net transfer of the settlement that
+    failed. Transient failures are retried with the settlement's remaining
+    fills after a backoff; the fills of permanent ones, or of any once the
+    attempts are used up, become dead letters. Transfers sent but not seen
+    confirmed (outcome["unconfirmed"]) are checked again after the backoff
+    rather than retried, and become dead letters too once the attempts are
+    used up, keeping what was sent so replay_dead_letter can look it up on
+    chain first.
+    """
+    retry_trades, dead_letters = [], []
+    for fills, error in failures:
+        trades = without_settlement_id(fills)
+        if settlement_retry.should_retry(error, settlement["attempts"]):
+            retry_trades += trades
+        else:
+            dead_letters.append({"trades": trades, "error": error})
+    unconfirmed = []
+    for entry in outcome.get("unconfirmed", []):
+        if settlement_retry.should_retry(entry["transfer"].get("error"), settlement["attempts"]):
+            unconfirmed.append(entry)
+        else:
+            dead_letters.append(
+                {
+                    "trades": entry["trades"],
+                    "error": entry["transfer"].get("error"),
+                    "sent": entry["transfer"],
+                }
+            )
+    outcome["unconfirmed"] = unconfirmed
+    settlement_retry.dead_lettered += len(dead_letters)
+    if dead_letters:
+        logger.error(
+            f"Settlement {settlement['id']}: {len(dead_letters)} transfer(s) moved to dead letters after {settlement['attempts']} attempt(s)"
+        )
+    if retry_trades or unconfirmed:
+        settlement_retry.retried += 1
+        delay = settlement_retry.delay(settlement["attempts"])
+        logger.warning(
+            f"Settlement {settlement['id']}: retrying {len(retry_trades)} fill(s) and checking {len(unconfirmed)} unconfirmed transfer(s) in {delay:.1f}s"
+        )
+        settlement_queue.retry(settlement["id"], retry_trades, outcome, delay, dead_letters)
+    else:
+        settlement_queue.complete(
+            settlement["id"], FAILED if failures or dead_letters else SETTLED, outcome, dead_letters
+        )
+
+
+def transfer_outcome(result: dict) -> dict:
+    """Summary of the settlement of one net transfer, as stored with its settlements"""
+    outcome = {
+        "netId": result["netId"],
+        "price": result["price"],
+        "quantity": result["quantity"],
+        "fills": len(result["fills"]),
+        "success": False,
+    }
+    settlement = result["settlement"]
+    if not settlement.get("settled"):
+        outcome["error"] = settlement.get("error") or settlement.get("reason")
+        return outcome
+    trade = settlement["settlement_results"][0]["trade"]
+    settlement_result = settlement["settlement_results"][0]["settlement_result"]
+    outcome["success"] = settlement_result["success"]
+    if settlement_result.get("unconfirmed"):
+        # Sent but not seen mined: what check_sent needs to tell later what became of it
+        token = settlement_result["trade_data"]["baseAsset"]
+        outcome["unconfirmed"] = True
+        outcome["transactionHashes"] = settlement_result["transaction_hashes"]
+        outcome["signer"] = settlement_result["signer"]
+        outcome["signerNonce"] = settlement_result["signer_nonce"]
+        outcome["nonces"] = [
+            [party[0], token, nonce]
+            for party, nonce in zip((trade["party1"], trade["party2"]), settlement_result["nonces"])
+        ]
+    if settlement_result.get("transaction_hash"):
+        outcome["transactionHash"] = settlement_result["transaction_hash"]
+        outcome["blockNumber"] = settlement_result.get("block_number")
+    if settlement_result.get("batch_size"):
+        outcome["batchSize"] = settlement_result["batch_size"]
+    if settlement_result.get("error"):
+        outcome["error"] = settlement_result["error"]
+    elif not outcome["success"] and outcome.get("transactionHash"):
+        outcome["error"] = "Transaction reverted on chain"
+    return outcome
+
+
+async def settle_fills(trades: list, base_asset: str, quote_asset: str) -> dict:
+    """Queue converted fills for settlement by the background workers"""
+    if settlement_queue is None:
+        return {"settled": False, "reason": "Settlement queue not initialized"}
+    settlement_id = settlement_queue.enqueue(trades, base_asset, quote_asset)
+    return {"settled": False, "queued": True, "settlementId": settlement_id}
+
+
+def fill_to_audit(trade: dict) -> dict:
+    """The fields of a fill reported in the audit of a net transfer"""
+    return {
+        "timestamp": trade["timestamp"],
+        "price": float(trade["price"]),
+        "quantity": float(trade["quantity"]),
+        "party1": trade["party1"][0],
+        "party1OrderId": trade["party1"][2],
+        "party2": trade["party2"][0],
+        "party2OrderId": trade["party2"][2],
+    }
+
+
+def net_transfer_order(transfer: dict) -> dict:
+    """A net transfer as an order with one trade between its pair"""
+    trade = {
+        "timestamp": transfer["timestamp"],
+        "price": float(transfer["price"]),
+        "quantity": float(transfer["quantity"]),
+        # The net price is an exact quotient, settled from these rather than the rounded floats
+        "exact_price": str(transfer["price"]),
+        "exact_quantity": str(transfer["quantity"]),
+        "party1": [transfer["seller"], "ask", transfer["order_id"], None, transfer["seller_key"]],
+        "party2": [transfer["buyer"], "bid", None, None, transfer["buyer_key"]],
+    }
+    # The buyer is reported as the order of a net transfer
+    return {
+        "orderId": transfer["order_id"],
+        "account": transfer["buyer"],
+        "price": trade["price"],
+        "quantity": trade["quantity"],
+        "side": "bid",
+        "baseAsset": transfer["base_asset"],
+        "quoteAsset": transfer["quote_asset"],
+        "trade_id": transfer["buyer"],
+        "trades": [trade],
+        "isValid": True,
+        "timestamp": trade["timestamp"],
+    }
+
+
+async def settle_orders_batched(orders: list) -> list:
+    """Settle the single trade of each order through the batcher contract.
+
+    Returns one settle_trades_if_any style result per order.
+    """
+    settlements = [None] * len(orders)
+    batch = []
+    for index, order_dict in enumerate(orders):
+        trade = order_dict["trades"][0]
+        try:
+            trade_execution = build_trade_execution(order_dict, trade)
+            for address in (trade["party1"][0], trade["party2"][0], trade_execution["account"],
+                            trade_execution["baseAsset"], trade_execution["quoteAsset"]):
+                Web3.to_checksum_address(address)
+        except Exception as e:
+            settlements[index] = {"settled": False, "error": str(e)}
+            continue
+        batch.append(
+            {
+                "index": index,
+                "party1": trade["party1"][0],
+                "party2": trade["party2"][0],
+                "token": trade_execution["baseAsset"],
+                "trade": trade,
+                "trade_execution": trade_execution,
+            }
+        )
+
+    results = await settlement_client.settle_batch(
+        batch,
+        lambda item, nonce1, nonce2: build_settle_trade_call(
+            item["trade_execution"], item["trade"], nonce1, nonce2
+        ),
+    )
+    transactions = set()
+    for item, result in zip(batch, results):
+        result["trade_data"] = item["trade_execution"]
+        if result.get("transaction_hash"):
+            transactions.add(result["transaction_hash"])
+        settlements[item["index"]] = {
+            "settled": True,
+            "settlement_results": [{"trade": item["trade"], "settlement_result": result}],
+            "total_trades": 1,
+            "successful_settlements": 1 if result["success"] else 0,
+        }
+    logger.info(
+        f"Settled {sum(1 for result in results if result['success'])} of {len(batch)} trade(s) in {len(transactions)} batch transaction(s)"
+    )
+    return settlements
+
+
+async def settle_orders_concurrently(orders: list) -> list:
+    """settle_trades_if_any on every order, as many at a time as the signer lanes allow.
+
+    An order waits for the earlier ones sharing a party and base asset, whose
+    settlement moves the nonce its signatures are made with.
+    """
+    tasks = []
+    last_task = {}  # (party, base asset) : task of the latest order settling with it
+
+    async def settle_after(previous: list, order_dict: dict) -> dict:
+        if previous:
+            await asyncio.gather(*previous, return_exceptions=True)
+        try:
+            return await settle_trades_if_any(order_dict)
+        except Exception as e:
+            # Keep the results of the other orders, some of which went out already
+            return {"settled": False, "error": str(e)}
+
+    for order_dict in orders:
+        keys = set(
+            (party[0].lower(), order_dict["baseAsset"])
+            for trade in order_dict["trades"]
+            for party in (trade["party1"], trade["party2"])
+        )
+        previous = list(set(last_task[key] for key in keys if key in last_task))
+        task = asyncio.ensure_future(settle_after(previous, order_dict))
+        for key in keys:
+            last_task[key] = task
+        tasks.append(task)
+    return list(await asyncio.gather(*tasks))
+
+
+async def settle_net_transfers(netting: dict) -> dict:
+    """Settle each net transfer of a netting window as one trade between its pair"""
+    orders = [net_transfer_order(transfer) for transfer in netting["transfers"]]
+    if settlement_client and settlement_client.batcher is not None and settlement_client.account and orders:
+        settlements = await settle_orders_batched(orders)
+    else:
+        settlements = await settle_orders_concurrently(orders)
+
+    settlement_results = []
+    for transfer, order_dict, settlement in zip(netting["transfers"], orders, settlements):
+        settlement_results.append(
+            {
+                "netId": transfer["net_id"],
+                "price": order_dict["price"],
+                "quantity": order_dict["quantity"],
+                "fills": [fill_to_audit(fill) for fill in transfer["fills"]],
+                "settlement": settlement,
+            }
+        )
+    return {
+        "settled": True,
+        "total_trades": netting["fills"],
+        "netTransfers": netting["transactions"],
+        "reductionRatio": netting["reduction_ratio"],
+        "offsets": [
+            [fill_to_audit(fill) for fill in offset["fills"]]
+            for offset in netting["offsets"]
+        ],
+        "settlement_results": settlement_results,
+        "successful_settlements": sum(
+            r["settlement"].get("successful_settlements", 0) for r in settlement_results
+        ),
+    }
+
+
+async def settle_auction_result(symbol: str, result: dict) -> dict:
+    """Settle the net transfers of an auction batch, and the orders its trades released"""
+    base_asset, quote_asset = symbol.split("_")
+    settlement_info = await settle_fills(convert_trades(result["trades"]), base_asset, quote_asset)
+    triggered_results = []
+    if result["triggered"]:
+        triggered_results = await settle_triggered_orders(result["triggered"])
+    return {"settlement_info": settlement_info, "triggered": triggered_results}
+
+
+def create_order_book() -> OrderBook:
+    """New order book with the configured self-trade prevention"""
+    return OrderBook(stp_mode=None if STP_MODE == "none" else STP_MODE)
+
 
 def get_token_address(symbol: str) -> str:
     """Get token address from symbol"""
     token_address = TOKEN_ADDRESSES.get(symbol.upper(), symbol)
-    print(token_address, "TOKEN_ADDRESS")
+    logger.debug(f"Token address of {symbol}: {token_address}")
     return token_address
 
 
@@ -92,6 +754,18 @@ def load_abi(abi_path):
     return data["abi"] if isinstance(data, dict) and "abi" in data else data
 
 
+def reserved_amount(account: str, asset: str) -> Decimal:
+    """Amount of asset the account's resting orders, over every book, may still need"""
+    reserved = Decimal(0)
+    for symbol, order_book in order_books.items():
+        base_asset, quote_asset = symbol.split("_")
+        if base_asset.upper() == asset.upper():
+            reserved += order_book.asks.reserved_by(account)[0]
+        if quote_asset.upper() == asset.upper():
+            reserved += order_book.bids.reserved_by(account)[1]
+    return reserved
+
+
 async def validate_order_prerequisites(order_data: dict) -> dict:
     """Validate that user has sufficient balance and allowance for the order"""
     if not settlement_client:
@@ -101,7 +775,29 @@ async def validate_order_prerequisites(order_data: dict) -> dict:
         account = order_data["account"]
         base_asset = order_data["baseAsset"]
         quote_asset = order_data["quoteAsset"]
-        price = Decimal(str(order_data["price"]))
+        # Stop orders released as market orders have no price, size them at the trigger
+        price = order_data.get("price")
+        if price is None:
+            price = order_data.get("triggerPrice")
+        if price is None and order_data.get("type") == "pegged":
+            # Pegged orders without a limit are sized at the price they would rest at now
+            order_book = order_books.get("%s_%s" % (order_data["baseAsset"], order_data["quoteAsset"]))
+            if order_book is not None:
+                price = order_book.pegged_order_price(
+                    {
+                        "side": order_data["side"],
+                        "peg_reference": order_data.get("pegReference"),
+                        "peg_offset": order_data.get("pegOffset"),
+                    }
+                )
+            if price is None:
+                raise Exception(
+                    "No %s to peg to, a pegged order needs a reference price or a limit price"
+                    % order_data.get("pegReference")
+                )
+        if price is None:
+            raise Exception("A price is required to size the order")
+        price = Decimal(str(price))
         quantity = Decimal(str(order_data["quantity"]))
         side = order_data["side"]
 
@@ -116,61 +812,64 @@ async def validate_order_prerequisites(order_data: dict) -> dict:
 
         if side.lower() == "bid":
             # Bidder needs quote asset (e.g., USDT) allowance and balance
-            allowance_sufficient, current_allowance = settlement_client.check_allowance(
-                account, quote_token_addr, quote_amount
-            )
-            balance_sufficient, current_balance = settlement_client.check_balance(
-                account, quote_token_addr, quote_amount
+            current_allowance, current_balance = await settlement_client.allowances.get(
+                account, quote_token_addr
             )
+            # What the account's resting orders may still need is not available to this one
+            reserved = int(reserved_amount(account, quote_asset) * (10**18))
+            allowance_sufficient = current_allowance - reserved >= quote_amount
+            balance_sufficient = current_balance - reserved >= quote_amount
 
             validation_result["checks"] = {
                 "required_asset": quote_asset,
                 "required_amount": float(quantity * price),
                 "current_allowance": current_allowance / (10**18),
                 "current_balance": current_balance / (10**18),
+                "reserved_amount": reserved / (10**18),
                 "allowance_sufficient": allowance_sufficient,
                 "balance_sufficient": balance_sufficient,
             }
 
             if not allowance_sufficient:
                 validation_result["errors"].append(
-                    f"Insufficient {quote_asset} allowance. Required: {float(quantity * price)}, Current: {current_allowance / (10 ** 18)}"
+                    f"Insufficient {quote_asset} allowance. Required: {float(quantity * price)}, Current: {current_allowance / (10 ** 18)}, Reserved: {reserved / (10 ** 18)}"
                 )
                 validation_result["valid"] = False
 
             if not balance_sufficient:
                 validation_result["errors"].append(
-                    f"Insufficient {quote_asset} balance. Required: {float(quantity * price)}, Current: {current_balance / (10 ** 18)}"
+                    f"Insufficient {quote_asset} balance. Required: {float(quantity * price)}, Current: {current_balance / (10 ** 18)}, Reserved: {reserved / (10 ** 18)}"
                 )
                 validation_result["valid"] = False
 
         elif side.lower() == "ask":
             # Asker needs base asset (e.g., SEI) allowance and balance
-            allowance_sufficient, current_allowance = settlement_client.check_allowance(
-                account, base_token_addr, base_amount
-            )
-            balance_sufficient, current_balance = settlement_client.check_balance(
-                account, base_token_addr, base_amount
+            current_allowance, current_balance = await settlement_client.allowances.get(
+                account, base_token_addr
             )
+            reserved = int(reserved_amount(account, base_asset) * (10**18))
+            allowance_sufficient = current_allowance - reserved >= base_amount
+            balance_sufficient = current_balance - reserved >= base_amount
 
             validation_result["checks"] = {
                 "required_asset": base_asset,
                 "required_amount": float(quantity),
                 "current_allowance": current_allowance / (10**18),
                 "current_balance": current_balance / (10**18),
+                "reserved_amount": reserved / (10**18),
                 "allowance_sufficient": allowance_sufficient,
                 "balance_sufficient": balance_sufficient,
             }
 
             if not allowance_sufficient:
                 validation_result["errors"].append(
-                    f"Insufficient {base_asset} allowance. Required: {float(quantity)}, Current: {current_allowance / (10 ** 18)}"
+                    f"Insufficient {base_asset} allowance. Required: {float(quantity)}, Current: {current_allowance / (10 ** 18)}, Reserved: {reserved / (10 ** 18)}"
                 )
                 validation_result["valid"] = False
 
             if not balance_sufficient:
                 validation_result["errors"].append(
-                    f"Insufficient {base_asset} balance. Required: {float(quantity)}, Current: {current_balance / (10 ** 18)}"
+                    f"Insufficient {base_asset} balance. Required: {float(quantity)}, Current: {current_balance / (10 ** 18)}, Reserved: {reserved / (10 ** 18)}"
                 )
                 validation_result["valid"] = False
 
@@ -217,6 +916,95 @@ def create_trade_signature_for_user(
         return ""
 
 
+def to_wei(amount) -> int:
+    """An amount (Decimal, float or str) in 18 decimal units, rounded to the nearest unit.
+
+    Goes through Decimal so that a price * quantity kept exact by netting stays exact
+    up to the last unit, where int(float(amount) * 10**18) would drift.
+    """
+    return int((Decimal(str(amount)) * (10**18)).to_integral_value())
+
+
+def build_trade_execution(order_dict: dict, trade: dict) -> dict:
+    """TradeExecution struct data of one trade of an order"""
+    # Convert amounts to proper units (18 decimals)
+    return {
+        "orderId": order_dict["orderId"],
+        "account": order_dict["account"],
+        "price": to_wei(trade.get("exact_price", trade["price"])),
+        "quantity": to_wei(trade.get("exact_quantity", trade["quantity"])),
+        "side": order_dict["side"],
+        "baseAsset": get_token_address(order_dict["baseAsset"]),
+        "quoteAsset": get_token_address(order_dict["quoteAsset"]),
+        "tradeId": str(order_dict["trade_id"]),
+        "timestamp": trade["timestamp"],
+        "isValid": order_dict["isValid"],
+    }
+
+
+def build_settle_trade_call(trade_execution: dict, trade: dict, nonce1: int, nonce2: int):
+    """The settleTrade call of a trade, signed for both parties with the given nonces"""
+    party1_addr, party1_side, party1_priv_key = trade["party1"][0], trade["party1"][1], trade["party1"][4]
+    party2_addr, party2_side, party2_priv_key = trade["party2"][0], trade["party2"][1], trade["party2"][4]
+
+    # For the quantities passed to settleTrade function:
+    # These represent the quantities each party is trading
+    party1_quantity = trade_execution["quantity"]  # Both parties trade the same base quantity
+    party2_quantity = trade_execution["quantity"]
+
+    # Create signatures for both parties
+    # NOTE: In production, these signatures should be created by the actual users
+    # Either on the frontend or through a secure signing service
+    signature1 = create_trade_signature_for_user(
+        party1_priv_key,
+        trade_execution["orderId"],
+        trade_execution["baseAsset"],
+        trade_execution["quoteAsset"],
+        trade_execution["price"],
+        party1_quantity,
+        party1_side,
+        trade["timestamp"],
+        nonce1,
+    )
+
+    signature2 = create_trade_signature_for_user(
+        party2_priv_key,
+        trade_execution["orderId"],
+        trade_execution["baseAsset"],
+        trade_execution["quoteAsset"],
+        trade_execution["price"],
+        party2_quantity,
+        party2_side,
+        trade["timestamp"],
+        nonce2,
+    )
+
+    return settlement_client.contract.functions.settleTrade(
+        (
+            trade_execution["orderId"],
+            Web3.to_checksum_address(trade_execution["account"]),
+            trade_execution["price"],
+            trade_execution["quantity"],
+            trade_execution["side"],
+            Web3.to_checksum_address(trade_execution["baseAsset"]),
+            Web3.to_checksum_address(trade_execution["quoteAsset"]),
+            trade_execution["tradeId"],
+            trade_execution["timestamp"],
+            trade_execution["isValid"],
+        ),
+        Web3.to_checksum_address(party1_addr),
+        Web3.to_checksum_address(party2_addr),
+        party1_quantity,
+        party2_quantity,
+        party1_side,
+        party2_side,
+        bytes.fromhex(signature1.replace("0x", "")),
+        bytes.fromhex(signature2.replace("0x", "")),
+        nonce1,
+        nonce2,
+    )
+
+
 async def settle_trades_if_any(order_dict: dict) -> dict:
     """Settle trades if any exist in the order response"""
     if not settlement_client or not order_dict.get("trades"):
@@ -226,76 +1014,11 @@ async def settle_trades_if_any(order_dict: dict) -> dict:
 
     try:
         for trade in order_dict["trades"]:
-            # Extract trade parties information
-            party1_addr = trade["party1"][0]
-            party1_priv_key = trade["party1"][4]
-            party1_side = trade["party1"][1]
-            party1_order_id = trade["party1"][2]
-            party1_remaining_qty = trade["party1"][3]
-
-            party2_addr = trade["party2"][0]
-            party2_side = trade["party2"][1]
-            party2_priv_key = trade["party2"][4]
-
-            party2_order_id = trade["party2"][2]
-            party2_remaining_qty = trade["party2"][3]
-
-            # Get token addresses
-            base_token_addr = get_token_address(order_dict["baseAsset"])
-            quote_token_addr = get_token_address(order_dict["quoteAsset"])
-
-            # Get nonces for both parties using base asset
-            nonce1 = settlement_client.get_user_nonce(party1_addr, base_token_addr)
-            nonce2 = settlement_client.get_user_nonce(party2_addr, base_token_addr)
-
-            # Convert amounts to proper units (18 decimals)
-            price_wei = int(float(trade["price"]) * (10**18))
-            quantity_wei = int(float(trade["quantity"]) * (10**18))
-
-            # Create TradeExecution struct data
-            trade_execution = {
-                "orderId": order_dict["orderId"],
-                "account": order_dict["account"],
-                "price": price_wei,
-                "quantity": quantity_wei,
-                "side": order_dict["side"],
-                "baseAsset": base_token_addr,
-                "quoteAsset": quote_token_addr,
-                "tradeId": str(order_dict["trade_id"]),
-                "timestamp": trade["timestamp"],
-                "isValid": order_dict["isValid"],
-            }
+            trade_execution = build_trade_execution(order_dict, trade)
 
-            # For the quantities passed to settleTrade function:
-            # These represent the quantities each party is trading
-            party1_quantity = quantity_wei  # Both parties trade the same base quantity
-            party2_quantity = quantity_wei
-
-            # Create signatures for both parties
-            # NOTE: In production, these signatures should be created by the actual users
-            # Either on the frontend or through a secure signing service
-            signature1 = create_trade_signature_for_user(
-                party1_priv_key,
-                trade_execution["orderId"],
-                base_token_addr,
-                quote_token_addr,
-                price_wei,
-                party1_quantity,
-                party1_side,
-                trade["timestamp"],
-                nonce1,
-            )
-
-            signature2 = create_trade_signature_for_user(
-                party2_priv_key,
-                trade_execution["orderId"],
-                base_token_addr,
-                quote_token_addr,
-                price_wei,
-                party2_quantity,
-                party2_side,
-                trade["timestamp"],
-                nonce2,
+            # Get nonces for both parties using base asset, concurrently
+            nonce1, nonce2 = await settlement_client.get_user_nonces(
+                [trade["party1"][0], trade["party2"][0]], trade_execution["baseAsset"]
             )
 
             # Attempt settlement
@@ -303,29 +1026,8 @@ async def settle_trades_if_any(order_dict: dict) -> dict:
 
             try:
                 # Build the settlement transaction
-                settlement_function = settlement_client.contract.functions.settleTrade(
-                    (
-                        trade_execution["orderId"],
-                        Web3.to_checksum_address(trade_execution["account"]),
-                        trade_execution["price"],
-                        trade_execution["quantity"],
-                        trade_execution["side"],
-                        Web3.to_checksum_address(trade_execution["baseAsset"]),
-                        Web3.to_checksum_address(trade_execution["quoteAsset"]),
-                        trade_execution["tradeId"],
-                        trade_execution["timestamp"],
-                        trade_execution["isValid"],
-                    ),
-                    Web3.to_checksum_address(party1_addr),
-                    Web3.to_checksum_address(party2_addr),
-                    party1_quantity,
-                    party2_quantity,
-                    party1_side,
-                    party2_side,
-                    bytes.fromhex(signature1.replace("0x", "")),
-                    bytes.fromhex(signature2.replace("0x", "")),
-                    nonce1,
-                    nonce2,
+                settlement_function = build_settle_trade_call(
+                    trade_execution, trade, nonce1, nonce2
                 )
 
                 # Check if we have a private key for transaction signing
@@ -336,10 +1038,10 @@ async def settle_trades_if_any(order_dict: dict) -> dict:
                         "trade_data": trade_execution,
                     }
                 else:
-                    # Estimate gas
+                    # Estimate gas, or take it from the cache of this call shape
                     try:
-                        gas_estimate = settlement_function.estimate_gas(
-                            {"from": settlement_client.account.address}
+                        gas_estimate = await settlement_client.gas.estimate(
+                            settlement_function, settlement_client.account.address
                         )
                     except Exception as gas_error:
                         logger.error(f"Gas estimation failed: {gas_error}")
@@ -353,38 +1055,12 @@ async def settle_trades_if_any(order_dict: dict) -> dict:
                         )
                         continue
 
-                    # Build transaction
-                    transaction = settlement_function.build_transaction(
-                        {
-                            "from": settlement_client.account.address,
-                            "gas": int(gas_estimate * 1.2),  # Add 20% buffer
-                            "gasPrice": settlement_client.web3.to_wei("20", "gwei"),
-                            "nonce": settlement_client.web3.eth.get_transaction_count(
-                                settlement_client.account.address
-                            ),
-                        }
+                    # Sign with the next operator nonce and the network fees, send and wait for the receipt
+                    settlement_result = await settlement_client.send_transaction(
+                        settlement_function, timeout=120, gas_estimate=gas_estimate
                     )
-
-                    # Sign and send transaction
-                    signed_txn = settlement_client.web3.eth.account.sign_transaction(
-                        transaction, settlement_client.account.key
-                    )
-                    tx_hash = settlement_client.web3.eth.send_raw_transaction(
-                        signed_txn.raw_transaction
-                    )
-
-                    # Wait for receipt
-                    receipt = settlement_client.web3.eth.wait_for_transaction_receipt(
-                        tx_hash, timeout=120
-                    )
-
-                    settlement_result = {
-                        "success": receipt.status == 1,
-                        "transaction_hash": receipt.transactionHash.hex(),
-                        "gas_used": receipt.gasUsed,
-                        "block_number": receipt.blockNumber,
-                        "trade_data": trade_execution,
-                    }
+                    settlement_result["trade_data"] = trade_execution
+                    settlement_result["nonces"] = [nonce1, nonce2]
 
             except Exception as settle_error:
                 logger.error(f"Settlement error: {settle_error}")
@@ -421,6 +1097,103 @@ async def settle_trades_if_any(order_dict: dict) -> dict:
     }
 
 
+def convert_trades(trades: list) -> list:
+    """Convert order book trade records to the serializable format used in responses"""
+    converted_trades = []
+    for trade in trades:
+        party1 = [
+            trade["party1"][0],
+            trade["party1"][1],
+            int(trade["party1"][2]) if trade["party1"][2] is not None else None,
+            float(trade["party1"][3]) if trade["party1"][3] is not None else None,
+            trade["party1"][4]
+        ]
+        party2 = [
+            trade["party2"][0],
+            trade["party2"][1],
+            int(trade["party2"][2]) if trade["party2"][2] is not None else None,
+            float(trade["party2"][3]) if trade["party2"][3] is not None else None,
+            trade["party2"][4]
+
+        ]
+
+        converted_trade = {
+            "timestamp": int(trade["timestamp"]),
+            "price": float(trade["price"]),
+            "quantity": float(trade["quantity"]),
+            "time": int(trade["time"]),
+            "party1": party1,
+            "party2": party2,
+        }
+        converted_trades.append(converted_trade)
+    return converted_trades
+
+
+def order_to_dict(order: dict, converted_trades: list) -> dict:
+    """Convert an order quote to a serializable format"""
+    order_dict = {
+        "orderId": int(order["order_id"]),
+        "account": order["account"],
+        "price": float(order["price"]) if order["price"] is not None else None,
+        "quantity": float(order["quantity"]),
+        "side": order["side"],
+        "baseAsset": order["baseAsset"],
+        "quoteAsset": order["quoteAsset"],
+        "trade_id": order["trade_id"],
+        "trades": converted_trades,
+        "isValid": True if order["order_id"] != 0 else True,
+        "timestamp": order["timestamp"],
+        "expireTime": order.get("expire_time"),
+    }
+    if order.get("peg_reference") is not None:
+        order_dict["pegReference"] = order["peg_reference"]
+        order_dict["pegOffset"] = float(order["peg_offset"])
+    if order.get("trigger_price") is not None:
+        order_dict["triggerPrice"] = float(order["trigger_price"])
+        order_dict["triggerDirection"] = order["trigger_direction"]
+        order_dict["executeAs"] = order["execute_as"]
+    return order_dict
+
+
+async def settle_triggered_orders(triggered: list) -> list:
+    """Report and settle the orders released from the trigger book by a trade"""
+    triggered_results = []
+    for item in triggered:
+        result = item["result"]
+        if not result["success"]:
+            triggered_results.append(
+                {
+                    "stopId": int(item["stop_id"]),
+                    "success": False,
+                    "message": result["message"],
+                }
+            )
+            continue
+        trades, order, task_id, _ = result["data"]
+        converted_trades = convert_trades(trades)
+        order_dict = order_to_dict(order or item["quote"], converted_trades)
+
+        settlement_info = {"settled": False}
+        if converted_trades:
+            logger.info(
+                f"Queueing {len(converted_trades)} triggered trade(s) of order {item['stop_id']} for settlement"
+            )
+            settlement_info = await settle_fills(
+                converted_trades, order_dict["baseAsset"], order_dict["quoteAsset"]
+            )
+
+        triggered_results.append(
+            {
+                "stopId": int(item["stop_id"]),
+                "success": True,
+                "order": order_dict,
+                "taskId": task_id,
+                "settlement_info": settlement_info,
+            }
+        )
+    return triggered_results
+
+
 @app.post("/api/register_order")
 async def register_order(payload: str = Form(...)):
     try:
@@ -447,20 +1220,34 @@ async def register_order(payload: str = Form(...)):
 
         # Step 2: Process the order in the order book
         if symbol not in order_books:
-            order_books[symbol] = OrderBook()
+            order_books[symbol] = create_order_book()
 
         order_book = order_books[symbol]
+        key_store.remember(payload_json["account"], payload_json["privateKey"])
 
         _order = {
-            "type": "limit",
+            "type": payload_json.get("type", "limit"),  # limit, ioc, fok, post_only, pegged, stop_loss, take_profit or trigger
             "trade_id": payload_json["account"],
             "account": payload_json["account"],
-            "price": Decimal(payload_json["price"]),
+            "price": (
+                Decimal(payload_json["price"])
+                if payload_json.get("price") is not None
+                else None
+            ),
             "quantity": Decimal(payload_json["quantity"]),
             "side": payload_json["side"],
             "baseAsset": payload_json["baseAsset"],
             "quoteAsset": payload_json["quoteAsset"],
-            "private_key": payload_json["privateKey"]
+            "private_key": payload_json["privateKey"],
+            "time_in_force": payload_json.get("timeInForce", "GTC"),
+            "expire_time": payload_json.get("expireTime"),
+            "trigger_price": payload_json.get("triggerPrice"),
+            "trigger_direction": payload_json.get("triggerDirection"),
+            "execute_as": payload_json.get("executeAs"),
+            "display_quantity": payload_json.get("displayQuantity"),
+            "peg_reference": payload_json.get("pegReference"),
+            "peg_offset": payload_json.get("pegOffset"),
+            "stp_mode": payload_json.get("stpMode"),
         }
 
         process_result = order_book.process_order(_order, False, False)
@@ -468,7 +1255,7 @@ async def register_order(payload: str = Form(...)):
         # This is the Failure case
         if not process_result["success"]:
             return JSONResponse(
-                content={"message": process_result["data"], "status_code": 0},
+                content={"message": process_result["message"], "status_code": 0},
                 status_code=400,
             )
 
@@ -480,49 +1267,8 @@ async def register_order(payload: str = Form(...)):
 
         assert order is not None
 
-        # Convert trades to the expected format
-        converted_trades = []
-        for trade in trades:
-            party1 = [
-                trade["party1"][0],
-                trade["party1"][1],
-                int(trade["party1"][2]) if trade["party1"][2] is not None else None,
-                float(trade["party1"][3]) if trade["party1"][3] is not None else None,
-                trade["party1"][4]
-            ]
-            party2 = [
-                trade["party2"][0],
-                trade["party2"][1],
-                int(trade["party2"][2]) if trade["party2"][2] is not None else None,
-                float(trade["party2"][3]) if trade["party2"][3] is not None else None,
-                trade["party2"][4]
-
-            ]
-
-            converted_trade = {
-                "timestamp": int(trade["timestamp"]),
-                "price": float(trade["price"]),
-                "quantity": float(trade["quantity"]),
-                "time": int(trade["time"]),
-                "party1": party1,
-                "party2": party2,
-            }
-            converted_trades.append(converted_trade)
-
-        # Convert order to a serializable format
-        order_dict = {
-            "orderId": int(order["order_id"]),
-            "account": order["account"],
-            "price": float(order["price"]),
-            "quantity": float(order["quantity"]),
-            "side": order["side"],
-            "baseAsset": order["baseAsset"],
-            "quoteAsset": order["quoteAsset"],
-            "trade_id": order["trade_id"],
-            "trades": converted_trades,
-            "isValid": True if order["order_id"] != 0 else True,
-            "timestamp": order["timestamp"],
-        }
+        converted_trades = convert_trades(trades)
+        order_dict = order_to_dict(order, converted_trades)
 
         next_best_order_dict = None
         if next_best_order is not None:
@@ -540,12 +1286,19 @@ async def register_order(payload: str = Form(...)):
                 "timestamp": next_best_order.timestamp,
             }
 
-        # Step 3: Settle trades if any exist
+        # Step 3: Queue the trades for settlement, if any exist; the response does not wait for it
         settlement_info = {"settled": False}
         if converted_trades:
-            logger.info(f"Attempting to settle {len(converted_trades)} trade(s)")
-            settlement_info = await settle_trades_if_any(order_dict)
-            logger.info(f"Settlement result: {settlement_info}")
+            logger.info(f"Queueing {len(converted_trades)} trade(s) for settlement")
+            settlement_info = await settle_fills(
+                converted_trades, order_dict["baseAsset"], order_dict["quoteAsset"]
+            )
+            logger.info(f"Settlement queued: {settlement_info}")
+
+        # Step 4: Queue the settlement of the orders this order's trades released from the trigger book
+        triggered_results = []
+        if process_result.get("triggered"):
+            triggered_results = await settle_triggered_orders(process_result["triggered"])
 
         logger.info(f"Order processed successfully with {len(converted_trades)} trades")
 
@@ -557,6 +1310,7 @@ async def register_order(payload: str = Form(...)):
                 "taskId": task_id,
                 "validation_details": validation_result.get("checks", {}),
                 "settlement_info": settlement_info,
+                "triggered": triggered_results,
                 "status_code": 1,
             },
             status_code=200,
@@ -567,8 +1321,10 @@ async def register_order(payload: str = Form(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Endpoints that change a book run on the event loop (async def), like the market makers'
+# requotes, rather than in the threadpool
 @app.post("/api/cancel_order")
-def cancel_order(payload: str = Form(...)):
+async def cancel_order(payload: str = Form(...)):
     try:
         payload_json = json.loads(payload)
         order_id = payload_json["orderId"]
@@ -576,6 +1332,20 @@ def cancel_order(payload: str = Form(...)):
         symbol = "%s_%s" % (payload_json["baseAsset"], payload_json["quoteAsset"])
 
         order_book = order_books[symbol]
+        if order_id in order_book.triggers:
+            # A dormant stop / trigger order that has not reached the book yet
+            stop = order_book.triggers.get(order_id)
+            order_book.cancel_order(side, order_id)
+            order_dict = order_to_dict(stop, [])
+            order_dict["isValid"] = False
+            return JSONResponse(
+                content={
+                    "message": "Order cancelled successfully",
+                    "order": order_dict,
+                    "status_code": 1,
+                }
+            )
+
         order = (
             order_book.bids.get_order(order_id)
             if order_id in order_book.bids.order_map
@@ -609,6 +1379,230 @@ def cancel_order(payload: str = Form(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/algo_order")
+async def register_algo_order(payload: str = Form(...)):
+    try:
+        payload_json = json.loads(payload)
+        symbol = "%s_%s" % (payload_json["baseAsset"], payload_json["quoteAsset"])
+
+        # The whole parent is validated up front, its children are not
+        validation_result = await validate_order_prerequisites(payload_json)
+        if not validation_result["valid"]:
+            return JSONResponse(
+                content={
+                    "message": "Order validation failed",
+                    "errors": validation_result.get("errors", []),
+                    "validation_details": validation_result.get("checks", {}),
+                    "status_code": 0,
+                },
+                status_code=400,
+            )
+
+        if symbol not in order_books:
+            order_books[symbol] = create_order_book()
+        key_store.remember(payload_json["account"], payload_json["privateKey"])
+
+        _order = {
+            "trade_id": payload_json["account"],
+            "account": payload_json["account"],
+            "price": (
+                Decimal(payload_json["price"])
+                if payload_json.get("price") is not None
+                else None
+            ),
+            "quantity": Decimal(payload_json["quantity"]),
+            "side": payload_json["side"],
+            "baseAsset": payload_json["baseAsset"],
+            "quoteAsset": payload_json["quoteAsset"],
+            "private_key": payload_json["privateKey"],
+            "stp_mode": payload_json.get("stpMode"),
+        }
+
+        try:
+            parent = algo_scheduler.submit(
+                payload_json.get("algo", "twap"),  # twap or vwap
+                symbol,
+                _order,
+                int(time.time() * 1000),
+                int(payload_json["duration"] * 1000),  # seconds
+                int(payload_json.get("interval", 1) * 1000),  # seconds between child orders
+                payload_json.get("maxParticipation"),
+            )
+        except Exception as e:
+            return JSONResponse(
+                content={"message": str(e), "status_code": 0},
+                status_code=400,
+            )
+
+        return JSONResponse(
+            content={
+                "message": "Algo order registered successfully",
+                "algo": parent.to_dict(),
+                "validation_details": validation_result.get("checks", {}),
+                "status_code": 1,
+            }
+        )
+    except Exception as e:
+        logger.error(f"Error in register_algo_order: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/algo_status")
+def get_algo_order(payload: str = Form(...)):
+    try:
+        payload_json = json.loads(payload)
+        parent = algo_scheduler.get(payload_json["algoId"])
+        if parent is None:
+            raise HTTPException(status_code=404, detail="Algo order not found")
+
+        return JSONResponse(
+            content={
+                "message": "Algo order retrieved successfully",
+                "algo": parent.to_dict(),
+                "status_code": 1,
+            }
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/cancel_algo")
+async def cancel_algo_order(payload: str = Form(...)):
+    try:
+        payload_json = json.loads(payload)
+        parent = algo_scheduler.cancel(payload_json["algoId"], order_books)
+        if parent is None:
+            raise HTTPException(status_code=404, detail="Algo order not found")
+
+        return JSONResponse(
+            content={
+                "message": "Algo order cancelled successfully",
+                "algo": parent.to_dict(),
+                "status_code": 1,
+            }
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def market_maker_funds(market_maker: MarketMaker) -> dict:
+    """What the market maker's account may commit to its quotes on each side.
+
+    The smaller of allowance and balance, less what the account's other resting
+    orders may still need: quote notional for the bids, base quantity for the asks.
+    """
+    account = market_maker.quote["account"]
+    funds = {}
+    for side, asset in (("bid", market_maker.quote["quoteAsset"]), ("ask", market_maker.quote["baseAsset"])):
+        allowance, balance = await settlement_client.allowances.get(account, get_token_address(asset))
+        # Its own quotes are re-sized against these funds, not reserved from them
+        reserved = reserved_amount(account, asset) - market_maker.committed(side)
+        funds[side] = Decimal(min(allowance, balance)) / (10**18) - reserved
+    return funds
+
+
+async def market_maker_funds_loop(market_maker: MarketMaker):
+    """Keep the funds of a running market maker up to date"""
+    while market_maker.running:
+        await asyncio.sleep(ALLOWANCE_POLL_INTERVAL)
+        if not market_maker.running:
+            break
+        try:
+            market_maker.set_funds(await market_maker_funds(market_maker))
+        except Exception as e:
+            logger.error(f"Error reading market maker funds: {e}")
+
+
+@app.post("/api/market_maker")
+async def configure_market_maker(payload: str = Form(...)):
+    try:
+        payload_json = json.loads(payload)
+        symbol = payload_json["symbol"]
+
+        # A new configuration replaces the running market maker and its quotes
+        if symbol in market_makers:
+            market_makers.pop(symbol).stop()
+
+        if not payload_json.get("enabled", True):
+            return JSONResponse(
+                content={
+                    "message": "Market maker stopped",
+                    "symbol": symbol,
+                    "status_code": 1,
+                }
+            )
+
+        if not settlement_client:
+            raise HTTPException(status_code=503, detail="Settlement client not available")
+
+        if symbol not in order_books:
+            order_books[symbol] = create_order_book()
+
+        base_asset, quote_asset = symbol.split("_")
+        key_store.remember(payload_json["account"], payload_json["privateKey"])
+        loop = asyncio.get_running_loop()
+        market_maker = MarketMaker(
+            order_books[symbol],
+            {
+                "trade_id": payload_json["account"],
+                "account": payload_json["account"],
+                "private_key": payload_json["privateKey"],
+                "baseAsset": base_asset,
+                "quoteAsset": quote_asset,
+            },
+            levels=int(payload_json.get("levels", 3)),
+            quantity=payload_json.get("quantity", 1),  # per level
+            half_spread=payload_json.get("halfSpread"),  # minimum, defaults to one tick
+            level_spacing=payload_json.get("levelSpacing"),  # defaults to one tick
+            max_inventory=payload_json.get("maxInventory", 10),
+            inventory_skew=payload_json.get("inventorySkew", 1),
+            volatility_multiplier=payload_json.get("volatilityMultiplier", 2),
+            min_interval=payload_json.get("minInterval", 0.1) * 1000,  # seconds between requotes
+            price_tolerance=payload_json.get("priceTolerance", 1),  # ticks
+            quantity_tolerance=payload_json.get("quantityTolerance", 0.1),
+            schedule=loop.call_later,
+        )
+        # Quotes are placed only once the account's funds are known
+        market_maker.set_funds(await market_maker_funds(market_maker))
+        market_makers[symbol] = market_maker
+        market_maker.start()
+        asyncio.ensure_future(market_maker_funds_loop(market_maker))
+
+        return JSONResponse(
+            content={
+                "message": "Market maker started",
+                "symbol": symbol,
+                "marketMaker": market_maker.report(),
+                "status_code": 1,
+            }
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/market_makers")
+def get_market_makers():
+    try:
+        return JSONResponse(
+            content={
+                "message": "Market makers retrieved successfully",
+                "marketMakers": {
+                    symbol: market_maker.report()
+                    for symbol, market_maker in market_makers.items()
+                },
+                "status_code": 1,
+            }
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/api/order")
 def get_order(payload: str = Form(...)):
     try:
@@ -616,6 +1610,7 @@ def get_order(payload: str = Form(...)):
         order_id = payload_json["orderId"]
 
         order = None
+        queue_position = None
         for symbol, order_book in order_books.items():
             if (
                 order_id in order_book.bids.order_map
@@ -626,6 +1621,13 @@ def get_order(payload: str = Form(...)):
                     if order_id in order_book.bids.order_map
                     else order_book.asks.get_order(order_id)
                 )
+                position = order_book.queue_position(order_id)
+                queue_position = {
+                    "ordersAhead": position["orders_ahead"],
+                    "volumeAhead": float(position["volume_ahead"]),
+                    "levelOrders": position["level_orders"],
+                    "levelVolume": float(position["level_volume"]),
+                }
 
         if order is not None:
             order_dict = {
@@ -640,12 +1642,14 @@ def get_order(payload: str = Form(...)):
                 "trades": [],
                 "isValid": True if order.order_id is not None else False,
                 "timestamp": order.timestamp,
+                "hiddenQuantity": float(order.hidden_quantity),
             }
 
             return JSONResponse(
                 content={
                     "message": "Order retrieved successfully",
                     "order": order_dict,
+                    "queuePosition": queue_position,
                     "status_code": 1,
                 }
             )
@@ -664,7 +1668,7 @@ def get_orderbook(payload: str = Form(...)):
         symbol = payload_json["symbol"]
 
         if symbol not in order_books:
-            order_book = OrderBook()
+            order_book = create_order_book()
             order_books[symbol] = order_book
         else:
             order_book = order_books[symbol]
@@ -682,6 +1686,203 @@ def get_orderbook(payload: str = Form(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/candles")
+def get_candles(payload: str = Form(...)):
+    try:
+        payload_json = json.loads(payload)
+        symbol = payload_json["symbol"]
+        interval = payload_json.get("interval", "1m")
+        limit = payload_json.get("limit")
+
+        if limit is not None and (
+            not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= MAX_CANDLES
+        ):
+            raise HTTPException(
+                status_code=400,
+                detail=f"limit must be an integer between 1 and {MAX_CANDLES}",
+            )
+        if symbol not in order_books:
+            raise HTTPException(status_code=404, detail="Order book not found")
+
+        candles = order_books[symbol].candles.get_candles(interval, limit)
+
+        return JSONResponse(
+            content={
+                "message": "Candles retrieved successfully",
+                "symbol": symbol,
+                "interval": interval,
+                "candles": candles,
+                "status_code": 1,
+            }
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/ticker")
+def get_ticker(payload: str = Form(...)):
+    try:
+        payload_json = json.loads(payload)
+        symbol = payload_json["symbol"]
+
+        if symbol not in order_books:
+            raise HTTPException(status_code=404, detail="Order book not found")
+
+        ticker = order_books[symbol].candles.get_ticker(int(time.time() * 1000))
+
+        return JSONResponse(
+            content={
+                "message": "Ticker retrieved successfully",
+                "symbol": symbol,
+                "ticker": ticker,
+                "status_code": 1,
+            }
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def fill_estimate_to_dict(estimate) -> Optional[dict]:
+    """Convert an OrderBook.estimate_fill result to a JSON serializable dict"""
+    if estimate is None:
+        return None
+    return {
+        "quantity": float(estimate["quantity"]),
+        "filled": float(estimate["filled"]),
+        "notional": float(estimate["notional"]),
+        "vwap": float(estimate["vwap"]),
+        "worstPrice": float(estimate["worst_price"]),
+        "levels": estimate["levels"],
+        "complete": estimate["complete"],
+    }
+
+
+@app.post("/api/quote")
+def get_quote(payload: str = Form(...)):
+    try:
+        payload_json = json.loads(payload)
+        symbol = "%s_%s" % (payload_json["baseAsset"], payload_json["quoteAsset"])
+        side = payload_json["side"]
+        quantity = payload_json["quantity"]
+        limit_price = payload_json.get("price")
+
+        if symbol not in order_books:
+            raise HTTPException(status_code=404, detail="Order book not found")
+
+        order_book = order_books[symbol]
+        if isinstance(quantity, list):
+            estimates = order_book.estimate_fill(
+                side,
+                [Decimal(str(q)) for q in quantity],
+                Decimal(str(limit_price)) if limit_price is not None else None,
+            )
+            quote = [fill_estimate_to_dict(e) for e in estimates]
+        else:
+            quote = fill_estimate_to_dict(
+                order_book.estimate_fill(
+                    side,
+                    Decimal(str(quantity)),
+                    Decimal(str(limit_price)) if limit_price is not None else None,
+                )
+            )
+
+        return JSONResponse(
+            content={
+                "message": "Quote estimated successfully",
+                "side": side,
+                "quote": quote,
+                "status_code": 1,
+            }
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/signals")
+def get_signals(payload: str = Form(...)):
+    try:
+        payload_json = json.loads(payload)
+        symbol = payload_json["symbol"]
+
+        if symbol not in order_books:
+            raise HTTPException(status_code=404, detail="Order book not found")
+
+        return JSONResponse(
+            content={
+                "message": "Signals retrieved successfully",
+                "symbol": symbol,
+                "signals": order_books[symbol].signals.to_dict(),
+                "status_code": 1,
+            }
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+FEED_QUEUE_SIZE = int(os.getenv("FEED_QUEUE_SIZE", 10000))
+
+
+@app.websocket("/ws/order-book")
+async def order_book_feed(websocket: WebSocket):
+    """Stream book deltas (level changes with signals, trades) for one symbol.
+
+    The client sends {"symbol": "BASE_QUOTE"} after connecting and first receives a
+    full snapshot, then every change event published by the OrderBook. An unknown
+    symbol gets an error message and the connection is closed.
+    """
+    await websocket.accept()
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=FEED_QUEUE_SIZE)
+
+    def enqueue(event):
+        if queue.full():
+            # Slow consumer: drop the event rather than stall matching
+            return
+        queue.put_nowait(event)
+
+    def on_event(event):
+        # Sync endpoints run in the threadpool, so hand events over to the loop thread
+        loop.call_soon_threadsafe(enqueue, event)
+
+    order_book = None
+    try:
+        payload_json = await websocket.receive_json()
+        symbol = payload_json["symbol"]
+        if symbol not in order_books:
+            # A read-only subscription does not create books
+            await websocket.send_json({"type": "error", "message": "Order book not found"})
+            await websocket.close(code=1008)
+            return
+        order_book = order_books[symbol]
+        order_book.listeners.append(on_event)
+
+        await websocket.send_json(
+            {
+                "type": "snapshot",
+                "orderbook": order_book.get_orderbook(symbol),
+                "signals": order_book.signals.to_dict(),
+            }
+        )
+        while True:
+            event = await queue.get()
+            await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Order book feed error: {e}")
+    finally:
+        if order_book is not None and on_event in order_book.listeners:
+            order_book.listeners.remove(on_event)
+
+
 @app.post("/api/get_best_order")
 def get_best_order(payload: str = Form(...)):
     try:
@@ -723,7 +1924,7 @@ def get_best_order(payload: str = Form(...)):
             if side == "bid"
             else order_book.asks.price_map[price]
         )
-        current_order = price_list.head_order
+        current_order = first_order(price_list)
         order_dict = {
             "order_id": int(current_order.order_id),
             "account": current_order.account,
@@ -766,17 +1967,18 @@ def check_available_funds(payload: str = Form(...)):
             # Check bids (buying orders)
             if quote_asset == asset:  # If quote asset matches, check bids
                 for order_id, order in order_book.bids.order_map.items():
-                    if order["account"].lower() == account.lower():
+                    if order.account.lower() == account.lower():
                         # For bids, the locked amount is price * quantity in quote asset
-                        locked_amount = order["price"] * order["quantity"]
+                        # (including the hidden reserve of iceberg orders)
+                        locked_amount = order.price * order.total_quantity
                         total_locked_amount += locked_amount
 
             # Check asks (selling orders)
             if base_asset == asset:  # If base asset matches, check asks
                 for order_id, order in order_book.asks.order_map.items():
-                    if order["account"].lower() == account.lower():
+                    if order.account.lower() == account.lower():
                         # For asks, the locked amount is just the quantity in base asset
-                        total_locked_amount += order["quantity"]
+                        total_locked_amount += order.total_quantity
 
         return JSONResponse(
             content={
@@ -791,6 +1993,221 @@ def check_available_funds(payload: str = Form(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/matching_mode")
+async def set_matching_mode(payload: str = Form(...)):
+    try:
+        payload_json = json.loads(payload)
+        symbol = payload_json["symbol"]
+        mode = payload_json["mode"]
+        interval = payload_json.get("interval")  # seconds between auctions
+
+        if mode not in ("continuous", "auction"):
+            raise HTTPException(
+                status_code=400, detail="mode must be continuous or auction"
+            )
+
+        if symbol not in order_books:
+            order_books[symbol] = create_order_book()
+        order_book = order_books[symbol]
+
+        results = order_book.set_matching_mode(
+            mode, interval * 1000 if interval is not None else None
+        )
+
+        # Leaving auction mode uncrosses whatever was collected, one batch per clearing price
+        auctions = []
+        for result in results:
+            settlement = await settle_auction_result(symbol, result)
+            auctions.append(
+                {
+                    "price": float(result["price"]),
+                    "volume": float(result["volume"]),
+                    "trades": convert_trades(result["trades"]),
+                    "settlement_info": settlement,
+                }
+            )
+
+        return JSONResponse(
+            content={
+                "message": "Matching mode updated successfully",
+                "symbol": symbol,
+                "mode": order_book.matching_mode,
+                "interval": order_book.auction_interval / 1000,
+                "auctions": auctions,
+                "status_code": 1,
+            }
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/metrics")
+def get_metrics():
+    try:
+        metrics = {}
+        for symbol, order_book in order_books.items():
+            book_metrics = order_book.metrics()
+            metrics[symbol] = {
+                "bidOrders": book_metrics["bid_orders"],
+                "askOrders": book_metrics["ask_orders"],
+                "dormantOrders": book_metrics["dormant_orders"],
+                "trades": book_metrics["trades"],
+                "matchingMode": book_metrics["matching_mode"],
+                "selfTradesPrevented": book_metrics["self_trades_prevented"],
+                "selfTradeQuantityPrevented": float(
+                    book_metrics["self_trade_quantity_prevented"]
+                ),
+            }
+
+        return JSONResponse(
+            content={
+                "message": "Metrics retrieved successfully",
+                "metrics": metrics,
+                "settlementQueue": (
+                    settlement_queue.counts() if settlement_queue is not None else None
+                ),
+                "netting": {
+                    "window": SETTLEMENT_WINDOW,
+                    "fills": settlement_netter.total_fills,
+                    "netTransfers": settlement_netter.total_transactions,
+                    "reductionRatio": settlement_netter.reduction_ratio(),
+                },
+                "signers": (
+                    settlement_client.signers.stats()
+                    if settlement_client is not None and settlement_client.signers is not None
+                    else None
+                ),
+                "receipts": (
+                    settlement_client.receipts.stats() if settlement_client is not None else None
+                ),
+                "gas": settlement_client.gas.stats() if settlement_client is not None else None,
+                "allowances": (
+                    settlement_client.allowances.stats() if settlement_client is not None else None
+                ),
+                "retries": settlement_retry.stats(),
+                "status_code": 1,
+            }
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/settlement_status")
+def get_settlement_status(payload: str = Form(...)):
+    try:
+        payload_json = json.loads(payload)
+        settlement = (
+            settlement_queue.get(payload_json["settlementId"])
+            if settlement_queue is not None
+            else None
+        )
+        if settlement is None:
+            raise HTTPException(status_code=404, detail="Settlement not found")
+
+        return JSONResponse(
+            content={
+                "message": "Settlement status retrieved successfully",
+                "settlementId": settlement["id"],
+                "status": settlement["status"],  # queued, settling, retrying, settled or failed
+                "attempts": settlement["attempts"],
+                "nextAttempt": settlement["notBefore"] if settlement["status"] == RETRYING else None,
+                "created": settlement["created"],
+                "updated": settlement["updated"],
+                "fills": [fill_to_audit(trade) for trade in settlement["trades"]],
+                "result": settlement["result"],
+                "status_code": 1,
+            }
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/dead_letters")
+def get_dead_letters(payload: str = Form("{}")):
+    """Fills given up on by the settlement workers, newest first"""
+    try:
+        payload_json = json.loads(payload)
+        if settlement_queue is None:
+            raise HTTPException(status_code=503, detail="Settlement queue not initialized")
+        dead_letters = settlement_queue.dead_letters(
+            int(payload_json.get("limit", 100)), bool(payload_json.get("replayed", False))
+        )
+
+        return JSONResponse(
+            content={
+                "message": "Dead letters retrieved successfully",
+                "deadLetters": [
+                    {
+                        "id": dead_letter["id"],
+                        "settlementId": dead_letter["settlementId"],
+                        "baseAsset": dead_letter["baseAsset"],
+                        "quoteAsset": dead_letter["quoteAsset"],
+                        "error": dead_letter["error"],
+                        "attempts": dead_letter["attempts"],
+                        "replayedAs": dead_letter["replayedAs"],
+                        "created": dead_letter["created"],
+                        "transactionHashes": (dead_letter["sent"] or {}).get("transactionHashes"),
+                        "fills": [fill_to_audit(trade) for trade in dead_letter["trades"]],
+                    }
+                    for dead_letter in dead_letters
+                ],
+                "status_code": 1,
+            }
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/replay_dead_letter")
+async def replay_dead_letter(payload: str = Form(...)):
+    """Queue the fills of a dead letter for settlement again.
+
+    Fills that went out in a transaction never seen confirmed are only
+    replayed once it is found reverted or dropped: signing them again while
+    it may still be mined could settle them twice.
+    """
+    try:
+        payload_json = json.loads(payload)
+        if settlement_queue is None:
+            raise HTTPException(status_code=503, detail="Settlement queue not initialized")
+        dead_letter_id = payload_json["deadLetterId"]
+        dead_letter = settlement_queue.get_dead_letter(dead_letter_id)
+        if dead_letter is None:
+            raise HTTPException(status_code=404, detail="Dead letter not found")
+        if dead_letter["replayedAs"] is not None:
+            raise HTTPException(status_code=409, detail="Dead letter already replayed")
+        if dead_letter["sent"] is not None or settlement_retry.classify(dead_letter["error"]) == UNKNOWN:
+            status, _ = await check_unconfirmed(dead_letter["sent"] or {})
+            if status not in ("reverted", "dropped"):
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Dead letter was sent in a transaction that is {status}, replaying it could settle it twice",
+                )
+        settlement_id = settlement_queue.replay(dead_letter_id)
+        if settlement_id is None:
+            raise HTTPException(status_code=409, detail="Dead letter already replayed")
+        logger.info(f"Replaying dead letter {dead_letter_id} as settlement {settlement_id}")
+
+        return JSONResponse(
+            content={
+                "message": "Dead letter queued for settlement",
+                "deadLetterId": dead_letter_id,
+                "settlementId": settlement_id,
+                "status_code": 1,
+            }
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # Add a health check endpoint for the settlement system
 @app.get("/api/settlement_health")
 async def settlement_health():
@@ -807,7 +2224,7 @@ async def settlement_health():
             )
 
         # Check if web3 is connected
-        web3_connected = settlement_client.web3.isConnected()
+        web3_connected = await settlement_client.web3.is_connected()
 
         return JSONResponse(
             content={
@@ -0,0 +1,302 @@
+import heapq
+from collections import OrderedDict
+from decimal import Decimal, ROUND_DOWN
+
+from .candles import DAY
+
+ALGO_TYPES = ("twap", "vwap")
+QUANTITY_STEP = Decimal("0.00000001")  # child sizes are rounded down to this
+
+
+class AlgoOrder(object):
+    '''
+    A parent order worked as a series of child limit orders until end_time.
+
+    Every `interval` ms the child of the previous slice is cancelled and a new
+    one is placed for the quantity the schedule is behind by: TWAP targets a
+    share of the parent proportional to elapsed time, VWAP the share of the
+    market volume traded so far in the volume expected over the whole duration.
+    max_participation caps each child at that fraction of the market volume
+    traded (by others) during the previous slice.
+    '''
+
+    def __init__(self, algo_id, algo_type, symbol, quote, start_time, duration, interval,
+                 max_participation=None):
+        self.algo_id = algo_id
+        self.algo_type = algo_type
+        self.symbol = symbol
+        self.side = quote["side"]
+        self.quantity = Decimal(quote["quantity"])
+        self.limit_price = Decimal(quote["price"]) if quote.get("price") is not None else None
+        self.quote = quote # account, trade_id, private_key, baseAsset, quoteAsset of the children
+        self.start_time = start_time
+        self.end_time = start_time + duration
+        self.interval = interval
+        self.max_participation = Decimal(max_participation) if max_participation is not None else None
+        self.status = "working" # working, completed, cancelled or expired
+        self.filled = Decimal(0)
+        self.notional = Decimal(0)
+        self.slices = 0
+        self.child_order_id = None # resting child of the current slice
+        self.next_time = start_time
+        # symbol volume counter and own fills at the previous slice, for the market volume in between
+        self.volume_mark = None
+        self.filled_mark = Decimal(0)
+        self.start_volume = None
+
+    @property
+    def remaining(self):
+        return self.quantity - self.filled
+
+    def fill(self, price, quantity):
+        self.filled += quantity
+        self.notional += price * quantity
+
+    def to_dict(self):
+        return {
+            "algoId": self.algo_id,
+            "algo": self.algo_type,
+            "symbol": self.symbol,
+            "side": self.side,
+            "quantity": float(self.quantity),
+            "price": float(self.limit_price) if self.limit_price is not None else None,
+            "filled": float(self.filled),
+            "averagePrice": float(self.notional / self.filled) if self.filled else None,
+            "slices": self.slices,
+            "childOrderId": self.child_order_id,
+            "startTime": self.start_time,
+            "endTime": self.end_time,
+            "interval": self.interval,
+            "maxParticipation": float(self.max_participation) if self.max_participation is not None else None,
+            "status": self.status,
+        }
+
+
+class AlgoScheduler(object):
+    '''
+    Releases the child orders of TWAP / VWAP parents into their OrderBooks.
+
+    Working parents sit in a heap keyed by their next slice time, so a run only
+    touches the parents that are due, however many are working. Fills of
+    resting children are picked up from each book's tape, which is read once
+    per run from where the previous run stopped and matched to parents through
+    a child order id map; the same pass keeps a per-symbol volume counter that
+    gives every parent the market volume since its last slice in O(1).
+    '''
+
+    def __init__(self, max_finished=10000, max_releases=200):
+        self.parents = {} # algo_id : AlgoOrder, working ones and the most recent finished ones
+        self.heap = [] # (next_time, algo_id), stale entries are skipped
+        self.children = {} # (symbol, child order id) : algo_id
+        self.working = {} # symbol : number of working parents
+        self.tape_cursors = {} # symbol : trades of its tape already read
+        self.volumes = {} # symbol : market volume read from its tape
+        self.finished = OrderedDict() # algo ids of finished parents, oldest first
+        self.max_finished = max_finished
+        self.max_releases = max_releases # slices per run, the rest wait for the next run
+        self.next_algo_id = 0
+
+    def __len__(self):
+        return sum(self.working.values())
+
+    def submit(self, algo_type, symbol, quote, now, duration, interval, max_participation=None):
+        '''Start working a parent order. duration and interval are in ms.'''
+        if algo_type not in ALGO_TYPES:
+            raise Exception("Unknown algo %s, expected one of %s" % (algo_type, ALGO_TYPES))
+        if quote["side"] not in ("bid", "ask"):
+            raise Exception("side must be bid or ask")
+        if Decimal(quote["quantity"]) <= 0:
+            raise Exception("quantity must be positive")
+        if duration <= 0 or interval <= 0:
+            raise Exception("duration and interval must be positive")
+        if max_participation is not None and not 0 < Decimal(max_participation) <= 1:
+            raise Exception("max_participation must be in (0, 1]")
+        self.next_algo_id += 1
+        parent = AlgoOrder(self.next_algo_id, algo_type, symbol, quote, now, duration,
+                           min(interval, duration), max_participation)
+        self.parents[parent.algo_id] = parent
+        self.working[symbol] = self.working.get(symbol, 0) + 1
+        heapq.heappush(self.heap, (parent.next_time, parent.algo_id))
+        return parent
+
+    def get(self, algo_id):
+        return self.parents.get(algo_id)
+
+    def cancel(self, algo_id, books):
+        '''Stop a working parent and cancel its resting child. Returns the parent, or None.'''
+        parent = self.parents.get(algo_id)
+        if parent is None or parent.status != "working":
+            return parent
+        book = books.get(parent.symbol)
+        if book is not None:
+            self.read_tape(parent.symbol, book)
+        self.finish(parent, "cancelled", book)
+        return parent
+
+    def run(self, now, books):
+        '''
+        Release the slices due at `now` (ms) into `books` (symbol : OrderBook).
+
+        Returns [(parent, process_order result)] for every child placed, so the
+        caller can settle its trades and the orders they released.
+        '''
+        for symbol, count in self.working.items():
+            if count and symbol in books:
+                self.read_tape(symbol, books[symbol])
+        released = []
+        heap = self.heap
+        releases = 0
+        while heap and heap[0][0] <= now and releases < self.max_releases:
+            next_time, algo_id = heapq.heappop(heap)
+            parent = self.parents.get(algo_id)
+            if parent is None or parent.status != "working" or parent.next_time != next_time:
+                continue
+            book = books.get(parent.symbol)
+            if book is None:
+                self.finish(parent, "cancelled", None)
+                continue
+            releases += 1
+            result = self.release_slice(parent, book, now)
+            if result is not None:
+                released.append((parent, result))
+        return released
+
+    def read_tape(self, symbol, book):
+        '''Fold the trades added to the book's tape since the last read into the parents.'''
+        tape = book.tape
+        cursor = self.tape_cursors.get(symbol, 0)
+        if cursor > len(tape):
+            cursor = 0 # the tape was wiped
+        volume = self.volumes.get(symbol, Decimal(0))
+        children = self.children
+        # Index [-1] is the newest trade; reading from the back keeps deque indexing cheap
+        for index in range(cursor - len(tape), 0):
+            trade = tape[index]
+            volume += trade["quantity"]
+            for party in (trade["party1"], trade["party2"]):
+                # Only resting orders carry an order id here; taker fills of a child are
+                # taken from the result of placing it
+                algo_id = children.get((symbol, party[2])) if party[2] is not None else None
+                if algo_id is not None:
+                    self.parents[algo_id].fill(trade["price"], trade["quantity"])
+        self.tape_cursors[symbol] = len(tape)
+        self.volumes[symbol] = volume
+
+    def release_slice(self, parent, book, now):
+        self.cancel_child(parent, book)
+        if parent.remaining <= 0:
+            self.finish(parent, "completed", book)
+            return None
+        if now >= parent.end_time:
+            self.finish(parent, "expired", book)
+            return None
+
+        volume = self.volumes.get(parent.symbol, Decimal(0))
+        if parent.start_volume is None:
+            parent.start_volume = volume
+        interval_volume = None
+        if parent.volume_mark is not None:
+            # Market volume of the previous slice, less the parent's own fills in it
+            interval_volume = max(volume - parent.volume_mark - (parent.filled - parent.filled_mark), 0)
+        parent.volume_mark = volume
+        parent.filled_mark = parent.filled
+
+        size = self.target_quantity(parent, book, now, volume) - parent.filled
+        if parent.max_participation is not None:
+            size = min(size, parent.max_participation * (interval_volume or 0))
+        size = min(size, parent.remaining)
+        price = self.child_price(parent, book)
+
+        result = None
+        if price is not None and size > 0:
+            size = self.child_quantity(parent, book, price, size)
+        if price is not None and size > 0:
+            child = dict(parent.quote)
+            child.update({
+                "type": "limit",
+                "side": parent.side,
+                "price": price,
+                "quantity": size,
+                "time_in_force": "GTC",
+                "expire_time": None,
+            })
+            result = book.process_order(child, False, False)
+            if result["success"]:
+                parent.slices += 1
+                trades, order_in_book = result["data"][0], result["data"][1]
+                for trade in trades: # taker fills, the tape has no order id for them
+                    parent.fill(trade["price"], trade["quantity"])
+                if order_in_book is not None:
+                    parent.child_order_id = order_in_book["order_id"]
+                    self.children[(parent.symbol, parent.child_order_id)] = parent.algo_id
+                # Credits other children the child traded against, and moves the marks past
+                # the child's own trades
+                self.read_tape(parent.symbol, book)
+                parent.volume_mark = self.volumes[parent.symbol]
+                parent.filled_mark = parent.filled
+
+        if parent.remaining <= 0:
+            self.finish(parent, "completed", book)
+        else:
+            parent.next_time = min(now + parent.interval, parent.end_time)
+            heapq.heappush(self.heap, (parent.next_time, parent.algo_id))
+        return result
+
+    def target_quantity(self, parent, book, now, volume):
+        '''How much of the parent should be filled by the end of the slice starting at `now`.'''
+        slice_end = min(now + parent.interval, parent.end_time)
+        if slice_end >= parent.end_time:
+            return parent.quantity
+        if parent.algo_type == "twap":
+            share = Decimal(slice_end - parent.start_time) / (parent.end_time - parent.start_time)
+            return parent.quantity * share
+        # VWAP: market volume so far against what the rest of the duration is expected to add
+        traded = volume - parent.start_volume
+        elapsed = now - parent.start_time
+        rate = book.candles.window.volume / DAY
+        if not rate and elapsed > 0:
+            rate = traded / elapsed
+        expected = traded + rate * (parent.end_time - now)
+        if not expected:
+            return parent.filled # no volume to follow yet
+        return parent.quantity * traded / expected
+
+    def child_quantity(self, parent, book, price, size):
+        '''size rounded down to QUANTITY_STEP, and capped at the first order it would take.'''
+        # A crossing limit order may only take the first order it meets
+        quote = {"account_id": book.intern_account(parent.quote.get("account")),
+                 "stp_mode": parent.quote.get("stp_mode")}
+        if parent.side == "bid":
+            best_order, _ = book.first_counterparty(book.asks, False, quote)
+            if best_order is not None and price >= best_order.price:
+                size = min(size, best_order.quantity)
+        else:
+            best_order, _ = book.first_counterparty(book.bids, True, quote)
+            if best_order is not None and price <= best_order.price:
+                size = min(size, best_order.quantity)
+        return size.quantize(QUANTITY_STEP, rounding=ROUND_DOWN)
+
+    def child_price(self, parent, book):
+        '''The parent's limit price, or the touch on the opposite side if it has none.'''
+        if parent.limit_price is not None:
+            return parent.limit_price
+        if parent.side == "bid":
+            return book.get_best_ask()
+        return book.get_best_bid()
+
+    def cancel_child(self, parent, book):
+        if parent.child_order_id is None:
+            return
+        self.children.pop((parent.symbol, parent.child_order_id), None)
+        if book is not None:
+            book.cancel_order(parent.side, parent.child_order_id)
+        parent.child_order_id = None
+
+    def finish(self, parent, status, book):
+        self.cancel_child(parent, book)
+        parent.status = status
+        self.working[parent.symbol] -= 1
+        self.finished[parent.algo_id] = None
+        while len(self.finished) > self.max_finished:
+            algo_id, _ = self.finished.popitem(last=False)
+            del self.parents[algo_id]
@@ -0,0 +1,200 @@
+from collections import deque, OrderedDict
+from decimal import Decimal
+
+
+# Candle interval name : length in milliseconds
+INTERVALS = OrderedDict([
+    ("1s", 1000),
+    ("1m", 60 * 1000),
+    ("5m", 5 * 60 * 1000),
+    ("1h", 60 * 60 * 1000),
+])
+
+DAY = 24 * 60 * 60 * 1000
+
+
+class RollingWindow(object):
+    '''
+    Sliding window statistics (volume, high, low, open) over the last `span`
+    milliseconds of trades.
+
+    Trades are coalesced into buckets of `granularity` milliseconds so the
+    window holds at most span / granularity entries. High and low are kept in
+    monotonic deques, so every update and expiry is amortised O(1).
+    '''
+
+    def __init__(self, span=DAY, granularity=1000):
+        self.span = span
+        self.granularity = granularity
+        self.buckets = deque() # [start, open, high, low, close, volume, notional], oldest first
+        self.max_queue = deque() # buckets with decreasing high
+        self.min_queue = deque() # buckets with increasing low
+        self.volume = Decimal(0)
+        self.quote_volume = Decimal(0)
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def add(self, timestamp, price, quantity):
+        start = timestamp - timestamp % self.granularity
+        notional = price * quantity
+        if self.buckets and self.buckets[-1][0] >= start:
+            # Same bucket, or a trade that arrived out of order: fold it into the newest bucket
+            bucket = self.buckets[-1]
+            if price > bucket[2]:
+                bucket[2] = price
+                self.max_queue.pop() # the newest bucket is always at the back
+                self._push_max(bucket)
+            if price < bucket[3]:
+                bucket[3] = price
+                self.min_queue.pop()
+                self._push_min(bucket)
+            bucket[4] = price
+            bucket[5] += quantity
+            bucket[6] += notional
+        else:
+            bucket = [start, price, price, price, price, quantity, notional]
+            self.buckets.append(bucket)
+            self._push_max(bucket)
+            self._push_min(bucket)
+        self.volume += quantity
+        self.quote_volume += notional
+        self.expire(timestamp)
+
+    def _push_max(self, bucket):
+        while self.max_queue and self.max_queue[-1][2] <= bucket[2]:
+            self.max_queue.pop()
+        self.max_queue.append(bucket)
+
+    def _push_min(self, bucket):
+        while self.min_queue and self.min_queue[-1][3] >= bucket[3]:
+            self.min_queue.pop()
+        self.min_queue.append(bucket)
+
+    def expire(self, now):
+        '''Drop buckets that fell out of the window ending at `now`.'''
+        cutoff = now - self.span
+        while self.buckets and self.buckets[0][0] <= cutoff:
+            bucket = self.buckets.popleft()
+            self.volume -= bucket[5]
+            self.quote_volume -= bucket[6]
+            if self.max_queue[0] is bucket:
+                self.max_queue.popleft()
+            if self.min_queue[0] is bucket:
+                self.min_queue.popleft()
+
+    def high(self):
+        return self.max_queue[0][2] if self.max_queue else None
+
+    def low(self):
+        return self.min_queue[0][3] if self.min_queue else None
+
+    def open(self):
+        return self.buckets[0][1] if self.buckets else None
+
+
+class CandleAggregator(object):
+    '''
+    Builds OHLCV candles incrementally from the trade tape.
+
+    Each interval keeps its bars in a fixed size ring buffer (a bounded deque),
+    the newest bar being updated in place as trades arrive. A RollingWindow
+    provides the 24h ticker statistics.
+    '''
+
+    def __init__(self, intervals=INTERVALS, max_bars=1000):
+        self.intervals = intervals
+        self.bars = dict((name, deque(maxlen=max_bars)) for name in intervals)
+        self.window = RollingWindow()
+        self.last_price = None
+        self.prev_price = None # price of the trade before last_price
+        self.last_timestamp = None
+
+    def add_trade(self, trade):
+        '''Fold a trade record (as produced by OrderBook.process_order_list) into every interval.'''
+        timestamp = int(trade["timestamp"])
+        price = trade["price"]
+        quantity = trade["quantity"]
+        for name, length in self.intervals.items():
+            start = timestamp - timestamp % length
+            bars = self.bars[name]
+            if bars and bars[-1]["start"] >= start:
+                bar = bars[-1]
+                if price > bar["high"]:
+                    bar["high"] = price
+                if price < bar["low"]:
+                    bar["low"] = price
+                bar["close"] = price
+                bar["volume"] += quantity
+                bar["trades"] += 1
+            else:
+                bars.append({
+                    "start": start,
+                    "open": price,
+                    "high": price,
+                    "low": price,
+                    "close": price,
+                    "volume": quantity,
+                    "trades": 1,
+                })
+        self.window.add(timestamp, price, quantity)
+        self.prev_price = self.last_price
+        self.last_price = price
+        self.last_timestamp = timestamp
+
+    def price_change_indicator(self):
+        if self.last_price is None or self.prev_price is None:
+            return None
+        if self.last_price > self.prev_price:
+            return "up"
+        elif self.last_price < self.prev_price:
+            return "down"
+        return "flat"
+
+    def get_candles(self, interval, limit=None):
+        '''Most recent bars for `interval`, oldest first, with prices as floats.'''
+        if interval not in self.bars:
+            raise ValueError("Unknown candle interval %s" % interval)
+        bars = self.bars[interval]
+        if limit is not None and limit < len(bars):
+            bars = list(bars)[-limit:]
+        return [
+            {
+                "start": bar["start"],
+                "open": float(bar["open"]),
+                "high": float(bar["high"]),
+                "low": float(bar["low"]),
+                "close": float(bar["close"]),
+                "volume": float(bar["volume"]),
+                "trades": bar["trades"],
+            }
+            for bar in bars
+        ]
+
+    def get_ticker(self, now=None):
+        '''Rolling 24h statistics. `now` (ms) expires stale buckets first when given.'''
+        if now is not None:
+            self.window.expire(now)
+        window = self.window
+        open_price = window.open()
+        change = None
+        change_percent = None
+        if open_price is not None and self.last_price is not None:
+            change = self.last_price - open_price
+            change_percent = float(change / open_price * 100) if open_price else None
+
+        def to_float(value):
+            return float(value) if value is not None else None
+
+        return {
+            "lastTradePrice": to_float(self.last_price),
+            "priceChangeIndicator": self.price_change_indicator(),
+            "lastTradeTime": self.last_timestamp,
+            "open24h": to_float(open_price),
+            "high24h": to_float(window.high()),
+            "low24h": to_float(window.low()),
+            "volume24h": float(window.volume),
+            "quoteVolume24h": float(window.quote_volume),
+            "change24h": to_float(change),
+            "changePercent24h": change_percent,
+        }
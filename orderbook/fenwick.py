@@ -0,0 +1,47 @@
+class FenwickTree(object):
+    '''
+    A Fenwick (binary indexed) tree over arrival sequence numbers, holding the
+    volume and the number of orders at each slot.
+
+    Used by OrderList to answer "how much is queued ahead of this order" in
+    O(log n) instead of walking the linked list from the head. Slots are 0-based.
+    '''
+
+    def __init__(self, capacity=16):
+        self.capacity = capacity
+        self.volume = [0] * (capacity + 1)
+        self.count = [0] * (capacity + 1)
+
+    @classmethod
+    def from_slots(cls, capacity, slots):
+        '''Build a tree in O(capacity) from (slot, volume) pairs, one order per slot.'''
+        tree = cls(capacity)
+        volume = tree.volume
+        count = tree.count
+        for slot, slot_volume in slots:
+            volume[slot + 1] += slot_volume
+            count[slot + 1] += 1
+        for i in range(1, capacity + 1):
+            parent = i + (i & -i)
+            if parent <= capacity:
+                volume[parent] += volume[i]
+                count[parent] += count[i]
+        return tree
+
+    def add(self, slot, volume, count):
+        i = slot + 1
+        while i <= self.capacity:
+            self.volume[i] += volume
+            self.count[i] += count
+            i += i & -i
+
+    def prefix(self, slot):
+        '''(count, volume) summed over the slots strictly before slot.'''
+        volume = 0
+        count = 0
+        i = slot
+        while i > 0:
+            volume += self.volume[i]
+            count += self.count[i]
+            i -= i & -i
+        return count, volume
@@ -0,0 +1,48 @@
+from eth_account import Account
+
+
+class KeyStore(object):
+    '''
+    Signing keys of the accounts trading on the books, held in memory only.
+
+    Keys arrive with the orders of their account (or are loaded from the
+    environment at startup). The settlement queue and the book snapshots keep
+    account addresses only, and the keys are looked up here again when fills
+    are settled or a book is restored. A key is only kept for the account it
+    belongs to, so an order cannot replace another account's key.
+    '''
+
+    def __init__(self, private_keys=()):
+        self.keys = {} # lower-cased account : private key
+        for private_key in private_keys:
+            self.remember(Account.from_key(private_key).address, private_key)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def remember(self, account, private_key):
+        '''Keep private_key for account. Returns False if it is not the key of account.'''
+        if account is None or not private_key:
+            return False
+        key = account.lower()
+        if self.keys.get(key) == private_key:
+            return True
+        try:
+            address = Account.from_key(private_key).address
+        except Exception:
+            return False
+        if address.lower() != key:
+            return False
+        self.keys[key] = private_key
+        return True
+
+    def get(self, account):
+        '''Private key of account, None if it is not known.'''
+        return self.keys.get(account.lower()) if account is not None else None
+
+    def attach(self, trades):
+        '''Give both parties of converted trades their keys back (None where unknown), in place.'''
+        for trade in trades:
+            for party in ("party1", "party2"):
+                trade[party] = list(trade[party][:4]) + [self.get(trade[party][0])]
+        return trades
@@ -0,0 +1,125 @@
+from itertools import islice
+
+import numpy as np
+
+from .pegs import level_orders
+
+
+class SideLadder(object):
+    '''
+    One side of the book exported as NumPy arrays.
+
+    Levels (price, volume, order count) and, optionally, individual orders
+    (order id, price, quantity, level index) are written into preallocated
+    buffers that only grow when the book outgrows them. The returned arrays are
+    views into those buffers: they stay valid until the next export after the
+    book changes, so callers that keep them around should copy them.
+    Exports are cached per OrderTree version, so polling an unchanged book is
+    free, and the per-order walk is cached per OrderList version, so after a
+    change only the levels that were touched are walked again.
+    '''
+
+    def __init__(self, tree, reverse, capacity=256):
+        self.tree = tree
+        self.reverse = reverse # True for bids, so index 0 is always the best price
+        self.level_price = np.empty(capacity, dtype=np.float64)
+        self.level_volume = np.empty(capacity, dtype=np.float64)
+        self.level_count = np.empty(capacity, dtype=np.int64)
+        self.order_id = np.empty(capacity, dtype=np.int64)
+        self.order_price = np.empty(capacity, dtype=np.float64)
+        self.order_quantity = np.empty(capacity, dtype=np.float64)
+        self.order_level = np.empty(capacity, dtype=np.int32)
+        self.cache_key = None
+        self.cached = None
+        self.level_cache = {} # price : (OrderList, version, order ids, float quantities)
+
+    @staticmethod
+    def _grow(buffer, size):
+        if size <= len(buffer):
+            return buffer
+        capacity = len(buffer)
+        while capacity < size:
+            capacity *= 2
+        return np.empty(capacity, dtype=buffer.dtype)
+
+    def _levels(self, depth):
+        price_map = self.tree.price_map
+        prices = reversed(price_map.keys()) if self.reverse else iter(price_map.keys())
+        if depth is not None:
+            prices = islice(prices, depth)
+        return prices
+
+    def export(self, depth=None, orders=False):
+        key = (self.tree.version, depth, orders)
+        if key == self.cache_key:
+            return self.cached
+
+        levels = self.tree.depth if depth is None else min(depth, self.tree.depth)
+        self.level_price = self._grow(self.level_price, levels)
+        self.level_volume = self._grow(self.level_volume, levels)
+        self.level_count = self._grow(self.level_count, levels)
+        level_price = self.level_price
+        level_volume = self.level_volume
+        level_count = self.level_count
+        price_map = self.tree.price_map
+
+        num_orders = 0
+        for i, price in enumerate(self._levels(depth)):
+            order_list = price_map[price]
+            level_price[i] = price
+            level_volume[i] = order_list.volume
+            level_count[i] = order_list.order_count
+            num_orders += order_list.order_count
+
+        result = {
+            "price": level_price[:levels],
+            "volume": level_volume[:levels],
+            "count": level_count[:levels],
+        }
+
+        if orders:
+            self.order_id = self._grow(self.order_id, num_orders)
+            self.order_price = self._grow(self.order_price, num_orders)
+            self.order_quantity = self._grow(self.order_quantity, num_orders)
+            self.order_level = self._grow(self.order_level, num_orders)
+            order_id = self.order_id
+            order_price = self.order_price
+            order_quantity = self.order_quantity
+            order_level = self.order_level
+
+            # Prices and level indices are per level, so they can be expanded with
+            # np.repeat; only ids and quantities come from the linked lists, and
+            # those are reused from the previous export for untouched levels.
+            ids = []
+            quantities = []
+            level_cache = {}
+            for price in self._levels(depth):
+                order_list = price_map[price]
+                cached = self.level_cache.get(price)
+                if cached is None or cached[0] is not order_list or cached[1] != order_list.version:
+                    level_ids = []
+                    level_quantities = []
+                    for order in level_orders(order_list):
+                        level_ids.append(order.order_id)
+                        level_quantities.append(float(order.quantity))
+                    cached = (order_list, order_list.version, level_ids, level_quantities)
+                level_cache[price] = cached
+                ids.extend(cached[2])
+                quantities.extend(cached[3])
+            self.level_cache = level_cache
+            counts = level_count[:levels]
+            order_id[:num_orders] = ids
+            order_quantity[:num_orders] = quantities
+            order_price[:num_orders] = np.repeat(level_price[:levels], counts)
+            order_level[:num_orders] = np.repeat(np.arange(levels, dtype=np.int32), counts)
+
+            result["orders"] = {
+                "order_id": order_id[:num_orders],
+                "price": order_price[:num_orders],
+                "quantity": order_quantity[:num_orders],
+                "level": order_level[:num_orders],
+            }
+
+        self.cache_key = key
+        self.cached = result
+        return result
@@ -0,0 +1,360 @@
+import math
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR
+
+
+class MarketMaker(object):
+    '''
+    A reference market maker quoting a two-sided ladder into one OrderBook.
+
+    It listens to the book's change events, so it reacts as soon as the book
+    changes rather than when someone polls it. Quotes are centred on a
+    reservation price: the mid of the other participants' best bid and ask,
+    shifted against the current inventory so that a long position quotes
+    lower (selling more readily) and a short one higher. The half spread
+    widens with an EWMA estimate of trade-to-trade volatility, and the size
+    on the side that would grow the position shrinks as inventory nears
+    max_inventory.
+
+    Re-quoting only touches the levels whose price or size moved by more than
+    the tolerances, changing the resting order in place with modify_order.
+    Events only mark the quotes stale: the book must not be changed while it
+    is still matching, so re-quoting runs afterwards, through `schedule` (a
+    callable(delay seconds, callback), e.g. the event loop's call_later) or by
+    calling requote() directly as the simulation does. min_interval (ms)
+    throttles how often that happens.
+
+    set_funds() caps what the ladder may commit on each side, the quote
+    notional of the bids and the base quantity of the asks: levels are kept
+    from the inside out while they fit, the rest are not quoted.
+    '''
+
+    def __init__(self, book, quote, levels=3, quantity=1, half_spread=None, level_spacing=None,
+                 max_inventory=10, inventory_skew=1, volatility_multiplier=2, ewma_lambda=0.94,
+                 min_interval=100, price_tolerance=1, quantity_tolerance=0.1, schedule=None):
+        tick = Decimal(str(book.tick_size))
+        self.book = book
+        self.quote = dict(quote) # account, trade_id, private_key, baseAsset, quoteAsset of the quotes
+        self.account_id = book.intern_account(quote.get("account"))
+        self.tick = tick
+        self.levels = levels
+        self.quantity = Decimal(str(quantity)) # per level
+        self.half_spread = Decimal(str(half_spread)) if half_spread is not None else tick # minimum
+        self.level_spacing = Decimal(str(level_spacing)) if level_spacing is not None else tick
+        self.max_inventory = Decimal(str(max_inventory))
+        self.inventory_skew = Decimal(str(inventory_skew)) # half spreads moved at max_inventory
+        self.volatility_multiplier = Decimal(str(volatility_multiplier))
+        self.ewma_lambda = ewma_lambda
+        self.min_interval = min_interval
+        self.price_tolerance = tick * price_tolerance # a level is moved when off by this much
+        self.quantity_tolerance = Decimal(str(quantity_tolerance)) # or its size by this fraction
+        self.schedule = schedule
+        self.orders = {"bid": [None] * levels, "ask": [None] * levels} # level : own order id
+        self.resting = {} # own order id : [price, quantity last seen]
+        self.inventory = Decimal(0)
+        self.cash = Decimal(0)
+        self.fills = 0
+        self.traded_volume = Decimal(0)
+        self.variance = None # EWMA of squared log returns between trades
+        self.last_trade_price = None
+        self.last_requote = None
+        self.reservation_price = None
+        self.dirty = True
+        self.scheduled = False
+        self.requoting = False
+        self.running = False
+        self.funds = None # {side: most its levels may commit}, None for no limit
+        self.updates = {"placed": 0, "modified": 0, "cancelled": 0, "unchanged": 0, "unfunded": 0}
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.book.listeners.append(self.on_event)
+            self.dirty = True
+            self.request_requote(0)
+
+    def stop(self):
+        '''Stop listening and pull every quote.'''
+        if self.running:
+            self.running = False
+            self.book.listeners.remove(self.on_event)
+        self.reconcile()
+        self.requoting = True
+        try:
+            for side, ids in self.orders.items():
+                for level, order_id in enumerate(ids):
+                    if order_id is not None:
+                        self.cancel_level(side, level)
+        finally:
+            self.requoting = False
+
+    def on_event(self, event):
+        if self.requoting:
+            return # our own quote changes
+        if event["type"] == "trade":
+            self.update_volatility(Decimal(str(event["price"])))
+        self.dirty = True
+        self.request_requote(0)
+
+    def set_funds(self, funds):
+        '''Cap the bid notional and ask quantity of the ladder, {"bid": .., "ask": ..} or None.'''
+        if funds != self.funds:
+            self.funds = funds
+            self.dirty = True
+            self.request_requote(0)
+
+    def committed(self, side):
+        '''What the resting quotes of a side commit: quote notional for bids, base quantity for asks.'''
+        total = Decimal(0)
+        for order_id in self.orders[side]:
+            if order_id is not None:
+                price, quantity = self.resting[order_id]
+                total += price * quantity if side == "bid" else quantity
+        return total
+
+    def request_requote(self, delay):
+        if self.schedule is not None and self.running and not self.scheduled:
+            self.scheduled = True
+            self.schedule(delay, self.run_scheduled)
+
+    def run_scheduled(self):
+        self.scheduled = False
+        if self.running:
+            self.requote()
+
+    def update_volatility(self, price):
+        if self.last_trade_price is not None and price > 0 and self.last_trade_price > 0:
+            log_return = math.log(price / self.last_trade_price)
+            if self.variance is None:
+                self.variance = log_return * log_return
+            else:
+                self.variance = self.ewma_lambda * self.variance + (1 - self.ewma_lambda) * log_return * log_return
+        self.last_trade_price = price
+
+    def reconcile(self):
+        '''Book the fills of our resting quotes since the last look into inventory and cash.'''
+        book = self.book
+        for side, ids in self.orders.items():
+            tree = book.bids if side == "bid" else book.asks
+            for level, order_id in enumerate(ids):
+                if order_id is None:
+                    continue
+                price, seen = self.resting[order_id]
+                order = tree.order_map.get(order_id)
+                left = order.quantity if order is not None else Decimal(0)
+                if left < seen:
+                    filled = seen - left
+                    self.fills += 1
+                    self.traded_volume += filled
+                    if side == "bid":
+                        self.inventory += filled
+                        self.cash -= filled * price
+                    else:
+                        self.inventory -= filled
+                        self.cash += filled * price
+                if order is None:
+                    ids[level] = None
+                    del self.resting[order_id]
+                else:
+                    self.resting[order_id][1] = left
+
+    def mid_price(self):
+        '''Mid of the best bid and ask of everyone else, the last trade if a side is empty.'''
+        book = self.book
+        others = {"account_id": self.account_id, "stp_mode": "cancel_newest"}
+        best_bid, _ = book.first_counterparty(book.bids, True, others)
+        best_ask, _ = book.first_counterparty(book.asks, False, others)
+        if best_bid is not None and best_ask is not None:
+            return (best_bid.price + best_ask.price) / 2
+        return book.candles.last_price
+
+    def ladder(self, mid):
+        '''{side: [(price, quantity) or None per level]} around the reservation price.'''
+        half_spread = self.half_spread
+        if self.variance is not None:
+            half_spread = max(half_spread, self.volatility_multiplier
+                              * Decimal(str(math.sqrt(self.variance))) * mid)
+        position = self.inventory / self.max_inventory if self.max_inventory else Decimal(0)
+        position = max(min(position, Decimal(1)), Decimal(-1))
+        reservation = mid - self.inventory_skew * position * half_spread
+        self.reservation_price = reservation
+        sizes = {
+            "bid": self.quantity * (1 - position) if position > 0 else self.quantity,
+            "ask": self.quantity * (1 + position) if position < 0 else self.quantity,
+        }
+        ladder = {"bid": [], "ask": []}
+        for level in range(self.levels):
+            distance = half_spread + level * self.level_spacing
+            bid = ((reservation - distance) / self.tick).to_integral_value(ROUND_FLOOR) * self.tick
+            ask = ((reservation + distance) / self.tick).to_integral_value(ROUND_CEILING) * self.tick
+            ladder["bid"].append((bid, sizes["bid"]) if bid > 0 and sizes["bid"] > 0 else None)
+            ladder["ask"].append((ask, sizes["ask"]) if sizes["ask"] > 0 else None)
+        return ladder
+
+    def fund_ladder(self, ladder):
+        '''Drop the levels, innermost kept first, that the funds of their side do not cover.'''
+        if self.funds is None:
+            return ladder
+        for side, targets in ladder.items():
+            budget = self.funds.get(side)
+            if budget is None:
+                continue
+            used = Decimal(0)
+            for level, target in enumerate(targets):
+                if target is None:
+                    continue
+                price, quantity = target
+                used += price * quantity if side == "bid" else quantity
+                if used > budget:
+                    unfunded = [index for index in range(level, len(targets)) if targets[index] is not None]
+                    self.updates["unfunded"] += len(unfunded)
+                    for index in unfunded:
+                        targets[index] = None
+                    break
+        return ladder
+
+    def requote(self, now=None):
+        '''Bring the resting quotes in line with the book. Returns the number of levels changed.'''
+        if self.requoting:
+            return 0
+        book = self.book
+        if now is None:
+            book.update_time()
+            now = book.time
+        self.reconcile()
+        if not self.dirty:
+            return 0
+        if self.last_requote is not None and now - self.last_requote < self.min_interval:
+            self.request_requote((self.min_interval - (now - self.last_requote)) / 1000.0)
+            return 0
+        mid = self.mid_price()
+        if mid is None:
+            return 0
+        previous_reservation = self.reservation_price
+        ladder = self.fund_ladder(self.ladder(mid))
+        # Move the side moving away from the other first, so the two never cross
+        sides = ("ask", "bid")
+        if previous_reservation is not None and self.reservation_price < previous_reservation:
+            sides = ("bid", "ask")
+        self.requoting = True
+        changed = 0
+        try:
+            for side in sides:
+                for level in range(self.levels):
+                    changed += self.update_level(side, level, ladder[side][level])
+        finally:
+            self.requoting = False
+        self.dirty = False
+        self.last_requote = now
+        return changed
+
+    def update_level(self, side, level, target):
+        order_id = self.orders[side][level]
+        if target is None:
+            if order_id is None:
+                return 0
+            self.cancel_level(side, level)
+            return 1
+        price, quantity = target
+        if order_id is None:
+            return self.place_level(side, level, price, quantity)
+        resting = self.resting[order_id]
+        if (abs(resting[0] - price) < self.price_tolerance
+                and abs(resting[1] - quantity) <= self.quantity_tolerance * quantity):
+            self.updates["unchanged"] += 1
+            return 0
+        if self.crosses(side, price):
+            self.cancel_level(side, level)
+            return 1
+        quote = dict(self.quote)
+        quote.update({"side": side, "price": price, "quantity": quantity,
+                      "account_id": self.account_id, "expire_time": None})
+        self.book.modify_order(order_id, quote)
+        self.resting[order_id] = [price, quantity]
+        self.updates["modified"] += 1
+        return 1
+
+    def crosses(self, side, price):
+        if side == "bid":
+            best_ask = self.book.get_best_ask()
+            return best_ask is not None and price >= best_ask
+        best_bid = self.book.get_best_bid()
+        return best_bid is not None and price <= best_bid
+
+    def place_level(self, side, level, price, quantity):
+        quote = dict(self.quote)
+        quote.update({"type": "post_only", "side": side, "price": price, "quantity": quantity,
+                      "time_in_force": "GTC", "expire_time": None})
+        result = self.book.process_order(quote, False, False)
+        order_in_book = result["data"][1] if result["success"] else None
+        if order_in_book is None:
+            return 0 # would have crossed
+        order_id = order_in_book["order_id"]
+        self.orders[side][level] = order_id
+        self.resting[order_id] = [price, quantity]
+        self.updates["placed"] += 1
+        return 1
+
+    def cancel_level(self, side, level):
+        order_id = self.orders[side][level]
+        self.book.cancel_order(side, order_id)
+        self.orders[side][level] = None
+        del self.resting[order_id]
+        self.updates["cancelled"] += 1
+
+    def report(self):
+        mid = self.mid_price()
+        pnl = self.cash + self.inventory * mid if mid is not None else None
+        quotes = {}
+        for side, ids in self.orders.items():
+            quotes[side] = [
+                [float(self.resting[order_id][0]), float(self.resting[order_id][1])]
+                if order_id is not None else None
+                for order_id in ids
+            ]
+        return {
+            "running": self.running,
+            "inventory": float(self.inventory),
+            "cash": float(self.cash),
+            "mid": float(mid) if mid is not None else None,
+            "pnl": float(pnl) if pnl is not None else None,
+            "fills": self.fills,
+            "tradedVolume": float(self.traded_volume),
+            "volatility": math.sqrt(self.variance) if self.variance is not None else None,
+            "reservationPrice": float(self.reservation_price) if self.reservation_price is not None else None,
+            "quotes": quotes,
+            "funds": dict((side, float(funds)) for side, funds in self.funds.items())
+            if self.funds is not None else None,
+            "updates": dict(self.updates),
+        }
+
+
+def simulate(market_maker, records):
+    '''
+    Replay recorded order flow against the market maker's book, re-quoting after
+    every record, and return its report. Its quotes are pulled at the end.
+
+    Records are process_order quotes with a "timestamp" (ms), or
+    {"action": "cancel", "side", "order_id", "timestamp"} to cancel an earlier
+    recorded order; recorded order ids are mapped to the ids the replay assigns.
+    '''
+    book = market_maker.book
+    order_ids = {} # recorded order id : order id in the replay
+    market_maker.start()
+    for record in records:
+        if record.get("action") == "cancel":
+            order_id = order_ids.pop(record["order_id"], None)
+            if order_id is not None:
+                book.cancel_order(record["side"], order_id)
+        else:
+            quote = dict(record)
+            recorded_id = quote.pop("order_id", None)
+            quote["quantity"] = Decimal(str(quote["quantity"]))
+            if quote.get("price") is not None:
+                quote["price"] = Decimal(str(quote["price"]))
+            result = book.process_order(quote, False, False)
+            if result["success"] and result["data"][1] is not None and recorded_id is not None:
+                order_ids[recorded_id] = result["data"][1]["order_id"]
+        market_maker.requote(record["timestamp"])
+    report = market_maker.report()
+    market_maker.stop()
+    return report
@@ -0,0 +1,140 @@
+from collections import OrderedDict
+from decimal import Decimal
+
+
+class SettlementNetter(object):
+    '''
+    Nets fills per counterparty pair before they are settled on-chain.
+
+    Fills are added during a settlement window and grouped by (account, account,
+    base asset, quote asset), the two accounts in a fixed order so that A buying
+    from B and B buying from A land in the same group. flush() turns each group
+    into a single net transfer: the net base quantity one side delivers and the
+    net quote amount it receives for it, expressed as one trade at the net price.
+    Groups whose base and quote nets do not make a trade (e.g. base nets to zero
+    but quote does not) are passed through fill by fill; groups that net to
+    nothing need no transaction at all. Every transfer keeps the fills it stands
+    for, and recent ones stay in `audit` keyed by net id.
+    '''
+
+    def __init__(self, max_audit=10000):
+        self.groups = OrderedDict() # (account a, account b, base, quote) : group state
+        self.next_net_id = 0
+        self.audit = OrderedDict() # net id : fills, most recent max_audit transfers
+        self.max_audit = max_audit
+        self.total_fills = 0
+        self.total_transactions = 0
+
+    def __len__(self):
+        return sum(len(group["fills"]) for group in self.groups.values())
+
+    def add(self, trade, base_asset, quote_asset):
+        '''Add one fill (a trade record with party1 / party2) to the current window.'''
+        party1 = trade["party1"]
+        party2 = trade["party2"]
+        if party1[1] == "ask":
+            seller, buyer = party1, party2
+        else:
+            seller, buyer = party2, party1
+        seller_account = seller[0].lower()
+        buyer_account = buyer[0].lower()
+        account_a, account_b = sorted((seller_account, buyer_account))
+        key = (account_a, account_b, base_asset, quote_asset)
+        group = self.groups.get(key)
+        if group is None:
+            group = {
+                "base_net": Decimal(0), # base delivered by account a to account b
+                "quote_net": Decimal(0), # quote paid by account b to account a
+                "accounts": {}, # lower-cased account : (address, private key)
+                "fills": [],
+            }
+            self.groups[key] = group
+
+        quantity = Decimal(str(trade["quantity"]))
+        notional = quantity * Decimal(str(trade["price"]))
+        if seller_account == account_a:
+            group["base_net"] += quantity
+            group["quote_net"] += notional
+        else:
+            group["base_net"] -= quantity
+            group["quote_net"] -= notional
+        group["accounts"][seller_account] = (seller[0], seller[4])
+        group["accounts"][buyer_account] = (buyer[0], buyer[4])
+        group["fills"].append(trade)
+
+    def flush(self):
+        '''Close the window: return its net transfers and reset the groups.
+
+        Returns {"transfers", "offsets", "fills", "transactions", "reduction_ratio"}.
+        offsets lists the groups that netted to nothing (with their fills), and the
+        reduction ratio is the share of per-fill transactions saved by netting.
+        '''
+        transfers = []
+        offsets = []
+        fills = 0
+        for key, group in self.groups.items():
+            fills += len(group["fills"])
+            account_a, account_b, base_asset, quote_asset = key
+            base_net = group["base_net"]
+            quote_net = group["quote_net"]
+            if base_net == 0 and quote_net == 0:
+                offsets.append({"base_asset": base_asset, "quote_asset": quote_asset, "fills": group["fills"]})
+                continue
+            if base_net != 0 and quote_net != 0 and (base_net > 0) == (quote_net > 0):
+                if base_net > 0:
+                    seller, buyer = account_a, account_b
+                else:
+                    seller, buyer = account_b, account_a
+                quantity = abs(base_net)
+                transfers.append(self._transfer(group, base_asset, quote_asset, seller, buyer,
+                                                quantity, abs(quote_net) / quantity, group["fills"]))
+            else:
+                # Cannot be expressed as one trade: settle the fills as they are
+                for trade in group["fills"]:
+                    party1, party2 = trade["party1"], trade["party2"]
+                    seller, buyer = (party1, party2) if party1[1] == "ask" else (party2, party1)
+                    transfers.append(self._transfer(group, base_asset, quote_asset, seller[0].lower(),
+                                                    buyer[0].lower(), Decimal(str(trade["quantity"])),
+                                                    Decimal(str(trade["price"])), [trade]))
+        self.groups = OrderedDict()
+        self.total_fills += fills
+        self.total_transactions += len(transfers)
+        return {
+            "transfers": transfers,
+            "offsets": offsets,
+            "fills": fills,
+            "transactions": len(transfers),
+            "reduction_ratio": 1 - float(len(transfers)) / fills if fills else 0.0,
+        }
+
+    def _transfer(self, group, base_asset, quote_asset, seller, buyer, quantity, price, fills):
+        net_id = self.next_net_id
+        self.next_net_id += 1
+        self.audit[net_id] = fills
+        while len(self.audit) > self.max_audit:
+            self.audit.popitem(last=False)
+        last_fill = fills[-1]
+        order_ids = [party[2] for trade in fills for party in (trade["party1"], trade["party2"])
+                     if party[2] is not None]
+        seller_address, seller_key = group["accounts"][seller]
+        buyer_address, buyer_key = group["accounts"][buyer]
+        return {
+            "net_id": net_id,
+            "base_asset": base_asset,
+            "quote_asset": quote_asset,
+            "seller": seller_address,
+            "seller_key": seller_key,
+            "buyer": buyer_address,
+            "buyer_key": buyer_key,
+            "quantity": quantity,
+            "price": price,
+            "timestamp": last_fill["timestamp"],
+            "order_id": order_ids[-1] if order_ids else net_id,
+            "fills": fills,
+        }
+
+    def reduction_ratio(self):
+        '''Share of per-fill settlement transactions saved since the netter was created.'''
+        if not self.total_fills:
+            return 0.0
+        return 1 - float(self.total_transactions) / self.total_fills
@@ -14,16 +14,24 @@ class Order(object):
         self.price = Decimal(quote['price']) # decimal representing price (currency)
         self.order_id = int(quote['order_id'])
         self.trade_id = quote['trade_id']
-        self.private_key = quote['private_key']
+        self.private_key = quote.get('private_key')
         # doubly linked list to make it easier to re-order Orders for a particular price point
         self.next_order = None
         self.prev_order = None
         self.order_list = order_list
+        self.queue_seq = None # arrival slot in the OrderList queue index
+        self.peg_group = None # PegGroup of a pegged order
 
         self.account = quote['account']
+        self.account_id = quote.get('account_id') # interned account, for self-trade prevention
         self.side = quote['side']
         self.baseAsset = quote['baseAsset']
         self.quoteAsset = quote['quoteAsset']
+        self.expire_time = quote.get('expire_time') # millisecond timestamp for GTT/GTD/DAY orders, None for GTC
+        # iceberg orders: quantity is the displayed clip, refilled up to display_quantity from the hidden reserve
+        display_quantity = quote.get('display_quantity')
+        self.display_quantity = Decimal(display_quantity) if display_quantity is not None else None
+        self.hidden_quantity = Decimal(quote.get('hidden_quantity') or 0)
 
     # helper functions to get Orders in linked list
     def next_order(self):
@@ -36,10 +44,48 @@ class Order(object):
         if new_quantity > self.quantity and self.order_list.tail_order != self:
             # check to see that the order is not the last order in list and the quantity is more
             self.order_list.move_to_tail(self) # move to the end
-        self.order_list.volume -= (self.quantity - new_quantity) # update volume
+        self.order_list.quantity_changed(self, new_quantity - self.quantity) # update volume
         self.timestamp = new_timestamp
         self.quantity = new_quantity
 
+    def replenish(self, new_timestamp):
+        '''Refill the displayed quantity of an iceberg order from its reserve and re-queue it at the tail.
+
+        O(1): the order keeps its OrderList and only loses its time priority.
+        '''
+        refill = min(self.display_quantity, self.hidden_quantity)
+        if self.order_list.tail_order != self:
+            self.order_list.move_to_tail(self)
+        self.order_list.quantity_changed(self, refill - self.quantity)
+        self.hidden_quantity -= refill
+        self.timestamp = new_timestamp
+        self.quantity = refill
+
+    @property
+    def total_quantity(self):
+        '''Displayed plus hidden quantity, i.e. everything the order still has to trade.'''
+        return self.quantity + self.hidden_quantity
+
+    def to_quote(self):
+        '''The quote that recreates this order as it rests now, e.g. for snapshots.
+
+        The signing key is left out; it is attached again on restore.
+        '''
+        return {
+            'timestamp': self.timestamp,
+            'quantity': str(self.quantity),
+            'price': str(self.price),
+            'order_id': self.order_id,
+            'trade_id': self.trade_id,
+            'account': self.account,
+            'side': self.side,
+            'baseAsset': self.baseAsset,
+            'quoteAsset': self.quoteAsset,
+            'expire_time': self.expire_time,
+            'display_quantity': str(self.display_quantity) if self.display_quantity is not None else None,
+            'hidden_quantity': str(self.hidden_quantity),
+        }
+
     def __str__(self):
         return "{}@{}/{} - {}".format(self.quantity, self.price,
                                       self.trade_id, self.timestamp)
@@ -1,23 +1,58 @@
 import sys
 import math
 from collections import deque  # a faster insert/pop queue
+from functools import partial
 from six.moves import cStringIO as StringIO
-from decimal import Decimal
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR
 import json
+import numpy as np
 from .ordertree import OrderTree
+from .candles import CandleAggregator
+from .ladder import SideLadder
+from .signals import BookSignals
+from .timerwheel import TimerWheel
+from .triggerbook import TriggerBook
+from .pegs import PEG_REFERENCES, PegGroup, first_order, level_orders
 import time
 
+DAY_MS = 24 * 60 * 60 * 1000
+TIME_IN_FORCE = ("GTC", "GTT", "GTD", "DAY")
+LIMIT_ORDER_TYPES = ("limit", "ioc", "fok", "post_only")
+TRIGGER_ORDER_TYPES = ("stop_loss", "take_profit", "trigger")
+STP_MODES = ("cancel_newest", "cancel_oldest", "cancel_both", "decrement")
+MATCHING_MODES = ("continuous", "auction")
+
 
 class OrderBook(object):
-    def __init__(self, tick_size=0.0001):
+    def __init__(self, tick_size=0.0001, stp_mode=None):
+        if stp_mode is not None and stp_mode not in STP_MODES:
+            raise ValueError("stp_mode must be None or one of %s" % (STP_MODES,))
         self.tape = deque(maxlen=None)  # Index[0] is most recent trade
+        self.candles = CandleAggregator()  # OHLCV bars and 24h stats built from the tape
         self.bids = OrderTree()
         self.asks = OrderTree()
+        self.bid_ladder = SideLadder(self.bids, reverse=True)
+        self.ask_ladder = SideLadder(self.asks, reverse=False)
+        self.signals = BookSignals(self.bids, self.asks)
+        self.listeners = []  # callables receiving book change events (the delta feed)
+        self.bids.listeners.append(partial(self.level_changed, "bid"))
+        self.asks.listeners.append(partial(self.level_changed, "ask"))
+        self.expiries = TimerWheel()  # order_id -> expire_time of resting GTT/GTD/DAY orders
+        self.triggers = TriggerBook()  # dormant stop-loss / take-profit / trigger orders
+        self.releasing_triggers = False
+        self.peg_references = None  # (best unpegged bid, best unpegged ask) the pegs were last priced at
         self.last_tick = None
         self.last_timestamp = 0
         self.tick_size = tick_size
         self.time = 0
         self.next_order_id = 0
+        self.stp_mode = stp_mode  # self-trade prevention mode, None to let accounts match themselves
+        self.account_ids = {}  # lower-cased account : small int, so STP compares ints in the matching loop
+        self.self_trades_prevented = 0
+        self.self_trade_quantity_prevented = 0
+        self.matching_mode = "continuous"  # or "auction": orders only cross in run_auction
+        self.auction_interval = 1000  # ms between uncrosses in auction mode
+        self.next_auction_time = None
 
     def update_time(self):
         # self.time += 1
@@ -37,9 +72,14 @@ class OrderBook(object):
             sys.exit("process_order() given order of quantity <= 0")
         if not from_data:
             self.next_order_id += 1
+        if quote.get("stp_mode") is not None and quote["stp_mode"] not in STP_MODES:
+            return {"success": False, "message": "Unknown stp_mode %s" % quote["stp_mode"]}
+        quote["account_id"] = self.intern_account(quote.get("account"))
+        if order_type == "market" and self.matching_mode == "auction":
+            return {"success": False, "message": "Market orders are not accepted in auction mode"}
         if order_type == "market":
             trades = self.process_market_order(quote, verbose)
-        elif order_type == "limit":
+        elif order_type in LIMIT_ORDER_TYPES:
             quote["price"] = Decimal(quote["price"])
             try:
                 trades, order_in_book, task_id, next_best_order = (
@@ -47,14 +87,259 @@ class OrderBook(object):
                 )
             except Exception as e:
                 return {"success": False, "message": str(e)}
+        elif order_type in TRIGGER_ORDER_TYPES:
+            trades = []
+            try:
+                order_in_book = self.add_trigger_order(quote, from_data)
+            except Exception as e:
+                return {"success": False, "message": str(e)}
+        elif order_type == "pegged":
+            trades = []
+            try:
+                order_in_book = self.add_pegged_order(quote, from_data)
+            except Exception as e:
+                return {"success": False, "message": str(e)}
         else:
-            sys.exit("order_type for process_order() is neither 'market' or 'limit'")
+            sys.exit(
+                "order_type for process_order() is neither 'market' nor one of %s"
+                % (LIMIT_ORDER_TYPES + TRIGGER_ORDER_TYPES + ("pegged",),)
+            )
+
+        self.reprice_pegs()
+
+        # A new last trade price (or a trigger already crossed) may release dormant orders
+        triggered = []
+        if trades or order_type in TRIGGER_ORDER_TYPES:
+            triggered = self.release_triggers(verbose)
 
         return {
             "success": True,
             "data": [trades, order_in_book, task_id, next_best_order],
+            "triggered": triggered,
         }
 
+    def add_trigger_order(self, quote, from_data):
+        """
+        Park a stop_loss, take_profit or trigger order in the trigger book until the
+        last trade price crosses its trigger_price.
+
+        stop_loss fires on a move against the resting position (bids when the price
+        rises to the trigger, asks when it falls to it), take_profit the other way
+        round, and trigger in the explicit trigger_direction ("rising" or "falling",
+        defaulting to the side of the last trade price the trigger is on).
+        Once released it runs as execute_as: "limit" (or another limit type) if it
+        has a price, "market" otherwise.
+        """
+        if quote.get("trigger_price") is None:
+            raise Exception("%s orders need a trigger_price" % quote["type"])
+        trigger_price = Decimal(quote["trigger_price"])
+        if trigger_price <= 0:
+            raise Exception("trigger_price must be positive")
+        side = quote["side"]
+        if side not in ("bid", "ask"):
+            raise Exception('add_trigger_order() given neither "bid" nor "ask"')
+        order_type = quote["type"]
+        if order_type == "stop_loss":
+            direction = "rising" if side == "bid" else "falling"
+        elif order_type == "take_profit":
+            direction = "falling" if side == "bid" else "rising"
+        else:
+            direction = quote.get("trigger_direction")
+            if direction is None:
+                last_price = self.candles.last_price
+                if last_price is None:
+                    raise Exception(
+                        "trigger orders need a trigger_direction before the first trade"
+                    )
+                direction = "rising" if trigger_price > last_price else "falling"
+            if direction not in ("rising", "falling"):
+                raise Exception('trigger_direction must be "rising" or "falling"')
+
+        if quote.get("price") is not None:
+            quote["price"] = Decimal(quote["price"])
+        execute_as = quote.get("execute_as") or (
+            "market" if quote.get("price") is None else "limit"
+        )
+        if execute_as not in ("market",) + LIMIT_ORDER_TYPES:
+            raise Exception("Unknown execute_as %s" % execute_as)
+        if execute_as != "market" and quote.get("price") is None:
+            raise Exception("%s orders triggered as %s need a price" % (order_type, execute_as))
+
+        if not from_data:
+            quote["order_id"] = self.next_order_id
+        quote["trigger_price"] = trigger_price
+        quote["trigger_direction"] = direction
+        quote["execute_as"] = execute_as
+        self.triggers.add(quote["order_id"], quote, trigger_price, direction)
+        return quote
+
+    def add_pegged_order(self, quote, from_data):
+        """
+        Rest a pegged order: its price follows peg_reference ("best_bid", "best_ask"
+        or "mid", taken from the unpegged orders of the book) plus peg_offset, and
+        an optional price acts as its limit. Pegged orders never take liquidity:
+        a price that would cross is held one tick behind the opposite best price.
+
+        Orders with the same side, reference, offset and limit share a PegGroup
+        that is repriced as a whole by reprice_pegs.
+        """
+        side = quote["side"]
+        if side not in ("bid", "ask"):
+            raise Exception('add_pegged_order() given neither "bid" nor "ask"')
+        reference = quote.get("peg_reference")
+        if reference not in PEG_REFERENCES:
+            raise Exception("peg_reference must be one of %s" % (PEG_REFERENCES,))
+        offset = Decimal(quote.get("peg_offset") or 0)
+        limit_price = Decimal(quote["price"]) if quote.get("price") is not None else None
+        if (quote.get("time_in_force") or "GTC") != "GTC":
+            raise Exception("Pegged orders are GTC only")
+        if quote.get("display_quantity") is not None:
+            raise Exception("Pegged orders cannot be iceberg orders")
+
+        tree = self.bids if side == "bid" else self.asks
+        group = tree.peg_groups.get((reference, offset, limit_price))
+        if group is not None:
+            price = group.price
+        else:
+            if self.peg_references is None:
+                self.peg_references = self.unpegged_best_prices()
+            price = self.peg_price(side, reference, offset, limit_price, self.peg_references)
+            if price is None:
+                raise Exception("No %s to peg to" % reference)
+
+        if not from_data:
+            quote["order_id"] = self.next_order_id
+        quote["expire_time"] = None
+        quote["hidden_quantity"] = 0
+        tree.insert_pegged_order(quote, reference, offset, limit_price, price)
+        quote["price"] = price
+        quote["peg_offset"] = offset
+        quote["peg_limit"] = limit_price
+        return quote
+
+    def pegged_order_price(self, quote):
+        """
+        Price a pegged order would rest at if it were added now, e.g. to size it
+        before it is accepted. None if its reference does not exist (or the quote
+        is not a valid pegged order). Never modifies the book.
+        """
+        side = quote.get("side")
+        reference = quote.get("peg_reference")
+        if side not in ("bid", "ask") or reference not in PEG_REFERENCES:
+            return None
+        offset = Decimal(quote.get("peg_offset") or 0)
+        limit_price = Decimal(quote["price"]) if quote.get("price") is not None else None
+        tree = self.bids if side == "bid" else self.asks
+        group = tree.peg_groups.get((reference, offset, limit_price))
+        if group is not None:
+            return group.price
+        references = self.peg_references
+        if references is None:
+            references = self.unpegged_best_prices()
+        return self.peg_price(side, reference, offset, limit_price, references)
+
+    def unpegged_best_prices(self):
+        return (self.bids.best_unpegged_price(True), self.asks.best_unpegged_price(False))
+
+    def peg_price(self, side, reference, offset, limit_price, references):
+        """
+        Price a peg group should rest at for the given (best bid, best ask) references,
+        rounded to the tick away from the spread, capped at its limit and kept one
+        tick behind the opposite best price. None if the reference does not exist.
+        """
+        best_bid, best_ask = references
+        if reference == "best_bid":
+            price = best_bid
+        elif reference == "best_ask":
+            price = best_ask
+        else:
+            price = (best_bid + best_ask) / 2 if best_bid is not None and best_ask is not None else None
+        if price is None:
+            return None
+        tick = Decimal(str(self.tick_size))
+        price += offset
+        if side == "bid":
+            price = (price / tick).to_integral_value(ROUND_FLOOR) * tick
+            if limit_price is not None and price > limit_price:
+                price = limit_price
+            opposite = self.asks.min_price()
+            if opposite is not None and price >= opposite:
+                price = opposite - tick
+        else:
+            price = (price / tick).to_integral_value(ROUND_CEILING) * tick
+            if limit_price is not None and price < limit_price:
+                price = limit_price
+            opposite = self.bids.max_price()
+            if opposite is not None and price <= opposite:
+                price = opposite + tick
+        if price <= 0:
+            return None
+        return price
+
+    def reprice_pegs(self):
+        """
+        Move every peg group to its new price after the unpegged best bid or ask has
+        changed. Each group moves as one node, so this costs O(groups moved), not
+        O(pegged orders). References ignore pegged orders, so moving groups never
+        triggers another reprice; bids are moved before asks so each side is kept
+        clear of the other.
+        """
+        if not self.bids.peg_groups and not self.asks.peg_groups:
+            self.peg_references = None
+            return
+        references = self.unpegged_best_prices()
+        if references == self.peg_references:
+            return
+        self.peg_references = references
+        for tree in (self.bids, self.asks):
+            for group in list(tree.peg_groups.values()):
+                price = self.peg_price(
+                    group.side, group.reference, group.offset, group.limit_price, references
+                )
+                if price is not None and price != group.price:
+                    # A missing reference leaves the group where it is
+                    tree.move_group(group, price)
+
+    def release_triggers(self, verbose):
+        """
+        Release every dormant order crossed by the last trade price and run it through
+        the normal matching path, trigger price order first and arrival order within
+        a price. Trades made by released orders can cross further triggers, so this
+        repeats until the last price stops releasing anything.
+
+        Returns one {"stop_id", "quote", "result"} per released order, result being
+        what process_order returned for it.
+        """
+        if self.releasing_triggers or not self.triggers:
+            return []
+        self.releasing_triggers = True
+        triggered = []
+        try:
+            while self.candles.last_price is not None:
+                last_price = self.candles.last_price
+                released = self.triggers.release(last_price)
+                if not released:
+                    break
+                for stop_id, quote in released:
+                    if self.listeners:
+                        self.emit(
+                            {
+                                "type": "trigger",
+                                "orderId": stop_id,
+                                "side": quote["side"],
+                                "triggerPrice": float(quote["trigger_price"]),
+                                "lastPrice": float(last_price),
+                                "timestamp": self.time,
+                            }
+                        )
+                    child = dict(quote)
+                    child["type"] = quote["execute_as"]
+                    result = self.process_order(child, False, verbose)
+                    triggered.append({"stop_id": stop_id, "quote": child, "result": result})
+        finally:
+            self.releasing_triggers = False
+        return triggered
+
     def process_order_list(
         self, side, order_list, quantity_still_to_trade, quote, verbose
     ):
@@ -64,8 +349,18 @@ class OrderBook(object):
         """
         trades = []
         quantity_to_trade = quantity_still_to_trade
+        stp_mode = quote.get("stp_mode") or self.stp_mode
+        taker_account = quote["account_id"]
         while len(order_list) > 0 and quantity_to_trade > 0:
             head_order = order_list.get_head_order()
+            if isinstance(head_order, PegGroup):
+                # A peg group rests as one node; trade with its members in time priority
+                head_order = head_order.orders.head_order
+            if stp_mode is not None and head_order.account_id == taker_account:
+                quantity_to_trade = self.prevent_self_trade(
+                    side, head_order, quantity_to_trade, stp_mode
+                )
+                continue
             traded_price = head_order.price
             counter_party = head_order.trade_id
             new_book_quantity = None
@@ -73,21 +368,24 @@ class OrderBook(object):
                 traded_quantity = quantity_to_trade
                 # Do the transaction
                 new_book_quantity = head_order.quantity - quantity_to_trade
-                head_order.update_quantity(new_book_quantity, head_order.timestamp)
-                quantity_to_trade = 0
-            elif quantity_to_trade == head_order.quantity:
-                traded_quantity = quantity_to_trade
                 if side == "bid":
-                    self.bids.remove_order_by_id(head_order.order_id)
+                    self.bids.update_order_quantity(
+                        head_order, new_book_quantity, head_order.timestamp
+                    )
                 else:
-                    self.asks.remove_order_by_id(head_order.order_id)
+                    self.asks.update_order_quantity(
+                        head_order, new_book_quantity, head_order.timestamp
+                    )
                 quantity_to_trade = 0
-            else:  # quantity to trade is larger than the head order
+            else:  # the head order's displayed quantity is filled in full
                 traded_quantity = head_order.quantity
-                if side == "bid":
-                    self.bids.remove_order_by_id(head_order.order_id)
+                tree = self.bids if side == "bid" else self.asks
+                if head_order.hidden_quantity > 0:
+                    # Iceberg: refill the clip from the reserve and re-queue it behind the level
+                    tree.replenish_order(head_order, self.time)
+                    new_book_quantity = head_order.quantity
                 else:
-                    self.asks.remove_order_by_id(head_order.order_id)
+                    tree.remove_order_by_id(head_order.order_id)
                 quantity_to_trade -= traded_quantity
             if verbose:
                 print(
@@ -141,7 +439,18 @@ class OrderBook(object):
                 ]
 
             self.tape.append(transaction_record)
+            self.candles.add_trade(transaction_record)
             trades.append(transaction_record)
+            if self.listeners:
+                self.emit(
+                    {
+                        "type": "trade",
+                        "price": float(traded_price),
+                        "quantity": float(traded_quantity),
+                        "takerSide": transaction_record["party2"][1],
+                        "timestamp": self.time,
+                    }
+                )
         return quantity_to_trade, trades
 
     def process_market_order(self, quote, verbose):
@@ -170,7 +479,9 @@ class OrderBook(object):
         # Note: modified so that only one trade can happen
         # If the quote quantity is less than the best opposing side order quantity, partial fill
         # If the quote quantity is the same as the best opposing side order quantity, complete fill
-        # If the quote quatity is larger than the best opposing side order quantity, reject this quote
+        # If the quote quatity is larger than the best opposing side order quantity, reject this quote,
+        # unless it is an IOC or FOK order: those fill against as many orders as they can (FOK: need,
+        # or not at all) and never rest, so their remainder locks no funds
 
         order_in_book = None
         trades = []
@@ -180,22 +491,55 @@ class OrderBook(object):
 
         task_id = 0  # only set for partial or complete fills
         next_best_order = None
+        walks_book = False  # an IOC or FOK order filled against more than the best order
 
         if quantity_to_trade <= 0:
             raise Exception("No orders of size 0 or less")
+        quote["expire_time"] = self.resolve_expire_time(quote)
+        display_quantity = quote.get("display_quantity")
+        if display_quantity is not None:
+            display_quantity = Decimal(display_quantity)
+            if display_quantity <= 0 or display_quantity > quantity_to_trade:
+                raise Exception("display_quantity must be positive and at most the order quantity")
+        order_type = quote.get("type", "limit")
+        if self.matching_mode == "auction" and order_type in ("ioc", "fok"):
+            raise Exception("%s orders are not accepted in auction mode" % order_type.upper())
+        if order_type != "limit":
+            # Rejections raise here, before anything in the book is touched. In auction mode
+            # post-only orders are checked against the collected book, so they never cross it
+            self.check_order_type(
+                order_type, side, price, quantity_to_trade,
+                quote["account_id"], quote.get("stp_mode") or self.stp_mode,
+            )
 
-        if side == "bid":
+        if self.matching_mode == "auction":
+            # Collected without matching, the book may cross until the next uncross
+            if side not in ("bid", "ask"):
+                sys.exit('process_limit_order() given neither "bid" nor "ask"')
+            if not from_data:
+                quote["order_id"] = self.next_order_id
+            self.set_iceberg_quantities(quote, quantity_to_trade)
+            if side == "bid":
+                self.bids.insert_order(quote)
+            else:
+                self.asks.insert_order(quote)
+            order_in_book = quote
+        elif side == "bid":
             # If we have asks, and we cross the spread, and we're covering more than one order, reject
-            if self.asks and price >= self.asks.min_price():
-                min_price_orders = self.asks.min_price_list()
-                if quantity_to_trade < min_price_orders.head_order.quantity:
+            best_order, following_order = self.first_counterparty(self.asks, False, quote)
+            if best_order is not None and price >= best_order.price:
+                if quantity_to_trade < best_order.quantity:
                     # Partial fill
                     task_id = 3
-                elif quantity_to_trade == min_price_orders.head_order.quantity:
+                elif quantity_to_trade == best_order.quantity:
                     # Complete fill
                     task_id = 4
-                    if len(min_price_orders) > 1:
-                        next_best_order = min_price_orders[1]
+                    next_best_order = following_order
+                elif order_type in ("ioc", "fok"):
+                    # Walks the book up to its price; an IOC remainder is cancelled below,
+                    # a FOK order was checked to fill in full
+                    task_id = 4
+                    walks_book = True
                 else:
                     # More than one order covered, reject this for now
                     # This is disabled for now as we only track and lock funds for the best order on-chain
@@ -218,25 +562,29 @@ class OrderBook(object):
                     "ask", best_price_asks, quantity_to_trade, quote, verbose
                 )
                 trades += new_trades
-            # If volume remains, need to update the book with new quantity
-            if quantity_to_trade > 0:
+            # If volume remains, need to update the book with new quantity (IOC/FOK remainders are cancelled)
+            if quantity_to_trade > 0 and order_type not in ("ioc", "fok"):
                 if not from_data:
                     quote["order_id"] = self.next_order_id
-                quote["quantity"] = quantity_to_trade
+                self.set_iceberg_quantities(quote, quantity_to_trade)
                 self.bids.insert_order(quote)
                 order_in_book = quote
         elif side == "ask":
             # If we have bids, and we cross the spread, and we're covering more than one order, reject
-            if self.bids and price <= self.bids.max_price():
-                max_price_orders = self.bids.max_price_list()
-                if quantity_to_trade < max_price_orders.head_order.quantity:
+            best_order, following_order = self.first_counterparty(self.bids, True, quote)
+            if best_order is not None and price <= best_order.price:
+                if quantity_to_trade < best_order.quantity:
                     # Partial fill
                     task_id = 3
-                elif quantity_to_trade == max_price_orders.head_order.quantity:
+                elif quantity_to_trade == best_order.quantity:
                     # Complete fill
                     task_id = 4
-                    if len(max_price_orders) > 1:
-                        next_best_order = max_price_orders.head_order.next_order
+                    next_best_order = following_order
+                elif order_type in ("ioc", "fok"):
+                    # Walks the book up to its price; an IOC remainder is cancelled below,
+                    # a FOK order was checked to fill in full
+                    task_id = 4
+                    walks_book = True
                 else:
                     # More than one order covered, reject this for now
                     # This is disabled for now as we only track and lock funds for the best order on-chain
@@ -258,32 +606,540 @@ class OrderBook(object):
                     "bid", best_price_bids, quantity_to_trade, quote, verbose
                 )
                 trades += new_trades
-            # If volume remains, need to update the book with new quantity
-            if quantity_to_trade > 0:
+            # If volume remains, need to update the book with new quantity (IOC/FOK remainders are cancelled)
+            if quantity_to_trade > 0 and order_type not in ("ioc", "fok"):
                 if not from_data:
                     quote["order_id"] = self.next_order_id
-                quote["quantity"] = quantity_to_trade
+                self.set_iceberg_quantities(quote, quantity_to_trade)
                 self.asks.insert_order(quote)
                 order_in_book = quote
         else:
             sys.exit('process_limit_order() given neither "bid" nor "ask"')
 
-        assert len(trades) == 1 or len(trades) == 0
+        if walks_book:
+            # The order now first in line on the opposite side
+            if side == "bid":
+                next_best_order = self.first_counterparty(self.asks, False, quote)[0]
+            else:
+                next_best_order = self.first_counterparty(self.bids, True, quote)[0]
+
+        if order_in_book is not None and order_in_book["expire_time"] is not None:
+            self.expiries.schedule(
+                order_in_book["order_id"], order_in_book["expire_time"], self.time
+            )
+
+        assert len(trades) == 1 or len(trades) == 0 or walks_book
         return trades, order_in_book, task_id, next_best_order
 
+    def set_matching_mode(self, mode, interval=None):
+        """
+        Switch between continuous matching and frequent batch auctions, where orders
+        collect for `interval` ms and are uncrossed together by run_auction. Leaving
+        auction mode uncrosses what was collected and returns the run_auction results:
+        none if the book did not cross, more than one if self-trade prevention left it
+        crossed after the first uncross.
+        """
+        if mode not in MATCHING_MODES:
+            raise ValueError("matching mode must be one of %s" % (MATCHING_MODES,))
+        if interval is not None:
+            if interval <= 0:
+                raise ValueError("auction interval must be positive")
+            self.auction_interval = int(interval)
+        results = []
+        if mode == "continuous" and self.matching_mode == "auction":
+            # Continuous matching needs an uncrossed book
+            result = self.run_auction()
+            while result is not None:
+                results.append(result)
+                result = self.run_auction()
+            self.next_auction_time = None
+        elif mode == "auction" and self.matching_mode == "continuous":
+            self.update_time()
+            self.next_auction_time = self.time + self.auction_interval
+        self.matching_mode = mode
+        return results
+
+    def auction_due(self, now):
+        return (
+            self.matching_mode == "auction"
+            and self.next_auction_time is not None
+            and now >= self.next_auction_time
+        )
+
+    def clearing_price(self):
+        """
+        Single price at which the crossed part of the book uncrosses, and the volume
+        that trades there, or None if the book does not cross.
+
+        Demand at a price is the bid volume priced at or above it and supply the ask
+        volume priced at or below it, both cumulative sums over the crossed levels.
+        Volumes count everything the orders still have to trade, iceberg reserves
+        included, so the whole batch can clear at this one price. The clearing price
+        maximises the executable volume min(demand, supply), then minimises the
+        imbalance |demand - supply|, then stays closest to the last trade price (or
+        the middle of the crossed range).
+        """
+        best_bid = self.bids.max_price()
+        best_ask = self.asks.min_price()
+        if best_bid is None or best_ask is None or best_bid < best_ask:
+            return None
+        bid_levels = self.bids.levels_within(best_ask, reverse=True)
+        ask_levels = self.asks.levels_within(best_bid)
+        crossed_bids = list(reversed(self.bids.prices[len(self.bids.prices) - bid_levels:]))
+        crossed_asks = list(self.asks.prices[:ask_levels])
+        bid_volumes = [self.bids.total_volume_at(price) for price in crossed_bids]
+        ask_volumes = [self.asks.total_volume_at(price) for price in crossed_asks]
+        bid_prices = np.array(crossed_bids, dtype=np.float64) # descending
+        ask_prices = np.array(crossed_asks, dtype=np.float64) # ascending
+        cumulative_demand = np.cumsum(np.array(bid_volumes, dtype=np.float64))
+        cumulative_supply = np.cumsum(np.array(ask_volumes, dtype=np.float64))
+
+        prices = sorted(set(crossed_bids) | set(crossed_asks))
+        candidates = np.array(prices, dtype=np.float64)
+        # Every candidate lies within [best ask, best bid], so both counts are at least 1
+        demand = cumulative_demand[np.searchsorted(-bid_prices, -candidates, side="right") - 1]
+        supply = cumulative_supply[np.searchsorted(ask_prices, candidates, side="right") - 1]
+        executable = np.minimum(demand, supply)
+        imbalance = np.abs(demand - supply)
+        if self.candles.last_price is not None:
+            reference = float(self.candles.last_price)
+        else:
+            reference = float(best_bid + best_ask) / 2
+        distance = np.abs(candidates - reference)
+        best = np.lexsort((candidates, distance, imbalance, -executable))[0]
+
+        # Back to the exact Decimal price and volumes
+        price = prices[best]
+        demand = sum(volume for level_price, volume in zip(crossed_bids, bid_volumes) if level_price >= price)
+        supply = sum(volume for level_price, volume in zip(crossed_asks, ask_volumes) if level_price <= price)
+        return price, min(demand, supply)
+
+    def run_auction(self, verbose=False):
+        """
+        Uncross the book at a single clearing price. Bids and asks are paired best
+        price first and in time priority within a price, iceberg clips refilling as
+        they go, and every fill of the batch trades at the clearing price. Returns
+        {"price", "volume", "trades", "triggered"} or None if the book did not cross.
+
+        Self-trade prevention can cancel volume the clearing price was computed with.
+        The batch still trades at that one price only; if the book crosses afterwards,
+        the rest is uncrossed by the next auction.
+        """
+        self.update_time()
+        if self.matching_mode == "auction":
+            self.next_auction_time = self.time + self.auction_interval
+        clearing = self.clearing_price()
+        if clearing is None:
+            return None
+        price = clearing[0]
+        volume = 0
+        trades = []
+        # Pairing best first until one side no longer reaches the price fills exactly the executable volume
+        while (
+            self.bids
+            and self.asks
+            and self.bids.max_price() >= price
+            and self.asks.min_price() <= price
+        ):
+            bid = first_order(self.bids.max_price_list())
+            ask = first_order(self.asks.min_price_list())
+            if self.stp_mode is not None and bid.account_id == ask.account_id:
+                self.uncross_self_trade(bid, ask)
+                continue
+            quantity = min(bid.quantity, ask.quantity)
+            bid_left = self.fill_resting(self.bids, bid, quantity)
+            ask_left = self.fill_resting(self.asks, ask, quantity)
+            volume += quantity
+            if verbose:
+                print(
+                    "AUCTION TRADE: Time - {}, Price - {}, Quantity - {}, Bid TradeID - {}, Ask TradeID - {}".format(
+                        self.time, price, quantity, bid.trade_id, ask.trade_id
+                    )
+                )
+            transaction_record = {
+                "timestamp": self.time,
+                "price": price,
+                "quantity": quantity,
+                "time": self.time,
+                "party1": [bid.trade_id, "bid", bid.order_id, bid_left, bid.private_key],
+                "party2": [ask.trade_id, "ask", ask.order_id, ask_left, ask.private_key],
+            }
+            self.tape.append(transaction_record)
+            self.candles.add_trade(transaction_record)
+            trades.append(transaction_record)
+            if self.listeners:
+                self.emit(
+                    {
+                        "type": "trade",
+                        "price": float(price),
+                        "quantity": float(quantity),
+                        "takerSide": None,
+                        "timestamp": self.time,
+                    }
+                )
+        self.reprice_pegs()
+        triggered = self.release_triggers(verbose) if trades else []
+        return {
+            "price": price,
+            "volume": volume,
+            "trades": trades,
+            "triggered": triggered,
+        }
+
+    def fill_resting(self, tree, order, quantity):
+        """Take quantity off a resting order. Returns what is left of it in the book (None once it is gone)."""
+        if quantity < order.quantity:
+            tree.update_order_quantity(order, order.quantity - quantity, order.timestamp)
+            return order.quantity
+        if order.hidden_quantity > 0:
+            tree.replenish_order(order, self.time)
+            return order.quantity
+        tree.remove_order_by_id(order.order_id)
+        return None
+
+    def uncross_self_trade(self, bid, ask):
+        """Self-trade prevention in an auction: the later of the two orders is treated as the incoming one."""
+        if bid.order_id > ask.order_id:
+            newest, newest_tree, oldest_side = bid, self.bids, "ask"
+        else:
+            newest, newest_tree, oldest_side = ask, self.asks, "bid"
+        oldest = ask if newest is bid else bid
+        remaining = self.prevent_self_trade(oldest_side, oldest, newest.quantity, self.stp_mode)
+        if remaining == newest.quantity:
+            return
+        if remaining > 0:
+            newest_tree.update_order_quantity(newest, remaining, newest.timestamp)
+        elif self.stp_mode == "decrement" and newest.hidden_quantity > 0:
+            newest_tree.replenish_order(newest, self.time)
+        else:
+            self.cancel_resting(newest_tree, newest, "self_trade")
+
+    def first_counterparty(self, tree, reverse, quote):
+        """
+        The first resting order of tree (best price first) that an incoming quote
+        would trade with, and the order queued right behind it in its level.
+        With self-trade prevention on, the quote's own orders are passed over:
+        they get cancelled or decremented, never traded. (None, None) if there is none.
+        """
+        stp_mode = quote.get("stp_mode") or self.stp_mode
+        prices = reversed(tree.prices) if reverse else iter(tree.prices)
+        for price in prices:
+            orders = level_orders(tree.price_map[price])
+            for order in orders:
+                if stp_mode is None or order.account_id != quote["account_id"]:
+                    return order, next(orders, None)
+        return None, None
+
+    def intern_account(self, account):
+        """Small int standing for an account (compared case-insensitively)."""
+        if account is None:
+            return None
+        key = account.lower()
+        account_id = self.account_ids.get(key)
+        if account_id is None:
+            account_id = len(self.account_ids)
+            self.account_ids[key] = account_id
+        return account_id
+
+    def prevent_self_trade(self, side, order, quantity, stp_mode):
+        """
+        Resolve an incoming order meeting a resting order of the same account instead
+        of trading. Returns the quantity the incoming order still has to trade:
+
+        cancel_newest: the incoming order's remainder is cancelled.
+        cancel_oldest: the resting order is cancelled and matching carries on.
+        cancel_both: both are cancelled.
+        decrement: both are reduced by the smaller quantity, without a trade.
+        """
+        tree = self.bids if side == "bid" else self.asks
+        prevented = min(quantity, order.quantity)
+        self.self_trades_prevented += 1
+        self.self_trade_quantity_prevented += prevented
+        if stp_mode == "decrement":
+            if prevented < order.quantity:
+                tree.update_order_quantity(order, order.quantity - prevented, order.timestamp)
+            elif order.hidden_quantity > 0:
+                tree.replenish_order(order, self.time)
+            else:
+                self.cancel_resting(tree, order, "self_trade")
+            return quantity - prevented
+        if stp_mode in ("cancel_oldest", "cancel_both"):
+            self.cancel_resting(tree, order, "self_trade")
+        if stp_mode in ("cancel_newest", "cancel_both"):
+            return 0
+        return quantity
+
+    def cancel_resting(self, tree, order, reason):
+        """Remove a resting order on the book's own initiative and publish the cancel."""
+        tree.remove_order_by_id(order.order_id)
+        self.expiries.cancel(order.order_id)
+        if self.listeners:
+            self.emit(
+                {
+                    "type": "cancel",
+                    "reason": reason,
+                    "orderId": order.order_id,
+                    "side": order.side,
+                    "price": float(order.price),
+                    "quantity": float(order.quantity),
+                    "account": order.account,
+                    "timestamp": self.time,
+                }
+            )
+
+    def metrics(self):
+        """Counters for monitoring: resting orders, trades and prevented self-trades."""
+        return {
+            "bid_orders": len(self.bids),
+            "ask_orders": len(self.asks),
+            "dormant_orders": len(self.triggers),
+            "trades": len(self.tape),
+            "matching_mode": self.matching_mode,
+            "self_trades_prevented": self.self_trades_prevented,
+            "self_trade_quantity_prevented": self.self_trade_quantity_prevented,
+        }
+
+    def set_iceberg_quantities(self, quote, quantity):
+        """
+        Split what is left of an order into the displayed quantity and, for iceberg
+        orders (those with a display_quantity), the hidden reserve behind it.
+        """
+        display_quantity = quote.get("display_quantity")
+        if display_quantity is not None and quantity > Decimal(display_quantity):
+            quote["quantity"] = Decimal(display_quantity)
+            quote["hidden_quantity"] = quantity - quote["quantity"]
+        else:
+            quote["quantity"] = quantity
+            quote["hidden_quantity"] = 0
+
+    def check_order_type(self, order_type, side, price, quantity, account_id=None, stp_mode=None):
+        """
+        Pre-trade checks for IOC, FOK and post-only limit orders. Raises if the order
+        must be rejected; never modifies the book.
+
+        post_only: rejected if it would cross, an O(1) look at the best opposite price.
+        ioc: rejected if nothing would match at its limit price.
+        fok: rejected unless the volume at or better than its limit price covers it in
+        full, checked against the best level first and then the cumulative depth. With
+        self-trade prevention on, the account's own orders are walked as matching would
+        meet them instead (see self_trade_free_fill).
+        """
+        if side == "bid":
+            best_price = self.asks.min_price()
+            crosses = best_price is not None and price >= best_price
+            best_list = self.asks.min_price_list()
+        elif side == "ask":
+            best_price = self.bids.max_price()
+            crosses = best_price is not None and price <= best_price
+            best_list = self.bids.max_price_list()
+        else:
+            raise Exception('check_order_type() given neither "bid" nor "ask"')
+
+        if order_type == "post_only":
+            if crosses:
+                raise Exception("Post-only order would cross the book")
+        elif order_type == "ioc":
+            if not crosses:
+                raise Exception("IOC order has nothing to match at its price")
+        elif order_type == "fok":
+            if not crosses:
+                raise Exception("FOK order cannot be filled in full")
+            if stp_mode is not None and account_id is not None:
+                if self.self_trade_free_fill(side, price, quantity, account_id, stp_mode) < quantity:
+                    raise Exception("FOK order cannot be filled in full")
+            elif quantity > best_list.volume:
+                estimate = self.estimate_fill(side, quantity, price)
+                if estimate is None or not estimate["complete"]:
+                    raise Exception("FOK order cannot be filled in full")
+
+    def self_trade_free_fill(self, side, price, quantity, account_id, stp_mode):
+        """
+        Quantity an incoming order of account_id would fill, up to quantity, with
+        self-trade prevention meeting the account's own resting orders on the way:
+        cancel_oldest passes over them, decrement uses up as much of the incoming
+        order as they hold and cancel_newest / cancel_both end the order at the
+        first one. Walks the orders at or better than price in priority order;
+        never modifies the book.
+        """
+        if side == "bid":
+            tree, prices = self.asks, iter(self.asks.prices)
+        else:
+            tree, prices = self.bids, reversed(self.bids.prices)
+        filled = 0
+        remaining = quantity
+        for level_price in prices:
+            if (level_price > price) if side == "bid" else (level_price < price):
+                break
+            for order in level_orders(tree.price_map[level_price]):
+                if order.account_id != account_id:
+                    traded = min(remaining, order.quantity)
+                    filled += traded
+                    remaining -= traded
+                elif stp_mode == "decrement":
+                    remaining -= min(remaining, order.quantity)
+                elif stp_mode != "cancel_oldest":
+                    return filled
+                if remaining <= 0:
+                    return filled
+        return filled
+
+    def resolve_expire_time(self, quote):
+        """
+        Expiry (ms) of a limit order from its time_in_force:
+        GTC (default) never expires, GTT expires at expire_time, GTD at the end of the
+        UTC day containing expire_time, DAY at the end of the current UTC day.
+        Raises before the book is touched if the expiry is missing or already past.
+        """
+        time_in_force = quote.get("time_in_force") or "GTC"
+        if time_in_force not in TIME_IN_FORCE:
+            raise Exception("Unknown time_in_force %s" % time_in_force)
+        if time_in_force == "GTC":
+            return None
+        if time_in_force == "DAY":
+            return (self.time // DAY_MS + 1) * DAY_MS
+        if quote.get("expire_time") is None:
+            raise Exception("%s orders need an expire_time" % time_in_force)
+        expire_time = int(quote["expire_time"])
+        if time_in_force == "GTD":
+            expire_time = (expire_time // DAY_MS + 1) * DAY_MS
+        if expire_time <= self.time:
+            raise Exception("Order expire_time is in the past")
+        return expire_time
+
+    def expire_orders(self, now=None):
+        """
+        Advance the expiry wheel to `now` (ms, defaults to the wall clock) and remove
+        every resting order whose time ran out. Only the orders that are due are
+        touched, never the whole book. Returns the cancel events, which are also
+        published to the book listeners.
+        """
+        if now is None:
+            now = int(time.time() * 1000)
+        cancels = []
+        for order_id, expire_time in self.expiries.advance(now):
+            if self.bids.order_exists(order_id):
+                tree = self.bids
+            elif self.asks.order_exists(order_id):
+                tree = self.asks
+            else:
+                continue  # filled since it was scheduled
+            order = tree.get_order(order_id)
+            if order.expire_time != expire_time:
+                continue  # replaced by an order with a different expiry
+            tree.remove_order_by_id(order_id)
+            cancels.append(
+                {
+                    "type": "cancel",
+                    "reason": "expired",
+                    "orderId": order.order_id,
+                    "side": order.side,
+                    "price": float(order.price),
+                    "quantity": float(order.quantity),
+                    "account": order.account,
+                    "expireTime": expire_time,
+                    "timestamp": now,
+                }
+            )
+        if cancels:
+            self.reprice_pegs()
+        if self.listeners:
+            for cancel in cancels:
+                self.emit(cancel)
+        return cancels
+
+    def snapshot(self):
+        """
+        Serialisable state of the resting book: every order in priority order, the
+        order id counter, the expiry wheel and the dormant trigger orders. The tape
+        and candles are not included, and neither are the orders' signing keys.
+        """
+        orders = []
+        for tree in (self.bids, self.asks):
+            for price in tree.prices:
+                for order in level_orders(tree.price_map[price]):
+                    orders.append(order.to_quote())
+        return {
+            "tick_size": self.tick_size,
+            "stp_mode": self.stp_mode,
+            "matching_mode": self.matching_mode,
+            "auction_interval": self.auction_interval,
+            "time": self.time,
+            "next_order_id": self.next_order_id,
+            "orders": orders,
+            "expiries": self.expiries.snapshot(),
+            "triggers": [
+                self.trigger_to_quote(self.triggers.get(stop_id))
+                for stop_id in self.triggers.stops
+            ],
+        }
+
+    @staticmethod
+    def trigger_to_quote(quote):
+        quote = dict(quote)
+        quote.pop("private_key", None)
+        for key in ("price", "quantity", "trigger_price"):
+            if quote.get(key) is not None:
+                quote[key] = str(quote[key])
+        return quote
+
+    @classmethod
+    def from_snapshot(cls, state, private_key=None):
+        """
+        Rebuild an OrderBook from snapshot(), keeping time priority and pending expiries.
+        private_key(account) gives the signing key of each restored order (None if unknown).
+        """
+        order_book = cls(state["tick_size"], state.get("stp_mode"))
+        order_book.time = state["time"]
+        order_book.auction_interval = state.get("auction_interval", order_book.auction_interval)
+        order_book.set_matching_mode(state.get("matching_mode", "continuous"))
+        order_book.next_order_id = state["next_order_id"]
+        for quote in state["orders"]:
+            quote["price"] = Decimal(quote["price"])
+            quote["quantity"] = Decimal(quote["quantity"])
+            quote["account_id"] = order_book.intern_account(quote["account"])
+            quote["private_key"] = private_key(quote["account"]) if private_key is not None else None
+            tree = order_book.bids if quote["side"] == "bid" else order_book.asks
+            if quote.get("peg_reference") is not None:
+                tree.insert_pegged_order(
+                    quote,
+                    quote["peg_reference"],
+                    Decimal(quote["peg_offset"]),
+                    Decimal(quote["peg_limit"]) if quote["peg_limit"] is not None else None,
+                    quote["price"],
+                )
+            else:
+                tree.insert_order(quote)
+        order_book.expiries = TimerWheel.restore(state["expiries"])
+        for quote in state.get("triggers", []):
+            for key in ("price", "quantity", "trigger_price"):
+                if quote.get(key) is not None:
+                    quote[key] = Decimal(quote[key])
+            quote["private_key"] = private_key(quote["account"]) if private_key is not None else None
+            order_book.triggers.add(
+                quote["order_id"], quote, quote["trigger_price"], quote["trigger_direction"]
+            )
+        return order_book
+
     def cancel_order(self, side, order_id, time=None):
         if time:
             self.time = time
         else:
             self.update_time()
+        if order_id in self.triggers:
+            # Still dormant, never reached the book
+            self.triggers.cancel(order_id)
+            return
         if side == "bid":
             if self.bids.order_exists(order_id):
                 self.bids.remove_order_by_id(order_id)
+                self.expiries.cancel(order_id)
         elif side == "ask":
             if self.asks.order_exists(order_id):
                 self.asks.remove_order_by_id(order_id)
+                self.expiries.cancel(order_id)
         else:
             sys.exit('cancel_order() given neither "bid" nor "ask"')
+        self.reprice_pegs()
 
     def modify_order(self, order_id, order_update, time=None):
         if time:
@@ -301,6 +1157,7 @@ class OrderBook(object):
                 self.asks.update_order(order_update)
         else:
             sys.exit('modify_order() given neither "bid" nor "ask"')
+        self.reprice_pegs()
 
     def get_volume_at_price(self, side, price):
         price = Decimal(price)
@@ -317,6 +1174,98 @@ class OrderBook(object):
         else:
             sys.exit('get_volume_at_price() given neither "bid" nor "ask"')
 
+    def level_changed(self, side, price, delta_volume, created, removed):
+        """
+        Called by the OrderTrees on every level change. Publishes the new level volume
+        together with the updated signals to the book listeners.
+        """
+        if not self.listeners:
+            return
+        tree = self.bids if side == "bid" else self.asks
+        volume = tree.price_map[price].volume if tree.price_exists(price) else 0
+        self.emit(
+            {
+                "type": "level",
+                "side": side,
+                "price": float(price),
+                "volume": float(volume),
+                "timestamp": self.time,
+                "signals": self.signals.to_dict(),
+            }
+        )
+
+    def emit(self, event):
+        for listener in list(self.listeners):
+            listener(event)
+
+    def estimate_fill(self, side, quantity, limit_price=None):
+        """
+        Estimate what an incoming order of `side` for `quantity` would cost right now,
+        without touching the book. `quantity` may be a single size or a list of sizes,
+        in which case a list of estimates is returned (sharing one depth rebuild).
+
+        Each estimate has the VWAP, worst price, notional, filled quantity and the
+        number of levels consumed, or is None if there is no opposing liquidity.
+        """
+        if side == "bid":
+            tree, reverse = self.asks, False
+        elif side == "ask":
+            tree, reverse = self.bids, True
+        else:
+            raise ValueError('estimate_fill() given neither "bid" nor "ask"')
+        if limit_price is not None:
+            limit_price = Decimal(limit_price)
+        if isinstance(quantity, (list, tuple)):
+            return [
+                tree.estimate_fill(Decimal(q), reverse, limit_price) for q in quantity
+            ]
+        return tree.estimate_fill(Decimal(quantity), reverse, limit_price)
+
+    def to_arrays(self, depth=None, orders=False):
+        """
+        Export the book as NumPy arrays for analytics, best price first on each side.
+
+        Returns {"bids": {...}, "asks": {...}} where each side holds "price",
+        "volume" and "count" arrays over its levels (limited to `depth` levels if
+        given) and, when `orders` is True, an "orders" dict of per-order
+        "order_id", "price", "quantity" and "level" arrays in priority order.
+        The arrays are views into buffers reused by later calls; copy them to keep them.
+        """
+        return {
+            "bids": self.bid_ladder.export(depth, orders),
+            "asks": self.ask_ladder.export(depth, orders),
+        }
+
+    def queue_position(self, order_id):
+        """
+        Where a resting order stands in its price level: the number of orders and the
+        volume queued ahead of it, answered in O(log n) from the level's queue index
+        (a peg group queued ahead counts as a single order).
+        Returns None if the order is not in the book.
+        """
+        if self.bids.order_exists(order_id):
+            order = self.bids.get_order(order_id)
+        elif self.asks.order_exists(order_id):
+            order = self.asks.get_order(order_id)
+        else:
+            return None
+        orders_ahead, volume_ahead = order.order_list.queue_position(order)
+        level = order.order_list
+        if order.peg_group is not None:
+            # Behind whatever is ahead of its group in the level, then its place in the group
+            level = order.peg_group.order_list
+            group_ahead, group_volume_ahead = level.queue_position(order.peg_group)
+            orders_ahead += group_ahead
+            volume_ahead += group_volume_ahead
+        return {
+            "side": order.side,
+            "price": order.price,
+            "orders_ahead": orders_ahead,
+            "volume_ahead": volume_ahead,
+            "level_orders": level.order_count,
+            "level_volume": level.volume,
+        }
+
     def get_best_bid(self):
         return self.bids.max_price()
 
@@ -380,18 +1329,21 @@ class OrderBook(object):
         orderbook = {
             "baseAsset": base_asset,
             "quoteAsset": quote_asset,
-            # "lastTradePrice": 95362.08,
-            # "priceChangeIndicator": "up",
+            "lastTradePrice": (
+                float(self.candles.last_price)
+                if self.candles.last_price is not None
+                else None
+            ),
+            "priceChangeIndicator": self.candles.price_change_indicator(),
             "asks": [],
             "bids": [],
         }
 
         for price in self.asks.prices:
             price_list = self.asks.price_map[price]
-            current_order = price_list.head_order
 
-            # Traverse the linked list of orders
-            while current_order != None:
+            # Traverse the linked list of orders (and the members of peg groups)
+            for current_order in level_orders(price_list):
                 orderbook["asks"].append(
                     {
                         "price": float(price),
@@ -401,14 +1353,12 @@ class OrderBook(object):
                         "orderId": current_order.order_id,
                     }
                 )
-                current_order = current_order.next_order
 
         for price in self.bids.prices:
             price_list = self.bids.price_map[price]
-            current_order = price_list.head_order
 
-            # Traverse the linked list of orders
-            while current_order != None:
+            # Traverse the linked list of orders (and the members of peg groups)
+            for current_order in level_orders(price_list):
                 orderbook["bids"].append(
                     {
                         "price": float(price),
@@ -418,6 +1368,5 @@ class OrderBook(object):
                         "orderId": current_order.order_id,
                     }
                 )
-                current_order = current_order.next_order
 
         return orderbook
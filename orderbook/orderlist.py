@@ -1,3 +1,6 @@
+from .fenwick import FenwickTree
+
+
 class OrderList(object):
     '''
     A doubly linked list of Orders. Used to iterate through Orders when
@@ -6,14 +9,23 @@ class OrderList(object):
     Order, we may need multiple Orders to fullfill a transaction. The
     OrderList makes this easy to do. OrderList is naturally arranged by time.
     Orders at the front of the list have priority.
+
+    Every order also holds a queue_seq slot in a Fenwick tree of volumes, so the
+    volume and number of orders ahead of any order can be found in O(log n).
+    Slots only grow (appends and moves to the tail take a fresh one) and are
+    compacted when they run out.
     '''
 
     def __init__(self):
         self.head_order = None # first order in the list
         self.tail_order = None # last order in the list
         self.length = 0 # number of Orders in the list
+        self.order_count = 0 # number of Orders, counting each member of a peg group resting here
         self.volume = 0 # sum of Order quantity in the list AKA share volume
         self.last = None # helper for iterating
+        self.version = 0 # incremented whenever the orders or their quantities change
+        self.queue_index = FenwickTree() # volume/count per arrival slot, for queue positions
+        self.next_seq = 0 # next free slot in queue_index
 
     def __len__(self):
         return self.length
@@ -40,7 +52,39 @@ class OrderList(object):
     def get_head_order(self):
         return self.head_order
 
+    def take_seq(self):
+        '''Hand out the next arrival slot, compacting the queue index when it is full.'''
+        if self.next_seq >= self.queue_index.capacity:
+            self.compact_queue_index()
+        seq = self.next_seq
+        self.next_seq += 1
+        return seq
+
+    def compact_queue_index(self):
+        '''Renumber the orders 0..length-1 in list order and rebuild the index with room to grow.'''
+        slots = []
+        seq = 0
+        order = self.head_order
+        while order is not None:
+            order.queue_seq = seq
+            slots.append((seq, order.quantity))
+            seq += 1
+            order = order.next_order
+        self.queue_index = FenwickTree.from_slots(max(16, 2 * seq + 16), slots)
+        self.next_seq = seq
+
+    def queue_position(self, order):
+        '''(orders ahead, volume ahead) of an order in this list.'''
+        return self.queue_index.prefix(order.queue_seq)
+
+    def quantity_changed(self, order, delta):
+        '''Account for a change of delta in the quantity of one of the orders.'''
+        self.volume += delta
+        self.version += 1
+        self.queue_index.add(order.queue_seq, delta, 0)
+
     def append_order(self, order):
+        order.queue_seq = self.take_seq() # before linking, so a compaction only renumbers the existing orders
         if len(self) == 0:
             order.next_order = None
             order.prev_order = None
@@ -52,13 +96,21 @@ class OrderList(object):
             self.tail_order.next_order = order
             self.tail_order = order
         self.length +=1
+        self.order_count += 1
         self.volume += order.quantity
+        self.version += 1
+        self.queue_index.add(order.queue_seq, order.quantity, 1)
 
     def remove_order(self, order):
         self.volume -= order.quantity
         self.length -= 1
-        if len(self) == 0: # if there are no more Orders, stop/return
+        self.order_count -= 1
+        self.version += 1
+        if len(self) == 0: # if there are no more Orders, reset the queue index and stop/return
+            self.queue_index = FenwickTree()
+            self.next_seq = 0
             return
+        self.queue_index.add(order.queue_seq, -order.quantity, -1)
 
         # Remove an Order from the OrderList. First grab next / prev order
         # from the Order we are removing. Then relink everything. Finally
@@ -80,6 +132,8 @@ class OrderList(object):
 
         Check to see that the quantity is larger than existing, update the quantities, then move to tail.
         '''
+        self.version += 1
+        new_seq = self.take_seq() # before relinking, so a compaction sees the order in its old place
         if order.prev_order != None: # This Order is not the first Order in the OrderList
             order.prev_order.next_order = order.next_order # Link the previous Order to the next Order, then move the Order to tail
         else: # This Order is the first Order in the OrderList
@@ -95,6 +149,11 @@ class OrderList(object):
         self.tail_order.next_order = order
         self.tail_order = order
 
+        # Re-queue in the index: free the old slot and use the one behind every other order
+        self.queue_index.add(order.queue_seq, -order.quantity, -1)
+        order.queue_seq = new_seq
+        self.queue_index.add(order.queue_seq, order.quantity, 1)
+
     def __str__(self):
         from six.moves import cStringIO as StringIO
         temp_file = StringIO()
@@ -1,6 +1,8 @@
+from bisect import bisect_left
 from sortedcontainers import SortedDict
 from .orderlist import OrderList
 from .order import Order
+from .pegs import PegGroup, PeggedOrder, level_orders
 
 class OrderTree(object):
     '''A red-black tree used to store OrderLists in price order
@@ -16,6 +18,11 @@ class OrderTree(object):
         self.volume = 0 # Contains total quantity from all Orders in tree
         self.num_orders = 0 # Contains count of Orders in tree
         self.depth = 0 # Number of different prices in tree (http://en.wikipedia.org/wiki/Order_book_(trading)#Book_depth)
+        self.version = 0 # Incremented on every change to the tree, used to invalidate derived views
+        self.depth_cache = {} # reverse : (version, prices, cumulative volume, cumulative notional)
+        self.listeners = [] # callables(price, delta_volume, created, removed) told about every level change
+        self.peg_groups = {} # (reference, offset, limit price) : PegGroup resting in this tree
+        self.reserved = {} # account (lower case) : [quantity, notional] of its resting orders, hidden reserve included
 
     def __len__(self):
         return len(self.order_map)
@@ -45,36 +52,198 @@ class OrderTree(object):
         if self.order_exists(quote['order_id']):
             self.remove_order_by_id(quote['order_id'])
         self.num_orders += 1
-        if quote['price'] not in self.price_map:
+        created = quote['price'] not in self.price_map
+        if created:
             self.create_price(quote['price']) # If price not in Price Map, create a node in RBtree
         order = Order(quote, self.price_map[quote['price']]) # Create an order
         self.price_map[order.price].append_order(order) # Add the order to the OrderList in Price Map
         self.order_map[order.order_id] = order
         self.volume += order.quantity
+        self.version += 1
+        self.reserve(order, order.total_quantity)
+        self.level_changed(order.price, order.quantity, created=created)
 
     def update_order(self, order_update):
         order = self.order_map[order_update['order_id']]
         original_quantity = order.quantity
         if order_update['price'] != order.price:
-            # Price changed. Remove order and update tree.
-            order_list = self.price_map[order.price]
-            order_list.remove_order(order)
-            if len(order_list) == 0: # If there is nothing else in the OrderList, remove the price from RBtree
-                self.remove_price(order.price)
+            # Price changed. insert_order removes the order (and its price if empty) before re-inserting
             self.insert_order(order_update)
         else:
             # Quantity changed. Price is the same.
             order.update_quantity(order_update['quantity'], order_update['timestamp'])
-        self.volume += order.quantity - original_quantity
+            self.volume += order.quantity - original_quantity
+            self.version += 1
+            self.reserve(order, order.quantity - original_quantity)
+            self.level_changed(order.price, order.quantity - original_quantity)
+
+    def update_order_quantity(self, order, new_quantity, new_timestamp):
+        '''Change the quantity of a resting order in place, e.g. after a partial fill.'''
+        delta = new_quantity - order.quantity
+        self.volume += delta
+        order.update_quantity(new_quantity, new_timestamp)
+        self.version += 1
+        self.reserve(order, delta)
+        self.level_changed(order.price, delta)
+
+    def replenish_order(self, order, new_timestamp):
+        '''Refill a filled iceberg clip from its reserve, moving it to the tail of its level in place.'''
+        old_quantity = order.quantity
+        old_total = order.total_quantity
+        order.replenish(new_timestamp)
+        delta = order.quantity - old_quantity
+        self.volume += delta
+        self.version += 1
+        self.reserve(order, order.total_quantity - old_total)
+        self.level_changed(order.price, delta)
+
+    def insert_pegged_order(self, quote, reference, offset, limit_price, price):
+        '''Add a pegged order to its peg group, resting a new group at price.'''
+        if self.order_exists(quote['order_id']):
+            self.remove_order_by_id(quote['order_id'])
+        self.num_orders += 1
+        key = (reference, offset, limit_price)
+        group = self.peg_groups.get(key)
+        if group is None:
+            group = PegGroup(quote['side'], reference, offset, limit_price)
+            self.peg_groups[key] = group
+        quote['price'] = group.price if group.price is not None else price
+        order = PeggedOrder(quote, group)
+        group.orders.append_order(order) # updates the group's level if the group rests already
+        self.order_map[order.order_id] = order
+        self.volume += order.quantity
+        self.version += 1
+        if group.order_list is None:
+            self.insert_group(group, price)
+        else:
+            self.level_changed(group.price, order.quantity)
+        self.reserve(order, order.total_quantity)
+
+    def insert_group(self, group, price):
+        '''Rest a peg group, as one node, at the tail of the level at price.'''
+        created = price not in self.price_map
+        if created:
+            self.create_price(price)
+        order_list = self.price_map[price]
+        group.price = price
+        order_list.append_order(group)
+        order_list.order_count += len(group) - 1
+        group.order_list = order_list
+        self.version += 1
+        self.level_changed(price, group.quantity, created=created)
+
+    def remove_group(self, group):
+        '''Take a peg group out of its level, leaving its members in place inside it.'''
+        order_list = group.order_list
+        order_list.remove_order(group)
+        order_list.order_count -= len(group) - 1
+        group.order_list = None
+        removed = len(order_list) == 0
+        if removed:
+            self.remove_price(group.price)
+        self.version += 1
+        self.level_changed(group.price, -group.quantity, removed=removed)
+
+    def move_group(self, group, price):
+        '''Reprice a peg group: O(1) relinking plus a price lookup, whatever the size of the group.
+
+        Without a limit price its members are reserved at the group's price, so the
+        notional of each account in the group moves with it.
+        '''
+        if price == group.price:
+            return
+        old_price = group.price
+        self.remove_group(group)
+        self.insert_group(group, price)
+        for account, quantity in group.reserved.items():
+            self.reserved[account][1] += quantity * (price - old_price)
+
+    def best_unpegged_price(self, reverse=False):
+        '''Best price holding an order that is not pegged (the highest if reverse), None if there is none.
+
+        Peg references are taken from these prices so that moving peg groups
+        never changes a reference, which keeps repricing from cascading.
+        '''
+        if not self.peg_groups:
+            return self.max_price() if reverse else self.min_price()
+        prices = reversed(self.prices) if reverse else iter(self.prices)
+        for price in prices:
+            node = self.price_map[price].head_order
+            while node is not None:
+                if not isinstance(node, PegGroup):
+                    return price
+                node = node.next_order
+        return None
+
+    def remove_pegged_order(self, order):
+        group = order.peg_group
+        self.num_orders -= 1
+        self.volume -= order.quantity
+        self.reserve(order, -order.total_quantity)
+        price = group.price
+        del self.order_map[order.order_id]
+        self.version += 1
+        if len(group) == 1:
+            # Last member: take the group out of the book first so the level loses its quantity
+            del self.peg_groups[group.key]
+            self.remove_group(group)
+            group.orders.remove_order(order)
+        else:
+            group.orders.remove_order(order)
+            self.level_changed(price, -order.quantity)
 
     def remove_order_by_id(self, order_id):
+        if self.order_map[order_id].peg_group is not None:
+            return self.remove_pegged_order(self.order_map[order_id])
         self.num_orders -= 1
         order = self.order_map[order_id]
         self.volume -= order.quantity
+        self.reserve(order, -order.total_quantity)
         order.order_list.remove_order(order)
-        if len(order.order_list) == 0:
+        removed = len(order.order_list) == 0
+        if removed:
             self.remove_price(order.price)
         del self.order_map[order_id]
+        self.version += 1
+        self.level_changed(order.price, -order.quantity, removed=removed)
+
+    def reserve(self, order, delta):
+        '''Move the quantity an account has resting in this tree by delta, and its notional.
+
+        Pegged orders count at their limit price, or without one at their group's
+        price, moved along with the group by move_group.
+        '''
+        if order.account is None or not delta:
+            return
+        key = order.account.lower()
+        group = order.peg_group
+        price = group.limit_price if group is not None and group.limit_price is not None else order.price
+        reserved = self.reserved.get(key)
+        if reserved is None:
+            reserved = self.reserved[key] = [0, 0]
+        reserved[0] += delta
+        reserved[1] += delta * price
+        if reserved[0] <= 0:
+            del self.reserved[key]
+        if group is not None and group.limit_price is None:
+            quantity = group.reserved.get(key, 0) + delta
+            if quantity > 0:
+                group.reserved[key] = quantity
+            else:
+                group.reserved.pop(key, None)
+
+    def reserved_by(self, account):
+        '''(quantity, notional) the account has resting in this tree.'''
+        reserved = self.reserved.get(account.lower()) if account is not None else None
+        return tuple(reserved) if reserved is not None else (0, 0)
+
+    def level_changed(self, price, delta_volume, created=False, removed=False):
+        '''Tell listeners that the volume at price moved by delta_volume.
+
+        created / removed flag a price level that was just added to or deleted from the tree.
+        '''
+        for listener in self.listeners:
+            listener(price, delta_volume, created, removed)
 
     def max_price(self):
         if self.depth > 0:
@@ -99,3 +268,72 @@ class OrderTree(object):
             return self.get_price_list(self.min_price())
         else:
             return None
+
+    def cumulative_depth(self, reverse=False):
+        '''Prefix sums of volume and notional over the price levels.
+
+        Levels are in ascending price order, or descending when reverse is True
+        (best first for bids). Returns (prices, cumulative volume, cumulative
+        notional). The sums are rebuilt lazily, at most once per tree version.
+        '''
+        cached = self.depth_cache.get(reverse)
+        if cached is not None and cached[0] == self.version:
+            return cached[1:]
+        prices = list(reversed(self.prices)) if reverse else list(self.prices)
+        cumulative_volume = []
+        cumulative_notional = []
+        volume = 0
+        notional = 0
+        for price in prices:
+            level_volume = self.price_map[price].volume
+            volume += level_volume
+            notional += price * level_volume
+            cumulative_volume.append(volume)
+            cumulative_notional.append(notional)
+        self.depth_cache[reverse] = (self.version, prices, cumulative_volume, cumulative_notional)
+        return prices, cumulative_volume, cumulative_notional
+
+    def total_volume_at(self, price):
+        '''Everything the orders at price still have to trade: their displayed volume plus iceberg reserves.'''
+        return sum(order.total_quantity for order in level_orders(self.price_map[price]))
+
+    def levels_within(self, price, reverse=False):
+        '''Number of levels, counted from the best end, that are at or better than price.'''
+        if reverse:
+            return self.depth - self.price_map.bisect_left(price)
+        return self.price_map.bisect_right(price)
+
+    def estimate_fill(self, quantity, reverse=False, limit_price=None):
+        '''Walk-free estimate of taking `quantity` from this tree, best levels first.
+
+        Uses a binary search over the cumulative volume instead of iterating
+        over the levels. Returns None when the tree has no eligible liquidity.
+        '''
+        prices, cumulative_volume, cumulative_notional = self.cumulative_depth(reverse)
+        levels = len(prices)
+        if limit_price is not None:
+            levels = self.levels_within(limit_price, reverse)
+        if levels == 0 or quantity <= 0:
+            return None
+        index = bisect_left(cumulative_volume, quantity, 0, levels)
+        if index >= levels:
+            # Not enough volume: the order would sweep every eligible level
+            index = levels - 1
+            filled = cumulative_volume[index]
+            notional = cumulative_notional[index]
+        else:
+            filled = quantity
+            if index > 0:
+                # Full levels before index, then the remainder at the last level touched
+                notional = cumulative_notional[index - 1] + (quantity - cumulative_volume[index - 1]) * prices[index]
+            else:
+                notional = quantity * prices[index]
+        return {
+            "quantity": quantity,
+            "filled": filled,
+            "notional": notional,
+            "vwap": notional / filled,
+            "worst_price": prices[index],
+            "levels": index + 1,
+            "complete": filled >= quantity,
+        }
@@ -0,0 +1,125 @@
+from .order import Order
+from .orderlist import OrderList
+
+PEG_REFERENCES = ("best_bid", "best_ask", "mid")
+
+
+class PegGroup(object):
+    '''
+    The pegged orders of one side sharing a reference, offset and limit price.
+
+    A group rests in its price level's OrderList as a single node in place of
+    its members (it has the next_order / prev_order / quantity / queue_seq an
+    OrderList needs), with quantity the total of its members. The members are
+    kept in time priority in their own PegOrderList, so repricing moves the
+    whole group with one unlink and one append, however many orders it holds.
+    '''
+
+    def __init__(self, side, reference, offset, limit_price=None):
+        self.side = side
+        self.reference = reference # one of PEG_REFERENCES
+        self.offset = offset # added to the reference price
+        self.limit_price = limit_price # bids never rest above it, asks never below it
+        self.orders = PegOrderList(self)
+        self.price = None # price of the level the group rests at
+        self.quantity = 0
+        self.reserved = {} # account (lower case) : quantity its members reserve at the group's price, without a limit price
+        # node in the OrderList of its price level
+        self.next_order = None
+        self.prev_order = None
+        self.order_list = None
+        self.queue_seq = None
+
+    @property
+    def key(self):
+        return (self.reference, self.offset, self.limit_price)
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __str__(self):
+        return "peg {}{:+} x{} - {}@{}".format(self.reference, self.offset, len(self),
+                                              self.quantity, self.price)
+
+
+class PegOrderList(OrderList):
+    '''
+    The members of a PegGroup in time priority. Every change to their volume or
+    number is passed on to the group's node in its price level, so the level's
+    volume and queue index stay exact without visiting the other members.
+    '''
+
+    def __init__(self, group):
+        OrderList.__init__(self)
+        self.group = group
+
+    def propagate(self, delta, count):
+        group = self.group
+        group.quantity += delta
+        level = group.order_list
+        if level is not None:
+            level.quantity_changed(group, delta)
+            level.order_count += count
+
+    def append_order(self, order):
+        OrderList.append_order(self, order)
+        self.propagate(order.quantity, 1)
+
+    def remove_order(self, order):
+        OrderList.remove_order(self, order)
+        self.propagate(-order.quantity, -1)
+
+    def quantity_changed(self, order, delta):
+        OrderList.quantity_changed(self, order, delta)
+        self.propagate(delta, 0)
+
+    def move_to_tail(self, order):
+        OrderList.move_to_tail(self, order)
+        if self.group.order_list is not None:
+            self.group.order_list.version += 1 # member order changed within the level
+
+
+class PeggedOrder(Order):
+    '''An Order whose price is always the price its PegGroup rests at.'''
+
+    def __init__(self, quote, group):
+        Order.__init__(self, quote, group.orders)
+        self.peg_group = group
+
+    @property
+    def price(self):
+        return self.peg_group.price
+
+    @price.setter
+    def price(self, price):
+        pass # set through the group
+
+    def to_quote(self):
+        quote = Order.to_quote(self)
+        group = self.peg_group
+        quote['peg_reference'] = group.reference
+        quote['peg_offset'] = str(group.offset)
+        quote['peg_limit'] = str(group.limit_price) if group.limit_price is not None else None
+        return quote
+
+
+def first_order(order_list):
+    '''The Order at the front of a price level, looking through a peg group resting there.'''
+    order = order_list.head_order
+    if isinstance(order, PegGroup):
+        order = order.orders.head_order
+    return order
+
+
+def level_orders(order_list):
+    '''Every Order of a price level in priority order, expanding peg groups into their members.'''
+    node = order_list.head_order
+    while node is not None:
+        if isinstance(node, PegGroup):
+            order = node.orders.head_order
+            while order is not None:
+                yield order
+                order = order.next_order
+        else:
+            yield node
+        node = node.next_order
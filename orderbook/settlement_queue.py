@@ -0,0 +1,340 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+QUEUED = "queued"
+SETTLING = "settling"
+SETTLED = "settled"
+FAILED = "failed"
+RETRYING = "retrying"
+
+
+def without_keys(trades: List[dict]) -> List[dict]:
+    """Converted trades as stored: each party without its signing key (the fifth field)"""
+    return [
+        dict(trade, party1=trade["party1"][:4], party2=trade["party2"][:4]) for trade in trades
+    ]
+
+
+def result_without_keys(result: Optional[dict]) -> Optional[dict]:
+    """A settlement result as stored: the fills of its unconfirmed transfers without keys"""
+    if not result or not result.get("unconfirmed"):
+        return result
+    unconfirmed = [
+        dict(entry, trades=without_keys(entry["trades"])) for entry in result["unconfirmed"]
+    ]
+    return dict(result, unconfirmed=unconfirmed)
+
+
+class SettlementQueue:
+    """Durable local queue of matched trades waiting for on-chain settlement.
+
+    Each enqueue stores the trades of one order (or auction batch) as a
+    settlement with its own id, in a SQLite file so nothing matched is lost
+    across restarts. Workers claim queued settlements, settle them and record
+    the outcome; settlements a crashed worker had claimed are queued again by
+    recover(). A settlement that failed transiently waits as retrying until
+    its backoff is over; trades that cannot be settled are moved to a
+    dead-letter table, from which replay() queues them again. Trades are
+    stored without the parties' signing keys (see without_keys), which the
+    workers look up again when they settle them.
+
+    One connection is shared by the event loop and the threadpool serving
+    the synchronous endpoints, every statement under one lock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS settlements (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                status TEXT NOT NULL,
+                base_asset TEXT NOT NULL,
+                quote_asset TEXT NOT NULL,
+                trades TEXT NOT NULL,
+                result TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                not_before INTEGER NOT NULL DEFAULT 0,
+                created INTEGER NOT NULL,
+                updated INTEGER NOT NULL
+            )
+            """
+        )
+        columns = [row["name"] for row in self.db.execute("PRAGMA table_info(settlements)")]
+        if "not_before" not in columns:
+            # Queue file of an earlier version
+            self.db.execute(
+                "ALTER TABLE settlements ADD COLUMN not_before INTEGER NOT NULL DEFAULT 0"
+            )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS settlements_status ON settlements (status, id)"
+        )
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                settlement_id INTEGER NOT NULL,
+                base_asset TEXT NOT NULL,
+                quote_asset TEXT NOT NULL,
+                trades TEXT NOT NULL,
+                error TEXT,
+                attempts INTEGER NOT NULL,
+                replayed_as INTEGER,
+                created INTEGER NOT NULL,
+                sent TEXT
+            )
+            """
+        )
+        columns = [row["name"] for row in self.db.execute("PRAGMA table_info(dead_letters)")]
+        if "sent" not in columns:
+            self.db.execute("ALTER TABLE dead_letters ADD COLUMN sent TEXT")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] < 1:
+            # Earlier versions stored the signing keys with the trades
+            self._drop_stored_keys()
+            self.db.execute("PRAGMA user_version = 1")
+
+    def _drop_stored_keys(self):
+        rows = self.db.execute("SELECT id, trades FROM dead_letters").fetchall()
+        self.db.executemany(
+            "UPDATE dead_letters SET trades = ? WHERE id = ?",
+            [(json.dumps(without_keys(json.loads(row["trades"]))), row["id"]) for row in rows],
+        )
+        rows = self.db.execute("SELECT id, trades, result FROM settlements").fetchall()
+        self.db.executemany(
+            "UPDATE settlements SET trades = ?, result = ? WHERE id = ?",
+            [
+                (json.dumps(without_keys(json.loads(row["trades"]))),
+                 json.dumps(result_without_keys(json.loads(row["result"]))) if row["result"] else None,
+                 row["id"])
+                for row in rows
+            ],
+        )
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def enqueue(self, trades: List[dict], base_asset: str, quote_asset: str) -> int:
+        """Queue converted trades for settlement, returns the settlement id"""
+        now = int(time.time() * 1000)
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT INTO settlements (status, base_asset, quote_asset, trades, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (QUEUED, base_asset, quote_asset, json.dumps(without_keys(trades)), now, now),
+            )
+            return cursor.lastrowid
+
+    def claim(self, limit: int, retry_limit: int = 0) -> List[dict]:
+        """Mark up to limit settlements as settling and return them.
+
+        At most retry_limit of them are retries whose backoff is over, longest
+        due first; the rest are queued settlements, oldest first.
+        """
+        now = int(time.time() * 1000)
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.db.execute(
+                    "SELECT * FROM settlements WHERE status = ? AND not_before <= ?"
+                    " ORDER BY not_before LIMIT ?",
+                    (RETRYING, now, min(retry_limit, limit)),
+                ).fetchall()
+                rows += self.db.execute(
+                    "SELECT * FROM settlements WHERE status = ? ORDER BY id LIMIT ?",
+                    (QUEUED, limit - len(rows)),
+                ).fetchall()
+                self.db.executemany(
+                    "UPDATE settlements SET status = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                    [(SETTLING, now, row["id"]) for row in rows],
+                )
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return [self._to_dict(row, SETTLING) for row in rows]
+
+    def complete(
+        self, settlement_id: int, status: str, result: dict, dead_letters: List[dict] = ()
+    ):
+        """Record the outcome (SETTLED or FAILED) of a claimed settlement.
+
+        dead_letters ({"trades", "error"} each, and "sent" if they went out in a
+        transaction never seen confirmed) are its trades given up on.
+        """
+        now = int(time.time() * 1000)
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.execute(
+                    "UPDATE settlements SET status = ?, result = ?, updated = ? WHERE id = ?",
+                    (status, json.dumps(result_without_keys(result)), now, settlement_id),
+                )
+                self._dead_letter(settlement_id, dead_letters, now)
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def retry(
+        self,
+        settlement_id: int,
+        trades: List[dict],
+        result: dict,
+        delay: float,
+        dead_letters: List[dict] = (),
+    ):
+        """Try the unsettled trades of a claimed settlement again after delay seconds.
+
+        dead_letters ({"trades", "error"} each, and "sent" if they went out in a
+        transaction never seen confirmed) are its trades given up on.
+        """
+        now = int(time.time() * 1000)
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.execute(
+                    "UPDATE settlements SET status = ?, trades = ?, result = ?, not_before = ?,"
+                    " updated = ? WHERE id = ?",
+                    (RETRYING, json.dumps(without_keys(trades)), json.dumps(result_without_keys(result)),
+                     now + int(delay * 1000), now, settlement_id),
+                )
+                self._dead_letter(settlement_id, dead_letters, now)
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def _dead_letter(self, settlement_id: int, dead_letters: List[dict], now: int):
+        if not dead_letters:
+            return
+        row = self.db.execute(
+            "SELECT base_asset, quote_asset, attempts FROM settlements WHERE id = ?",
+            (settlement_id,),
+        ).fetchone()
+        self.db.executemany(
+            "INSERT INTO dead_letters (settlement_id, base_asset, quote_asset, trades, error,"
+            " attempts, created, sent) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (settlement_id, row["base_asset"], row["quote_asset"],
+                 json.dumps(without_keys(dead_letter["trades"])), dead_letter["error"], row["attempts"], now,
+                 json.dumps(dead_letter["sent"]) if dead_letter.get("sent") is not None else None)
+                for dead_letter in dead_letters
+            ],
+        )
+
+    def dead_letters(self, limit: int = 100, replayed: bool = False) -> List[dict]:
+        """Dead letters not replayed yet (or all of them), newest first"""
+        query = "SELECT * FROM dead_letters"
+        if not replayed:
+            query += " WHERE replayed_as IS NULL"
+        with self.lock:
+            rows = self.db.execute(query + " ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [self._dead_letter_to_dict(row) for row in rows]
+
+    def get_dead_letter(self, dead_letter_id: int) -> Optional[dict]:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT * FROM dead_letters WHERE id = ?", (dead_letter_id,)
+            ).fetchone()
+        return self._dead_letter_to_dict(row) if row is not None else None
+
+    def replay(self, dead_letter_id: int) -> Optional[int]:
+        """Queue the trades of a dead letter as a new settlement, returns its id.
+
+        None if there is no such dead letter or it was replayed already. A dead
+        letter with "sent" went out in a transaction that may yet be mined; the
+        caller has to find it dropped or reverted before replaying it.
+        """
+        now = int(time.time() * 1000)
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute(
+                    "SELECT * FROM dead_letters WHERE id = ? AND replayed_as IS NULL",
+                    (dead_letter_id,),
+                ).fetchone()
+                settlement_id = None
+                if row is not None:
+                    settlement_id = self.db.execute(
+                        "INSERT INTO settlements (status, base_asset, quote_asset, trades, created, updated)"
+                        " VALUES (?, ?, ?, ?, ?, ?)",
+                        (QUEUED, row["base_asset"], row["quote_asset"], row["trades"], now, now),
+                    ).lastrowid
+                    self.db.execute(
+                        "UPDATE dead_letters SET replayed_as = ? WHERE id = ?",
+                        (settlement_id, dead_letter_id),
+                    )
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return settlement_id
+
+    def recover(self) -> int:
+        """Queue again the settlements left settling by a previous run, returns how many"""
+        with self.lock:
+            cursor = self.db.execute(
+                "UPDATE settlements SET status = ?, updated = ? WHERE status = ?",
+                (QUEUED, int(time.time() * 1000), SETTLING),
+            )
+            return cursor.rowcount
+
+    def get(self, settlement_id: int) -> Optional[dict]:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT * FROM settlements WHERE id = ?", (settlement_id,)
+            ).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def counts(self) -> Dict[str, int]:
+        """Number of settlements in each status, and of dead letters not replayed yet"""
+        counts = {QUEUED: 0, SETTLING: 0, RETRYING: 0, SETTLED: 0, FAILED: 0}
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT status, COUNT(*) FROM settlements GROUP BY status"
+            ).fetchall()
+            dead_letters = self.db.execute(
+                "SELECT COUNT(*) FROM dead_letters WHERE replayed_as IS NULL"
+            ).fetchone()[0]
+        for status, count in rows:
+            counts[status] = count
+        counts["deadLetters"] = dead_letters
+        return counts
+
+    @staticmethod
+    def _to_dict(row, status: str = None) -> dict:
+        return {
+            "id": row["id"],
+            "status": status or row["status"],
+            "baseAsset": row["base_asset"],
+            "quoteAsset": row["quote_asset"],
+            "trades": json.loads(row["trades"]),
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "attempts": row["attempts"] + (1 if status == SETTLING else 0),
+            "notBefore": row["not_before"] or None,
+            "created": row["created"],
+            "updated": row["updated"],
+        }
+
+    @staticmethod
+    def _dead_letter_to_dict(row) -> dict:
+        return {
+            "id": row["id"],
+            "settlementId": row["settlement_id"],
+            "baseAsset": row["base_asset"],
+            "quoteAsset": row["quote_asset"],
+            "trades": json.loads(row["trades"]),
+            "error": row["error"],
+            "attempts": row["attempts"],
+            "replayedAs": row["replayed_as"],
+            "created": row["created"],
+            "sent": json.loads(row["sent"]) if row["sent"] else None,
+        }
@@ -0,0 +1,90 @@
+import random
+from typing import Optional
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+UNKNOWN = "unknown"
+
+# Failures that settle nothing however often they are retried: the contract (or its
+# simulation) rejected the trade, or the trade itself is malformed
+PERMANENT_ERRORS = (
+    "revert",
+    "unknown format",  # not an address
+    "must be a hex string",
+    "checksum",
+    "non-hexadecimal",
+    "odd-length",
+    "no private key",
+)
+
+# Failures after a transaction went out: it may still be mined, so its fills are not
+# signed again until its receipt or the parties' nonces show what became of it
+UNKNOWN_ERRORS = (
+    "not confirmed",
+    "outcome unknown",
+)
+
+
+class RetryPolicy:
+    """When and how soon a failed settlement is tried again.
+
+    Errors are classified by their message: a transaction sent but not seen
+    confirmed is unknown, contract reverts and malformed trades are
+    permanent, anything else (RPC timeouts and connection errors before
+    sending, nonce races, a missing client) is transient. Transient failures
+    are retried, and unknown ones checked again, after an exponential
+    backoff with full jitter, base_delay * 2 ** (attempts - 1) capped at
+    max_delay, until max_attempts attempts were made. Of every claim of `limit`
+    settlements, at most `budget` of it goes to retries, so a burst of
+    failures never holds up newly matched trades.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        base_delay: float = 1,
+        max_delay: float = 300,
+        budget: float = 0.25,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.retried = 0
+        self.dead_lettered = 0
+        self.errors = {TRANSIENT: 0, PERMANENT: 0, UNKNOWN: 0}
+
+    @staticmethod
+    def classify(error: Optional[str]) -> str:
+        message = (error or "").lower()
+        if any(pattern in message for pattern in UNKNOWN_ERRORS):
+            return UNKNOWN
+        if any(pattern in message for pattern in PERMANENT_ERRORS):
+            return PERMANENT
+        return TRANSIENT
+
+    def should_retry(self, error: Optional[str], attempts: int) -> bool:
+        """Whether a failure after `attempts` attempts is tried again, counting it"""
+        kind = self.classify(error)
+        self.errors[kind] += 1
+        return kind != PERMANENT and attempts < self.max_attempts
+
+    def delay(self, attempts: int) -> float:
+        """Seconds to wait before the next attempt, after `attempts` attempts"""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** max(attempts - 1, 0))
+        return random.uniform(0, ceiling)
+
+    def retry_limit(self, limit: int) -> int:
+        """Retries claimed at most alongside a claim of `limit` settlements"""
+        return max(1, int(limit * self.budget))
+
+    def stats(self) -> dict:
+        return {
+            "maxAttempts": self.max_attempts,
+            "budget": self.budget,
+            "retried": self.retried,
+            "deadLettered": self.dead_lettered,
+            "transientErrors": self.errors[TRANSIENT],
+            "permanentErrors": self.errors[PERMANENT],
+            "unknownErrors": self.errors[UNKNOWN],
+        }
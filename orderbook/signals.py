@@ -0,0 +1,123 @@
+from decimal import Decimal
+
+
+class DepthWindow(object):
+    '''
+    Running volume and notional over the best `levels` price levels of one OrderTree.
+
+    Updated from the tree's level change notifications: a change inside the
+    window adjusts the sums by its delta, and a level created or removed inside
+    the window pushes out or pulls in the level at the window boundary, which
+    is found with a single O(log n) index lookup. The levels themselves are
+    never rescanned.
+    '''
+
+    def __init__(self, tree, reverse, levels=5):
+        self.tree = tree
+        self.reverse = reverse # True for bids, so rank 0 is the highest price
+        self.levels = levels
+        self.volume = Decimal(0)
+        self.notional = Decimal(0)
+
+    def price_at(self, rank):
+        prices = self.tree.prices
+        return prices[-1 - rank] if self.reverse else prices[rank]
+
+    def rank(self, price, removed=False):
+        '''Rank of price counted from the best level. For a removed level, the rank it had.'''
+        index = self.tree.price_map.bisect_left(price)
+        if not self.reverse:
+            return index
+        depth = self.tree.depth + 1 if removed else self.tree.depth
+        return depth - 1 - index
+
+    def on_level_change(self, price, delta_volume, created, removed):
+        rank = self.rank(price, removed)
+        if rank >= self.levels:
+            return
+        self.volume += delta_volume
+        self.notional += price * delta_volume
+        if created and self.tree.depth > self.levels:
+            # The level that was last in the window has been pushed out
+            pushed_out = self.price_at(self.levels)
+            pushed_volume = self.tree.price_map[pushed_out].volume
+            self.volume -= pushed_volume
+            self.notional -= pushed_out * pushed_volume
+        elif removed and self.tree.depth >= self.levels:
+            # The level just outside the window moves in
+            pulled_in = self.price_at(self.levels - 1)
+            pulled_volume = self.tree.price_map[pulled_in].volume
+            self.volume += pulled_volume
+            self.notional += pulled_in * pulled_volume
+
+    def vwap(self):
+        return self.notional / self.volume if self.volume else None
+
+
+class BookSignals(object):
+    '''
+    Microstructure signals for an OrderBook: spread, mid, top-of-book
+    imbalance, microprice and a depth weighted mid over `levels` levels.
+
+    Top-of-book values are read straight from the trees in O(1); the depth
+    weighted values come from DepthWindows kept up to date by the trees'
+    level change notifications.
+    '''
+
+    def __init__(self, bids, asks, levels=5):
+        self.bids = bids
+        self.asks = asks
+        self.levels = levels
+        self.bid_window = DepthWindow(bids, reverse=True, levels=levels)
+        self.ask_window = DepthWindow(asks, reverse=False, levels=levels)
+        bids.listeners.append(self.bid_window.on_level_change)
+        asks.listeners.append(self.ask_window.on_level_change)
+
+    def compute(self):
+        '''Current signal values as Decimals (None where a side is empty).'''
+        best_bid = self.bids.max_price()
+        best_ask = self.asks.min_price()
+        bid_size = self.bids.price_map[best_bid].volume if best_bid is not None else None
+        ask_size = self.asks.price_map[best_ask].volume if best_ask is not None else None
+        signals = {
+            "best_bid": best_bid,
+            "best_ask": best_ask,
+            "bid_size": bid_size,
+            "ask_size": ask_size,
+            "spread": None,
+            "mid": None,
+            "microprice": None,
+            "imbalance": None,
+            "weighted_mid": None,
+            "depth_imbalance": None,
+            "levels": self.levels,
+        }
+        if best_bid is None or best_ask is None:
+            return signals
+
+        signals["spread"] = best_ask - best_bid
+        signals["mid"] = (best_bid + best_ask) / 2
+        top_volume = bid_size + ask_size
+        if top_volume:
+            # Microprice leans towards the side with less resting size
+            signals["microprice"] = (best_bid * ask_size + best_ask * bid_size) / top_volume
+            signals["imbalance"] = (bid_size - ask_size) / top_volume
+
+        bid_volume = self.bid_window.volume
+        ask_volume = self.ask_window.volume
+        depth_volume = bid_volume + ask_volume
+        if bid_volume and ask_volume:
+            # Same weighting as the microprice, applied to each side's VWAP over the window
+            signals["weighted_mid"] = (
+                self.bid_window.vwap() * ask_volume + self.ask_window.vwap() * bid_volume
+            ) / depth_volume
+        if depth_volume:
+            signals["depth_imbalance"] = (bid_volume - ask_volume) / depth_volume
+        return signals
+
+    def to_dict(self):
+        '''compute() with values converted to floats, for JSON responses and the delta feed.'''
+        return dict(
+            (key, float(value) if isinstance(value, Decimal) else value)
+            for key, value in self.compute().items()
+        )
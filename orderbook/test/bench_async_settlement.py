@@ -0,0 +1,121 @@
+"""
+Order entry validation under concurrent load: TradeSettlementClient vs AsyncTradeSettlementClient.
+
+Starts a local mock JSON-RPC node that answers every call after RPC_LATENCY seconds, then
+validates CONCURRENCY orders at once the way register_order did (allowance and balance
+check for each) with both clients, and the way it does now through the async client's
+AllowanceCache, while a probe coroutine measures how long the event loop is kept from
+running anything else. The RPC calls the mock answered are counted for each.
+
+    python -m orderbook.test.bench_async_settlement
+"""
+import asyncio
+import threading
+import time
+
+from aiohttp import web
+
+from orderbook.trade_settlement_client import (
+    create_async_settlement_client,
+    create_settlement_client,
+)
+
+RPC_PORT = 8546
+RPC_LATENCY = 0.02  # seconds per RPC call
+CONCURRENCY = 50
+
+CONTRACT = "0xF14dbF48b727AD8346dD8Fa6C0FC42FCb81FF115"
+USER = "0xf39Fd6e51aad88F6F4ce6aB8827279cffFb92367"
+TOKEN = "0x54099052D0e04a5CF24e4c7c82eA693Fb25E0Bed"
+AMOUNT = 10**18
+
+rpc_calls = 0
+
+
+async def handle_rpc(request):
+    global rpc_calls
+    payload = await request.json()
+    await asyncio.sleep(RPC_LATENCY)
+
+    def answer(call):
+        global rpc_calls
+        rpc_calls += 1
+        if call["method"] in ("eth_chainId", "eth_blockNumber"):
+            result = "0x1"
+        elif call["method"] == "eth_getLogs":
+            result = []
+        elif call["method"] == "eth_call":
+            # (bool sufficient, uint256 amount) = (true, 10**24)
+            result = "0x" + (1).to_bytes(32, "big").hex() + (10**24).to_bytes(32, "big").hex()
+        else:
+            result = "0x0"
+        return {"jsonrpc": "2.0", "id": call["id"], "result": result}
+
+    if isinstance(payload, list):
+        return web.json_response([answer(call) for call in payload])
+    return web.json_response(answer(payload))
+
+
+def start_mock_rpc():
+    loop = asyncio.new_event_loop()
+    app = web.Application()
+    app.router.add_post("/", handle_rpc)
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", RPC_PORT).start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+
+async def probe_loop_lag(stop, lags):
+    """Worst delay of a 1ms timer, i.e. how long other requests would have waited"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - start - 0.001)
+
+
+async def run(name, validate):
+    stop = asyncio.Event()
+    lags = []
+    probe = asyncio.create_task(probe_loop_lag(stop, lags))
+    await asyncio.sleep(0.01)
+    calls = rpc_calls
+    start = time.perf_counter()
+    await asyncio.gather(*[validate() for _ in range(CONCURRENCY)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+    print(
+        f"{name:>6}: {CONCURRENCY} validations in {elapsed * 1000:8.1f} ms, "
+        f"worst event loop stall {max(lags) * 1000:8.1f} ms, {rpc_calls - calls:4d} RPC calls"
+    )
+
+
+async def main():
+    url = f"http://127.0.0.1:{RPC_PORT}"
+    sync_client = create_settlement_client(url, CONTRACT)
+    async_client = create_async_settlement_client(url, CONTRACT)
+
+    async def validate_sync():
+        sync_client.check_allowance(USER, TOKEN, AMOUNT)
+        sync_client.check_balance(USER, TOKEN, AMOUNT)
+
+    async def validate_async():
+        await async_client.check_allowance_and_balance(USER, TOKEN, AMOUNT)
+
+    async def validate_cached():
+        allowance, balance = await async_client.allowances.get(USER, TOKEN)
+        return allowance >= AMOUNT and balance >= AMOUNT
+
+    # Warm up connections and cached chain data
+    await validate_sync()
+    await validate_async()
+
+    await run("sync", validate_sync)
+    await run("async", validate_async)
+    await run("cached", validate_cached)
+
+
+if __name__ == "__main__":
+    start_mock_rpc()
+    asyncio.run(main())
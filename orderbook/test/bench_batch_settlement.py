@@ -0,0 +1,373 @@
+"""
+Settling trades one transaction each vs batched through an aggregate3 batcher contract.
+
+Starts a local stand-in for an EVM node that executes settleTrade the way the settlement
+contract checks it (both parties' nonces per base token, counted up on success), directly
+or through aggregate3, mines each transaction BLOCK_TIME seconds after it was sent (in a block
+of its own), answers the contract's reads and ERC-20 allowance / balanceOf (directly or through
+Multicall3) and answers every call after RPC_LATENCY seconds. TRADES trades between a few accounts are then settled both ways, with
+REJECTED of them reverting on chain, and every other trade must end up settled exactly once.
+
+    python -m orderbook.test.bench_batch_settlement
+"""
+import asyncio
+import random
+import threading
+import time
+
+import rlp
+from aiohttp import web
+from eth_abi import encode
+from eth_account import Account
+from web3 import Web3
+
+from orderbook.trade_settlement_client import (
+    MULTICALL3_ABI,
+    MULTICALL3_AGGREGATE3_ABI,
+    AllowanceChecker,
+    TRADE_SETTLEMENT_ABI,
+    create_async_settlement_client,
+    event_topic,
+)
+
+RPC_PORT = 8547
+RPC_LATENCY = 0.02  # seconds per RPC call
+BLOCK_TIME = 0.1  # seconds until a sent transaction is mined
+BLOCK_GAS_LIMIT = 3000000
+GAS_PER_SETTLEMENT = 95000
+TRADES = 60
+REJECTED = 3  # trades whose settleTrade reverts, e.g. for a missing allowance
+ACCOUNTS = 6
+
+CONTRACT = "0xF14dbF48b727AD8346dD8Fa6C0FC42FCb81FF115"
+BATCHER = "0xcA11bde05977b3631167028862bE2a173976CA11"  # Multicall3, for batched settlement and reads
+TOKEN = "0x54099052D0e04a5CF24e4c7c82eA693Fb25E0Bed"
+QUOTE_TOKEN = "0x8eFcF5c2DDDA6C1A63D8395965Ca6c0609CE32D5"
+OPERATOR_KEY = "0x" + "11" * 32
+SIGNATURE = "0x" + "00" * 65  # the stand-in does not check signatures
+HOLDING = 10**24  # allowance and balance of every account in every token, unless set
+
+decoder = Web3()
+settlement_contract = decoder.eth.contract(address=CONTRACT, abi=TRADE_SETTLEMENT_ABI)
+batcher_contract = decoder.eth.contract(address=BATCHER, abi=MULTICALL3_AGGREGATE3_ABI)
+multicall_contract = decoder.eth.contract(address=BATCHER, abi=MULTICALL3_ABI)
+token_contract = decoder.eth.contract(address=TOKEN, abi=AllowanceChecker("http://127.0.0.1").erc20_abi)
+TRADE_SETTLED_TOPIC = event_topic(TRADE_SETTLEMENT_ABI, "TradeSettled")
+
+
+class Chain(object):
+    '''State of the stand-in node: the settlement contract's nonces and the mined transactions.'''
+
+    def __init__(self):
+        self.nonces = {} # (user, token) : nonce
+        self.settled = {} # trade id : times settled
+        self.holdings = {} # (user, token) : [allowance, balance], HOLDING each unless set
+        self.logs = [] # TradeSettled logs of the mined settlements
+        self.sender_nonces = {} # sender : next nonce, counting pending transactions
+        self.mined_nonces = {} # sender : next nonce, counting mined transactions only
+        self.block_number = 1
+        self.base_fee = 10**9
+        self.min_fee = 0 # transactions paying less per gas are not mined until replaced
+        self.pending = [] # (mined at, tx hash, transaction)
+        self.receipts = {}
+        self.transactions = 0
+        self.requests = 0 # HTTP requests, a batch of calls being one
+        self.rpc_calls = 0
+
+    def settle(self, nonces, settled, data):
+        '''Run one settleTrade call on the given state, returns an error or None.'''
+        _, args = settlement_contract.decode_function_input(data)
+        trade = args["tradeData"]
+        base_asset = trade["baseAsset"].lower()
+        if trade["tradeId"].startswith("reject"):
+            return "insufficient allowance"
+        for party, nonce in ((args["party1"], args["nonce1"]), (args["party2"], args["nonce2"])):
+            if nonces.get((party.lower(), base_asset), 0) != nonce:
+                return "invalid nonce"
+        for party in (args["party1"], args["party2"]):
+            key = (party.lower(), base_asset)
+            nonces[key] = nonces.get(key, 0) + 1
+        settled[trade["tradeId"]] = settled.get(trade["tradeId"], 0) + 1
+        return None
+
+    def execute(self, to, data, apply):
+        '''Run a transaction, returns (gas, error); its changes are kept only if apply and it succeeds.'''
+        nonces = dict(self.nonces)
+        settled = dict(self.settled)
+        if to.lower() == BATCHER.lower():
+            _, args = batcher_contract.decode_function_input(data)
+            calls = [call["callData"] for call in args["calls"]]
+            gas = 21000 + 10000
+        else:
+            calls = [data]
+            gas = 21000
+        for call in calls:
+            error = self.settle(nonces, settled, call)
+            if error is not None:
+                return gas, error
+            gas += GAS_PER_SETTLEMENT
+        if apply:
+            self.nonces = nonces
+            self.settled = settled
+            self.logs += [self.trade_settled_log(call) for call in calls]
+        return gas, None
+
+    def call(self, to, data):
+        '''Return data of a view call: the settlement contract's reads, Multicall3 or an ERC-20.'''
+        if to.lower() == BATCHER.lower():
+            function, args = multicall_contract.decode_function_input(data)
+            if function.fn_name == "getBlockNumber":
+                return encode(["uint256"], [self.block_number])
+            results = []
+            for call in args["calls"]:
+                try:
+                    results.append((True, self.call(call["target"], call["callData"])))
+                except Exception:
+                    if not call["allowFailure"]:
+                        raise
+                    results.append((False, b""))
+            return encode(["(bool,bytes)[]"], [results])
+        if to.lower() not in (CONTRACT.lower(), TOKEN.lower(), QUOTE_TOKEN.lower()):
+            return b""  # no code there
+        if to.lower() != CONTRACT.lower():
+            function, args = token_contract.decode_function_input(data)
+            owner = args["owner"] if function.fn_name == "allowance" else args["account"]
+            allowance, balance = self.holdings.get((owner.lower(), to.lower()), (HOLDING, HOLDING))
+            return encode(["uint256"], [allowance if function.fn_name == "allowance" else balance])
+        function, args = settlement_contract.decode_function_input(data)
+        key = (args["user"].lower(), args["token"].lower())
+        if function.fn_name == "getUserNonce":
+            return encode(["uint256"], [self.nonces.get(key, 0)])
+        allowance, balance = self.holdings.get(key, (HOLDING, HOLDING))
+        amount = allowance if function.fn_name == "checkAllowance" else balance
+        return encode(["bool", "uint256"], [amount >= args["requiredAmount"], amount])
+
+    def trade_settled_log(self, data):
+        _, args = settlement_contract.decode_function_input(data)
+        trade = args["tradeData"]
+        return {
+            "address": CONTRACT,
+            "topics": [TRADE_SETTLED_TOPIC] + ["0x" + "00" * 12 + address[2:].lower() for address in (
+                args["party1"], args["party2"], trade["baseAsset"])],
+            "data": "0x" + encode(["address", "uint256", "uint256", "uint256"], [
+                trade["quoteAsset"], trade["price"], trade["quantity"], trade["timestamp"]]).hex(),
+            "blockNumber": hex(self.block_number),
+            "blockHash": "0x" + self.block_number.to_bytes(32, "big").hex(),
+            "transactionHash": "0x" + "00" * 32,
+            "transactionIndex": "0x0",
+            "logIndex": "0x0",
+            "removed": False,
+        }
+
+    def mine(self):
+        now = time.monotonic()
+        for entry in list(self.pending):
+            _, tx_hash, transaction = entry
+            if entry[0] > now or transaction["fee"] < self.min_fee:
+                continue
+            self.pending.remove(entry)
+            self.block_number += 1
+            sender = transaction["from"].lower()
+            self.mined_nonces[sender] = max(self.mined_nonces.get(sender, 0), transaction["nonce"] + 1)
+            gas, error = self.execute(transaction["to"], transaction["data"], True)
+            self.receipts[tx_hash] = {
+                "transactionHash": tx_hash,
+                "transactionIndex": "0x0",
+                "blockHash": "0x" + self.block_number.to_bytes(32, "big").hex(),
+                "blockNumber": hex(self.block_number),
+                "from": transaction["from"],
+                "to": transaction["to"],
+                "cumulativeGasUsed": hex(gas),
+                "gasUsed": hex(gas),
+                "effectiveGasPrice": hex(20 * 10**9),
+                "contractAddress": None,
+                "logs": [],
+                "logsBloom": "0x" + "00" * 256,
+                "status": "0x0" if error else "0x1",
+                "type": "0x0",
+            }
+
+    def answer(self, call):
+        self.rpc_calls += 1
+        self.mine()
+        method, params = call["method"], call.get("params", [])
+        result = None
+        if method == "eth_chainId":
+            result = "0x1"
+        elif method == "eth_blockNumber":
+            result = hex(self.block_number)
+        elif method == "eth_getBlockByNumber":
+            result = {
+                "number": hex(self.block_number),
+                "hash": "0x" + self.block_number.to_bytes(32, "big").hex(),
+                "parentHash": "0x" + (self.block_number - 1).to_bytes(32, "big").hex(),
+                "gasLimit": hex(BLOCK_GAS_LIMIT),
+                "gasUsed": "0x0",
+                "timestamp": hex(int(time.time())),
+                "baseFeePerGas": hex(10**9),
+                "transactions": [],
+            }
+        elif method == "eth_feeHistory":
+            blocks = int(params[0], 16) if isinstance(params[0], str) else params[0]
+            result = {
+                "oldestBlock": hex(max(self.block_number - blocks + 1, 0)),
+                "baseFeePerGas": [hex(self.base_fee)] * (blocks + 1),
+                "gasUsedRatio": [0.5] * blocks,
+                "reward": [[hex(10**9)]] * blocks,
+            }
+        elif method == "eth_gasPrice":
+            result = hex(self.base_fee + 10**9)
+        elif method == "eth_call":
+            result = "0x" + self.call(params[0]["to"], bytes.fromhex(params[0]["data"][2:])).hex()
+        elif method == "eth_getCode":
+            deployed = (CONTRACT.lower(), BATCHER.lower(), TOKEN.lower(), QUOTE_TOKEN.lower())
+            result = "0x00" if params[0].lower() in deployed else "0x"
+        elif method == "eth_getLogs":
+            query = params[0]
+            addresses = query.get("address") or []
+            addresses = [address.lower() for address in (addresses if isinstance(addresses, list) else [addresses])]
+            first, last = int(query["fromBlock"], 16), int(query["toBlock"], 16)
+            result = [log for log in self.logs if first <= int(log["blockNumber"], 16) <= last
+                      and (not addresses or log["address"].lower() in addresses)]
+        elif method == "eth_estimateGas":
+            gas, error = self.execute(params[0]["to"], params[0]["data"], False)
+            if error is not None:
+                reason = "0x08c379a0" + encode(["string"], [error]).hex()
+                return {"jsonrpc": "2.0", "id": call["id"],
+                        "error": {"code": 3, "message": "execution reverted: " + error, "data": reason}}
+            result = hex(gas)
+        elif method == "eth_getTransactionCount":
+            counts = self.sender_nonces if params[1:] == ["pending"] else self.mined_nonces
+            result = hex(counts.get(params[0].lower(), 0))
+        elif method == "eth_sendRawTransaction":
+            raw = bytes.fromhex(params[0][2:])
+            sender = Account.recover_transaction(raw)
+            if raw[0] == 2:
+                # EIP-1559: chainId, nonce, maxPriorityFeePerGas, maxFeePerGas, gas, to, value, data, ...
+                fields = rlp.decode(raw[1:])
+                nonce, fee, to, data = fields[1], fields[3], fields[5], fields[7]
+            else:
+                # legacy: nonce, gasPrice, gas, to, value, data, v, r, s
+                fields = rlp.decode(raw)
+                nonce, fee, to, data = fields[0], fields[1], fields[3], fields[5]
+            transaction = {"from": sender, "nonce": int.from_bytes(nonce, "big"),
+                           "fee": int.from_bytes(fee, "big"), "to": "0x" + to.hex(), "data": "0x" + data.hex()}
+            expected = self.sender_nonces.get(sender.lower(), 0)
+            error = None
+            if transaction["nonce"] > expected:
+                error = "nonce too high"
+            elif transaction["nonce"] < expected:
+                replaced = [entry for entry in self.pending if entry[2]["from"] == sender
+                            and entry[2]["nonce"] == transaction["nonce"]]
+                if not replaced:
+                    error = "nonce too low"
+                elif transaction["fee"] * 10 < replaced[0][2]["fee"] * 11:
+                    error = "replacement transaction underpriced"
+                else:
+                    self.pending.remove(replaced[0])
+            if error is not None:
+                return {"jsonrpc": "2.0", "id": call["id"], "error": {"code": -32000, "message": error}}
+            self.sender_nonces[sender.lower()] = max(expected, transaction["nonce"] + 1)
+            tx_hash = Web3.keccak(raw).hex()
+            if not tx_hash.startswith("0x"):
+                tx_hash = "0x" + tx_hash
+            self.pending.append((time.monotonic() + BLOCK_TIME, tx_hash, transaction))
+            self.transactions += 1
+            result = tx_hash
+        elif method == "eth_getTransactionReceipt":
+            result = self.receipts.get(params[0])
+        return {"jsonrpc": "2.0", "id": call["id"], "result": result}
+
+
+chain = Chain()
+
+
+async def handle_rpc(request):
+    payload = await request.json()
+    chain.requests += 1
+    await asyncio.sleep(RPC_LATENCY)
+    if isinstance(payload, list):
+        return web.json_response([chain.answer(call) for call in payload])
+    return web.json_response(chain.answer(payload))
+
+
+def start_stand_in():
+    loop = asyncio.new_event_loop()
+    app = web.Application()
+    app.router.add_post("/", handle_rpc)
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", RPC_PORT).start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+
+def make_trades(run):
+    random.seed(7)
+    accounts = [Account.create().address for _ in range(ACCOUNTS)]
+    rejected = set(random.sample(range(TRADES), REJECTED))
+    trades = []
+    for index in range(TRADES):
+        seller, buyer = random.sample(accounts, 2)
+        trade_id = ("reject" if index in rejected else "trade") + f"-{run}-{index}"
+        trades.append({"party1": seller, "party2": buyer, "token": TOKEN, "trade_id": trade_id,
+                       "index": index})
+    return trades
+
+
+def build_call(client, trade, nonce1, nonce2):
+    return client.contract.functions.settleTrade(
+        (trade["index"], trade["party2"], 10**18, 10**18, "bid", TOKEN, QUOTE_TOKEN,
+         trade["trade_id"], 1, True),
+        trade["party1"],
+        trade["party2"],
+        10**18,
+        10**18,
+        "ask",
+        "bid",
+        bytes.fromhex(SIGNATURE[2:]),
+        bytes.fromhex(SIGNATURE[2:]),
+        nonce1,
+        nonce2,
+    )
+
+
+async def settle_one_by_one(client, trades):
+    results = []
+    for trade in trades:
+        nonce1, nonce2 = await client.get_user_nonces([trade["party1"], trade["party2"]], TOKEN)
+        try:
+            results.append(await client.send_transaction(build_call(client, trade, nonce1, nonce2)))
+        except Exception as e:
+            results.append({"success": False, "error": str(e)})
+    return results
+
+
+async def run(name, settle, trades):
+    transactions, rpc_calls = chain.transactions, chain.rpc_calls
+    start = time.perf_counter()
+    results = await settle(trades)
+    elapsed = time.perf_counter() - start
+    expected = [not trade["trade_id"].startswith("reject") for trade in trades]
+    reported = [result["success"] for result in results]
+    settled_once = all(chain.settled.get(trade["trade_id"], 0) == int(ok)
+                       for trade, ok in zip(trades, expected))
+    print(
+        f"{name:>8}: {sum(reported)} of {len(trades)} trades settled in "
+        f"{chain.transactions - transactions:3d} transactions, {chain.rpc_calls - rpc_calls:4d} RPC calls, "
+        f"{elapsed * 1000:8.1f} ms; failures isolated {'ok' if reported == expected else 'WRONG'}, "
+        f"settled exactly once {'ok' if settled_once else 'WRONG'}"
+    )
+
+
+async def main():
+    url = f"http://127.0.0.1:{RPC_PORT}"
+    client = create_async_settlement_client(url, CONTRACT, OPERATOR_KEY, batcher_address=BATCHER)
+    await run("single", lambda trades: settle_one_by_one(client, trades), make_trades(0))
+    await run("batched", lambda trades: client.settle_batch(
+        trades, lambda trade, nonce1, nonce2: build_call(client, trade, nonce1, nonce2)),
+        make_trades(1))
+
+
+if __name__ == "__main__":
+    start_stand_in()
+    asyncio.run(main())
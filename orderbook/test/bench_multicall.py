@@ -0,0 +1,120 @@
+"""
+Prerequisite reads of orders: one eth_call per read vs all of them in one Multicall3 call.
+
+Uses the EVM stand-in of bench_batch_settlement, which answers every call after RPC_LATENCY
+seconds. Each order needs the buyer's quote and the seller's base token allowance and balance
+checked and both parties' nonces read, six reads in all. They are made for one order at a time
+and for CONCURRENCY orders at once, as separate concurrent eth_calls and as one multicall per
+order, then AllowanceChecker.batch_allowance_check is timed against checking CHECKS allowances
+and balances one by one. The requests and RPC calls the stand-in answered are counted for each.
+
+    python -m orderbook.test.bench_multicall
+"""
+import asyncio
+import time
+
+from eth_account import Account
+
+from orderbook.test.bench_batch_settlement import (
+    CONTRACT,
+    QUOTE_TOKEN,
+    RPC_PORT,
+    TOKEN,
+    chain,
+    start_stand_in,
+)
+from orderbook.trade_settlement_client import (
+    AllowanceChecker,
+    check_functions,
+    create_async_settlement_client,
+    nonce_functions,
+)
+
+ORDERS = 20
+CONCURRENCY = 50
+CHECKS = 20
+AMOUNT = 10**18
+
+
+def order_functions(client, buyer, seller):
+    '''Every read validating and settling one trade between buyer and seller needs.'''
+    return check_functions(
+        client.contract, [(buyer, QUOTE_TOKEN, AMOUNT), (seller, TOKEN, AMOUNT)]
+    ) + nonce_functions(client.contract, [(buyer, TOKEN), (seller, TOKEN)])
+
+
+def report(name, count, what, elapsed, requests, calls):
+    print(
+        f"{name:>24}: {count:3d} {what} in {elapsed * 1000:8.1f} ms "
+        f"({elapsed * 1000 / count:6.1f} ms each), {requests:4d} requests, {calls:4d} RPC calls"
+    )
+
+
+async def run(name, read, orders, concurrency):
+    requests, calls = chain.requests, chain.rpc_calls
+    start = time.perf_counter()
+    for index in range(0, len(orders), concurrency):
+        results = await asyncio.gather(
+            *[read(buyer, seller) for buyer, seller in orders[index:index + concurrency]]
+        )
+        assert all(len(result) == 6 for result in results)
+    elapsed = time.perf_counter() - start
+    report(name, len(orders), "orders", elapsed, chain.requests - requests, chain.rpc_calls - calls)
+
+
+def run_checker(name, check, checks):
+    requests, calls = chain.requests, chain.rpc_calls
+    start = time.perf_counter()
+    results = check(checks)
+    elapsed = time.perf_counter() - start
+    assert len(results) == len(checks)
+    assert all(result["allowance_sufficient"] and result["balance_sufficient"] for result in results)
+    report(name, len(checks), "checks", elapsed, chain.requests - requests, chain.rpc_calls - calls)
+
+
+async def main():
+    client = create_async_settlement_client(f"http://127.0.0.1:{RPC_PORT}", CONTRACT)
+    orders = [(Account.create().address, Account.create().address) for _ in range(CONCURRENCY)]
+
+    async def separate(buyer, seller):
+        return await asyncio.gather(
+            *[function.call() for function in order_functions(client, buyer, seller)]
+        )
+
+    async def multicall(buyer, seller):
+        return await client.multicall(order_functions(client, buyer, seller))
+
+    # Warm up connections and cached chain data
+    await separate(*orders[0])
+    await multicall(*orders[0])
+
+    await run("separate, one at a time", separate, orders[:ORDERS], 1)
+    await run("multicall, one at a time", multicall, orders[:ORDERS], 1)
+    await run("separate, concurrent", separate, orders, CONCURRENCY)
+    await run("multicall, concurrent", multicall, orders, CONCURRENCY)
+
+
+def check_one_by_one(checker, checks):
+    '''What batch_allowance_check did before: an allowance and a balance call per check.'''
+    results = []
+    for check in checks:
+        allowance = checker.check_token_allowance(check["token"], check["owner"], check["spender"])
+        balance = checker.check_token_balance(check["token"], check["owner"])
+        results.append({
+            "allowance_sufficient": allowance >= check["required"],
+            "balance_sufficient": balance >= check["required"],
+        })
+    return results
+
+
+if __name__ == "__main__":
+    start_stand_in()
+    asyncio.run(main())
+    checker = AllowanceChecker(f"http://127.0.0.1:{RPC_PORT}")
+    checks = [
+        {"token": TOKEN, "owner": Account.create().address, "spender": CONTRACT, "required": AMOUNT}
+        for _ in range(CHECKS)
+    ]
+    checker.web3.eth.chain_id  # warm up the connection
+    run_checker("allowances one by one", lambda checks: check_one_by_one(checker, checks), checks)
+    run_checker("batch_allowance_check", checker.batch_allowance_check, checks)
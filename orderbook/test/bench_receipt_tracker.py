@@ -0,0 +1,81 @@
+"""
+Waiting for many settlement receipts: wait_for_transaction_receipt per transaction vs ReceiptTracker.
+
+Uses the EVM stand-in of bench_batch_settlement, with IN_FLIGHT transactions already sent and
+mined MINED_PER_BLOCK per block, one block every BLOCK_TIME seconds. Both ways wait for all of
+them at once; the requests and RPC calls the stand-in answered are counted for each.
+
+    python -m orderbook.test.bench_receipt_tracker
+"""
+import asyncio
+import time
+
+from web3 import AsyncWeb3
+
+from orderbook.test.bench_batch_settlement import RPC_PORT, chain, start_stand_in
+from orderbook.trade_settlement_client import ReceiptTracker
+
+IN_FLIGHT = 1000
+MINED_PER_BLOCK = 200
+BLOCK_TIME = 0.5  # seconds
+
+
+def receipt(tx_hash, block_number):
+    return {
+        "transactionHash": tx_hash,
+        "transactionIndex": "0x0",
+        "blockHash": "0x" + block_number.to_bytes(32, "big").hex(),
+        "blockNumber": hex(block_number),
+        "from": "0x" + "11" * 20,
+        "to": "0x" + "22" * 20,
+        "cumulativeGasUsed": hex(116000),
+        "gasUsed": hex(116000),
+        "effectiveGasPrice": hex(20 * 10**9),
+        "contractAddress": None,
+        "logs": [],
+        "logsBloom": "0x" + "00" * 256,
+        "status": "0x1",
+        "type": "0x0",
+    }
+
+
+async def mine(hashes):
+    '''Mine the transactions MINED_PER_BLOCK a block, oldest first.'''
+    for start in range(0, len(hashes), MINED_PER_BLOCK):
+        await asyncio.sleep(BLOCK_TIME)
+        chain.block_number += 1
+        for tx_hash in hashes[start:start + MINED_PER_BLOCK]:
+            chain.receipts[tx_hash] = receipt(tx_hash, chain.block_number)
+
+
+async def run(name, wait, run_id):
+    hashes = ["0x" + run_id.to_bytes(4, "big").hex() + index.to_bytes(28, "big").hex()
+              for index in range(IN_FLIGHT)]
+    requests, rpc_calls = chain.requests, chain.rpc_calls
+    start = time.perf_counter()
+    blocks = chain.block_number
+    miner = asyncio.ensure_future(mine(hashes))
+    receipts = await asyncio.gather(*[wait(tx_hash) for tx_hash in hashes])
+    elapsed = time.perf_counter() - start
+    await miner
+    blocks = chain.block_number - blocks
+    requests = chain.requests - requests
+    calls = chain.rpc_calls - rpc_calls
+    print(
+        f"{name:>8}: {sum(r.status for r in receipts)} receipts over {blocks} blocks in "
+        f"{elapsed * 1000:8.1f} ms, {requests:6d} requests ({requests / blocks:7.1f} per block), "
+        f"{calls:6d} RPC calls"
+    )
+
+
+async def main():
+    web3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(f"http://127.0.0.1:{RPC_PORT}"))
+    tracker = ReceiptTracker(web3, poll_interval=0.1)
+    await run("polling", lambda tx_hash: web3.eth.wait_for_transaction_receipt(
+        tx_hash, timeout=60, poll_latency=0.1), 1)
+    await run("tracker", lambda tx_hash: tracker.wait(tx_hash, timeout=60), 2)
+
+
+if __name__ == "__main__":
+    start_stand_in()
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+"""
+Fixtures of the tests: the EVM stand-in of bench_batch_settlement behind an in-memory web3
+provider (no server, no latency, every transaction mined on the next call), a settlement
+queue in a temporary SQLite file, and quotes for the matching engine.
+"""
+import json
+from collections import Counter
+from decimal import Decimal
+
+import pytest
+from web3._utils.encoding import Web3JsonEncoder
+from web3.providers.async_base import AsyncBaseProvider
+from web3.providers.base import BaseProvider
+
+from orderbook.settlement_queue import SettlementQueue
+from orderbook.test import bench_batch_settlement
+from orderbook.test.bench_batch_settlement import BATCHER, CONTRACT, OPERATOR_KEY, Chain
+from orderbook.trade_settlement_client import AllowanceChecker, create_async_settlement_client
+
+
+def order(side, quantity, price=None, account="0xaaaa", **fields):
+    '''A process_order quote of account, a limit order unless fields set another type.'''
+    quote = {
+        "type": "limit",
+        "side": side,
+        "quantity": Decimal(str(quantity)),
+        "price": str(price) if price is not None else None,
+        "trade_id": account,
+        "account": account,
+        "private_key": account + "-key",
+        "baseAsset": "SEI",
+        "quoteAsset": "USDT",
+    }
+    quote.update(fields)
+    return quote
+
+
+def rpc_call(provider, method, params):
+    provider.request_id += 1
+    provider.calls[method] += 1
+    # Through JSON and back, as over HTTP
+    params = json.loads(json.dumps(params, cls=Web3JsonEncoder))
+    return provider.chain.answer(
+        {"jsonrpc": "2.0", "id": provider.request_id, "method": method, "params": params}
+    )
+
+
+class InMemoryProvider(AsyncBaseProvider):
+    '''Answers AsyncWeb3 requests from a stand-in Chain, counting the calls of each method.'''
+
+    def __init__(self, chain):
+        super().__init__()
+        self.chain = chain
+        self.request_id = 0
+        self.calls = Counter()
+
+    async def make_request(self, method, params):
+        self.chain.requests += 1
+        return rpc_call(self, method, params)
+
+    async def make_batch_request(self, requests):
+        self.chain.requests += 1
+        return [rpc_call(self, method, params) for method, params in requests]
+
+    async def is_connected(self, show_traceback=False):
+        return True
+
+
+class InMemorySyncProvider(BaseProvider):
+    '''Answers Web3 requests from a stand-in Chain, counting the calls of each method.'''
+
+    def __init__(self, chain):
+        super().__init__()
+        self.chain = chain
+        self.request_id = 0
+        self.calls = Counter()
+
+    def make_request(self, method, params):
+        self.chain.requests += 1
+        return rpc_call(self, method, params)
+
+    def is_connected(self, show_traceback=False):
+        return True
+
+
+@pytest.fixture
+def chain(monkeypatch):
+    monkeypatch.setattr(bench_batch_settlement, "BLOCK_TIME", 0)
+    return Chain()
+
+
+@pytest.fixture
+def make_client(chain):
+    '''An AsyncTradeSettlementClient on the stand-in, signing with the operator key.'''
+
+    def make_client():
+        client = create_async_settlement_client(
+            "http://stand-in", CONTRACT, OPERATOR_KEY, batcher_address=BATCHER
+        )
+        client.web3.provider = InMemoryProvider(chain)
+        return client
+
+    return make_client
+
+
+@pytest.fixture
+def checker(chain):
+    checker = AllowanceChecker("http://stand-in")
+    checker.web3.provider = InMemorySyncProvider(chain)
+    return checker
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = SettlementQueue(str(tmp_path / "settlements.db"))
+    yield queue
+    queue.close()
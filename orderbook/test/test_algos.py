@@ -0,0 +1,134 @@
+from decimal import Decimal
+
+import pytest
+
+from orderbook import OrderBook
+from orderbook.algos import AlgoScheduler
+from orderbook.test.conftest import order
+
+
+def working(scheduler, algo_type="twap", quantity=10, price=99, side="bid", **options):
+    '''A parent of 0xaaaa on SEI submitted at t=0 for 1000ms in 250ms slices.'''
+    options.setdefault("duration", 1000)
+    options.setdefault("interval", 250)
+    return scheduler.submit(algo_type, "SEI", order(side, quantity, price), 0, **options)
+
+
+def child(book, parent):
+    return book.bids.get_order(parent.child_order_id) if parent.child_order_id is not None else None
+
+
+def test_twap_places_children_on_schedule():
+    books = {"SEI": OrderBook()}
+    scheduler = AlgoScheduler()
+    parent = working(scheduler)
+
+    [(released, result)] = scheduler.run(0, books)
+    assert released is parent and result["success"]
+    assert child(books["SEI"], parent).quantity == Decimal("2.5")
+    # Not due yet
+    assert scheduler.run(100, books) == []
+    # The next slice replaces the child with what the schedule is behind by
+    scheduler.run(250, books)
+    assert len(books["SEI"].bids) == 1 and child(books["SEI"], parent).quantity == 5
+    assert parent.slices == 2
+
+
+def test_resting_child_fills_are_read_from_the_tape():
+    books = {"SEI": OrderBook()}
+    scheduler = AlgoScheduler()
+    parent = working(scheduler)
+    scheduler.run(0, books)
+    books["SEI"].process_order(order("ask", 2, 99, "0xbbbb"), False, False)
+
+    scheduler.run(250, books)
+    assert parent.filled == 2 and parent.to_dict()["averagePrice"] == 99.0
+    assert child(books["SEI"], parent).quantity == 3
+
+
+def test_crossing_child_takes_the_first_order_only():
+    books = {"SEI": OrderBook()}
+    books["SEI"].process_order(order("ask", 1, 98, "0xbbbb"), False, False)
+    books["SEI"].process_order(order("ask", 5, 99, "0xbbbb"), False, False)
+    scheduler = AlgoScheduler()
+    parent = working(scheduler, price=None)
+
+    [(_, result)] = scheduler.run(0, books)
+    assert len(result["data"][0]) == 1 and parent.filled == 1
+    assert parent.child_order_id is None
+
+
+def test_parent_completes_and_expires():
+    books = {"SEI": OrderBook()}
+    books["SEI"].process_order(order("ask", 10, 99, "0xbbbb"), False, False)
+    scheduler = AlgoScheduler()
+    done = working(scheduler, quantity=1, duration=100, interval=100)
+    late = working(scheduler, price=90)
+
+    scheduler.run(0, books)
+    assert done.status == "completed" and done.filled == 1
+    scheduler.run(1000, books)
+    assert late.status == "expired" and len(books["SEI"].bids) == 0
+    assert len(scheduler) == 0
+
+
+def test_participation_cap_follows_market_volume():
+    books = {"SEI": OrderBook()}
+    scheduler = AlgoScheduler()
+    parent = working(scheduler, max_participation="0.5")
+
+    # No market volume seen yet, so no child
+    assert scheduler.run(0, books) == []
+    books["SEI"].process_order(order("ask", 1, 101, "0xbbbb"), False, False)
+    books["SEI"].process_order(order("bid", 1, 101, "0xcccc"), False, False)
+    scheduler.run(250, books)
+    assert child(books["SEI"], parent).quantity == Decimal("0.5")
+
+
+def test_vwap_waits_for_volume_to_follow():
+    books = {"SEI": OrderBook()}
+    scheduler = AlgoScheduler()
+    parent = working(scheduler, algo_type="vwap")
+    assert scheduler.run(0, books) == [] and parent.child_order_id is None
+    assert parent.status == "working"
+
+
+def test_cancel_removes_the_child():
+    books = {"SEI": OrderBook()}
+    scheduler = AlgoScheduler()
+    parent = working(scheduler)
+    scheduler.run(0, books)
+    assert scheduler.cancel(parent.algo_id, books).status == "cancelled"
+    assert len(books["SEI"].bids) == 0
+    assert scheduler.run(250, books) == []
+
+
+def test_runs_release_at_most_max_releases_slices():
+    books = {"SEI": OrderBook()}
+    scheduler = AlgoScheduler(max_releases=2)
+    parents = [working(scheduler) for _ in range(3)]
+    assert len(scheduler.run(0, books)) == 2
+    assert [parent.slices for parent in parents] == [1, 1, 0]
+    assert len(scheduler.run(0, books)) == 1
+
+
+def test_finished_parents_are_forgotten_oldest_first():
+    books = {"SEI": OrderBook()}
+    scheduler = AlgoScheduler(max_finished=1)
+    first, second = working(scheduler), working(scheduler)
+    scheduler.cancel(first.algo_id, books)
+    scheduler.cancel(second.algo_id, books)
+    assert scheduler.get(first.algo_id) is None and scheduler.get(second.algo_id) is second
+
+
+@pytest.mark.parametrize(
+    "algo_type, options",
+    [
+        ("iceberg", {}),
+        ("twap", {"duration": 0}),
+        ("twap", {"max_participation": "1.5"}),
+    ],
+)
+def test_invalid_parents_are_rejected(algo_type, options):
+    with pytest.raises(Exception):
+        working(AlgoScheduler(), algo_type=algo_type, **options)
@@ -0,0 +1,125 @@
+import asyncio
+
+from eth_account import Account
+
+from orderbook.test.bench_batch_settlement import HOLDING, QUOTE_TOKEN, TOKEN, build_call
+
+
+def hand_polled(client, **options):
+    '''The client's allowance cache with the given options, its loop never started, polled by the test instead.'''
+    cache = client.allowances
+    for name, value in options.items():
+        setattr(cache, name, value)
+    cache.task = asyncio.get_running_loop().create_future()
+    return cache
+
+
+def test_second_read_is_a_hit(chain, make_client):
+    client = make_client()
+    user = Account.create().address
+    chain.holdings[(user.lower(), TOKEN.lower())] = (5, 7)
+
+    async def read_twice():
+        cache = hand_polled(client)
+        return await cache.get(user, TOKEN), await cache.get(user.lower(), TOKEN.lower()), cache.stats()
+
+    first, second, stats = asyncio.run(read_twice())
+    assert first == second == (5, 7)
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+    # Allowance, balance and the block number in one eth_call
+    assert client.web3.provider.calls["eth_call"] == 1
+    assert stats["lastBlock"] == chain.block_number
+
+
+def test_concurrent_misses_share_one_read(chain, make_client):
+    client = make_client()
+    user = Account.create().address
+
+    async def read_together():
+        cache = hand_polled(client)
+        return await asyncio.gather(*[cache.get(user, TOKEN) for _ in range(5)])
+
+    assert asyncio.run(read_together()) == [(HOLDING, HOLDING)] * 5
+    assert client.web3.provider.calls["eth_call"] == 1
+
+
+def test_expired_values_are_read_again(chain, make_client):
+    client = make_client()
+    user = Account.create().address
+
+    async def read_twice():
+        cache = hand_polled(client, ttl=0)
+        await cache.get(user, TOKEN)
+        chain.holdings[(user.lower(), TOKEN.lower())] = (1, 2)
+        return await cache.get(user, TOKEN)
+
+    assert asyncio.run(read_twice()) == (1, 2)
+    assert client.web3.provider.calls["eth_call"] == 2
+
+
+def test_least_recently_used_values_are_evicted(chain, make_client):
+    client = make_client()
+    users = [Account.create().address for _ in range(3)]
+
+    async def read():
+        cache = hand_polled(client, max_entries=2)
+        await cache.get(users[0], TOKEN)
+        await cache.get(users[1], TOKEN)
+        await cache.get(users[0], TOKEN)  # users[1] is now the least recently used
+        await cache.get(users[2], TOKEN)
+        return set(account for account, _ in cache.entries), cache.evictions
+
+    accounts, evictions = asyncio.run(read())
+    assert accounts == {users[0].lower(), users[2].lower()}
+    assert evictions == 1
+
+
+def test_settlement_drops_both_parties_in_both_assets(chain, make_client):
+    client = make_client()
+    seller, buyer, bystander = (Account.create().address for _ in range(3))
+    trade = {"party1": seller, "party2": buyer, "token": TOKEN, "trade_id": "trade-0", "index": 0}
+
+    async def settle_and_poll():
+        cache = hand_polled(client)
+        for account in (seller, buyer, bystander):
+            for token in (TOKEN, QUOTE_TOKEN):
+                await cache.get(account, token)
+        result = await client.send_transaction(build_call(client, trade, 0, 0), timeout=5)
+        assert result["success"]
+        await cache.poll()
+        return set(cache.entries), cache.invalidations
+
+    entries, invalidations = asyncio.run(settle_and_poll())
+    assert entries == {(bystander.lower(), TOKEN.lower()), (bystander.lower(), QUOTE_TOKEN.lower())}
+    assert invalidations == 4
+
+
+def test_everything_is_dropped_after_too_many_blocks(chain, make_client):
+    client = make_client()
+    user = Account.create().address
+
+    async def read_and_poll():
+        cache = hand_polled(client, max_blocks=10)
+        await cache.get(user, TOKEN)
+        chain.block_number += 11
+        await cache.poll()
+        return len(cache), cache.last_block
+
+    entries, last_block = asyncio.run(read_and_poll())
+    assert entries == 0
+    assert last_block == chain.block_number
+
+
+def test_invalidate_during_a_read_keeps_it_out_of_the_cache(chain, make_client):
+    client = make_client()
+    user = Account.create().address
+
+    async def read_and_invalidate():
+        cache = hand_polled(client)
+        read = asyncio.ensure_future(cache.get(user, TOKEN))
+        await asyncio.sleep(0)  # the read is in progress
+        cache.invalidate(user)
+        await read
+        return len(cache)
+
+    assert asyncio.run(read_and_invalidate()) == 0
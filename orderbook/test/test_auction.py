@@ -0,0 +1,79 @@
+from decimal import Decimal
+
+from orderbook import OrderBook
+from orderbook.test.conftest import order
+
+
+def collecting(stp_mode=None):
+    book = OrderBook(stp_mode=stp_mode)
+    book.set_matching_mode("auction")
+    return book
+
+
+def test_uncrosses_at_the_price_of_most_volume():
+    book = collecting()
+    book.process_order(order("bid", 3, 101, "0xb1"), False, False)
+    book.process_order(order("bid", 2, 99, "0xb2"), False, False)
+    book.process_order(order("ask", 2, 98, "0xa1"), False, False)
+    book.process_order(order("ask", 2, 100, "0xa2"), False, False)
+    assert book.clearing_price() == (Decimal(100), 3)
+
+    result = book.run_auction()
+    assert result["price"] == Decimal(100) and result["volume"] == 3
+    assert [trade["price"] for trade in result["trades"]] == [Decimal(100)] * 2
+    assert book.get_best_bid() == Decimal(99) and book.get_best_ask() == Decimal(100)
+    assert book.run_auction() is None
+
+
+def test_icebergs_clear_in_full_at_one_price():
+    book = collecting()
+    book.process_order(order("ask", 5, 95, "0xa1", display_quantity="1"), False, False)
+    book.process_order(order("bid", 5, 100, "0xb1"), False, False)
+    # The reserve behind the displayed clip counts towards supply
+    assert book.clearing_price() == (Decimal(95), 5)
+
+    result = book.run_auction()
+    assert result["volume"] == 5
+    assert len(result["trades"]) == 5
+    assert set(trade["price"] for trade in result["trades"]) == {result["price"]}
+    assert len(book.bids) == 0 and len(book.asks) == 0
+
+
+def test_post_only_orders_never_cross_the_collected_book():
+    book = collecting()
+    book.process_order(order("ask", 1, 100, "0xa1"), False, False)
+    rejected = book.process_order(order("bid", 1, 100, "0xb1", type="post_only"), False, False)
+    assert not rejected["success"]
+    assert rejected["message"] == "Post-only order would cross the book"
+
+    resting = book.process_order(order("bid", 1, 99, "0xb1", type="post_only"), False, False)
+    assert resting["success"] and resting["data"][1] is not None
+    # A later order crossing it trades with it in the uncross, as with any resting order
+    book.process_order(order("ask", 1, 99, "0xa2"), False, False)
+    assert book.run_auction()["volume"] == 1
+
+
+def test_ioc_fok_and_market_orders_are_rejected_while_collecting():
+    book = collecting()
+    for quote in (
+        order("bid", 1, 100, type="ioc"),
+        order("bid", 1, 100, type="fok"),
+        order("bid", 1, type="market"),
+    ):
+        assert not book.process_order(quote, False, False)["success"]
+
+
+def test_leaving_auction_mode_leaves_the_book_uncrossed():
+    book = collecting(stp_mode="cancel_oldest")
+    book.process_order(order("bid", 1, 100, "0xaaaa"), False, False)
+    book.process_order(order("ask", 1, 96, "0xaaaa"), False, False)
+    book.process_order(order("bid", 1, 98, "0xcccc"), False, False)
+
+    results = book.set_matching_mode("continuous")
+    # Self-trade prevention cancelled the bid the first price was found with
+    assert [result["price"] for result in results] == [Decimal(100), Decimal(96)]
+    assert [len(result["trades"]) for result in results] == [0, 1]
+    for result in results:
+        assert all(trade["price"] == result["price"] for trade in result["trades"])
+    assert book.clearing_price() is None
+    assert book.set_matching_mode("auction") == []
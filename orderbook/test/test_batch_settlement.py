@@ -0,0 +1,96 @@
+import asyncio
+
+from eth_account import Account
+
+from orderbook.test.bench_batch_settlement import BATCHER, TOKEN, build_call
+
+
+def make_trades(count, rejected=(), accounts=3):
+    '''count trades among a few accounts (so parties share nonces), those in rejected reverting.'''
+    parties = [Account.create().address for _ in range(accounts)]
+    return [
+        {
+            "party1": parties[index % accounts],
+            "party2": parties[(index + 1) % accounts],
+            "token": TOKEN,
+            "trade_id": ("reject" if index in rejected else "trade") + f"-{index}",
+            "index": index,
+        }
+        for index in range(count)
+    ]
+
+
+def settle(client, trades):
+    return asyncio.run(
+        client.settle_batch(trades, lambda trade, nonce1, nonce2: build_call(client, trade, nonce1, nonce2))
+    )
+
+
+def test_settles_every_trade_in_one_transaction(chain, make_client):
+    client = make_client()
+    results = settle(client, make_trades(8))
+    assert all(result["success"] and result["batch_size"] == 8 for result in results)
+    assert len(set(result["transaction_hash"] for result in results)) == 1
+    assert chain.transactions == 1
+    assert chain.settled == {f"trade-{index}": 1 for index in range(8)}
+
+
+def test_first_failing_trade_bisects_prefixes(chain, make_client):
+    client = make_client()
+    for failing in (0, 1, 5, 9):
+        trades = make_trades(10, rejected={failing})
+
+        async def bisect():
+            nonces = await client.allocate_nonces(trades)
+            functions = [build_call(client, trade, *nonce) for trade, nonce in zip(trades, nonces)]
+            ok, error = await client.simulate_batch(functions)
+            assert ok is False
+            return await client.first_failing_trade(functions, error)
+
+        index, error, gas = asyncio.run(bisect())
+        assert index == failing
+        assert "insufficient allowance" in error
+        assert (gas is None) == (failing == 0)
+
+
+def test_reverting_trade_is_isolated(chain, make_client):
+    client = make_client()
+    trades = make_trades(10, rejected={3, 7})
+    results = settle(client, trades)
+    for trade, result in zip(trades, results):
+        if trade["trade_id"].startswith("reject"):
+            assert not result["success"]
+            assert "insufficient allowance" in result["error"]
+        else:
+            assert result["success"], result
+    # The trades before each failing one go out as they were simulated, the rest batched again
+    assert chain.transactions == 3
+    assert chain.settled == {f"trade-{index}": 1 for index in range(10) if index not in (3, 7)}
+
+
+def test_batch_too_large_for_the_gas_target_is_split(chain, make_client):
+    client = make_client()
+    client.batch_gas_fraction = 0.1  # 300000 gas, three settlements
+    results = settle(client, make_trades(7))
+    assert all(result["success"] for result in results)
+    assert max(result["batch_size"] for result in results) <= 3
+    assert chain.settled == {f"trade-{index}": 1 for index in range(7)}
+
+
+def test_simulation_rpc_error_falls_back_to_single_trades(chain, make_client):
+    answer = chain.answer
+
+    def failing_estimates(call):
+        if call["method"] == "eth_estimateGas" and call["params"][0]["to"].lower() == BATCHER.lower():
+            return {"jsonrpc": "2.0", "id": call["id"], "error": {"code": -32603, "message": "upstream timeout"}}
+        return answer(call)
+
+    chain.answer = failing_estimates
+    client = make_client()
+    trades = make_trades(5, rejected={2})
+    results = settle(client, trades)
+    # One transaction per trade; the rejected one reverts on chain (its gas came from the cache)
+    assert [result["success"] for result in results] == [True, True, False, True, True]
+    assert "batch_size" not in results[0]
+    assert chain.transactions == 5
+    assert chain.settled == {f"trade-{index}": 1 for index in (0, 1, 3, 4)}
@@ -0,0 +1,77 @@
+from decimal import Decimal
+
+import pytest
+
+from orderbook import OrderBook
+from orderbook.candles import DAY, CandleAggregator, RollingWindow
+from orderbook.test.conftest import order
+
+
+def trade(timestamp, price, quantity=1):
+    return {"timestamp": timestamp, "price": Decimal(str(price)), "quantity": Decimal(str(quantity))}
+
+
+def test_trades_fold_into_bars_of_every_interval():
+    candles = CandleAggregator()
+    for timestamp, price, quantity in [(0, 10, 1), (500, 12, 2), (900, 9, 1), (1000, 11, 3)]:
+        candles.add_trade(trade(timestamp, price, quantity))
+
+    assert candles.get_candles("1s") == [
+        {"start": 0, "open": 10.0, "high": 12.0, "low": 9.0, "close": 9.0, "volume": 4.0, "trades": 3},
+        {"start": 1000, "open": 11.0, "high": 11.0, "low": 11.0, "close": 11.0, "volume": 3.0, "trades": 1},
+    ]
+    [minute] = candles.get_candles("1m")
+    assert (minute["open"], minute["high"], minute["low"], minute["close"]) == (10.0, 12.0, 9.0, 11.0)
+    assert (minute["volume"], minute["trades"]) == (7.0, 4)
+
+
+def test_bars_are_a_bounded_ring_and_limit_keeps_the_newest():
+    candles = CandleAggregator(max_bars=3)
+    for second in range(5):
+        candles.add_trade(trade(second * 1000, second + 1))
+    assert [bar["start"] for bar in candles.get_candles("1s")] == [2000, 3000, 4000]
+    assert [bar["close"] for bar in candles.get_candles("1s", limit=2)] == [4.0, 5.0]
+
+
+def test_unknown_interval_is_rejected():
+    with pytest.raises(ValueError):
+        CandleAggregator().get_candles("3m")
+
+
+def test_ticker_follows_the_last_24_hours():
+    candles = CandleAggregator()
+    candles.add_trade(trade(0, 20, 1))
+    candles.add_trade(trade(1000, 10, 2))
+    candles.add_trade(trade(DAY // 2, 15, 1))
+
+    ticker = candles.get_ticker()
+    assert (ticker["open24h"], ticker["high24h"], ticker["low24h"]) == (20.0, 20.0, 10.0)
+    assert (ticker["volume24h"], ticker["quoteVolume24h"]) == (4.0, 55.0)
+    assert ticker["lastTradePrice"] == 15.0 and ticker["priceChangeIndicator"] == "up"
+    assert ticker["change24h"] == -5.0 and ticker["changePercent24h"] == -25.0
+
+    # The first trade leaves the window, the high moves to the next bucket
+    ticker = candles.get_ticker(now=DAY + 500)
+    assert (ticker["open24h"], ticker["high24h"], ticker["low24h"]) == (10.0, 15.0, 10.0)
+    assert ticker["volume24h"] == 3.0
+
+
+def test_rolling_window_extremes_survive_expiry():
+    window = RollingWindow(span=3000, granularity=1000)
+    for timestamp, price in [(0, 5), (1000, 9), (2000, 1), (3000, 4)]:
+        window.add(timestamp, Decimal(price), Decimal(1))
+    # The bucket at 0 expired when the trade at 3000 arrived
+    assert len(window) == 3
+    assert (window.open(), window.high(), window.low()) == (9, 9, 1)
+    window.expire(4000)
+    assert (window.open(), window.high(), window.low()) == (1, 4, 1)
+    window.expire(10000)
+    assert (len(window), window.high(), window.low(), window.volume) == (0, None, None, 0)
+
+
+def test_order_book_trades_feed_the_candles():
+    book = OrderBook()
+    book.process_order(order("ask", 1, 100, "0xbbbb"), False, False)
+    book.process_order(order("bid", 1, 100), False, False)
+    assert book.candles.last_price == Decimal("100")
+    assert book.candles.get_candles("1h")[0]["volume"] == 1.0
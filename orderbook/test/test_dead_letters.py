@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+import app
+from orderbook.settlement_queue import FAILED
+from orderbook.test.bench_batch_settlement import TOKEN
+from orderbook.test.test_settlement_client import make_trade, replace, stalled_send
+
+
+@pytest.fixture
+def server(monkeypatch, queue, make_client):
+    '''The app with the temporary settlement queue and a settlement client on the stand-in.'''
+    client = make_client()
+    monkeypatch.setattr(app, "settlement_queue", queue)
+    monkeypatch.setattr(app, "settlement_client", client)
+    return client
+
+
+def fill(trade):
+    return {"timestamp": 1, "price": 100.0, "quantity": 1.0,
+            "party1": [trade["party1"], "ask", 1, None], "party2": [trade["party2"], "bid", None, None]}
+
+
+def give_up(queue, trade, outcome):
+    '''Dead-letter the fill of trade after its last attempt ended as outcome, returns the dead letter.'''
+    queue.enqueue([fill(trade)], "SEI", "USDT")
+    [settlement] = queue.claim(1)
+    settlement["attempts"] = app.settlement_retry.max_attempts
+    if outcome.get("unconfirmed"):
+        app.record_attempt(settlement, {"unconfirmed": [{"transfer": outcome, "trades": [fill(trade)]}]}, [])
+    else:
+        app.record_attempt(settlement, {"unconfirmed": []}, [([fill(trade)], outcome["error"])])
+    assert queue.get(settlement["id"])["status"] == FAILED
+    [dead_letter] = queue.dead_letters()
+    return dead_letter
+
+
+def unconfirmed(result, trade):
+    '''The transfer outcome app.transfer_outcome makes of an unconfirmed send.'''
+    return {"netId": 1, "success": False, "unconfirmed": True, "error": result["error"],
+            "transactionHashes": result["transaction_hashes"], "signer": result["signer"],
+            "signerNonce": result["signer_nonce"],
+            "nonces": [[trade["party1"], TOKEN, 0], [trade["party2"], TOKEN, 0]]}
+
+
+def replay(dead_letter):
+    return asyncio.run(app.replay_dead_letter(json.dumps({"deadLetterId": dead_letter["id"]})))
+
+
+def test_unconfirmed_dead_letter_keeps_what_was_sent(chain, server, queue):
+    trade = make_trade("trade-0")
+    result = stalled_send(chain, server, trade)
+    dead_letter = give_up(queue, trade, unconfirmed(result, trade))
+    assert dead_letter["sent"]["transactionHashes"] == result["transaction_hashes"]
+    assert dead_letter["sent"]["signerNonce"] == 0
+
+
+def test_pending_dead_letter_is_not_replayed(chain, server, queue):
+    trade = make_trade("trade-0")
+    dead_letter = give_up(queue, trade, unconfirmed(stalled_send(chain, server, trade), trade))
+    with pytest.raises(HTTPException) as refused:
+        replay(dead_letter)
+    assert refused.value.status_code == 409 and "pending" in refused.value.detail
+    assert queue.get_dead_letter(dead_letter["id"])["replayedAs"] is None
+
+
+def test_mined_dead_letter_is_not_replayed(chain, server, queue):
+    trade = make_trade("trade-0")
+    dead_letter = give_up(queue, trade, unconfirmed(stalled_send(chain, server, trade), trade))
+    chain.min_fee = 0  # mined late
+    with pytest.raises(HTTPException) as refused:
+        replay(dead_letter)
+    assert "mined" in refused.value.detail
+    assert queue.counts()["queued"] == 0
+
+
+def test_dropped_dead_letter_is_replayed(chain, server, queue):
+    trade = make_trade("trade-0")
+    result = stalled_send(chain, server, trade)
+    dead_letter = give_up(queue, trade, unconfirmed(result, trade))
+    replace(chain, server, make_trade("trade-1"), result["signer_nonce"])
+
+    response = json.loads(replay(dead_letter).body)
+    assert queue.get(response["settlementId"])["trades"] == [fill(trade)]
+    assert queue.get_dead_letter(dead_letter["id"])["replayedAs"] == response["settlementId"]
+
+
+def test_lost_outcome_cannot_be_replayed(chain, server, queue):
+    trade = make_trade("trade-0")
+    outcome = {"netId": 1, "success": False, "unconfirmed": True, "error": "Settlement outcome unknown: boom"}
+    dead_letter = give_up(queue, trade, outcome)
+    assert "transactionHashes" not in dead_letter["sent"]
+    with pytest.raises(HTTPException) as refused:
+        replay(dead_letter)
+    assert "unknown" in refused.value.detail
+
+
+def test_permanent_failure_is_replayed(chain, server, queue):
+    trade = make_trade("trade-0")
+    dead_letter = give_up(queue, trade, {"error": "execution reverted: insufficient allowance"})
+    assert dead_letter["sent"] is None
+    assert json.loads(replay(dead_letter).body)["settlementId"] is not None
+    with pytest.raises(HTTPException) as refused:
+        replay(dead_letter)
+    assert refused.value.detail == "Dead letter already replayed"
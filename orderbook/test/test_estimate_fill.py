@@ -0,0 +1,75 @@
+from decimal import Decimal
+
+import pytest
+
+from orderbook import OrderBook
+from orderbook.test.conftest import order
+
+
+def book_with(*quotes):
+    '''A book resting (side, quantity, price) orders of 0xbbbb.'''
+    book = OrderBook()
+    for side, quantity, price in quotes:
+        book.process_order(order(side, quantity, price, "0xbbbb"), False, False)
+    return book
+
+
+def test_fill_within_the_best_level():
+    book = book_with(("ask", 2, 100), ("ask", 3, 101))
+    estimate = book.estimate_fill("bid", 1)
+    assert estimate == {
+        "quantity": Decimal(1),
+        "filled": Decimal(1),
+        "notional": Decimal(100),
+        "vwap": Decimal(100),
+        "worst_price": Decimal(100),
+        "levels": 1,
+        "complete": True,
+    }
+
+
+def test_fill_across_levels_is_priced_by_vwap():
+    book = book_with(("ask", 2, 100), ("ask", 3, 101), ("ask", 1, 105))
+    estimate = book.estimate_fill("bid", 4)
+    assert estimate["notional"] == 2 * 100 + 2 * 101
+    assert estimate["vwap"] == Decimal(402) / 4
+    assert (estimate["worst_price"], estimate["levels"], estimate["complete"]) == (101, 2, True)
+
+
+def test_asks_take_bids_from_the_highest_price():
+    book = book_with(("bid", 1, 98), ("bid", 1, 99))
+    estimate = book.estimate_fill("ask", 2)
+    assert (estimate["worst_price"], estimate["notional"], estimate["levels"]) == (98, 197, 2)
+
+
+def test_limit_price_caps_the_levels():
+    book = book_with(("ask", 2, 100), ("ask", 3, 101))
+    estimate = book.estimate_fill("bid", 4, limit_price="100")
+    assert (estimate["filled"], estimate["worst_price"], estimate["complete"]) == (2, 100, False)
+    assert book.estimate_fill("bid", 1, limit_price="99") is None
+
+
+def test_too_large_an_order_sweeps_every_level():
+    book = book_with(("ask", 2, 100), ("ask", 3, 101))
+    estimate = book.estimate_fill("bid", 10)
+    assert (estimate["filled"], estimate["levels"], estimate["complete"]) == (5, 2, False)
+
+
+def test_several_sizes_share_one_call():
+    book = book_with(("ask", 2, 100), ("ask", 3, 101))
+    small, large = book.estimate_fill("bid", [1, 5])
+    assert small["levels"] == 1 and large["levels"] == 2 and large["complete"]
+
+
+def test_estimates_follow_the_book_and_leave_it_alone():
+    book = book_with(("ask", 2, 100))
+    assert book.estimate_fill("bid", 1)["worst_price"] == 100
+    book.process_order(order("ask", 1, 99, "0xbbbb"), False, False)
+    assert book.estimate_fill("bid", 1)["worst_price"] == 99
+    assert len(book.asks) == 2
+
+
+def test_empty_side_and_bad_side():
+    assert book_with(("bid", 1, 99)).estimate_fill("bid", 1) is None
+    with pytest.raises(ValueError):
+        OrderBook().estimate_fill("buy", 1)
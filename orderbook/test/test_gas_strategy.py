@@ -0,0 +1,101 @@
+import asyncio
+
+from eth_account import Account
+
+from orderbook.test.bench_batch_settlement import TOKEN, build_call
+from orderbook.trade_settlement_client import GasStrategy
+
+GWEI = 10**9
+
+
+def settlement(index=0):
+    return {"party1": Account.create().address, "party2": Account.create().address, "token": TOKEN,
+            "trade_id": f"trade-{index}", "index": index}
+
+
+def test_estimates_are_cached_per_shape_and_resampled(chain, make_client):
+    client = make_client()
+    gas = GasStrategy(client.web3, sample_every=3)
+    function = build_call(client, settlement(), 0, 0)
+
+    async def estimate(times):
+        return [await gas.estimate(function, client.account.address) for _ in range(times)]
+
+    estimates = asyncio.run(estimate(4))
+    assert len(set(estimates)) == 1
+    # The first use and every third after it go to the node
+    assert client.web3.provider.calls["eth_estimateGas"] == 2
+    assert gas.stats()["cacheHits"] == 2 and gas.stats()["shapes"] == {"settleTradex1": estimates[0]}
+
+
+def test_expired_estimates_are_sampled_again(chain, make_client):
+    client = make_client()
+    gas = GasStrategy(client.web3, estimate_ttl=0)
+    function = build_call(client, settlement(), 0, 0)
+
+    async def estimate():
+        for _ in range(3):
+            await gas.estimate(function, client.account.address)
+
+    asyncio.run(estimate())
+    assert client.web3.provider.calls["eth_estimateGas"] == 3 and gas.hits == 0
+
+
+def test_cached_gas_is_the_largest_recent_sample():
+    gas = GasStrategy(None, window=2)
+    shape = ("aggregate3", 10)
+    for sample in (500, 300, 200):
+        gas.record(shape, sample)
+    # 500 left the window
+    assert gas.shapes[shape]["samples"] == [300, 200]
+    assert gas.stats()["shapes"] == {"aggregate3x10": 300}
+
+
+def test_eip1559_fees_from_fee_history(chain, make_client):
+    client = make_client()
+    chain.base_fee = 3 * GWEI
+    gas = GasStrategy(client.web3, fee_headroom=2)
+
+    async def fees():
+        return await gas.fees(), await gas.fees()
+
+    first, second = asyncio.run(fees())
+    # Twice the next base fee plus the median reward paid
+    assert first == second == {"maxFeePerGas": 7 * GWEI, "maxPriorityFeePerGas": GWEI}
+    assert gas.eip1559 is True
+    # Refreshed at most every fee_refresh seconds
+    assert client.web3.provider.calls["eth_feeHistory"] == 1
+
+
+def test_legacy_gas_price_without_a_base_fee(chain, make_client):
+    client = make_client()
+    chain.base_fee = 0
+    gas = GasStrategy(client.web3, fee_refresh=0)
+
+    assert asyncio.run(gas.fees()) == {"gasPrice": GWEI}
+    assert gas.eip1559 is False
+    assert client.web3.provider.calls["eth_gasPrice"] == 1
+
+
+def test_legacy_gas_price_when_fee_history_fails(chain, make_client, monkeypatch):
+    client = make_client()
+    answer = chain.answer
+
+    def without_fee_history(call):
+        if call["method"] == "eth_feeHistory":
+            return {"jsonrpc": "2.0", "id": call["id"], "error": {"code": -32601, "message": "method not found"}}
+        return answer(call)
+
+    monkeypatch.setattr(chain, "answer", without_fee_history)
+    gas = GasStrategy(client.web3)
+    assert asyncio.run(gas.fees()) == {"gasPrice": chain.base_fee + GWEI}
+    assert gas.eip1559 is False
+
+
+def test_bump_raises_every_fee_up_to_the_cap():
+    gas = GasStrategy(None, bump_ratio=1.125, max_fee=100)
+    assert gas.bump({"gasPrice": 80}) == {"gasPrice": 90}
+    assert gas.bump({"gasPrice": 90}) == {"gasPrice": 100}
+    bumped = gas.bump({"maxFeePerGas": 96, "maxPriorityFeePerGas": 95})
+    assert bumped == {"maxFeePerGas": 100, "maxPriorityFeePerGas": 100}
+    assert gas.stats()["bumps"] == 3
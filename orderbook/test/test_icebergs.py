@@ -0,0 +1,72 @@
+import json
+from decimal import Decimal
+
+from orderbook import OrderBook
+from orderbook.test.conftest import order
+
+
+def iceberg(side, quantity, price, display, account="0xbbbb"):
+    return order(side, quantity, price, account, display_quantity=str(display))
+
+
+def test_only_the_clip_is_displayed():
+    book = OrderBook()
+    result = book.process_order(iceberg("ask", 10, 100, 2), False, False)
+    resting = book.asks.get_order(result["data"][1]["order_id"])
+    assert (resting.quantity, resting.hidden_quantity, resting.total_quantity) == (2, 8, 10)
+    assert book.asks.price_map[Decimal(100)].volume == 2
+    assert book.to_arrays()["asks"]["volume"].tolist() == [2.0]
+
+
+def test_filled_clip_refills_behind_the_level():
+    book = OrderBook()
+    book.process_order(iceberg("ask", 5, 100, 2), False, False)
+    book.process_order(order("ask", 1, 100, "0xcccc"), False, False)
+    # Takes the whole first clip: the iceberg refills and loses its place to 0xcccc
+    trades = book.process_order(order("bid", 2, 100), False, False)["data"][0]
+    assert [(trade["quantity"], trade["party1"][3]) for trade in trades] == [(2, 2)]
+    assert [o.account for o in book.asks.min_price_list()] == ["0xcccc", "0xbbbb"]
+    assert book.queue_position(1)["orders_ahead"] == 1
+    assert book.asks.get_order(1).hidden_quantity == 1
+
+
+def test_sweep_trades_clip_after_clip():
+    book = OrderBook()
+    book.process_order(iceberg("ask", 5, 100, 2), False, False)
+    trades = book.process_order(order("bid", 5, None, type="market"), False, False)["data"][0]
+    assert [trade["quantity"] for trade in trades] == [2, 2, 1]
+    assert len(book.asks) == 0
+
+
+def test_partial_clip_fill_keeps_the_reserve():
+    book = OrderBook()
+    book.process_order(iceberg("bid", 6, 99, 3), False, False)
+    book.process_order(order("ask", 1, 99, "0xcccc"), False, False)
+    resting = book.bids.get_order(1)
+    assert (resting.quantity, resting.hidden_quantity) == (2, 3)
+
+
+def test_iceberg_taker_rests_its_remainder_as_an_iceberg():
+    book = OrderBook()
+    book.process_order(order("ask", 1, 100, "0xcccc"), False, False)
+    result = book.process_order(order("bid", 1, 100, display_quantity="1"), False, False)
+    assert len(result["data"][0]) == 1 and result["data"][1] is None
+
+    result = book.process_order(order("bid", 7, 99, display_quantity="3"), False, False)
+    resting = book.bids.get_order(result["data"][1]["order_id"])
+    assert (resting.quantity, resting.hidden_quantity) == (3, 4)
+
+
+def test_display_quantity_must_fit_the_order():
+    book = OrderBook()
+    for display in ("0", "11"):
+        assert not book.process_order(iceberg("ask", 10, 100, display), False, False)["success"]
+    assert len(book.asks) == 0
+
+
+def test_snapshot_keeps_the_reserve():
+    book = OrderBook()
+    book.process_order(iceberg("ask", 10, 100, 2), False, False)
+    restored = OrderBook.from_snapshot(json.loads(json.dumps(book.snapshot())))
+    resting = restored.asks.get_order(1)
+    assert (resting.quantity, resting.hidden_quantity, resting.display_quantity) == (2, 8, Decimal(2))
@@ -0,0 +1,42 @@
+import asyncio
+
+from eth_account import Account
+
+import app
+from orderbook.keystore import KeyStore
+from orderbook.settlement_queue import RETRYING
+
+
+def test_keeps_a_key_only_for_its_own_account():
+    owner, other = Account.create(), Account.create()
+    store = KeyStore()
+    assert store.remember(owner.address.lower(), owner.key.hex())
+    assert not store.remember(other.address, owner.key.hex())
+    assert not store.remember(owner.address, other.key.hex())  # cannot replace the owner's key
+    assert not store.remember(owner.address, "not a key")
+    assert store.get(owner.address) == owner.key.hex()
+    assert store.get(other.address) is None and len(store) == 1
+
+
+def test_attaches_keys_to_stored_trades():
+    seller, buyer = Account.create(), Account.create()
+    store = KeyStore([seller.key.hex()])
+    trades = [{"party1": [seller.address, "ask", 1, None], "party2": [buyer.address, "bid", None, None]}]
+    store.attach(trades)
+    assert trades[0]["party1"] == [seller.address, "ask", 1, None, seller.key.hex()]
+    assert trades[0]["party2"][4] is None
+
+
+def test_fills_wait_until_the_keys_of_their_accounts_are_known(monkeypatch, queue):
+    seller, buyer = Account.create(), Account.create()
+    monkeypatch.setattr(app, "settlement_queue", queue)
+    monkeypatch.setattr(app, "key_store", KeyStore([seller.key.hex()]))
+    fill = {"timestamp": 1, "price": 100.0, "quantity": 1.0, "time": 1,
+            "party1": [seller.address, "ask", 1, None], "party2": [buyer.address, "bid", None, None]}
+    settlement_id = queue.enqueue([fill], "SEI", "USDT")
+
+    asyncio.run(app.settle_claimed(queue.claim(1)))
+    settlement = queue.get(settlement_id)
+    assert settlement["status"] == RETRYING
+    assert settlement["trades"] == [fill]
+    assert app.settlement_retry.classify(f"Signing key of {buyer.address} not known yet") == "transient"
@@ -0,0 +1,56 @@
+from orderbook import OrderBook
+from orderbook.ladder import SideLadder
+from orderbook.test.conftest import order
+
+
+def book_with(*quotes):
+    '''A book resting (side, quantity, price) orders of 0xbbbb.'''
+    book = OrderBook()
+    for side, quantity, price in quotes:
+        book.process_order(order(side, quantity, price, "0xbbbb"), False, False)
+    return book
+
+
+def test_levels_best_price_first():
+    book = book_with(("bid", 1, 98), ("bid", 2, 99), ("bid", 1, 99), ("ask", 3, 101), ("ask", 1, 102))
+    ladder = book.to_arrays()
+    assert ladder["bids"]["price"].tolist() == [99.0, 98.0]
+    assert ladder["bids"]["volume"].tolist() == [3.0, 1.0]
+    assert ladder["bids"]["count"].tolist() == [2, 1]
+    assert ladder["asks"]["price"].tolist() == [101.0, 102.0]
+    assert "orders" not in ladder["asks"]
+
+
+def test_depth_limits_the_levels():
+    book = book_with(("ask", 1, 101), ("ask", 1, 102), ("ask", 1, 103))
+    assert book.to_arrays(depth=2)["asks"]["price"].tolist() == [101.0, 102.0]
+    assert book.to_arrays(depth=10)["asks"]["price"].tolist() == [101.0, 102.0, 103.0]
+
+
+def test_orders_in_priority_order():
+    book = book_with(("bid", 1, 98), ("bid", 2, 99), ("bid", 3, 99))
+    orders = book.to_arrays(orders=True)["bids"]["orders"]
+    assert orders["order_id"].tolist() == [2, 3, 1]
+    assert orders["price"].tolist() == [99.0, 99.0, 98.0]
+    assert orders["quantity"].tolist() == [2.0, 3.0, 1.0]
+    assert orders["level"].tolist() == [0, 0, 1]
+
+
+def test_unchanged_book_is_served_from_the_cache():
+    book = book_with(("ask", 1, 101))
+    first = book.to_arrays(orders=True)["asks"]
+    assert book.to_arrays(orders=True)["asks"] is first
+    book.process_order(order("ask", 2, 101, "0xbbbb"), False, False)
+    second = book.to_arrays(orders=True)["asks"]
+    assert second is not first
+    assert second["orders"]["quantity"].tolist() == [1.0, 2.0]
+
+
+def test_buffers_grow_with_the_book():
+    book = OrderBook()
+    book.ask_ladder = SideLadder(book.asks, reverse=False, capacity=2)
+    for price in range(100, 105):
+        book.process_order(order("ask", 1, price, "0xbbbb"), False, False)
+    ladder = book.to_arrays(orders=True)["asks"]
+    assert ladder["price"].tolist() == [100.0, 101.0, 102.0, 103.0, 104.0]
+    assert ladder["orders"]["order_id"].tolist() == [1, 2, 3, 4, 5]
@@ -0,0 +1,98 @@
+from decimal import Decimal
+
+from orderbook import OrderBook
+from orderbook.marketmaker import MarketMaker, simulate
+from orderbook.test.conftest import order
+
+MAKER = "0xmmmm"
+
+
+def quoting(schedule=None, **options):
+    '''A market maker of MAKER on a tick 1 book where others bid 90 and offer 110.'''
+    book = OrderBook(tick_size=1)
+    book.process_order(order("bid", 5, 90, "0xbbbb"), False, False)
+    book.process_order(order("ask", 5, 110, "0xbbbb"), False, False)
+    options.setdefault("levels", 2)
+    options.setdefault("half_spread", 2)
+    market_maker = MarketMaker(book, order("bid", 1, account=MAKER), schedule=schedule, **options)
+    market_maker.start()
+    return book, market_maker
+
+
+def ladder(market_maker):
+    return dict(
+        (side, [tuple(level) if level is not None else None for level in levels])
+        for side, levels in market_maker.report()["quotes"].items()
+    )
+
+
+def test_quotes_a_ladder_around_the_mid_of_the_others():
+    book, market_maker = quoting()
+    assert market_maker.requote(0) == 4
+    assert ladder(market_maker) == {"bid": [(98.0, 1.0), (97.0, 1.0)], "ask": [(102.0, 1.0), (103.0, 1.0)]}
+    assert book.get_best_bid() == 98 and book.get_best_ask() == 102
+    # Nothing changed, nothing to do
+    assert market_maker.requote(1000) == 0
+
+
+def test_fills_skew_the_quotes_against_the_inventory():
+    book, market_maker = quoting()
+    market_maker.requote(0)
+    book.process_order(order("ask", 1, 98, "0xcccc"), False, False)
+    market_maker.requote(1000)
+
+    report = market_maker.report()
+    assert (report["inventory"], report["cash"], report["fills"]) == (1.0, -98.0, 1)
+    # Long one lot: the reservation price moves down and the bids get smaller
+    assert report["reservationPrice"] == 99.8
+    assert ladder(market_maker)["bid"] == [(97.0, 0.9), (96.0, 0.9)]
+    assert ladder(market_maker)["ask"] == [(102.0, 1.0), (103.0, 1.0)]
+    assert report["updates"]["unchanged"] == 2
+
+
+def test_requotes_are_throttled_and_scheduled():
+    calls = []
+    book, market_maker = quoting(schedule=lambda delay, callback: calls.append((delay, callback)))
+    assert calls == [(0, market_maker.run_scheduled)]
+    market_maker.scheduled = False
+    market_maker.requote(1000)
+    book.process_order(order("bid", 1, 95, "0xcccc"), False, False)
+    assert len(calls) == 2 and market_maker.dirty
+    # The scheduled requote runs only 50ms after the last one, and is put off for the rest
+    market_maker.scheduled = False
+    assert market_maker.requote(1050) == 0
+    assert calls[-1][0] == 0.05
+
+
+def test_funds_cap_each_side_from_the_inside_out():
+    book, market_maker = quoting()
+    market_maker.set_funds({"bid": 150, "ask": 1})
+    market_maker.requote(0)
+    assert ladder(market_maker) == {"bid": [(98.0, 1.0), None], "ask": [(102.0, 1.0), None]}
+    assert market_maker.committed("bid") == 98 and market_maker.committed("ask") == 1
+    assert market_maker.report()["updates"]["unfunded"] == 2
+
+
+def test_stop_pulls_every_quote():
+    book, market_maker = quoting()
+    market_maker.requote(0)
+    market_maker.stop()
+    assert not market_maker.running and market_maker.on_event not in book.listeners
+    assert len(book.bids) == 1 and len(book.asks) == 1
+
+
+def test_simulate_replays_recorded_flow():
+    book = OrderBook(tick_size=1)
+    market_maker = MarketMaker(book, order("bid", 1, account=MAKER), levels=1, half_spread=2)
+    records = [
+        dict(order("bid", 5, 90, "0xbbbb"), timestamp=0, order_id=7),
+        dict(order("ask", 5, 110, "0xbbbb"), timestamp=1000),
+        dict(order("ask", 1, 98, "0xcccc"), timestamp=2000),
+        {"action": "cancel", "side": "bid", "order_id": 7, "timestamp": 3000},
+    ]
+    report = simulate(market_maker, records)
+    assert report["fills"] == 1 and report["inventory"] == 1.0
+    assert report["tradedVolume"] == 1.0
+    # The recorded bid was cancelled, and the quotes pulled
+    assert len(book.bids) == 0 and len(book.asks) == 1
+    assert market_maker.inventory == Decimal(1)
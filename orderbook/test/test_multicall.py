@@ -0,0 +1,110 @@
+import asyncio
+
+from eth_account import Account
+from web3 import Web3
+
+from orderbook.test.bench_batch_settlement import CONTRACT, HOLDING, QUOTE_TOKEN, TOKEN
+from orderbook.test.conftest import InMemorySyncProvider
+from orderbook.trade_settlement_client import (
+    MULTICALL3_ABI,
+    AllowanceChecker,
+    check_functions,
+    nonce_functions,
+)
+
+NO_CODE = "0x" + "42" * 20
+
+
+def order_reads(client, buyer, seller):
+    return check_functions(
+        client.contract, [(buyer, QUOTE_TOKEN, 10**18), (seller, TOKEN, 10**18)]
+    ) + nonce_functions(client.contract, [(buyer, TOKEN), (seller, TOKEN)])
+
+
+def expected_reads(chain, buyer, seller):
+    allowance, balance = chain.holdings.get((buyer.lower(), QUOTE_TOKEN.lower()), (HOLDING, HOLDING))
+    return [
+        [allowance >= 10**18, allowance],
+        [balance >= 10**18, balance],
+        [True, HOLDING],
+        [True, HOLDING],
+        chain.nonces.get((buyer.lower(), TOKEN.lower()), 0),
+        chain.nonces.get((seller.lower(), TOKEN.lower()), 0),
+    ]
+
+
+def test_reads_of_an_order_go_out_in_one_call(chain, make_client):
+    client = make_client()
+    buyer, seller = Account.create().address, Account.create().address
+    chain.holdings[(buyer.lower(), QUOTE_TOKEN.lower())] = (10**17, 3 * 10**18)
+    chain.nonces[(seller.lower(), TOKEN.lower())] = 4
+
+    results = asyncio.run(client.multicall(order_reads(client, buyer, seller)))
+    assert [list(result) if isinstance(result, tuple) else result for result in results] == (
+        expected_reads(chain, buyer, seller)
+    )
+    assert client.web3.provider.calls["eth_call"] == 1
+
+
+def test_failed_call_is_returned_as_its_exception(chain, make_client):
+    client = make_client()
+    user = Account.create().address
+    # No contract at NO_CODE: its call returns nothing, which does not decode
+    stray = client.web3.eth.contract(address=Web3.to_checksum_address(NO_CODE), abi=client.contract.abi)
+    functions = nonce_functions(client.contract, [(user, TOKEN)]) + nonce_functions(stray, [(user, TOKEN)])
+
+    results = asyncio.run(client.multicall(functions))
+    assert results[0] == 0
+    assert isinstance(results[1], Exception)
+
+
+def test_falls_back_to_separate_calls_without_multicall3(chain, make_client):
+    client = make_client()
+    client.multicall3 = client.web3.eth.contract(address=Web3.to_checksum_address(NO_CODE), abi=MULTICALL3_ABI)
+    buyer, seller = Account.create().address, Account.create().address
+    chain.nonces[(buyer.lower(), TOKEN.lower())] = 2
+
+    async def read_twice():
+        first = await client.multicall(order_reads(client, buyer, seller))
+        fallen_back = client.multicall3 is None
+        calls = client.web3.provider.calls["eth_call"]
+        second = await client.multicall(order_reads(client, buyer, seller))
+        return first, fallen_back, second, client.web3.provider.calls["eth_call"] - calls
+
+    first, fallen_back, second, calls = asyncio.run(read_twice())
+    expected = expected_reads(chain, buyer, seller)
+    for results in (first, second):
+        assert [list(result) if isinstance(result, (list, tuple)) else result for result in results] == expected
+    # Once Multicall3 turned out missing, reads go out one by one without trying it again
+    assert fallen_back
+    assert calls == len(expected)
+
+
+def test_batch_allowance_check(chain, checker):
+    owners = [Account.create().address for _ in range(3)]
+    chain.holdings[(owners[1].lower(), TOKEN.lower())] = (10, HOLDING)
+    chain.holdings[(owners[2].lower(), TOKEN.lower())] = (HOLDING, 10)
+    checks = [{"token": TOKEN, "owner": owner, "spender": CONTRACT, "required": 100} for owner in owners]
+
+    results = checker.batch_allowance_check(checks)
+    assert checker.web3.provider.calls["eth_call"] == 1
+    assert [(result["allowance_sufficient"], result["balance_sufficient"]) for result in results] == [
+        (True, True),
+        (False, True),
+        (True, False),
+    ]
+    assert results[1]["current_allowance"] == 10 and results[2]["current_balance"] == 10
+
+
+def test_batch_allowance_check_without_multicall3(chain):
+    checker = AllowanceChecker("http://stand-in", multicall_address=NO_CODE)
+    checker.web3.provider = InMemorySyncProvider(chain)
+    owner = Account.create().address
+    chain.holdings[(owner.lower(), TOKEN.lower())] = (10, HOLDING)
+
+    results = checker.batch_allowance_check(
+        [{"token": TOKEN, "owner": owner, "spender": CONTRACT, "required": 100}]
+    )
+    assert results[0]["allowance_sufficient"] is False
+    assert results[0]["balance_sufficient"] is True
+    assert checker.web3.provider.calls["eth_call"] == 1 + 2  # the failed multicall, then one per read
@@ -0,0 +1,86 @@
+from decimal import Decimal
+
+from orderbook.netting import SettlementNetter
+
+A, B, C = "0xAaaa", "0xBbbb", "0xCccc"
+
+
+def fill(seller, buyer, quantity, price, order_id=1, timestamp=1):
+    '''A fill as convert_trades returns it, the seller's order resting.'''
+    return {
+        "timestamp": timestamp,
+        "price": price,
+        "quantity": quantity,
+        "party1": [seller, "ask", order_id, None, seller + "-key"],
+        "party2": [buyer, "bid", None, None, buyer + "-key"],
+    }
+
+
+def test_fills_between_a_pair_net_to_one_transfer():
+    netter = SettlementNetter()
+    netter.add(fill(A, B, 3, 100.0), "SEI", "USDT")
+    netter.add(fill(B, A, 1, 102.0), "SEI", "USDT")
+    netter.add(fill(A, B, 2, 101.0), "SEI", "USDT")
+    result = netter.flush()
+    [transfer] = result["transfers"]
+    assert (transfer["seller"], transfer["buyer"]) == (A, B)
+    assert (transfer["seller_key"], transfer["buyer_key"]) == (A + "-key", B + "-key")
+    assert transfer["quantity"] == 4
+    # 300 + 202 - 102 quote for 4 base
+    assert transfer["price"] == Decimal(400) / 4
+    assert len(transfer["fills"]) == 3
+    assert result["fills"] == 3 and result["transactions"] == 1
+    assert abs(result["reduction_ratio"] - 2 / 3) < 1e-9
+    assert len(netter) == 0
+
+
+def test_net_price_stays_an_exact_decimal():
+    netter = SettlementNetter()
+    netter.add(fill(A, B, 1, 0.1), "SEI", "USDT")
+    netter.add(fill(A, B, 2, 0.2), "SEI", "USDT")
+    [transfer] = netter.flush()["transfers"]
+    assert transfer["quantity"] == Decimal(3)
+    assert transfer["price"] == Decimal("0.5") / 3
+    # Off by far less than a wei of the quote amount
+    assert abs(transfer["price"] * transfer["quantity"] - Decimal("0.5")) < Decimal("1e-24")
+
+
+def test_pairs_and_markets_are_netted_apart():
+    netter = SettlementNetter()
+    netter.add(fill(A, B, 1, 100.0), "SEI", "USDT")
+    netter.add(fill(A, C, 1, 100.0), "SEI", "USDT")
+    netter.add(fill(A, B, 1, 100.0), "ETH", "USDT")
+    result = netter.flush()
+    assert result["transactions"] == 3
+    assert result["reduction_ratio"] == 0.0
+
+
+def test_offsetting_fills_need_no_transaction():
+    netter = SettlementNetter()
+    netter.add(fill(A, B, 2, 100.0), "SEI", "USDT")
+    netter.add(fill(B, A, 2, 100.0), "SEI", "USDT")
+    result = netter.flush()
+    assert result["transfers"] == []
+    assert len(result["offsets"]) == 1 and len(result["offsets"][0]["fills"]) == 2
+    assert result["reduction_ratio"] == 1.0
+
+
+def test_nets_that_make_no_trade_pass_through_fill_by_fill():
+    netter = SettlementNetter()
+    # Base nets to zero but quote does not
+    netter.add(fill(A, B, 1, 100.0, order_id=7), "SEI", "USDT")
+    netter.add(fill(B, A, 1, 101.0, order_id=8), "SEI", "USDT")
+    transfers = netter.flush()["transfers"]
+    assert [(transfer["seller"], transfer["buyer"]) for transfer in transfers] == [(A, B), (B, A)]
+    assert [transfer["price"] for transfer in transfers] == [Decimal("100.0"), Decimal("101.0")]
+    assert [transfer["order_id"] for transfer in transfers] == [7, 8]
+
+
+def test_audit_keeps_the_fills_of_recent_transfers():
+    netter = SettlementNetter(max_audit=2)
+    for index in range(3):
+        netter.add(fill(A, B, 1, 100.0, timestamp=index), "SEI", "USDT")
+        netter.flush()
+    assert list(netter.audit) == [1, 2]
+    assert netter.audit[2][0]["timestamp"] == 2
+    assert netter.reduction_ratio() == 0.0
@@ -0,0 +1,81 @@
+import asyncio
+
+from eth_account import Account
+
+from orderbook.test.bench_batch_settlement import TOKEN, build_call
+from orderbook.trade_settlement_client import NonceManager
+
+
+def settlement(index):
+    return {"party1": Account.create().address, "party2": Account.create().address, "token": TOKEN,
+            "trade_id": f"trade-{index}", "index": index}
+
+
+def test_reserve_counts_up_from_one_chain_read(chain, make_client):
+    client = make_client()
+    address = Account.create().address
+    chain.sender_nonces[address.lower()] = 5
+    nonces = NonceManager(client.web3, address)
+
+    async def reserve():
+        return await asyncio.gather(*[nonces.reserve() for _ in range(3)])
+
+    assert sorted(asyncio.run(reserve())) == [5, 6, 7]
+    assert client.web3.provider.calls["eth_getTransactionCount"] == 1
+    assert set(nonces.pending) == {5, 6, 7}
+    nonces.sent(5, "0x01")
+    nonces.confirm(5)
+    assert nonces.stats()["pending"] == 2 and nonces.stats()["nextNonce"] == 8
+
+
+def test_release_takes_back_only_the_last_nonce(chain, make_client):
+    client = make_client()
+    nonces = NonceManager(client.web3, Account.create().address)
+
+    async def reserve_and_release():
+        first = await nonces.reserve()
+        second = await nonces.reserve()
+        nonces.release(second)
+        assert await nonces.reserve() == second
+        # Releasing an earlier one leaves a gap: the next reserve reads the chain again
+        nonces.release(first)
+        assert nonces.next_nonce is None
+        return await nonces.reserve()
+
+    assert asyncio.run(reserve_and_release()) == 0
+    assert client.web3.provider.calls["eth_getTransactionCount"] == 2
+
+
+def test_sync_forgets_nonces_the_chain_has_used(chain, make_client):
+    client = make_client()
+    address = Account.create().address
+    nonces = NonceManager(client.web3, address)
+
+    async def reserve_and_sync():
+        for _ in range(3):
+            await nonces.reserve()
+        chain.sender_nonces[address.lower()] = 2
+        return await nonces.sync()
+
+    assert asyncio.run(reserve_and_sync()) == 2
+    assert set(nonces.pending) == {2}
+
+
+def test_send_resyncs_after_a_nonce_error(chain, make_client):
+    client = make_client()
+    operator = client.account.address.lower()
+
+    async def send_twice():
+        first = await client.send_transaction(build_call(client, settlement(0), 0, 0), timeout=5)
+        # Another process sends from the same key behind our back
+        chain.sender_nonces[operator] += 2
+        chain.mined_nonces[operator] = chain.sender_nonces[operator]
+        second = await client.send_transaction(build_call(client, settlement(1), 0, 0), timeout=5)
+        return first, second
+
+    first, second = asyncio.run(send_twice())
+    assert first["success"] and second["success"]
+    nonces = client.signers.lanes[0].nonces
+    assert nonces.resyncs == 1
+    assert chain.sender_nonces[operator] == 4 and nonces.next_nonce == 4
+    assert chain.settled == {"trade-0": 1, "trade-1": 1}
@@ -0,0 +1,84 @@
+from decimal import Decimal
+
+from orderbook import OrderBook
+from orderbook.test.conftest import order
+
+
+def book_with(*asks):
+    '''A book resting (quantity, price) asks of 0xbbbb in the given order.'''
+    book = OrderBook()
+    for quantity, price in asks:
+        book.process_order(order("ask", quantity, price, "0xbbbb"), False, False)
+    return book
+
+
+def resting(book):
+    return [(o["side"], o["quantity"], o["price"]) for o in book.snapshot()["orders"]]
+
+
+def test_limit_orders_larger_than_the_best_order_are_rejected():
+    book = book_with((1, 100), (1, 101))
+    result = book.process_order(order("bid", 2, 101), False, False)
+    assert not result["success"]
+    assert "larger than best order" in result["message"]
+    assert len(book.tape) == 0
+
+
+def test_ioc_walks_the_book_and_cancels_the_rest():
+    book = book_with((1, 100), (1, 101), (1, 102))
+    result = book.process_order(order("bid", 3, 101, type="ioc"), False, False)
+    assert result["success"]
+    trades, order_in_book, task_id, next_best = result["data"]
+    assert [(t["price"], t["quantity"]) for t in trades] == [
+        (Decimal("100"), Decimal("1")),
+        (Decimal("101"), Decimal("1")),
+    ]
+    assert order_in_book is None and task_id == 4
+    assert next_best.price == Decimal("102")
+    # The unfilled unit never rests
+    assert resting(book) == [("ask", "1", "102")]
+
+
+def test_ioc_no_larger_than_the_best_order_fills_as_a_limit_order():
+    book = book_with((2, 100))
+    result = book.process_order(order("bid", 1, 100, type="ioc"), False, False)
+    assert result["success"] and len(result["data"][0]) == 1 and result["data"][2] == 3
+    assert resting(book) == [("ask", "1", "100")]
+
+
+def test_ioc_with_nothing_to_match_is_rejected():
+    book = book_with((1, 100))
+    result = book.process_order(order("bid", 1, 99, type="ioc"), False, False)
+    assert not result["success"]
+    assert resting(book) == [("ask", "1", "100")]
+
+
+def test_fok_fills_in_full_across_levels():
+    book = book_with((1, 100), (1, 101))
+    result = book.process_order(order("bid", 2, 101, type="fok"), False, False)
+    assert result["success"] and len(result["data"][0]) == 2
+    assert resting(book) == []
+
+
+def test_fok_that_cannot_fill_in_full_leaves_the_book_alone():
+    book = book_with((1, 100), (1, 101))
+    result = book.process_order(order("bid", 3, 101, type="fok"), False, False)
+    assert not result["success"]
+    assert len(book.tape) == 0
+    assert resting(book) == [("ask", "1", "100"), ("ask", "1", "101")]
+
+
+def test_post_only_rests_unless_it_would_cross():
+    book = book_with((1, 100))
+    assert not book.process_order(order("bid", 1, 100, type="post_only"), False, False)["success"]
+    result = book.process_order(order("bid", 1, 99, type="post_only"), False, False)
+    assert result["success"] and result["data"][1] is not None
+    assert resting(book) == [("bid", "1", "99"), ("ask", "1", "100")]
+
+
+def test_ioc_and_fok_are_rejected_in_auction_mode():
+    book = book_with((1, 100))
+    book.set_matching_mode("auction")
+    for order_type in ("ioc", "fok"):
+        result = book.process_order(order("bid", 1, 100, type=order_type), False, False)
+        assert not result["success"]
@@ -0,0 +1,78 @@
+from decimal import Decimal
+
+from orderbook import OrderBook
+from orderbook.test.conftest import order
+
+PEGGER = "0xPeg0"
+
+
+def peg(side, quantity, reference, offset=0, limit=None, account=PEGGER):
+    return order(side, quantity, limit, account, type="pegged", peg_reference=reference, peg_offset=str(offset))
+
+
+def book_at(bid, ask):
+    book = OrderBook(tick_size=1)
+    book.process_order(order("bid", 5, bid, "0xbid0"), False, False)
+    book.process_order(order("ask", 5, ask, "0xask0"), False, False)
+    return book
+
+
+def test_pegs_follow_their_reference_as_one_group():
+    book = book_at(85, 95)
+    ids = [book.process_order(peg("bid", 1, "best_bid"), False, False)["data"][1]["order_id"] for _ in range(3)]
+    assert book.bids.get_order(ids[0]).price == Decimal(85)
+    assert len(book.bids.peg_groups) == 1
+
+    book.process_order(order("bid", 1, 90, "0xbid1"), False, False)
+    assert [book.bids.get_order(order_id).price for order_id in ids] == [Decimal(90)] * 3
+    # Behind the order that moved the reference, in time priority among themselves
+    position = book.queue_position(ids[2])
+    assert (position["orders_ahead"], position["volume_ahead"]) == (3, 3)
+
+
+def test_offset_mid_and_limit():
+    book = book_at(80, 90)
+    low = book.process_order(peg("bid", 1, "mid", offset=-2), False, False)["data"][1]
+    capped = book.process_order(peg("ask", 1, "best_bid", offset=1, limit=84), False, False)["data"][1]
+    assert low["price"] == Decimal(83)
+    assert capped["price"] == Decimal(84)  # best bid + 1 is below its limit
+
+
+def test_pegs_never_cross():
+    book = book_at(85, 86)
+    pegged = book.process_order(peg("bid", 1, "best_ask"), False, False)["data"][1]
+    assert pegged["price"] == Decimal(85)
+    assert len(book.tape) == 0
+
+
+def test_price_of_a_pegged_order_before_it_is_added():
+    book = book_at(85, 95)
+    assert book.pegged_order_price(peg("bid", 1, "mid")) == Decimal(90)
+    assert book.pegged_order_price(peg("bid", 1, "nowhere")) is None
+    assert len(book.bids) == 1
+
+
+def test_reservation_moves_with_a_group_without_limit():
+    book = book_at(85, 95)
+    first = book.process_order(peg("bid", 1, "best_bid"), False, False)["data"][1]
+    assert book.bids.reserved_by(PEGGER) == (1, 85)
+
+    reference = book.process_order(order("bid", 1, 90, "0xbid1"), False, False)["data"][1]
+    assert book.bids.reserved_by(PEGGER) == (1, 90)
+    second = book.process_order(peg("bid", 2, "best_bid", account=PEGGER.lower()), False, False)["data"][1]
+    assert book.bids.reserved_by(PEGGER) == (3, 270)
+
+    book.cancel_order("bid", reference["order_id"])
+    assert book.bids.reserved_by(PEGGER) == (3, 255)
+    book.cancel_order("bid", first["order_id"])
+    book.cancel_order("bid", second["order_id"])
+    assert book.bids.reserved_by(PEGGER) == (0, 0)
+    assert book.bids.reserved_by("0xbid0") == (5, 425)
+
+
+def test_reservation_of_a_group_with_limit_stays_at_the_limit():
+    book = book_at(85, 95)
+    book.process_order(peg("bid", 1, "best_bid", limit=88), False, False)
+    assert book.bids.reserved_by(PEGGER) == (1, 88)
+    book.process_order(order("bid", 1, 87, "0xbid1"), False, False)
+    assert book.bids.reserved_by(PEGGER) == (1, 88)
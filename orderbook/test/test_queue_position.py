@@ -0,0 +1,72 @@
+import random
+from decimal import Decimal
+
+from orderbook import OrderBook
+from orderbook.test.conftest import order
+
+
+def walked(book, order_id):
+    '''Orders and volume ahead of order_id, counted the slow way from the head of its level.'''
+    resting = book.bids.get_order(order_id)
+    orders_ahead, volume_ahead = 0, Decimal(0)
+    current = resting.order_list.get_head_order()
+    while current is not resting:
+        orders_ahead += 1
+        volume_ahead += current.quantity
+        current = current.next_order
+    return orders_ahead, volume_ahead
+
+
+def test_position_counts_the_orders_ahead():
+    book = OrderBook()
+    for quantity in (1, 2, 3):
+        book.process_order(order("bid", quantity, 99), False, False)
+    book.process_order(order("bid", 5, 98), False, False)
+
+    position = book.queue_position(3)
+    assert position == {
+        "side": "bid",
+        "price": Decimal(99),
+        "orders_ahead": 2,
+        "volume_ahead": 3,
+        "level_orders": 3,
+        "level_volume": 6,
+    }
+    assert book.queue_position(1)["orders_ahead"] == 0
+    assert book.queue_position(4)["level_volume"] == 5
+    assert book.queue_position(99) is None
+
+
+def test_fills_cancels_and_larger_sizes_move_the_queue():
+    book = OrderBook()
+    for quantity in (2, 2, 2):
+        book.process_order(order("bid", quantity, 99), False, False)
+    # A partial fill of the head and a cancel in the middle
+    book.process_order(order("ask", 1, 99, "0xbbbb"), False, False)
+    book.cancel_order("bid", 2)
+    assert (book.queue_position(3)["orders_ahead"], book.queue_position(3)["volume_ahead"]) == (1, 1)
+    # A larger size loses time priority
+    book.modify_order(1, {"side": "bid", "price": Decimal(99), "quantity": Decimal(3)})
+    assert (book.queue_position(1)["orders_ahead"], book.queue_position(1)["volume_ahead"]) == (1, 2)
+    assert book.queue_position(3)["orders_ahead"] == 0
+
+
+def test_positions_match_a_walk_after_random_changes():
+    book = OrderBook()
+    rng = random.Random(11)
+    for _ in range(500):
+        roll = rng.random()
+        if book.bids and roll < 0.25:
+            book.cancel_order("bid", rng.choice(list(book.bids.order_map)))
+        elif book.bids and roll < 0.4:
+            order_id = rng.choice(list(book.bids.order_map))
+            resting = book.bids.get_order(order_id)
+            quantity = resting.quantity + rng.choice([-1, 1]) if resting.quantity > 1 else Decimal(2)
+            book.modify_order(order_id, {"side": "bid", "price": resting.price, "quantity": quantity})
+        elif book.bids and roll < 0.5:
+            book.process_order(order("ask", 1, 90, "0xbbbb"), False, False)
+        else:
+            book.process_order(order("bid", rng.randint(1, 3), rng.choice([98, 99])), False, False)
+        for order_id in book.bids.order_map:
+            position = book.queue_position(order_id)
+            assert (position["orders_ahead"], position["volume_ahead"]) == walked(book, order_id)
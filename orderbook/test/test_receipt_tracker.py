@@ -0,0 +1,148 @@
+import asyncio
+
+from eth_account import Account
+
+from orderbook.test.bench_batch_settlement import TOKEN, build_call
+from orderbook.trade_settlement_client import ReceiptTracker
+
+
+def receipt(tx_hash, block_number, fork=0, status=1):
+    '''A raw receipt of tx_hash mined in block_number of the given fork.'''
+    return {
+        "transactionHash": tx_hash,
+        "transactionIndex": "0x0",
+        "blockHash": "0x" + (fork * 2**32 + block_number).to_bytes(32, "big").hex(),
+        "blockNumber": hex(block_number),
+        "from": "0x" + "00" * 20,
+        "to": "0x" + "00" * 20,
+        "cumulativeGasUsed": "0x5208",
+        "gasUsed": "0x5208",
+        "effectiveGasPrice": hex(10**9),
+        "contractAddress": None,
+        "logs": [],
+        "logsBloom": "0x" + "00" * 256,
+        "status": hex(status),
+        "type": "0x0",
+    }
+
+
+def hand_polled(client, confirmations):
+    '''A tracker whose loop never starts, polled by the test instead.'''
+    tracker = ReceiptTracker(client.web3, confirmations)
+    tracker.task = asyncio.get_running_loop().create_future()
+    return tracker
+
+
+def test_resolves_sent_transactions(chain, make_client):
+    client = make_client()
+
+    async def send_and_wait():
+        trades = [
+            {"party1": Account.create().address, "party2": Account.create().address, "token": TOKEN,
+             "trade_id": f"trade-{index}", "index": index}
+            for index in range(5)
+        ]
+        results = await asyncio.gather(
+            *[client.send_transaction(build_call(client, trade, 0, 0), timeout=5) for trade in trades]
+        )
+        return results, client.receipts.stats()
+
+    results, stats = asyncio.run(send_and_wait())
+    assert all(result["success"] for result in results)
+    assert stats["resolved"] == 5 and stats["watching"] == 0
+    # Receipts are fetched in batches per block, not polled per transaction
+    assert stats["rpcCalls"] < 5 * 2
+
+
+def test_waits_for_confirmations(chain, make_client):
+    client = make_client()
+    tx_hash = "0x" + "ab" * 32
+
+    async def follow():
+        tracker = hand_polled(client, confirmations=2)
+        future = tracker.watch(tx_hash)
+        chain.block_number = 10
+        await tracker.poll()
+        assert not future.done()  # not mined
+
+        chain.receipts[tx_hash] = receipt(tx_hash, 10)
+        chain.block_number = 11
+        await tracker.poll()
+        assert not future.done()  # one block deep
+
+        chain.block_number = 12
+        await tracker.poll()
+        assert future.done()
+        return future.result()
+
+    mined = asyncio.run(follow())
+    assert mined.blockNumber == 10 and mined.status == 1
+
+
+def test_reorganised_out_transaction_goes_back_to_waiting(chain, make_client):
+    client = make_client()
+    tx_hash = "0x" + "cd" * 32
+
+    async def follow():
+        tracker = hand_polled(client, confirmations=2)
+        future = tracker.watch(tx_hash)
+        chain.receipts[tx_hash] = receipt(tx_hash, 20)
+        chain.block_number = 20
+        await tracker.poll()
+        assert tracker.watched[tx_hash]["receipt"].blockNumber == 20
+
+        # Block 20 is replaced, the transaction is not in the new one
+        del chain.receipts[tx_hash]
+        chain.block_number = 22
+        await tracker.poll()
+        assert not future.done()
+        assert tracker.watched[tx_hash]["receipt"] is None
+
+        # Mined again on the new fork
+        chain.receipts[tx_hash] = receipt(tx_hash, 23, fork=1)
+        chain.block_number = 23
+        await tracker.poll()
+        assert not future.done()
+        chain.block_number = 25
+        await tracker.poll()
+        return future.result()
+
+    mined = asyncio.run(follow())
+    assert mined.blockNumber == 23
+    assert mined.blockHash == bytes.fromhex(receipt("", 23, fork=1)["blockHash"][2:])
+
+
+def test_receipt_moved_to_another_block_is_checked_again(chain, make_client):
+    client = make_client()
+    tx_hash = "0x" + "ef" * 32
+
+    async def follow():
+        tracker = hand_polled(client, confirmations=1)
+        future = tracker.watch(tx_hash)
+        chain.receipts[tx_hash] = receipt(tx_hash, 30)
+        chain.block_number = 30
+        await tracker.poll()
+        # At depth the receipt comes from another block: not confirmed yet
+        chain.receipts[tx_hash] = receipt(tx_hash, 31, fork=1)
+        chain.block_number = 31
+        await tracker.poll()
+        assert not future.done()
+        chain.block_number = 32
+        await tracker.poll()
+        return future.result()
+
+    assert asyncio.run(follow()).blockNumber == 31
+
+
+def test_forget_cancels_the_wait(chain, make_client):
+    client = make_client()
+    tx_hash = "0x" + "12" * 32
+
+    async def forget():
+        tracker = hand_polled(client, confirmations=0)
+        future = tracker.watch(tx_hash)
+        tracker.forget(tx_hash)
+        return future, len(tracker)
+
+    future, watching = asyncio.run(forget())
+    assert future.cancelled() and watching == 0
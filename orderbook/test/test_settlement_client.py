@@ -0,0 +1,128 @@
+import asyncio
+
+from eth_account import Account
+
+from orderbook.test.bench_batch_settlement import HOLDING, QUOTE_TOKEN, TOKEN, build_call
+
+
+def test_reads_allowance_balance_and_nonces(chain, make_client):
+    client = make_client()
+    user, other = Account.create().address, Account.create().address
+    chain.holdings[(user.lower(), QUOTE_TOKEN.lower())] = (5, 10**18)
+    chain.nonces[(user.lower(), TOKEN.lower())] = 7
+
+    async def read():
+        return (
+            await client.check_allowance_and_balance(user, QUOTE_TOKEN, 10**17),
+            await client.check_allowance_and_balance(other, QUOTE_TOKEN, 10**17),
+            await client.get_user_nonces([user, other], TOKEN),
+        )
+
+    (allowance, balance), (other_allowance, other_balance), nonces = asyncio.run(read())
+    assert allowance == (False, 5)
+    assert balance == (True, 10**18)
+    assert other_allowance == (True, HOLDING) and other_balance == (True, HOLDING)
+    assert nonces == [7, 0]
+
+
+def test_send_transaction_signs_with_consecutive_nonces(chain, make_client):
+    client = make_client()
+    trades = [
+        {"party1": Account.create().address, "party2": Account.create().address, "token": TOKEN,
+         "trade_id": f"trade-{index}", "index": index}
+        for index in range(3)
+    ]
+
+    async def send():
+        return await asyncio.gather(
+            *[client.send_transaction(build_call(client, trade, 0, 0), timeout=5) for trade in trades]
+        )
+
+    results = asyncio.run(send())
+    assert all(result["success"] for result in results)
+    assert len(set(result["transaction_hash"] for result in results)) == 3
+    assert chain.sender_nonces[client.account.address.lower()] == 3
+    assert chain.settled == {"trade-0": 1, "trade-1": 1, "trade-2": 1}
+
+
+def stalled_send(chain, client, trade, gas_estimate=None):
+    '''Send the settlement of trade while the stand-in mines nothing, returning its unconfirmed result.'''
+    chain.min_fee = 10**30
+    result = asyncio.run(
+        client.send_transaction(build_call(client, trade, 0, 0), timeout=0.3, gas_estimate=gas_estimate)
+    )
+    assert not result["success"] and result["unconfirmed"]
+    assert "not confirmed" in result["error"]
+    assert len(result["transaction_hashes"]) == 1 and result["signer_nonce"] == 0
+    return result
+
+
+def check_sent(client, result, trade):
+    return asyncio.run(
+        client.check_sent(
+            result["transaction_hashes"],
+            result["signer"],
+            result["signer_nonce"],
+            [(trade["party1"], TOKEN, 0), (trade["party2"], TOKEN, 0)],
+        )
+    )
+
+
+def replace(chain, client, trade, nonce):
+    '''Send the settlement of trade with the given operator nonce and higher fees, and mine it.'''
+
+    async def send():
+        fields = {"from": client.account.address, "gas": 200000, "nonce": nonce}
+        fields.update(await client.gas.fees())
+        transaction = await build_call(client, trade, 0, 0).build_transaction(fields)
+        transaction = client.gas.bump(client.gas.bump(transaction))
+        signed = client.web3.eth.account.sign_transaction(transaction, client.account.key)
+        await client.web3.eth.send_raw_transaction(signed.raw_transaction)
+
+    asyncio.run(send())
+    chain.min_fee = 0
+
+
+def make_trade(trade_id, party1=None, party2=None):
+    return {"party1": party1 or Account.create().address, "party2": party2 or Account.create().address,
+            "token": TOKEN, "trade_id": trade_id, "index": 0}
+
+
+def test_unconfirmed_send_is_pending_until_mined(chain, make_client):
+    client = make_client()
+    trade = make_trade("trade-0")
+    result = stalled_send(chain, client, trade)
+    assert check_sent(client, result, trade) == ("pending", None)
+    assert chain.settled == {}
+
+    chain.min_fee = 0
+    status, receipt = check_sent(client, result, trade)
+    assert status == "mined" and receipt.status == 1
+    assert chain.settled == {"trade-0": 1}
+
+
+def test_unconfirmed_send_that_reverted(chain, make_client):
+    client = make_client()
+    trade = make_trade("reject-0")
+    result = stalled_send(chain, client, trade, gas_estimate=100000)
+    chain.min_fee = 0
+    status, receipt = check_sent(client, result, trade)
+    assert status == "reverted" and receipt.status == 0
+
+
+def test_unconfirmed_send_replaced_by_another_trade_was_dropped(chain, make_client):
+    client = make_client()
+    trade = make_trade("trade-0")
+    result = stalled_send(chain, client, trade)
+    replace(chain, client, make_trade("trade-1"), result["signer_nonce"])
+    assert check_sent(client, result, trade) == ("dropped", None)
+    assert chain.settled == {"trade-1": 1}
+
+
+def test_unconfirmed_send_whose_parties_nonces_moved_is_unknown(chain, make_client):
+    client = make_client()
+    trade = make_trade("trade-0")
+    result = stalled_send(chain, client, trade)
+    # Not a copy we know of, but it spent the parties' signed nonces
+    replace(chain, client, make_trade("trade-0-copy", trade["party1"], trade["party2"]), result["signer_nonce"])
+    assert check_sent(client, result, trade) == ("unknown", None)
@@ -0,0 +1,123 @@
+import json
+import time
+
+from orderbook.settlement_queue import (
+    FAILED,
+    QUEUED,
+    RETRYING,
+    SETTLED,
+    SETTLING,
+    SettlementQueue,
+)
+
+
+def fill(index, keys=False):
+    '''A converted trade, as stored (without keys) unless keys.'''
+    party1 = ["0xseller", "ask", index, None] + (["seller-key"] if keys else [])
+    party2 = ["0xbuyer", "bid", None, None] + (["buyer-key"] if keys else [])
+    return {"timestamp": index, "price": 100.0, "quantity": 1.0, "party1": party1, "party2": party2}
+
+
+def test_claims_oldest_first_and_completes(queue):
+    ids = [queue.enqueue([fill(index, keys=True)], "SEI", "USDT") for index in range(3)]
+    claimed = queue.claim(2)
+    assert [settlement["id"] for settlement in claimed] == ids[:2]
+    assert all(settlement["status"] == SETTLING and settlement["attempts"] == 1 for settlement in claimed)
+    assert claimed[0]["trades"] == [fill(0)] and claimed[0]["baseAsset"] == "SEI"
+
+    queue.complete(ids[0], SETTLED, {"transfers": []})
+    queue.complete(ids[1], FAILED, {"error": "reverted"})
+    assert queue.get(ids[0])["status"] == SETTLED
+    assert queue.get(ids[1])["result"] == {"error": "reverted"}
+    assert queue.counts() == {QUEUED: 1, SETTLING: 0, RETRYING: 0, SETTLED: 1, FAILED: 1, "deadLetters": 0}
+
+
+def test_retry_waits_for_its_backoff(queue):
+    settlement_id = queue.enqueue([fill(0), fill(1)], "SEI", "USDT")
+    queue.claim(1, 1)
+    queue.retry(settlement_id, [fill(1)], {"transfers": []}, delay=0.2)
+    assert queue.get(settlement_id)["status"] == RETRYING
+    assert queue.claim(10, 10) == []
+
+    time.sleep(0.25)
+    claimed = queue.claim(10, 10)
+    assert [settlement["id"] for settlement in claimed] == [settlement_id]
+    assert claimed[0]["trades"] == [fill(1)]  # only what is left to settle
+    assert claimed[0]["attempts"] == 2
+
+
+def test_retries_take_at_most_their_share_of_a_claim(queue):
+    retries = [queue.enqueue([fill(index)], "SEI", "USDT") for index in range(3)]
+    queue.claim(3)
+    for settlement_id in retries:
+        queue.retry(settlement_id, [fill(0)], {}, delay=0)
+    new = [queue.enqueue([fill(index)], "SEI", "USDT") for index in range(3)]
+    claimed = [settlement["id"] for settlement in queue.claim(4, 1)]
+    assert claimed == retries[:1] + new
+
+
+def test_dead_letters_are_replayed_once(queue):
+    settlement_id = queue.enqueue([fill(0), fill(1)], "SEI", "USDT")
+    queue.claim(1)
+    queue.complete(settlement_id, FAILED, {}, [{"trades": [fill(1)], "error": "execution reverted"}])
+    [dead_letter] = queue.dead_letters()
+    assert dead_letter["settlementId"] == settlement_id
+    assert dead_letter["trades"] == [fill(1)] and dead_letter["attempts"] == 1
+    assert queue.counts()["deadLetters"] == 1
+
+    replayed = queue.replay(dead_letter["id"])
+    assert queue.get(replayed)["status"] == QUEUED
+    assert queue.get(replayed)["trades"] == [fill(1)]
+    assert queue.replay(dead_letter["id"]) is None
+    assert queue.dead_letters() == []
+    assert queue.dead_letters(replayed=True)[0]["replayedAs"] == replayed
+
+
+def test_recovers_settlements_of_a_crashed_run(tmp_path):
+    path = str(tmp_path / "settlements.db")
+    queue = SettlementQueue(path)
+    settlement_id = queue.enqueue([fill(0)], "SEI", "USDT")
+    queue.claim(1)
+    queue.close()
+
+    reopened = SettlementQueue(path)
+    try:
+        assert reopened.get(settlement_id)["status"] == SETTLING
+        assert reopened.recover() == 1
+        [claimed] = reopened.claim(1)
+        assert claimed["id"] == settlement_id and claimed["attempts"] == 2
+    finally:
+        reopened.close()
+
+
+def test_signing_keys_are_never_stored(queue):
+    settlement_id = queue.enqueue([fill(0, keys=True), fill(1, keys=True)], "SEI", "USDT")
+    queue.claim(1)
+    unconfirmed = {"transfer": {"netId": 1, "error": "sent but not confirmed"}, "trades": [fill(1, keys=True)]}
+    queue.retry(settlement_id, [fill(0, keys=True)], {"unconfirmed": [unconfirmed]}, 0,
+                [{"trades": [fill(0, keys=True)], "error": "execution reverted"}])
+    queue.claim(1, 1)
+    queue.complete(settlement_id, FAILED, {"unconfirmed": [unconfirmed]})
+    with queue.lock:
+        stored = [row[0] for row in queue.db.execute("SELECT trades FROM settlements UNION ALL"
+                                                     " SELECT result FROM settlements UNION ALL"
+                                                     " SELECT trades FROM dead_letters")]
+    assert not any("-key" in text for text in stored)
+    assert queue.get(settlement_id)["result"]["unconfirmed"][0]["trades"] == [fill(1)]
+
+
+def test_keys_stored_by_an_earlier_version_are_dropped(tmp_path):
+    path = str(tmp_path / "settlements.db")
+    queue = SettlementQueue(path)
+    settlement_id = queue.enqueue([fill(0)], "SEI", "USDT")
+    with queue.lock:
+        queue.db.execute("UPDATE settlements SET trades = ? WHERE id = ?",
+                         (json.dumps([fill(0, keys=True)]), settlement_id))
+        queue.db.execute("PRAGMA user_version = 0")
+    queue.close()
+
+    reopened = SettlementQueue(path)
+    try:
+        assert reopened.get(settlement_id)["trades"] == [fill(0)]
+    finally:
+        reopened.close()
@@ -0,0 +1,40 @@
+import random
+
+from orderbook.settlement_retry import PERMANENT, TRANSIENT, UNKNOWN, RetryPolicy
+
+
+def test_classifies_errors_by_message():
+    assert RetryPolicy.classify("execution reverted: insufficient allowance") == PERMANENT
+    assert RetryPolicy.classify("Unknown format '0x12', attempted to normalize to '0x12'") == PERMANENT
+    assert RetryPolicy.classify("No private key available for transaction signing") == PERMANENT
+    assert RetryPolicy.classify("HTTPConnectionPool: Read timed out") == TRANSIENT
+    assert RetryPolicy.classify("nonce too low") == TRANSIENT
+    assert RetryPolicy.classify(None) == TRANSIENT
+    # Sent, possibly mined: neither retried blindly nor given up on
+    assert RetryPolicy.classify("Transaction ab12 sent but not confirmed after 120 seconds") == UNKNOWN
+    assert RetryPolicy.classify("Settlement outcome unknown: execution reverted") == UNKNOWN
+
+
+def test_retries_until_attempts_are_used_up():
+    policy = RetryPolicy(max_attempts=3)
+    assert policy.should_retry("connection reset", 1)
+    assert policy.should_retry("sent but not confirmed", 2)
+    assert not policy.should_retry("connection reset", 3)
+    assert not policy.should_retry("execution reverted", 1)
+    stats = policy.stats()
+    assert (stats["transientErrors"], stats["permanentErrors"], stats["unknownErrors"]) == (2, 1, 1)
+
+
+def test_backoff_is_capped_and_jittered():
+    random.seed(1)
+    policy = RetryPolicy(base_delay=1, max_delay=10)
+    for attempts, ceiling in ((1, 1), (2, 2), (3, 4), (4, 8), (5, 10), (20, 10)):
+        delays = [policy.delay(attempts) for _ in range(200)]
+        assert all(0 <= delay <= ceiling for delay in delays)
+        assert max(delays) > ceiling / 2
+
+
+def test_retry_budget():
+    policy = RetryPolicy(budget=0.25)
+    assert policy.retry_limit(100) == 25
+    assert policy.retry_limit(2) == 1
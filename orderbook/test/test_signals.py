@@ -0,0 +1,81 @@
+import random
+from decimal import Decimal
+
+from orderbook import OrderBook
+from orderbook.signals import BookSignals
+from orderbook.test.conftest import order
+
+
+def book_with(*quotes):
+    '''A book resting (side, quantity, price) orders of 0xbbbb.'''
+    book = OrderBook()
+    for side, quantity, price in quotes:
+        book.process_order(order(side, quantity, price, "0xbbbb"), False, False)
+    return book
+
+
+def rescanned(tree, reverse, levels):
+    '''Volume and notional of the best levels, summed the slow way.'''
+    prices = list(tree.prices)
+    if reverse:
+        prices.reverse()
+    volume = sum((tree.price_map[price].volume for price in prices[:levels]), Decimal(0))
+    notional = sum((price * tree.price_map[price].volume for price in prices[:levels]), Decimal(0))
+    return volume, notional
+
+
+def test_top_of_book_signals():
+    book = book_with(("bid", 3, 99), ("ask", 1, 101))
+    signals = book.signals.compute()
+    assert (signals["spread"], signals["mid"]) == (2, 100)
+    assert (signals["bid_size"], signals["ask_size"]) == (3, 1)
+    # Leans towards the ask, which has less size resting
+    assert signals["microprice"] == Decimal("100.5")
+    assert signals["imbalance"] == Decimal("0.5")
+
+
+def test_one_sided_book_has_no_spread():
+    signals = book_with(("bid", 1, 99)).signals.to_dict()
+    assert signals["best_bid"] == 99.0 and signals["best_ask"] is None
+    assert signals["spread"] is None and signals["weighted_mid"] is None
+
+
+def test_depth_weighted_values_cover_the_window_only():
+    book = OrderBook()
+    signals = BookSignals(book.bids, book.asks, levels=1)
+    for side, quantity, price in [("bid", 1, 99), ("bid", 1, 98), ("ask", 1, 101), ("ask", 3, 102)]:
+        book.process_order(order(side, quantity, price, "0xbbbb"), False, False)
+    values = signals.compute()
+    assert (signals.bid_window.volume, signals.ask_window.volume) == (1, 1)
+    assert values["weighted_mid"] == 100 and values["depth_imbalance"] == 0
+
+
+def test_depth_windows_match_a_rescan_after_random_changes():
+    book = OrderBook()
+    signals = BookSignals(book.bids, book.asks, levels=3)
+    rng = random.Random(7)
+    for _ in range(400):
+        resting = [tree for tree in (book.bids, book.asks) if tree]
+        if resting and rng.random() < 0.3:
+            tree = rng.choice(resting)
+            order_id = rng.choice(list(tree.order_map))
+            book.cancel_order(tree.get_order(order_id).side, order_id)
+            continue
+        side = rng.choice(["bid", "ask"])
+        price = rng.randint(90, 99) if side == "bid" else rng.randint(100, 109)
+        if rng.random() < 0.1:
+            # Crosses and takes (part of) the best opposite order
+            price = 110 if side == "bid" else 89
+        book.process_order(order(side, 1, price, "0xbbbb"), False, False)
+        assert (signals.bid_window.volume, signals.bid_window.notional) == rescanned(book.bids, True, 3)
+        assert (signals.ask_window.volume, signals.ask_window.notional) == rescanned(book.asks, False, 3)
+
+
+def test_level_changes_publish_the_signals():
+    book = book_with(("ask", 1, 101))
+    events = []
+    book.listeners.append(events.append)
+    book.process_order(order("bid", 1, 99, "0xbbbb"), False, False)
+    [event] = [event for event in events if event["type"] == "level"]
+    assert (event["side"], event["price"], event["volume"]) == ("bid", 99.0, 1.0)
+    assert event["signals"]["spread"] == 2.0
@@ -0,0 +1,67 @@
+import asyncio
+
+from eth_account import Account
+
+from orderbook.test.bench_batch_settlement import BATCHER, CONTRACT, OPERATOR_KEY, TOKEN, build_call
+from orderbook.test.conftest import InMemoryProvider
+from orderbook.trade_settlement_client import SignerPool, create_async_settlement_client
+
+KEYS = ["0x" + "22" * 32, "0x" + "33" * 32, "0x" + "44" * 32]
+
+
+def settlement(index):
+    return {"party1": Account.create().address, "party2": Account.create().address, "token": TOKEN,
+            "trade_id": f"trade-{index}", "index": index}
+
+
+def test_acquire_hands_out_the_least_loaded_lane(make_client):
+    pool = SignerPool(make_client().web3, KEYS, max_pending=4)
+
+    async def acquire():
+        first = await pool.acquire()
+        second = await pool.acquire()
+        third = await pool.acquire()
+        await pool.release(second)
+        return first, second, third, await pool.acquire()
+
+    first, second, third, fourth = asyncio.run(acquire())
+    assert len({first, second, third}) == 3
+    assert fourth is second
+    assert [lane["inFlight"] for lane in pool.stats()] == [1, 1, 1]
+
+
+def test_acquire_waits_while_every_lane_is_full(make_client):
+    pool = SignerPool(make_client().web3, KEYS[:2], max_pending=1)
+
+    async def acquire():
+        held = [await pool.acquire(), await pool.acquire()]
+        waiting = asyncio.ensure_future(pool.acquire())
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        await pool.release(held[1])
+        return held[1], await asyncio.wait_for(waiting, 1)
+
+    released, acquired = asyncio.run(acquire())
+    assert acquired is released
+    assert all(lane.in_flight <= lane.max_pending for lane in pool.lanes)
+
+
+def test_concurrent_sends_spread_over_the_keys(chain):
+    client = create_async_settlement_client(
+        "http://stand-in", CONTRACT, OPERATOR_KEY, batcher_address=BATCHER, private_keys=KEYS
+    )
+    client.web3.provider = InMemoryProvider(chain)
+    assert len(client.signers) == 4
+
+    async def send():
+        return await asyncio.gather(
+            *[client.send_transaction(build_call(client, settlement(index), 0, 0), timeout=5)
+              for index in range(8)]
+        )
+
+    results = asyncio.run(send())
+    assert all(result["success"] for result in results)
+    # Two transactions on each key, each with its own nonce sequence
+    for key in [OPERATOR_KEY] + KEYS:
+        assert chain.sender_nonces[Account.from_key(key).address.lower()] == 2
+    assert [(lane["sent"], lane["succeeded"], lane["inFlight"]) for lane in client.signers.stats()] == [(2, 2, 0)] * 4
@@ -0,0 +1,38 @@
+import json
+
+from orderbook.orderbook import OrderBook
+from orderbook.test.conftest import order
+
+
+def resting_book():
+    book = OrderBook()
+    book.process_order(order("bid", 2, 99, account="0xaaaa"), False, False)
+    book.process_order(order("ask", 1, 101, account="0xbbbb"), False, False)
+    book.process_order(
+        order("ask", 1, 95, account="0xcccc", type="stop_loss", trigger_price="96"), False, False
+    )
+    return book
+
+
+def test_snapshot_leaves_out_signing_keys():
+    state = json.dumps(resting_book().snapshot())
+    assert "-key" not in state
+    assert "private_key" not in state
+
+
+def test_restore_gets_keys_from_the_lookup():
+    state = json.loads(json.dumps(resting_book().snapshot()))
+    keys = {"0xaaaa": "0xaaaa-key", "0xcccc": "0xcccc-key"}
+    book = OrderBook.from_snapshot(state, keys.get)
+
+    assert book.bids.get_order(1).private_key == "0xaaaa-key"
+    assert book.asks.get_order(2).private_key is None
+    assert book.triggers.get(3)["private_key"] == "0xcccc-key"
+
+
+def test_restore_without_lookup_has_no_keys():
+    state = json.loads(json.dumps(resting_book().snapshot()))
+    book = OrderBook.from_snapshot(state)
+
+    assert book.bids.get_order(1).private_key is None
+    assert book.triggers.get(3)["private_key"] is None
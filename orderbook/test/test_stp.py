@@ -0,0 +1,88 @@
+from decimal import Decimal
+
+import pytest
+
+from orderbook import OrderBook
+from orderbook.test.conftest import order
+
+OWN, OTHER = "0xAaaa", "0xbbbb"
+
+
+def book_with(stp_mode, *asks):
+    '''A book with stp_mode resting (account, quantity, price) asks in the given order.'''
+    book = OrderBook(stp_mode=stp_mode)
+    for account, quantity, price in asks:
+        book.process_order(order("ask", quantity, price, account), False, False)
+    return book
+
+
+def resting(book):
+    return [(o["account"], o["quantity"], o["price"]) for o in book.snapshot()["orders"]]
+
+
+@pytest.mark.parametrize(
+    "stp_mode, traded, left",
+    [
+        ("cancel_newest", 0, [(OWN, "1", "100"), (OTHER, "1", "100"), (OTHER, "1", "101")]),
+        ("cancel_oldest", 1, [(OTHER, "1", "101")]),
+        ("cancel_both", 0, [(OTHER, "1", "100"), (OTHER, "1", "101")]),
+        ("decrement", 0, [(OTHER, "1", "100"), (OTHER, "1", "101")]),
+    ],
+)
+def test_limit_orders_never_trade_with_their_own_account(stp_mode, traded, left):
+    book = book_with(stp_mode, (OWN, 1, 100), (OTHER, 1, 100), (OTHER, 1, 101))
+    # Same account whatever the case of the address
+    result = book.process_order(order("bid", 1, 100, OWN.lower()), False, False)
+    assert result["success"] and result["data"][1] is None
+    assert len(book.tape) == traded
+    assert all(trade["party1"][0] == OTHER for trade in book.tape)
+    assert resting(book) == left
+    assert (book.self_trades_prevented, book.self_trade_quantity_prevented) == (1, 1)
+
+
+def test_self_trades_are_allowed_without_stp():
+    book = book_with(None, (OWN, 1, 100))
+    book.process_order(order("bid", 1, 100, OWN), False, False)
+    assert len(book.tape) == 1 and book.self_trades_prevented == 0
+
+
+def test_order_level_mode_overrides_the_book():
+    book = book_with(None, (OWN, 1, 100))
+    book.process_order(order("bid", 1, 100, OWN, stp_mode="cancel_newest"), False, False)
+    assert len(book.tape) == 0 and len(book.asks) == 1
+    assert not book.process_order(order("bid", 1, 100, OWN, stp_mode="bogus"), False, False)["success"]
+
+
+@pytest.mark.parametrize("stp_mode", ["cancel_newest", "cancel_oldest", "cancel_both", "decrement"])
+def test_fok_counts_no_volume_of_its_own_account(stp_mode):
+    book = book_with(stp_mode, (OWN, 1, 100), (OTHER, 1, 100))
+    before = resting(book)
+    result = book.process_order(order("bid", 2, 100, OWN, type="fok"), False, False)
+    assert not result["success"]
+    assert result["message"] == "FOK order cannot be filled in full"
+    assert resting(book) == before and len(book.tape) == 0
+    assert book.self_trades_prevented == 0
+
+
+@pytest.mark.parametrize(
+    "stp_mode, accepted", [("cancel_newest", False), ("cancel_oldest", True), ("cancel_both", False), ("decrement", False)]
+)
+def test_fok_behind_its_own_order(stp_mode, accepted):
+    book = book_with(stp_mode, (OWN, 1, 100), (OTHER, 1, 100), (OTHER, 1, 101))
+    result = book.process_order(order("bid", 2, 101, OWN, type="fok"), False, False)
+    assert result["success"] == accepted
+    if accepted:
+        # The own order is cancelled, the rest fills in full
+        assert [trade["quantity"] for trade in result["data"][0]] == [1, 1]
+        assert len(book.asks) == 0
+    else:
+        assert len(book.tape) == 0 and len(book.asks) == 3
+
+
+@pytest.mark.parametrize("stp_mode", ["cancel_newest", "cancel_oldest", "cancel_both", "decrement"])
+def test_fok_ahead_of_its_own_order_fills(stp_mode):
+    book = book_with(stp_mode, (OTHER, 2, 100), (OWN, 1, 100))
+    result = book.process_order(order("bid", 2, 100, OWN, type="fok"), False, False)
+    assert result["success"]
+    assert [trade["quantity"] for trade in result["data"][0]] == [Decimal(2)]
+    assert resting(book) == [(OWN, "1", "100")]
@@ -0,0 +1,135 @@
+import random
+
+from orderbook import OrderBook
+from orderbook.orderbook import DAY_MS
+from orderbook.test.conftest import order
+from orderbook.timerwheel import TimerWheel
+
+
+def test_timers_fire_once_their_deadline_has_passed():
+    wheel = TimerWheel(tick_ms=100, current_tick=0)
+    wheel.schedule("a", 250)
+    wheel.schedule("b", 1000)
+    assert wheel.advance(200) == []
+    assert wheel.advance(300) == [("a", 250)]
+    assert wheel.advance(999) == []
+    assert wheel.advance(1000) == [("b", 1000)]
+    assert len(wheel) == 0
+
+
+def test_past_deadlines_and_cancels_schedule_nothing():
+    wheel = TimerWheel(tick_ms=100, current_tick=10)
+    assert not wheel.schedule("late", 1000)
+    assert wheel.schedule("a", 5000)
+    assert wheel.cancel("a") and not wheel.cancel("a")
+    assert "a" not in wheel and wheel.advance(6000) == []
+
+
+def test_rescheduling_moves_the_timer():
+    wheel = TimerWheel(tick_ms=100, current_tick=0)
+    wheel.schedule("a", 500)
+    wheel.schedule("a", 900)
+    assert wheel.advance(600) == []
+    assert wheel.advance(900) == [("a", 900)]
+
+
+def test_far_deadlines_cascade_down_the_levels():
+    wheel = TimerWheel(tick_ms=1, current_tick=0)
+    deadlines = {"level1": 300, "level2": 70000, "level3": 5000000}
+    for key, deadline in deadlines.items():
+        wheel.schedule(key, deadline)
+    assert {key: wheel.timers[key][0] for key in deadlines} == {"level1": 1, "level2": 2, "level3": 3}
+    fired = []
+    # Small steps, so the wheel ticks through every cascade instead of rebuilding
+    for now in range(0, 5000001, 200):
+        fired += wheel.advance(now)
+    assert fired == [("level1", 300), ("level2", 70000), ("level3", 5000000)]
+
+
+def test_deadlines_beyond_the_top_level_are_parked():
+    wheel = TimerWheel(tick_ms=1, current_tick=0)
+    beyond = wheel.max_ticks * 2
+    wheel.schedule("far", beyond)
+    assert wheel.advance(wheel.max_ticks + 10) == []
+    assert "far" in wheel
+    assert wheel.advance(beyond) == [("far", beyond)]
+
+
+def test_long_gaps_rebuild_instead_of_stepping():
+    wheel = TimerWheel(tick_ms=100, current_tick=0)
+    wheel.schedule("a", 30000)
+    wheel.schedule("b", 10000)
+    wheel.schedule("c", 10 ** 9)
+    assert wheel.advance(10 ** 8) == [("b", 10000), ("a", 30000)]
+    assert wheel.current_tick == 10 ** 6 and "c" in wheel
+    assert wheel.advance(10 ** 9) == [("c", 10 ** 9)]
+
+
+def test_random_timers_fire_within_a_tick_of_their_deadline():
+    rng = random.Random(3)
+    wheel = TimerWheel(tick_ms=10, current_tick=0)
+    pending = {}
+    now = 0
+    for key in range(2000):
+        if pending and rng.random() < 0.2:
+            cancelled = rng.choice(sorted(pending))
+            wheel.cancel(cancelled)
+            del pending[cancelled]
+        deadline = now + rng.choice([1, 50, 3000, 200000, 20000000])
+        if wheel.schedule(key, deadline):
+            pending[key] = deadline
+        now += rng.choice([0, 5, 40, 5000])
+        fired = dict(wheel.advance(now))
+        # Never early, and at most one tick late (deadlines round up to the next tick)
+        assert all(pending[key] == deadline <= now for key, deadline in fired.items())
+        assert all(key in fired for key, deadline in pending.items() if deadline <= now - wheel.tick_ms)
+        for key in fired:
+            del pending[key]
+    assert dict(wheel.advance(now + 10 ** 9)) == pending
+
+
+def test_snapshot_restores_the_pending_timers():
+    wheel = TimerWheel(tick_ms=100, current_tick=0)
+    wheel.schedule("a", 500)
+    wheel.schedule("b", 10 ** 7)
+    restored = TimerWheel.restore(wheel.snapshot())
+    assert len(restored) == 2
+    assert restored.advance(600) == [("a", 500)]
+    assert restored.advance(10 ** 7) == [("b", 10 ** 7)]
+
+
+def test_book_expires_only_due_orders():
+    book = OrderBook()
+    now = 10 * DAY_MS + 1000
+    for order_id, time_in_force, expire_time in [(1, "GTT", now + 500), (2, "GTC", None), (3, "DAY", None)]:
+        quote = order("bid", 1, 99, timestamp=now, order_id=order_id,
+                      time_in_force=time_in_force, expire_time=expire_time)
+        book.process_order(quote, True, False)
+    events = []
+    book.listeners.append(events.append)
+
+    assert book.expire_orders(now + 400) == []
+    [cancel] = book.expire_orders(now + 500)
+    assert (cancel["orderId"], cancel["reason"], cancel["expireTime"]) == (1, "expired", now + 500)
+    assert cancel in events
+    [cancel] = book.expire_orders(11 * DAY_MS)
+    assert cancel["orderId"] == 3
+    assert list(book.bids.order_map) == [2]
+
+
+def test_filled_and_cancelled_orders_do_not_expire():
+    book = OrderBook()
+    now = 10 * DAY_MS
+    for order_id in (1, 2):
+        book.process_order(order("bid", 1, 99, timestamp=now, order_id=order_id,
+                                 time_in_force="GTT", expire_time=now + 100), True, False)
+    book.cancel_order("bid", 1, time=now + 10)
+    book.process_order(order("ask", 1, 99, "0xbbbb", timestamp=now + 20, order_id=3), True, False)
+    assert book.expire_orders(now + 100) == []
+
+
+def test_expiry_in_the_past_is_rejected():
+    book = OrderBook()
+    quote = order("bid", 1, 99, timestamp=DAY_MS, order_id=1, time_in_force="GTT", expire_time=DAY_MS)
+    assert not book.process_order(quote, True, False)["success"]
+    assert len(book.bids) == 0
@@ -0,0 +1,115 @@
+from decimal import Decimal
+
+import pytest
+
+from orderbook import OrderBook
+from orderbook.test.conftest import order
+from orderbook.triggerbook import TriggerBook
+
+
+def trade_at(book, price):
+    '''Make the last trade price `price` with a 1 lot trade between 0xcccc and 0xdddd.'''
+    book.process_order(order("ask", 1, price, "0xcccc"), False, False)
+    return book.process_order(order("bid", 1, price, "0xdddd"), False, False)
+
+
+def test_release_slices_every_crossed_level_in_order():
+    triggers = TriggerBook()
+    for stop_id, price, direction in [(1, 105, "rising"), (2, 101, "rising"), (3, 101, "rising"),
+                                      (4, 110, "rising"), (5, 95, "falling"), (6, 99, "falling")]:
+        triggers.add(stop_id, {"stop_id": stop_id}, Decimal(price), direction)
+
+    assert [stop_id for stop_id, _ in triggers.release(Decimal(105))] == [2, 3, 1]
+    assert [stop_id for stop_id, _ in triggers.release(Decimal(94))] == [6, 5]
+    assert list(triggers.stops) == [4] and len(triggers) == 1
+
+
+def test_cancel_removes_the_order_and_its_empty_level():
+    triggers = TriggerBook()
+    triggers.add(1, {"stop_id": 1}, Decimal(100), "rising")
+    assert triggers.cancel(1) == {"stop_id": 1}
+    assert triggers.cancel(1) is None
+    assert 100 not in triggers.rising and 1 not in triggers
+    with pytest.raises(Exception):
+        triggers.add(2, {}, Decimal(100), "sideways")
+
+
+def test_stop_loss_waits_for_the_price_and_then_trades():
+    book = OrderBook()
+    trade_at(book, 100)
+    book.process_order(order("bid", 1, 90, "0xbbbb"), False, False)
+    result = book.process_order(
+        order("ask", 1, None, "0xaaaa", type="stop_loss", trigger_price="95"), False, False
+    )
+    assert result["success"] and result["triggered"] == []
+    stop_id = result["data"][1]["order_id"]
+    assert stop_id in book.triggers and len(book.bids) == 1
+
+    # A sell stop-loss fires on a fall to its trigger and runs as a market order
+    [released] = trade_at(book, 95)["triggered"]
+    assert released["stop_id"] == stop_id and released["quote"]["type"] == "market"
+    assert stop_id not in book.triggers
+    assert len(book.bids) == 0 and book.candles.last_price == 90
+
+
+def test_directions_of_each_trigger_type():
+    book = OrderBook()
+    trade_at(book, 100)
+    quotes = [
+        order("bid", 1, 120, type="stop_loss", trigger_price="105"),
+        order("bid", 1, 120, type="take_profit", trigger_price="95"),
+        order("ask", 1, 80, type="take_profit", trigger_price="105"),
+        order("bid", 1, 120, type="trigger", trigger_price="105"),
+        order("bid", 1, 120, type="trigger", trigger_price="105", trigger_direction="falling"),
+    ]
+    results = [book.process_order(quote, False, False)["data"][1] for quote in quotes]
+    assert [quote["trigger_direction"] for quote in results] == [
+        "rising", "falling", "rising", "rising", "falling"
+    ]
+    # A limit price makes it a limit order once released
+    assert results[0]["execute_as"] == "limit"
+
+
+def test_trigger_already_crossed_is_released_at_once():
+    book = OrderBook()
+    trade_at(book, 100)
+    book.process_order(order("ask", 1, 101, "0xbbbb"), False, False)
+    result = book.process_order(
+        order("bid", 1, 101, type="trigger", trigger_price="99", trigger_direction="rising"), False, False
+    )
+    [released] = result["triggered"]
+    assert released["result"]["success"] and len(released["result"]["data"][0]) == 1
+
+
+def test_released_trades_can_release_further_triggers():
+    book = OrderBook()
+    trade_at(book, 100)
+    for price in (94, 92):
+        book.process_order(order("bid", 1, price, "0xbbbb"), False, False)
+    book.process_order(order("ask", 1, None, type="stop_loss", trigger_price="95"), False, False)
+    book.process_order(order("ask", 1, None, type="stop_loss", trigger_price="94"), False, False)
+    # The first stop trades at 94, which crosses the second
+    triggered = trade_at(book, 95)["triggered"]
+    assert [released["stop_id"] for released in triggered] == [5, 6]
+    assert book.candles.last_price == 92 and len(book.bids) == 0
+
+
+def test_cancelled_trigger_never_fires():
+    book = OrderBook()
+    trade_at(book, 100)
+    result = book.process_order(order("ask", 1, None, type="stop_loss", trigger_price="95"), False, False)
+    book.cancel_order("ask", result["data"][1]["order_id"])
+    assert len(book.triggers) == 0
+    assert trade_at(book, 90)["triggered"] == []
+
+
+def test_invalid_trigger_orders_are_rejected():
+    book = OrderBook()
+    for quote in [
+        order("ask", 1, None, type="stop_loss"),
+        order("ask", 1, None, type="stop_loss", trigger_price="-1"),
+        order("bid", 1, None, type="trigger", trigger_price="100"),
+        order("bid", 1, None, type="stop_loss", trigger_price="100", execute_as="limit"),
+    ]:
+        assert not book.process_order(quote, False, False)["success"]
+    assert len(book.triggers) == 0
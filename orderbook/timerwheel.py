@@ -0,0 +1,148 @@
+import math
+
+
+class TimerWheel(object):
+    '''
+    A hierarchical timer wheel keyed by arbitrary hashable keys (order ids).
+
+    Level 0 has 256 slots of `tick_ms` each; every higher level has 64 slots,
+    each covering a full turn of the level below. Scheduling and cancelling
+    are O(1); advancing the wheel costs O(1) per tick plus O(1) per timer each
+    time it cascades down a level (at most three times). An advance of more
+    than a turn of level 0 re-buckets every timer instead of stepping ticks. Deadlines beyond the
+    top level are parked in its furthest slot and rescheduled when it cascades.
+    '''
+
+    LEVEL_BITS = (8, 6, 6, 6)
+
+    def __init__(self, tick_ms=100, current_tick=None):
+        self.tick_ms = tick_ms
+        self.current_tick = current_tick # last tick processed, set on first use
+        self.levels = [[{} for _ in range(1 << bits)] for bits in self.LEVEL_BITS]
+        self.shifts = []
+        shift = 0
+        for bits in self.LEVEL_BITS:
+            self.shifts.append(shift)
+            shift += bits
+        self.max_ticks = (1 << shift) - 1
+        self.timers = {} # key : (level, slot, deadline)
+
+    def __len__(self):
+        return len(self.timers)
+
+    def __contains__(self, key):
+        return key in self.timers
+
+    def schedule(self, key, deadline, now=None):
+        '''Add or move the timer for key. deadline and now are in milliseconds.
+
+        Returns False (and schedules nothing) if the deadline has already passed.
+        '''
+        if self.current_tick is None:
+            self.current_tick = (now if now is not None else deadline) // self.tick_ms
+        self.cancel(key)
+        return self._place(key, deadline)
+
+    def _place(self, key, deadline):
+        deadline_tick = int(math.ceil(deadline / float(self.tick_ms)))
+        delta = deadline_tick - self.current_tick
+        if delta <= 0:
+            return False
+        target = self.current_tick + min(delta, self.max_ticks)
+        for level, bits in enumerate(self.LEVEL_BITS):
+            if delta < 1 << (self.shifts[level] + bits) or level == len(self.LEVEL_BITS) - 1:
+                slot = (target >> self.shifts[level]) & ((1 << bits) - 1)
+                self.levels[level][slot][key] = deadline
+                self.timers[key] = (level, slot, deadline)
+                return True
+
+    def cancel(self, key):
+        timer = self.timers.pop(key, None)
+        if timer is None:
+            return False
+        level, slot, _ = timer
+        del self.levels[level][slot][key]
+        return True
+
+    def _cascade(self, level):
+        '''Re-place every timer of the current slot of level into the levels below. Returns the slot index.'''
+        slot = (self.current_tick >> self.shifts[level]) & ((1 << self.LEVEL_BITS[level]) - 1)
+        bucket = self.levels[level][slot]
+        self.levels[level][slot] = {}
+        for key, deadline in bucket.items():
+            del self.timers[key]
+            if not self._place(key, deadline):
+                # Already due: put it in the level 0 slot processed next
+                self.levels[0][self.current_tick & 0xFF][key] = deadline
+                self.timers[key] = (0, self.current_tick & 0xFF, deadline)
+        return slot
+
+    def advance(self, now):
+        '''Move the wheel forward to `now` (ms) and return the (key, deadline) pairs that expired.'''
+        target = now // self.tick_ms
+        if self.current_tick is None:
+            self.current_tick = target
+            return []
+        if target - self.current_tick > 1 << self.LEVEL_BITS[0]:
+            # More than a turn of level 0 behind (e.g. a snapshot restored after downtime):
+            # re-bucket from the absolute deadlines rather than stepping every tick
+            return self._rebuild(target, now)
+        expired = []
+        while self.current_tick < target:
+            if not self.timers:
+                # Nothing scheduled, skip straight to now
+                self.current_tick = target
+                break
+            self.current_tick += 1
+            if self.current_tick & 0xFF == 0:
+                level = 1
+                while level < len(self.LEVEL_BITS) and self._cascade(level) == 0:
+                    level += 1
+            slot = self.current_tick & 0xFF
+            bucket = self.levels[0][slot]
+            if bucket:
+                self.levels[0][slot] = {}
+                for key, deadline in bucket.items():
+                    del self.timers[key]
+                    if deadline <= now:
+                        expired.append((key, deadline))
+                    else:
+                        # Parked beyond the wheel range or rounded into this tick early
+                        self._place(key, deadline)
+        return expired
+
+    def _rebuild(self, target, now):
+        '''Jump to tick target, returning the timers due by now and placing the rest afresh.'''
+        timers = [(key, timer[2]) for key, timer in self.timers.items()]
+        self.levels = [[{} for _ in range(1 << bits)] for bits in self.LEVEL_BITS]
+        self.timers = {}
+        self.current_tick = target
+        expired = []
+        for key, deadline in timers:
+            if deadline <= now:
+                expired.append((key, deadline))
+            elif not self._place(key, deadline):
+                # Rounded into the current tick: fire on the next advance
+                slot = (target + 1) & 0xFF
+                self.levels[0][slot][key] = deadline
+                self.timers[key] = (0, slot, deadline)
+        expired.sort(key=lambda timer: timer[1])
+        return expired
+
+    def snapshot(self):
+        '''Serialisable state: the tick settings and every pending (key, deadline).'''
+        return {
+            "tick_ms": self.tick_ms,
+            "current_tick": self.current_tick,
+            "timers": [[key, timer[2]] for key, timer in self.timers.items()],
+        }
+
+    @classmethod
+    def restore(cls, state):
+        wheel = cls(state["tick_ms"], state["current_tick"])
+        for key, deadline in state["timers"]:
+            if not wheel._place(key, deadline):
+                # Due by the time of the snapshot: fire on the next advance
+                wheel.levels[0][(wheel.current_tick + 1) & 0xFF][key] = deadline
+                wheel.timers[key] = (0, (wheel.current_tick + 1) & 0xFF, deadline)
+        return wheel
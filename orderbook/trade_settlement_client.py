@@ -1,10 +1,29 @@
-from web3 import Web3
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from web3 import AsyncWeb3, Web3
+from web3.datastructures import AttributeDict
+from web3.exceptions import BadFunctionCallOutput, ContractLogicError, TimeExhausted
+from hexbytes import HexBytes
+from eth_abi import decode as abi_decode, encode as abi_encode
 from eth_account import Account
+from eth_utils.abi import (
+    function_abi_to_4byte_selector,
+    get_abi_input_types,
+    get_abi_output_types,
+)
 
 # from eth_account.messages import encode_structured_data
 # import json
 # import time
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Multicall3 is deployed at this address on most EVM chains
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
 
 
 class TradeSettlementClient:
@@ -14,6 +33,7 @@ class TradeSettlementClient:
         contract_address: str,
         contract_abi: dict,
         private_key: str = None,
+        multicall_address: str = MULTICALL3_ADDRESS,
     ):
         self.web3 = Web3(Web3.HTTPProvider(web3_provider))
         self.contract_address = Web3.to_checksum_address(contract_address)
@@ -21,6 +41,33 @@ class TradeSettlementClient:
             address=self.contract_address, abi=contract_abi
         )
         self.account = Account.from_key(private_key) if private_key else None
+        self.multicall3 = self.web3.eth.contract(
+            address=Web3.to_checksum_address(multicall_address), abi=MULTICALL3_ABI
+        )
+
+    def multicall(self, functions: list) -> list:
+        """Run view calls in one eth_call through Multicall3, see run_multicall"""
+        return run_multicall(self.multicall3, functions)
+
+    def check_allowances_and_balances(
+        self, checks: List[Tuple[str, str, int]]
+    ) -> List[Tuple[Tuple[bool, int], Tuple[bool, int]]]:
+        """Allowance and balance checks of (user, token, required amount) triples, in one call"""
+        try:
+            functions = check_functions(self.contract, checks)
+        except Exception as e:
+            logger.error(f"Error checking allowance and balance: {e}")
+            return [((False, 0), (False, 0)) for _ in checks]
+        return checks_from_results(checks, self.multicall(functions))
+
+    def get_nonces(self, pairs: List[Tuple[str, str]]) -> List[int]:
+        """Nonces of (user, token) pairs, in one call"""
+        try:
+            functions = nonce_functions(self.contract, pairs)
+        except Exception as e:
+            logger.error(f"Error getting nonce: {e}")
+            return [0] * len(pairs)
+        return nonces_from_results(self.multicall(functions))
 
     def check_allowance(
         self, user_address: str, token_address: str, required_amount: int
@@ -39,7 +86,7 @@ class TradeSettlementClient:
             return sufficient, current_allowance
 
         except Exception as e:
-            print(f"Error checking allowance: {e}")
+            logger.error(f"Error checking allowance: {e}")
             return False, 0
 
     def check_balance(
@@ -60,7 +107,7 @@ class TradeSettlementClient:
             return sufficient, current_balance
 
         except Exception as e:
-            print(f"Error checking balance: {e}")
+            logger.error(f"Error checking balance: {e}")
             return False, 0
 
     def batch_check_allowances(
@@ -79,7 +126,7 @@ class TradeSettlementClient:
             return list(sufficient_list), list(allowances_list)
 
         except Exception as e:
-            print(f"Error in batch checking allowances: {e}")
+            logger.error(f"Error in batch checking allowances: {e}")
             return [], []
 
     def create_trade_signature(
@@ -124,7 +171,7 @@ class TradeSettlementClient:
 
             # Sign the message using the user's private key
             account = Account.from_key(user_private_key)
-            print(account.address, "ADDRESSA")
+            logger.debug(f"Signing trade as {account.address}")
 
             # Create the Ethereum signed message hash (adds the prefix)
             eth_message_hash = encode_defunct(message_hash)
@@ -135,7 +182,7 @@ class TradeSettlementClient:
             return signature.signature.hex()
 
         except Exception as e:
-            print(f"Error creating signature: {e}")
+            logger.error(f"Error creating signature: {e}")
             return ""
 
     def verify_trade_signature(
@@ -169,7 +216,7 @@ class TradeSettlementClient:
             return result
 
         except Exception as e:
-            print(f"Error verifying signature: {e}")
+            logger.error(f"Error verifying signature: {e}")
             return False
 
     def get_user_nonce(self, user_address: str, token_address: str) -> int:
@@ -184,7 +231,7 @@ class TradeSettlementClient:
             return nonce
 
         except Exception as e:
-            print(f"Error getting nonce: {e}")
+            logger.error(f"Error getting nonce: {e}")
             return 0
 
     def settle_trade_direct(
@@ -222,14 +269,14 @@ class TradeSettlementClient:
             )
 
             # Estimate gas
-            gas_estimate = function.estimateGas({"from": self.account.address})
+            gas_estimate = function.estimate_gas({"from": self.account.address})
 
             # Build transaction
             transaction = function.build_transaction(
                 {
                     "from": self.account.address,
                     "gas": int(gas_estimate * 1.2),  # Add 20% buffer
-                    "gasPrice": self.web3.toWei("20", "gwei"),
+                    "gasPrice": self.web3.eth.gas_price,
                     "nonce": self.web3.eth.get_transaction_count(self.account.address),
                 }
             )
@@ -251,7 +298,7 @@ class TradeSettlementClient:
             }
 
         except Exception as e:
-            print(f"Error settling trade: {e}")
+            logger.error(f"Error settling trade: {e}")
             return {"success": False, "error": str(e)}
 
     def get_token_address(self, token_symbol: str) -> str:
@@ -432,6 +479,1423 @@ class TradeSettlementClient:
             return results
 
 
+def multicall_calls(functions: list, allow_failure: bool = True) -> list:
+    """aggregate3 calls running the given contract calls"""
+    return [
+        (
+            function.address,
+            allow_failure,
+            function_abi_to_4byte_selector(function.abi)
+            + abi_encode(get_abi_input_types(function.abi), function.args),
+        )
+        for function in functions
+    ]
+
+
+def run_multicall(multicall3, functions: list) -> list:
+    """Run view calls in one eth_call through a (synchronous) Multicall3 contract.
+
+    Returns each call's result, or the exception it failed with. Without a
+    Multicall3 at that address, the calls are made one by one.
+    """
+    if not functions:
+        return []
+    try:
+        results = multicall3.functions.aggregate3(multicall_calls(functions)).call()
+    except Exception as e:
+        logger.warning(f"Error in multicall, calling one by one: {e}")
+        results = []
+        for function in functions:
+            try:
+                results.append(function.call())
+            except Exception as call_error:
+                results.append(call_error)
+        return results
+    return multicall_results(functions, results)
+
+
+def multicall_results(functions: list, results: list) -> list:
+    """Decoded return value of each call of an aggregate3, or an exception if it failed"""
+    decoded = []
+    for function, (success, data) in zip(functions, results):
+        if not success:
+            decoded.append(ContractLogicError(f"{function.fn_name} reverted", data="0x" + data.hex()))
+            continue
+        try:
+            values = abi_decode(get_abi_output_types(function.abi), data)
+            decoded.append(values[0] if len(values) == 1 else list(values))
+        except Exception as e:
+            decoded.append(e)
+    return decoded
+
+
+def check_functions(contract, checks: List[Tuple[str, str, int]]) -> list:
+    """checkAllowance and checkBalance calls of each (user, token, required amount)"""
+    functions = []
+    for user, token, amount in checks:
+        user = Web3.to_checksum_address(user)
+        token = Web3.to_checksum_address(token)
+        functions.append(contract.functions.checkAllowance(user, token, amount))
+        functions.append(contract.functions.checkBalance(user, token, amount))
+    return functions
+
+
+def checks_from_results(checks: list, results: list) -> list:
+    """((sufficient, allowance), (sufficient, balance)) of each check, (False, 0) where a read failed"""
+    pairs = []
+    for index in range(len(checks)):
+        pair = []
+        for name, result in (("allowance", results[2 * index]), ("balance", results[2 * index + 1])):
+            if isinstance(result, Exception):
+                logger.error(f"Error checking {name}: {result}")
+                result = (False, 0)
+            pair.append(tuple(result))
+        pairs.append(tuple(pair))
+    return pairs
+
+
+def nonce_functions(contract, pairs: List[Tuple[str, str]]) -> list:
+    return [
+        contract.functions.getUserNonce(
+            Web3.to_checksum_address(user), Web3.to_checksum_address(token)
+        )
+        for user, token in pairs
+    ]
+
+
+def nonces_from_results(results: list) -> List[int]:
+    nonces = []
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Error getting nonce: {result}")
+            result = 0
+        nonces.append(result)
+    return nonces
+
+
+# Send errors meaning the node's view of the operator nonce differs from ours
+NONCE_ERRORS = (
+    "nonce too low",
+    "nonce too high",
+    "nonce is too low",
+    "invalid nonce",
+    "replacement transaction underpriced",
+    "already known",
+    "known transaction",
+)
+
+
+def is_nonce_error(error: Exception) -> bool:
+    message = str(error).lower()
+    return any(pattern in message for pattern in NONCE_ERRORS)
+
+
+class TransactionUnconfirmed(TimeExhausted):
+    """A transaction went out but no receipt of it (or of a copy with higher fees) was seen.
+
+    It may still be mined: tx_hashes holds every copy sent.
+    """
+
+    def __init__(self, message: str, tx_hashes: list):
+        super().__init__(message)
+        self.tx_hashes = tx_hashes
+
+
+class NonceManager:
+    """Hands out the operator account's transaction nonces locally.
+
+    The next nonce is read from the chain (pending block) once, by sync() at
+    startup or on first use, and then counted up under a lock, so concurrent
+    sends get distinct nonces without an RPC each. Nonces handed out stay in
+    `pending` until their transaction is confirmed or given up. A nonce whose
+    send failed is taken back if nothing was handed out after it; otherwise,
+    and on nonce errors from the node, the counter is read from the chain
+    again.
+    """
+
+    def __init__(self, web3, address: str):
+        self.web3 = web3
+        self.address = address
+        self.lock = asyncio.Lock()
+        self.next_nonce = None
+        self.pending = {}  # nonce : transaction hash, None until sent
+        self.resyncs = 0
+
+    async def sync(self) -> int:
+        async with self.lock:
+            return await self._sync()
+
+    async def _sync(self) -> int:
+        self.next_nonce = await self.web3.eth.get_transaction_count(
+            self.address, "pending"
+        )
+        # Nonces below the chain's count are used, whatever became of them
+        for nonce in [nonce for nonce in self.pending if nonce < self.next_nonce]:
+            del self.pending[nonce]
+        return self.next_nonce
+
+    async def reserve(self) -> int:
+        """The next nonce, no other caller gets it"""
+        async with self.lock:
+            if self.next_nonce is None:
+                await self._sync()
+            nonce = self.next_nonce
+            self.next_nonce += 1
+            self.pending[nonce] = None
+            return nonce
+
+    def sent(self, nonce: int, tx_hash):
+        self.pending[nonce] = tx_hash
+
+    def confirm(self, nonce: int):
+        self.pending.pop(nonce, None)
+
+    def release(self, nonce: int):
+        """Take back a nonce whose transaction was never sent"""
+        self.pending.pop(nonce, None)
+        if self.next_nonce == nonce + 1:
+            self.next_nonce = nonce
+        else:
+            self.next_nonce = None  # leaves a gap, read the chain again before the next
+
+    async def resync(self) -> int:
+        async with self.lock:
+            self.resyncs += 1
+            return await self._sync()
+
+    def stats(self) -> dict:
+        return {
+            "address": self.address,
+            "nextNonce": self.next_nonce,
+            "pending": len(self.pending),
+            "resyncs": self.resyncs,
+        }
+
+
+# Receipt fields that are quantities, converted from hex like web3 does
+RECEIPT_QUANTITIES = (
+    "blockNumber",
+    "cumulativeGasUsed",
+    "effectiveGasPrice",
+    "gasUsed",
+    "status",
+    "transactionIndex",
+    "type",
+)
+
+
+def format_receipt(receipt: dict) -> AttributeDict:
+    """A raw eth_getTransactionReceipt result as the AttributeDict web3 returns"""
+    formatted = dict(receipt)
+    for key in RECEIPT_QUANTITIES:
+        if isinstance(formatted.get(key), str):
+            formatted[key] = int(formatted[key], 16)
+    for key in ("transactionHash", "blockHash"):
+        if isinstance(formatted.get(key), str):
+            formatted[key] = HexBytes(formatted[key])
+    return AttributeDict(formatted)
+
+
+class ReceiptTracker:
+    """Waits for transaction receipts by following blocks instead of polling each transaction.
+
+    One loop runs while anything is watched. It reads the block number every
+    poll_interval seconds and, when a new block arrived, fetches the receipts
+    of every transaction not yet mined in batched JSON-RPC requests of up to
+    max_batch calls (between blocks, only those of newly watched ones), so
+    the RPC cost per block does not grow with the number of transactions in
+    flight. A receipt counts once it is
+    `confirmations` blocks deep; with confirmations, it is fetched again at
+    that depth and the transaction goes back to waiting if it left the chain.
+    """
+
+    def __init__(
+        self, web3, confirmations: int = 0, poll_interval: float = 0.2, max_batch: int = 500
+    ):
+        self.web3 = web3
+        self.confirmations = confirmations
+        self.poll_interval = poll_interval
+        self.max_batch = max_batch
+        self.watched = {}  # tx hash : {"future", "callbacks", "receipt"}
+        self.task = None
+        self.last_block = None
+        self.blocks = 0
+        self.rpc_calls = 0
+        self.resolved = 0
+
+    def __len__(self):
+        return len(self.watched)
+
+    def watch(self, tx_hash, callback=None) -> asyncio.Future:
+        """Future of the receipt of tx_hash; callback(receipt) is called with it too"""
+        key = self._key(tx_hash)
+        entry = self.watched.get(key)
+        if entry is None:
+            entry = {
+                "future": asyncio.get_running_loop().create_future(),
+                "callbacks": [],
+                "receipt": None,
+                "checked": False,  # receipt fetched at least once
+            }
+            self.watched[key] = entry
+        if callback is not None:
+            entry["callbacks"].append(callback)
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+        return entry["future"]
+
+    def forget(self, tx_hash):
+        entry = self.watched.pop(self._key(tx_hash), None)
+        if entry is not None and not entry["future"].done():
+            entry["future"].cancel()
+
+    async def wait(self, tx_hash, timeout: float = 120):
+        """The receipt of tx_hash, raising TimeExhausted after timeout seconds"""
+        future = self.watch(tx_hash)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self.forget(tx_hash)
+            raise TimeExhausted(
+                f"Transaction {self._key(tx_hash)} is not in the chain after {timeout} seconds"
+            )
+
+    async def run(self):
+        while self.watched:
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.error(f"Error tracking receipts: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def poll(self):
+        block = await self.web3.eth.block_number
+        self.rpc_calls += 1
+        if self.last_block is not None and block <= self.last_block:
+            # No new block; transactions watched since the last fetch may be mined already
+            hashes = [key for key, entry in self.watched.items() if not entry["checked"]]
+            if not hashes:
+                return
+        else:
+            self.last_block = block
+            self.blocks += 1
+            # Not mined yet, or mined and deep enough to be checked once more
+            hashes = [
+                key
+                for key, entry in self.watched.items()
+                if entry["receipt"] is None
+                or (self.confirmations and entry["receipt"].blockNumber + self.confirmations <= block)
+            ]
+        for start in range(0, len(hashes), self.max_batch):
+            chunk = hashes[start:start + self.max_batch]
+            responses = await self.web3.provider.make_batch_request(
+                [("eth_getTransactionReceipt", [key]) for key in chunk]
+            )
+            self.rpc_calls += 1
+            if isinstance(responses, dict):  # the whole batch was refused
+                raise Exception(responses.get("error"))
+            responses = sorted(responses, key=lambda response: response.get("id", 0))
+            for key, response in zip(chunk, responses):
+                entry = self.watched.get(key)
+                if entry is None:
+                    continue
+                entry["checked"] = True
+                result = response.get("result")
+                if result is None:
+                    entry["receipt"] = None  # not mined, or reorganised out
+                    continue
+                receipt = format_receipt(result)
+                confirmed = entry["receipt"] is not None and entry["receipt"].blockHash == receipt.blockHash
+                entry["receipt"] = receipt
+                # The receipt may come from a block after the one just read
+                if confirmed or receipt.blockNumber + self.confirmations <= max(block, receipt.blockNumber):
+                    self._resolve(key, receipt)
+
+    def _resolve(self, key, receipt):
+        entry = self.watched.pop(key)
+        self.resolved += 1
+        if not entry["future"].done():
+            entry["future"].set_result(receipt)
+        for callback in entry["callbacks"]:
+            try:
+                callback(receipt)
+            except Exception as e:
+                logger.error(f"Error in receipt callback: {e}")
+
+    @staticmethod
+    def _key(tx_hash) -> str:
+        key = tx_hash.hex() if isinstance(tx_hash, (bytes, bytearray)) else str(tx_hash)
+        key = key.lower()
+        return key if key.startswith("0x") else "0x" + key
+
+    def stats(self) -> dict:
+        return {
+            "watching": len(self.watched),
+            "confirmations": self.confirmations,
+            "lastBlock": self.last_block,
+            "blocks": self.blocks,
+            "rpcCalls": self.rpc_calls,
+            "resolved": self.resolved,
+        }
+
+
+class GasStrategy:
+    """Gas limits and fees of settlement transactions, without an RPC per transaction.
+
+    Gas estimates are cached per call shape (function and number of batched
+    calls): every sample_every-th use of a shape, and any use after
+    estimate_ttl seconds, estimates again, and the cached value is the largest
+    of the last `window` samples. Fees follow the network through
+    eth_feeHistory over the last fee_blocks blocks, refreshed at most every
+    fee_refresh seconds: EIP-1559 fields (a max fee covering fee_headroom
+    times the next base fee, plus the median priority fee paid) where blocks
+    carry a base fee, the node's gas price otherwise. A transaction not mined
+    within bump_after seconds is replaced with fees raised by bump_ratio, at
+    most max_bumps times.
+    """
+
+    def __init__(
+        self,
+        web3,
+        sample_every: int = 20,
+        estimate_ttl: float = 60,
+        window: int = 5,
+        fee_blocks: int = 10,
+        fee_refresh: float = 2,
+        fee_headroom: float = 2,
+        bump_after: float = 30,
+        bump_ratio: float = 1.125,
+        max_bumps: int = 3,
+        max_fee: int = None,
+    ):
+        self.web3 = web3
+        self.sample_every = sample_every
+        self.estimate_ttl = estimate_ttl
+        self.window = window
+        self.fee_blocks = fee_blocks
+        self.fee_refresh = fee_refresh
+        self.fee_headroom = fee_headroom
+        self.bump_after = bump_after
+        self.bump_ratio = bump_ratio
+        self.max_bumps = max_bumps
+        self.max_fee = max_fee  # wei per gas a bump never goes past, None for no cap
+        self.shapes = {}  # shape : {"samples", "uses", "sampled_at"}
+        self.fee_fields = None
+        self.fees_at = None
+        self.fee_lock = asyncio.Lock()
+        self.eip1559 = None
+        self.hits = 0
+        self.estimates = 0
+        self.bumps = 0
+
+    @staticmethod
+    def shape(function) -> tuple:
+        if function.fn_name == "aggregate3":
+            return ("aggregate3", len(function.args[0]))
+        return (function.fn_name, 1)
+
+    async def estimate(self, function, sender: str) -> int:
+        """Gas of a call, from the cache unless the shape is due for a sample"""
+        shape = self.shape(function)
+        entry = self.shapes.get(shape)
+        now = time.monotonic()
+        if (
+            entry is not None
+            and entry["uses"] % self.sample_every
+            and now - entry["sampled_at"] < self.estimate_ttl
+        ):
+            entry["uses"] += 1
+            self.hits += 1
+            return max(entry["samples"])
+        gas = await function.estimate_gas({"from": sender})
+        self.record(shape, gas)
+        return max(self.shapes[shape]["samples"])
+
+    def record(self, shape: tuple, gas: int):
+        """Add an estimate made elsewhere (e.g. a batch simulation) to the cache"""
+        entry = self.shapes.setdefault(shape, {"samples": [], "uses": 0, "sampled_at": 0})
+        entry["samples"] = (entry["samples"] + [gas])[-self.window:]
+        entry["uses"] += 1
+        entry["sampled_at"] = time.monotonic()
+        self.estimates += 1
+
+    async def fees(self) -> dict:
+        """Fee fields for a new transaction: maxFeePerGas and maxPriorityFeePerGas, or gasPrice"""
+        async with self.fee_lock:
+            if self.fee_fields is None or time.monotonic() - self.fees_at >= self.fee_refresh:
+                self.fee_fields = await self._network_fees()
+                self.fees_at = time.monotonic()
+            return dict(self.fee_fields)
+
+    async def _network_fees(self) -> dict:
+        try:
+            history = await self.web3.eth.fee_history(self.fee_blocks, "latest", [50])
+            base_fees = history.get("baseFeePerGas") or []
+            if base_fees and base_fees[-1]:
+                self.eip1559 = True
+                rewards = sorted(reward[0] for reward in history.get("reward") or [] if reward)
+                priority = rewards[len(rewards) // 2] if rewards else self.web3.to_wei(1, "gwei")
+                # The last base fee is the next block's
+                max_fee = int(base_fees[-1] * self.fee_headroom) + priority
+                return {"maxFeePerGas": max_fee, "maxPriorityFeePerGas": priority}
+        except Exception as e:
+            logger.warning(f"Error reading fee history: {e}")
+        self.eip1559 = False
+        try:
+            return {"gasPrice": await self.web3.eth.gas_price}
+        except Exception as e:
+            logger.error(f"Error reading gas price: {e}")
+            return {"gasPrice": self.web3.to_wei("20", "gwei")}
+
+    def bump(self, transaction: dict) -> dict:
+        """The transaction with its fees raised to replace a stuck copy"""
+        bumped = dict(transaction)
+        fields = ("maxFeePerGas", "maxPriorityFeePerGas") if "maxFeePerGas" in bumped else ("gasPrice",)
+        for field in fields:
+            # Nodes want at least 10% more, rounded up
+            bumped[field] = -(-bumped[field] * int(self.bump_ratio * 1000) // 1000)
+            if self.max_fee is not None:
+                bumped[field] = min(bumped[field], self.max_fee)
+        if "maxFeePerGas" in bumped:
+            bumped["maxPriorityFeePerGas"] = min(bumped["maxPriorityFeePerGas"], bumped["maxFeePerGas"])
+        self.bumps += 1
+        return bumped
+
+    def stats(self) -> dict:
+        return {
+            "eip1559": self.eip1559,
+            "fees": self.fee_fields,
+            "estimates": self.estimates,
+            "cacheHits": self.hits,
+            "shapes": {
+                f"{name}x{calls}": max(entry["samples"])
+                for (name, calls), entry in self.shapes.items()
+                if entry["samples"]
+            },
+            "bumps": self.bumps,
+        }
+
+
+def event_topic(abi: list, name: str) -> str:
+    """topic0 of the event `name` of an ABI"""
+    event = next(item for item in abi if item.get("type") == "event" and item["name"] == name)
+    signature = f"{name}({','.join(item['type'] for item in event['inputs'])})"
+    return Web3.to_hex(Web3.keccak(text=signature))
+
+
+ERC20_TRANSFER_TOPIC = Web3.to_hex(Web3.keccak(text="Transfer(address,address,uint256)"))
+ERC20_APPROVAL_TOPIC = Web3.to_hex(Web3.keccak(text="Approval(address,address,uint256)"))
+
+
+class AllowanceCache:
+    """Allowances and balances of (account, token) pairs for order entry, without an RPC per order.
+
+    Values read through checkAllowance / checkBalance are kept for ttl
+    seconds, at most max_entries of them with the least recently used
+    evicted first, and concurrent misses of one pair share a single read.
+    While anything is cached one loop follows the chain every poll_interval
+    seconds and drops the pairs a new block touched: both sides of an ERC-20
+    Transfer and the owner of an Approval of a cached token, and both parties
+    of a TradeSettled of the settlement contract, in its base and quote
+    asset. If the logs cannot be read, or more than max_blocks blocks went
+    by, everything is dropped.
+    """
+
+    def __init__(
+        self,
+        client,
+        ttl: float = 30,
+        max_entries: int = 10000,
+        poll_interval: float = 1,
+        max_blocks: int = 1000,
+    ):
+        self.client = client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.poll_interval = poll_interval
+        self.max_blocks = max_blocks
+        self.entries = OrderedDict()  # (account, token) lower case : (allowance, balance, read at)
+        self.reading = {}  # (account, token) : future of the read in progress
+        self.generation = 0  # counted up when a pair being read is invalidated, older reads are not kept
+        self.settled_topic = event_topic(client.contract.abi, "TradeSettled")
+        self.task = None
+        self.last_block = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.rpc_calls = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    async def get(self, account: str, token: str) -> Tuple[int, int]:
+        """(allowance, balance) of account in token, read from the chain on a miss"""
+        key = (account.lower(), token.lower())
+        entry = self.entries.get(key)
+        if entry is not None and time.monotonic() - entry[2] < self.ttl:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+        self.misses += 1
+        future = self.reading.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._read(key, account, token, self.generation))
+            self.reading[key] = future
+            future.add_done_callback(lambda _: self.reading.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def _read(self, key: tuple, account: str, token: str, generation: int) -> Tuple[int, int]:
+        account = Web3.to_checksum_address(account)
+        token = Web3.to_checksum_address(token)
+        functions = check_functions(self.client.contract, [(account, token, 0)])
+        if self.last_block is None and self.client.multicall3 is not None:
+            # Logs are followed from the block the first values were read at
+            functions.append(self.client.multicall3.functions.getBlockNumber())
+        results = await self.client.multicall(functions)
+        self.rpc_calls += 1
+        for result in results[:2]:
+            if isinstance(result, Exception):
+                raise result
+        (_, allowance), (_, balance) = results[:2]
+        if self.last_block is None:
+            block_number = results[2] if len(results) > 2 else None
+            if block_number is None or isinstance(block_number, Exception):
+                block_number = await self.client.web3.eth.block_number
+                self.rpc_calls += 1
+            if self.last_block is None:
+                self.last_block = block_number
+        if generation == self.generation:
+            self.entries[key] = (allowance, balance, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            if self.task is None or self.task.done():
+                self.task = asyncio.ensure_future(self.run())
+        return allowance, balance
+
+    def invalidate(self, account: str, token: str = None):
+        """Drop the cached values of account, in token or in every token"""
+        account = account.lower()
+        keys = (
+            [(account, token.lower())]
+            if token is not None
+            else [key for key in list(self.entries) + list(self.reading) if key[0] == account]
+        )
+        for key in keys:
+            if key in self.reading:
+                self.generation += 1
+            if self.entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        self.generation += 1
+        self.invalidations += len(self.entries)
+        self.entries.clear()
+
+    async def run(self):
+        while self.entries:
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.error(f"Error following allowance and balance changes: {e}")
+                self.clear()
+            await asyncio.sleep(self.poll_interval)
+        # Nothing cached, the next read starts following from its own block
+        self.last_block = None
+
+    async def poll(self):
+        block = await self.client.web3.eth.block_number
+        self.rpc_calls += 1
+        if self.last_block is None or block <= self.last_block:
+            return
+        if block - self.last_block > self.max_blocks:
+            self.last_block = block
+            self.clear()
+            return
+        tokens = set(token for _, token in self.entries)
+        logs = await self.client.web3.eth.get_logs(
+            {
+                "fromBlock": self.last_block + 1,
+                "toBlock": block,
+                "address": [Web3.to_checksum_address(token) for token in tokens]
+                + [self.client.contract_address],
+                "topics": [[ERC20_TRANSFER_TOPIC, ERC20_APPROVAL_TOPIC, self.settled_topic]],
+            }
+        )
+        self.rpc_calls += 1
+        self.last_block = block
+        for log in logs:
+            topics = [Web3.to_hex(topic) for topic in log["topics"]]
+            # Indexed addresses are the last 20 bytes of their topic
+            addresses = ["0x" + topic[-40:] for topic in topics[1:]]
+            if topics[0] == self.settled_topic:
+                if log["address"].lower() != self.client.contract_address.lower():
+                    continue
+                data = Web3.to_hex(log["data"])
+                quote_asset = "0x" + data[26:66]
+                for party in addresses[:2]:
+                    self.invalidate(party, addresses[2])
+                    self.invalidate(party, quote_asset)
+            elif topics[0] == ERC20_TRANSFER_TOPIC:
+                for party in addresses[:2]:
+                    self.invalidate(party, log["address"])
+            elif topics[0] == ERC20_APPROVAL_TOPIC and addresses:
+                self.invalidate(addresses[0], log["address"])
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": self.hits / lookups if lookups else None,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+            "lastBlock": self.last_block,
+            "rpcCalls": self.rpc_calls,
+        }
+
+
+class SignerLane:
+    """One operator key with its own nonce sequence and in-flight transactions"""
+
+    def __init__(self, web3, account, max_pending: int):
+        self.account = account
+        self.nonces = NonceManager(web3, account.address)
+        self.max_pending = max_pending
+        self.in_flight = 0
+        self.sent = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.gas_used = 0
+
+    def stats(self) -> dict:
+        stats = self.nonces.stats()
+        stats.update(
+            {
+                "inFlight": self.in_flight,
+                "maxPending": self.max_pending,
+                "sent": self.sent,
+                "succeeded": self.succeeded,
+                "failed": self.failed,
+                "gasUsed": self.gas_used,
+            }
+        )
+        return stats
+
+
+class SignerPool:
+    """Operator keys sending settlement transactions side by side.
+
+    Each key is a lane with its own NonceManager, so transactions on
+    different lanes never compete for a nonce. acquire() hands out the lane
+    with the fewest transactions in flight, waiting while every lane has
+    max_pending of them.
+    """
+
+    def __init__(self, web3, private_keys: List[str], max_pending: int = 16):
+        self.lanes = [
+            SignerLane(web3, Account.from_key(key), max_pending) for key in private_keys
+        ]
+        self.condition = asyncio.Condition()
+
+    def __len__(self):
+        return len(self.lanes)
+
+    async def sync(self) -> List[int]:
+        return list(await asyncio.gather(*[lane.nonces.sync() for lane in self.lanes]))
+
+    async def acquire(self) -> SignerLane:
+        async with self.condition:
+            while True:
+                free = [lane for lane in self.lanes if lane.in_flight < lane.max_pending]
+                if free:
+                    lane = min(free, key=lambda lane: lane.in_flight)
+                    lane.in_flight += 1
+                    return lane
+                await self.condition.wait()
+
+    async def release(self, lane: SignerLane):
+        async with self.condition:
+            lane.in_flight -= 1
+            self.condition.notify()
+
+    def stats(self) -> List[dict]:
+        return [lane.stats() for lane in self.lanes]
+
+
+class AsyncTradeSettlementClient:
+    """TradeSettlementClient on AsyncWeb3, for use from the event loop.
+
+    Every RPC is awaited instead of blocking the loop, and calls that do not
+    depend on each other (allowance and balance, both parties' nonces) are
+    issued concurrently.
+
+    With a batcher_address, settle_batch packs many settleTrade calls into one
+    transaction through a Multicall3-style aggregate3 contract. The settlement
+    contract must accept settleTrade from that contract.
+
+    Transactions are signed by a SignerPool of private_key and private_keys,
+    each key a lane with its own nonces; `account` is the first key. Their
+    receipts come from one ReceiptTracker, `confirmations` blocks deep, and
+    their gas and fees from a GasStrategy (gas_strategy are its options).
+    Order entry reads allowances and balances through an AllowanceCache
+    (allowance_cache are its options). Reads that one request needs together
+    (allowances, balances, nonces) go out as one eth_call through the
+    Multicall3 at multicall_address.
+    """
+
+    def __init__(
+        self,
+        web3_provider: str,
+        contract_address: str,
+        contract_abi: dict,
+        private_key: str = None,
+        batcher_address: str = None,
+        max_batch_trades: int = 50,
+        batch_gas_fraction: float = 0.5,
+        private_keys: List[str] = None,
+        max_pending_per_signer: int = 16,
+        confirmations: int = 0,
+        receipt_poll_interval: float = 0.2,
+        gas_strategy: dict = None,
+        allowance_cache: dict = None,
+        multicall_address: str = MULTICALL3_ADDRESS,
+    ):
+        self.web3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(web3_provider))
+        self.contract_address = Web3.to_checksum_address(contract_address)
+        self.contract = self.web3.eth.contract(
+            address=self.contract_address, abi=contract_abi
+        )
+        self.multicall3 = self.web3.eth.contract(
+            address=Web3.to_checksum_address(multicall_address), abi=MULTICALL3_ABI
+        )
+        keys = [private_key] if private_key else []
+        keys += [key for key in private_keys or [] if key not in keys]
+        self.signers = SignerPool(self.web3, keys, max_pending_per_signer) if keys else None
+        self.account = self.signers.lanes[0].account if keys else None
+        self.receipts = ReceiptTracker(self.web3, confirmations, receipt_poll_interval)
+        self.gas = GasStrategy(self.web3, **(gas_strategy or {}))
+        self.allowances = AllowanceCache(self, **(allowance_cache or {}))
+        self.batcher = (
+            self.web3.eth.contract(
+                address=Web3.to_checksum_address(batcher_address),
+                abi=MULTICALL3_AGGREGATE3_ABI,
+            )
+            if batcher_address
+            else None
+        )
+        self.max_batch_trades = max_batch_trades
+        # Share of the block gas limit one batch may use
+        self.batch_gas_fraction = batch_gas_fraction
+        # Running estimate of the gas of one settleTrade inside a batch
+        self.gas_per_trade = 150000
+
+    # Signing is local and the token mapping static, nothing to await
+    create_trade_signature = TradeSettlementClient.create_trade_signature
+    get_token_address = TradeSettlementClient.get_token_address
+
+    async def check_allowance(
+        self, user_address: str, token_address: str, required_amount: int
+    ) -> Tuple[bool, int]:
+        """Check if user has sufficient allowance for the contract"""
+        try:
+            user_address = Web3.to_checksum_address(user_address)
+            token_address = Web3.to_checksum_address(token_address)
+
+            sufficient, current_allowance = await self.contract.functions.checkAllowance(
+                user_address, token_address, required_amount
+            ).call()
+            return sufficient, current_allowance
+
+        except Exception as e:
+            logger.error(f"Error checking allowance: {e}")
+            return False, 0
+
+    async def check_balance(
+        self, user_address: str, token_address: str, required_amount: int
+    ) -> Tuple[bool, int]:
+        """Check if user has sufficient token balance"""
+        try:
+            user_address = Web3.to_checksum_address(user_address)
+            token_address = Web3.to_checksum_address(token_address)
+
+            sufficient, current_balance = await self.contract.functions.checkBalance(
+                user_address, token_address, required_amount
+            ).call()
+            return sufficient, current_balance
+
+        except Exception as e:
+            logger.error(f"Error checking balance: {e}")
+            return False, 0
+
+    async def multicall(self, functions: list) -> list:
+        """Run view calls in one eth_call through Multicall3.
+
+        Returns each call's result, or the exception it failed with. If the
+        multicall fails, the calls are made concurrently instead; once it
+        returned nothing (no Multicall3 at multicall_address), always.
+        """
+        if not functions:
+            return []
+        if self.multicall3 is not None:
+            try:
+                results = await self.multicall3.functions.aggregate3(
+                    multicall_calls(functions)
+                ).call()
+                return multicall_results(functions, results)
+            except BadFunctionCallOutput as e:
+                logger.warning(f"Error in multicall, no Multicall3 deployed, calling one by one: {e}")
+                self.multicall3 = None
+            except Exception as e:
+                logger.warning(f"Error in multicall, calling one by one: {e}")
+        return list(
+            await asyncio.gather(
+                *[function.call() for function in functions], return_exceptions=True
+            )
+        )
+
+    async def check_allowance_and_balance(
+        self, user_address: str, token_address: str, required_amount: int
+    ) -> Tuple[Tuple[bool, int], Tuple[bool, int]]:
+        """Allowance and balance checks in one call"""
+        checks = await self.check_allowances_and_balances(
+            [(user_address, token_address, required_amount)]
+        )
+        return checks[0]
+
+    async def check_allowances_and_balances(
+        self, checks: List[Tuple[str, str, int]]
+    ) -> List[Tuple[Tuple[bool, int], Tuple[bool, int]]]:
+        """Allowance and balance checks of (user, token, required amount) triples, in one call"""
+        try:
+            functions = check_functions(self.contract, checks)
+        except Exception as e:
+            logger.error(f"Error checking allowance and balance: {e}")
+            return [((False, 0), (False, 0)) for _ in checks]
+        return checks_from_results(checks, await self.multicall(functions))
+
+    async def batch_check_allowances(
+        self, users: List[str], tokens: List[str], amounts: List[int]
+    ) -> Tuple[List[bool], List[int]]:
+        """Batch check allowances for multiple users and tokens"""
+        try:
+            users_checksummed = [Web3.to_checksum_address(addr) for addr in users]
+            tokens_checksummed = [Web3.to_checksum_address(addr) for addr in tokens]
+
+            sufficient_list, allowances_list = await self.contract.functions.batchCheckAllowances(
+                users_checksummed, tokens_checksummed, amounts
+            ).call()
+            return list(sufficient_list), list(allowances_list)
+
+        except Exception as e:
+            logger.error(f"Error in batch checking allowances: {e}")
+            return [], []
+
+    async def verify_trade_signature(
+        self,
+        signer: str,
+        order_id: int,
+        base_asset: str,
+        quote_asset: str,
+        price: int,
+        quantity: int,
+        side: str,
+        timestamp: int,
+        nonce: int,
+        signature: str,
+    ) -> bool:
+        """Verify a trade signature on-chain"""
+        try:
+            return await self.contract.functions.verifyTradeSignature(
+                Web3.to_checksum_address(signer),
+                order_id,
+                Web3.to_checksum_address(base_asset),
+                Web3.to_checksum_address(quote_asset),
+                price,
+                quantity,
+                side,
+                timestamp,
+                nonce,
+                bytes.fromhex(signature.replace("0x", "")),
+            ).call()
+
+        except Exception as e:
+            logger.error(f"Error verifying signature: {e}")
+            return False
+
+    async def get_user_nonce(self, user_address: str, token_address: str) -> int:
+        """Get user's current nonce for a specific token"""
+        try:
+            user_address = Web3.to_checksum_address(user_address)
+            token_address = Web3.to_checksum_address(token_address)
+
+            return await self.contract.functions.getUserNonce(
+                user_address, token_address
+            ).call()
+
+        except Exception as e:
+            logger.error(f"Error getting nonce: {e}")
+            return 0
+
+    async def get_user_nonces(
+        self, user_addresses: List[str], token_address: str
+    ) -> List[int]:
+        """Nonces of several users for one token, in one call"""
+        return await self.get_nonces([(user, token_address) for user in user_addresses])
+
+    async def get_nonces(self, pairs: List[Tuple[str, str]]) -> List[int]:
+        """Nonces of (user, token) pairs, in one call"""
+        try:
+            functions = nonce_functions(self.contract, pairs)
+        except Exception as e:
+            logger.error(f"Error getting nonce: {e}")
+            return [0] * len(pairs)
+        return nonces_from_results(await self.multicall(functions))
+
+    async def send_transaction(
+        self, function, timeout: int = 120, gas_estimate: int = None
+    ) -> dict:
+        """Estimate, build, sign and send a contract call, then await its receipt.
+
+        The transaction goes out on the least loaded signer lane, with the next
+        nonce of its NonceManager; a send rejected for its nonce is retried once
+        with a nonce read from the chain again.
+        """
+        lane = await self.signers.acquire()
+        try:
+            result = await self._send_on_lane(lane, function, timeout, gas_estimate)
+        except Exception:
+            lane.failed += 1
+            raise
+        finally:
+            await self.signers.release(lane)
+        if result["success"]:
+            lane.succeeded += 1
+        else:
+            lane.failed += 1
+        lane.gas_used += result["gas_used"]
+        return result
+
+    async def _send_on_lane(self, lane, function, timeout, gas_estimate) -> dict:
+        account, nonces = lane.account, lane.nonces
+        if gas_estimate is None:
+            gas_estimate = await self.gas.estimate(function, account.address)
+        fees = await self.gas.fees()
+
+        for attempt in range(2):
+            nonce = await nonces.reserve()
+            try:
+                fields = {
+                    "from": account.address,
+                    "gas": int(gas_estimate * 1.2),  # Add 20% buffer
+                    "nonce": nonce,
+                }
+                fields.update(fees)
+                transaction = await function.build_transaction(fields)
+
+                signed_txn = self.web3.eth.account.sign_transaction(
+                    transaction, account.key
+                )
+                tx_hash = await self.web3.eth.send_raw_transaction(
+                    signed_txn.raw_transaction
+                )
+                break
+            except Exception as e:
+                if not is_nonce_error(e):
+                    nonces.release(nonce)
+                    raise
+                nonces.confirm(nonce)
+                await nonces.resync()
+                if attempt:
+                    raise
+        nonces.sent(nonce, tx_hash)
+        lane.sent += 1
+
+        try:
+            receipt = await self.wait_or_bump(account, transaction, tx_hash, timeout)
+        except TransactionUnconfirmed as e:
+            # Not a failure to send again: check_sent tells later what became of it
+            return {
+                "success": False,
+                "unconfirmed": True,
+                "error": str(e),
+                "transaction_hashes": [HexBytes(sent).hex() for sent in e.tx_hashes],
+                "gas_used": 0,
+                "signer": account.address,
+                "signer_nonce": nonce,
+            }
+        finally:
+            nonces.confirm(nonce)
+
+        return {
+            "success": receipt.status == 1,
+            "transaction_hash": receipt.transactionHash.hex(),
+            "gas_used": receipt.gasUsed,
+            "block_number": receipt.blockNumber,
+            "signer": account.address,
+        }
+
+    async def wait_or_bump(self, account, transaction: dict, tx_hash, timeout: float):
+        """Receipt of a sent transaction, replacing it with higher fees while it is stuck.
+
+        Every copy sent stays watched, since any of them may be the one mined.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        hashes = [tx_hash]
+        try:
+            while True:
+                # Resolved by the receipt tracker following the chain, with all other sends
+                futures = [self.receipts.watch(sent) for sent in hashes]
+                remaining = deadline - loop.time()
+                bump = len(hashes) <= self.gas.max_bumps
+                done, _ = await asyncio.wait(
+                    futures,
+                    timeout=min(self.gas.bump_after, remaining) if bump else remaining,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if done:
+                    return done.pop().result()
+                if loop.time() >= deadline:
+                    raise TransactionUnconfirmed(
+                        f"Transaction {hashes[-1].hex()} sent but not confirmed after {timeout} seconds",
+                        hashes,
+                    )
+                transaction = self.gas.bump(transaction)
+                signed_txn = self.web3.eth.account.sign_transaction(transaction, account.key)
+                try:
+                    hashes.append(
+                        await self.web3.eth.send_raw_transaction(signed_txn.raw_transaction)
+                    )
+                except Exception as e:
+                    # Already mined or known: keep waiting for the copies sent
+                    if not is_nonce_error(e):
+                        raise
+        except TransactionUnconfirmed:
+            raise
+        except Exception as e:
+            raise TransactionUnconfirmed(
+                f"Transaction {hashes[-1].hex()} sent but not confirmed: {e}", hashes
+            ) from e
+        finally:
+            for sent in hashes:
+                self.receipts.forget(sent)
+
+    async def check_sent(
+        self, tx_hashes: list, signer: str, signer_nonce: int, nonces: list
+    ) -> Tuple[str, Optional[AttributeDict]]:
+        """What became of a transaction sent without its receipt seen, and its receipt if mined.
+
+        nonces holds (party, token, nonce signed with) of the trades in it. The
+        receipt tracker looks up every copy sent: "mined" or "reverted" if one
+        is confirmed. Without a receipt, "pending" while a copy is mined but not
+        yet confirmed or the signer's nonce is still unused, since a copy may
+        yet be mined; "dropped" once the signer's nonce went to another
+        transaction and the parties' nonces show nothing was settled with the
+        signatures, so the trades can be signed again; "unknown" if the
+        parties' nonces moved all the same.
+        """
+        futures = [self.receipts.watch(sent) for sent in tx_hashes]
+        entries = [self.receipts.watched[self.receipts._key(sent)] for sent in tx_hashes]
+        try:
+            # Until every copy was looked up once
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + max(5, 10 * self.receipts.poll_interval)
+            while not all(entry["checked"] for entry in entries) and loop.time() < deadline:
+                await asyncio.sleep(self.receipts.poll_interval / 2)
+            for future in futures:
+                if future.done() and not future.cancelled():
+                    receipt = future.result()
+                    return ("mined" if receipt.status == 1 else "reverted"), receipt
+            if not all(entry["checked"] for entry in entries) or any(
+                entry["receipt"] is not None for entry in entries
+            ):
+                return "pending", None
+        finally:
+            for sent in tx_hashes:
+                self.receipts.forget(sent)
+
+        if await self.web3.eth.get_transaction_count(signer, "latest") <= signer_nonce:
+            return "pending", None
+        current = await self.get_nonces([(party, token) for party, token, _ in nonces])
+        if all(now <= signed for now, (_, _, signed) in zip(current, nonces)):
+            return "dropped", None
+        return "unknown", None
+
+    async def settle_trade_direct(
+        self,
+        trade_execution_tuple: tuple,
+        party1: str,
+        party2: str,
+        party1_quantity: int,
+        party2_quantity: int,
+        party1_side: str,
+        party2_side: str,
+        signature1: str,
+        signature2: str,
+        nonce1: int,
+        nonce2: int,
+    ) -> dict:
+        """Settle a trade directly using the contract's settleTrade function"""
+        if not self.account:
+            raise ValueError("No private key provided for transaction signing")
+
+        try:
+            function = self.contract.functions.settleTrade(
+                trade_execution_tuple,  # TradeExecution struct as tuple
+                Web3.to_checksum_address(party1),
+                Web3.to_checksum_address(party2),
+                party1_quantity,
+                party2_quantity,
+                party1_side,
+                party2_side,
+                bytes.fromhex(signature1.replace("0x", "")),
+                bytes.fromhex(signature2.replace("0x", "")),
+                nonce1,
+                nonce2,
+            )
+            return await self.send_transaction(function)
+
+        except Exception as e:
+            logger.error(f"Error settling trade: {e}")
+            return {"success": False, "error": str(e)}
+
+    def batch_call(self, functions: list):
+        """aggregate3 call running the settleTrade calls in order, reverting if any does"""
+        return self.batcher.functions.aggregate3(
+            [
+                (
+                    self.contract_address,
+                    False,
+                    self.contract.encode_abi(function.abi_element_identifier, args=function.args),
+                )
+                for function in functions
+            ]
+        )
+
+    async def simulate_batch(self, functions: list) -> Tuple[Optional[bool], object]:
+        """(True, gas estimate) if the batch would succeed, (False, revert reason) if it
+        would revert, or (None, error) if it could not be simulated (an RPC error or
+        timeout from eth_estimateGas)"""
+        try:
+            gas = await self.batch_call(functions).estimate_gas(
+                {"from": self.account.address}
+            )
+            return True, gas
+        except ContractLogicError as e:
+            return False, str(e)
+        except Exception as e:
+            return None, str(e)
+
+    async def first_failing_trade(self, functions: list, error: str) -> Tuple[int, str, int]:
+        """Bisect a reverting batch down to the first call that reverts.
+
+        Later calls may depend on earlier ones (the parties' nonces), so prefixes are
+        simulated rather than halves: a prefix reverts exactly when it contains the
+        first failing call, which takes log2(len(functions)) simulations to find.
+        Returns its index, its revert reason and the gas estimate of the calls before
+        it (None if it is the first). The index is None if a simulation could not be
+        run, with the error in place of the revert reason.
+        """
+        succeeds, fails = 0, len(functions)
+        gas = None
+        while fails - succeeds > 1:
+            middle = (succeeds + fails) // 2
+            ok, result = await self.simulate_batch(functions[:middle])
+            if ok is None:
+                return None, result, None
+            if ok:
+                succeeds, gas = middle, result
+            else:
+                fails, error = middle, result
+        return fails - 1, error, gas
+
+    async def allocate_nonces(self, trades: List[dict]) -> List[Tuple[int, int]]:
+        """(nonce1, nonce2) of each trade, counting up for parties with several trades.
+
+        Each trade is a dict with party1, party2 and token (the base asset the
+        contract keeps the parties' nonces for).
+        """
+        keys = []
+        for trade in trades:
+            for party in (trade["party1"], trade["party2"]):
+                key = (party.lower(), trade["token"].lower())
+                if key not in keys:
+                    keys.append(key)
+        next_nonce = dict(zip(keys, await self.get_nonces(keys)))
+        nonces = []
+        for trade in trades:
+            pair = []
+            for party in (trade["party1"], trade["party2"]):
+                key = (party.lower(), trade["token"].lower())
+                pair.append(next_nonce[key])
+                next_nonce[key] += 1
+            nonces.append(tuple(pair))
+        return nonces
+
+    async def settle_batch(self, trades: List[dict], build_call) -> List[dict]:
+        """Settle trades in as few transactions as the block gas limit allows.
+
+        build_call(trade, nonce1, nonce2) returns the settleTrade contract call of a
+        trade. Batches are sized from the gas a trade has been taking and a share of
+        the block gas limit, and shrunk if their estimate still exceeds it. A batch
+        that would revert is bisected to the first failing trade, which is reported
+        failed; the trades before it are sent and the rest batched again with their
+        nonces allocated anew. A batch that cannot be simulated (an RPC error or
+        timeout) falls back to settling its first trade on its own before batching
+        the rest again. A batch sent but not seen confirmed is not sent again:
+        its trades are reported unconfirmed, with the nonces they were signed
+        with, for check_sent. Returns one settlement result per trade, in order.
+        """
+        if not self.account:
+            raise ValueError("No private key provided for transaction signing")
+        if self.batcher is None:
+            raise ValueError("No batcher contract configured")
+
+        results = [None] * len(trades)
+        pending = list(range(len(trades)))
+        mined_reverts = 0
+        try:
+            block = await self.web3.eth.get_block("latest")
+            gas_target = int(block["gasLimit"] * self.batch_gas_fraction)
+            while pending:
+                nonces = await self.allocate_nonces([trades[i] for i in pending])
+                functions = [
+                    build_call(trades[i], *nonce) for i, nonce in zip(pending, nonces)
+                ]
+                size = min(
+                    len(functions),
+                    self.max_batch_trades,
+                    max(1, gas_target // self.gas_per_trade),
+                )
+                ok, result = await self.simulate_batch(functions[:size])
+                while ok and result > gas_target and size > 1:
+                    size = max(1, size * gas_target // result)
+                    ok, result = await self.simulate_batch(functions[:size])
+                if ok is False:
+                    index, error, result = await self.first_failing_trade(
+                        functions[:size], result
+                    )
+                    if index is None:
+                        ok = None
+                    else:
+                        results[pending.pop(index)] = {"success": False, "error": error}
+                        if index == 0:
+                            continue
+                        # The trades before the failing one are sent as they were simulated
+                        size = index
+                if ok is None:
+                    # No simulation to go by: settle the first trade by itself, so an
+                    # error only fails the trade it belongs to
+                    try:
+                        results[pending[0]] = await self.send_transaction(functions[0])
+                    except Exception as e:
+                        results[pending[0]] = {"success": False, "error": str(e)}
+                    results[pending[0]]["nonces"] = list(nonces[0])
+                    del pending[0]
+                    continue
+                gas_estimate = result
+                self.gas_per_trade = max(1, (self.gas_per_trade + gas_estimate // size) // 2)
+
+                receipt = await self.send_transaction(
+                    self.batch_call(functions[:size]), gas_estimate=gas_estimate
+                )
+                if not receipt["success"] and not receipt.get("unconfirmed"):
+                    # Reverted on chain after passing the simulation; retry once, then
+                    # give up on the batch
+                    mined_reverts += 1
+                    if mined_reverts < 2:
+                        continue
+                    receipt["error"] = "Batch reverted on chain"
+                mined_reverts = 0
+                receipt["batch_size"] = size
+                for i, nonce in zip(pending[:size], nonces):
+                    results[i] = dict(receipt, nonces=list(nonce))
+                del pending[:size]
+
+        except Exception as e:
+            logger.error(f"Error settling batch: {e}")
+            for i in pending:
+                results[i] = {"success": False, "error": str(e)}
+
+        return results
+
+    async def validate_trade_prerequisites(self, trade_data: dict) -> dict:
+        """Validate all prerequisites before settling a trade, all checks in one call"""
+        results = {
+            "valid": True,
+            "errors": [],
+            "warnings": [],
+            "allowance_checks": {},
+            "balance_checks": {},
+        }
+
+        try:
+            if not trade_data.get("trades") or len(trade_data["trades"]) == 0:
+                return results  # No trades to validate
+
+            trade = trade_data["trades"][0]  # Validate first trade
+            base_asset_addr = self.get_token_address(trade_data["baseAsset"])
+            quote_asset_addr = self.get_token_address(trade_data["quoteAsset"])
+
+            quantity = trade_data["quantity"]
+            price = trade_data["price"]
+
+            # Convert to wei (18 decimals)
+            base_amount = int(quantity * (10**18))
+            quote_amount = int(quantity * price * (10**18))
+
+            # Bidders need the quote asset, askers the base asset
+            requirements = []
+            for name, party in (("party1", trade["party1"]), ("party2", trade["party2"])):
+                if party[1] == "bid":
+                    requirements.append((name, party[0], "quote", quote_asset_addr, quote_amount))
+                else:
+                    requirements.append((name, party[0], "base", base_asset_addr, base_amount))
+
+            checks = await self.check_allowances_and_balances(
+                [(address, token, amount) for _, address, _, token, amount in requirements]
+            )
+
+            for (name, _, asset, _, amount), check in zip(requirements, checks):
+                (sufficient, allowance), (balance_sufficient, balance) = check
+                key = f"{name}_{asset}"
+                label = name.capitalize()
+                results["allowance_checks"][key] = {
+                    "sufficient": sufficient,
+                    "current": allowance,
+                    "required": amount,
+                }
+                results["balance_checks"][key] = {
+                    "sufficient": balance_sufficient,
+                    "current": balance,
+                    "required": amount,
+                }
+
+                if not sufficient:
+                    results["errors"].append(
+                        f"{label} insufficient {asset} allowance: {allowance} < {amount}"
+                    )
+                    results["valid"] = False
+
+                if not balance_sufficient:
+                    results["errors"].append(
+                        f"{label} insufficient {asset} balance: {balance} < {amount}"
+                    )
+                    results["valid"] = False
+
+            return results
+
+        except Exception as e:
+            results["valid"] = False
+            results["errors"].append(f"Error validating prerequisites: {e}")
+            return results
+
+
 # Contract ABI for your TradeSettlement contract
 TRADE_SETTLEMENT_ABI = [
     {"inputs": [], "stateMutability": "nonpayable", "type": "constructor"},
@@ -701,6 +2165,50 @@ TRADE_SETTLEMENT_ABI = [
 ]
 
 
+# aggregate3 of the Multicall3 contract, or any wrapper with the same interface
+MULTICALL3_AGGREGATE3_ABI = [
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"internalType": "address", "name": "target", "type": "address"},
+                    {"internalType": "bool", "name": "allowFailure", "type": "bool"},
+                    {"internalType": "bytes", "name": "callData", "type": "bytes"},
+                ],
+                "internalType": "struct Multicall3.Call3[]",
+                "name": "calls",
+                "type": "tuple[]",
+            }
+        ],
+        "name": "aggregate3",
+        "outputs": [
+            {
+                "components": [
+                    {"internalType": "bool", "name": "success", "type": "bool"},
+                    {"internalType": "bytes", "name": "returnData", "type": "bytes"},
+                ],
+                "internalType": "struct Multicall3.Result[]",
+                "name": "returnData",
+                "type": "tuple[]",
+            }
+        ],
+        "stateMutability": "payable",
+        "type": "function",
+    }
+]
+
+
+MULTICALL3_ABI = MULTICALL3_AGGREGATE3_ABI + [
+    {
+        "inputs": [],
+        "name": "getBlockNumber",
+        "outputs": [{"internalType": "uint256", "name": "blockNumber", "type": "uint256"}],
+        "stateMutability": "view",
+        "type": "function",
+    }
+]
+
+
 # Helper function to encode ABI packed data
 def encode_abi_packed(types, values):
     """Helper function to encode data similar to Solidity's abi.encodePacked"""
@@ -715,8 +2223,11 @@ from eth_account.messages import encode_defunct
 
 # Utility functions for allowance checking
 class AllowanceChecker:
-    def __init__(self, web3_provider: str):
+    def __init__(self, web3_provider: str, multicall_address: str = MULTICALL3_ADDRESS):
         self.web3 = Web3(Web3.HTTPProvider(web3_provider))
+        self.multicall3 = self.web3.eth.contract(
+            address=Web3.to_checksum_address(multicall_address), abi=MULTICALL3_ABI
+        )
 
         # Standard ERC20 ABI for allowance checking
         self.erc20_abi = [
@@ -755,7 +2266,7 @@ class AllowanceChecker:
             return allowance
 
         except Exception as e:
-            print(f"Error checking token allowance: {e}")
+            logger.error(f"Error checking token allowance: {e}")
             return 0
 
     def check_token_balance(self, token_address: str, owner: str) -> int:
@@ -772,25 +2283,48 @@ class AllowanceChecker:
             return balance
 
         except Exception as e:
-            print(f"Error checking token balance: {e}")
+            logger.error(f"Error checking token balance: {e}")
             return 0
 
     def batch_allowance_check(self, checks: List[Dict]) -> List[Dict]:
         """
-        Batch check multiple allowances
+        Batch check multiple allowances, every allowance and balance in one multicall
         checks format: [{'token': '0x...', 'owner': '0x...', 'spender': '0x...', 'required': 1000}, ...]
         """
-        results = []
-
+        functions = []
         for check in checks:
             try:
-                current_allowance = self.check_token_allowance(
-                    check["token"], check["owner"], check["spender"]
+                token_contract = self.web3.eth.contract(
+                    address=Web3.to_checksum_address(check["token"]), abi=self.erc20_abi
                 )
-
-                current_balance = self.check_token_balance(
-                    check["token"], check["owner"]
+                owner = Web3.to_checksum_address(check["owner"])
+                functions.append(
+                    (
+                        token_contract.functions.allowance(
+                            owner, Web3.to_checksum_address(check["spender"])
+                        ),
+                        token_contract.functions.balanceOf(owner),
+                    )
                 )
+            except Exception as e:
+                functions.append(e)
+        values = iter(
+            run_multicall(
+                self.multicall3,
+                [call for pair in functions if isinstance(pair, tuple) for call in pair],
+            )
+        )
+
+        results = []
+
+        for check, pair in zip(checks, functions):
+            try:
+                if not isinstance(pair, tuple):
+                    raise pair
+                current_allowance, current_balance = next(values), next(values)
+                for value in (current_allowance, current_balance):
+                    if isinstance(value, Exception):
+                        raise value
 
                 result = {
                     "token": check["token"],
@@ -831,6 +2365,24 @@ def create_settlement_client(
     )
 
 
+def create_async_settlement_client(
+    web3_provider: str,
+    contract_address: str,
+    private_key: str = None,
+    batcher_address: str = None,
+    private_keys: List[str] = None,
+):
+    """Factory function to create an AsyncTradeSettlementClient with the correct ABI"""
+    return AsyncTradeSettlementClient(
+        web3_provider=web3_provider,
+        contract_address=contract_address,
+        contract_abi=TRADE_SETTLEMENT_ABI,
+        private_key=private_key,
+        batcher_address=batcher_address,
+        private_keys=private_keys,
+    )
+
+
 # Example usage
 def main():
     # Configuration
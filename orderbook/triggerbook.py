@@ -0,0 +1,71 @@
+from sortedcontainers import SortedDict
+
+
+class TriggerBook(object):
+    '''
+    Dormant stop / take-profit / trigger orders of one symbol, indexed by trigger price.
+
+    `rising` holds orders that fire once the last trade price reaches or exceeds
+    their trigger price, `falling` those that fire once it reaches or goes below
+    it. Each index maps trigger price : {stop_id: quote} (insertion ordered), so
+    a price move releases every crossed level with one range slice of the
+    sorted keys, however many stops are resting elsewhere.
+    '''
+
+    def __init__(self):
+        self.rising = SortedDict()
+        self.falling = SortedDict()
+        self.stops = {} # stop_id : (direction, trigger price)
+
+    def __len__(self):
+        return len(self.stops)
+
+    def __contains__(self, stop_id):
+        return stop_id in self.stops
+
+    def add(self, stop_id, quote, trigger_price, direction):
+        if direction == "rising":
+            index = self.rising
+        elif direction == "falling":
+            index = self.falling
+        else:
+            raise Exception('TriggerBook.add() given neither "rising" nor "falling"')
+        if trigger_price not in index:
+            index[trigger_price] = {}
+        index[trigger_price][stop_id] = quote
+        self.stops[stop_id] = (direction, trigger_price)
+
+    def get(self, stop_id):
+        direction, trigger_price = self.stops[stop_id]
+        index = self.rising if direction == "rising" else self.falling
+        return index[trigger_price][stop_id]
+
+    def cancel(self, stop_id):
+        '''Remove a dormant order, returning its quote (None if unknown).'''
+        if stop_id not in self.stops:
+            return None
+        direction, trigger_price = self.stops.pop(stop_id)
+        index = self.rising if direction == "rising" else self.falling
+        level = index[trigger_price]
+        quote = level.pop(stop_id)
+        if not level:
+            del index[trigger_price]
+        return quote
+
+    def release(self, last_price):
+        '''Remove and return the quotes triggered by a trade at last_price.
+
+        Orders come out in the order their trigger prices were crossed (rising
+        triggers lowest first, then falling triggers highest first) and by
+        arrival within a trigger price, so the release order is deterministic.
+        '''
+        released = []
+        crossed = list(self.rising.irange(maximum=last_price))
+        for trigger_price in crossed:
+            released.extend(self.rising.pop(trigger_price).items())
+        crossed = list(self.falling.irange(minimum=last_price, reverse=True))
+        for trigger_price in crossed:
+            released.extend(self.falling.pop(trigger_price).items())
+        for stop_id, _ in released:
+            del self.stops[stop_id]
+        return released